@@ -0,0 +1,157 @@
+"""
+Anthropic Cache - Planificador de breakpoints cache_control
+Anthropic cachea el prefijo del prompt (tools → system → messages) hasta cada
+bloque marcado con cache_control (máximo 4 por request). Este módulo decide,
+por tamaño en tokens, dónde poner los breakpoints "ephemeral": al final de las
+herramientas, al final del system estático, en el mensaje que inicia el turno
+y en el último mensaje (que avanza con cada ronda de herramientas). Las marcas
+se ponen sobre copias del payload; el historial guardado nunca las lleva.
+"""
+
+import os
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.prompt_cache import split_prompt
+from app.utils.token_counter import TokenCounter, token_counter
+
+logger = logging.getLogger(__name__)
+
+# false = comportamiento anterior (solo el mensaje del usuario, con use_cache_control)
+ANTHROPIC_CACHE_PLANNER = os.getenv('ANTHROPIC_CACHE_PLANNER', 'true').lower() == 'true'
+# Límite de breakpoints por request de la API
+ANTHROPIC_CACHE_MAX_BREAKPOINTS = int(os.getenv('ANTHROPIC_CACHE_MAX_BREAKPOINTS', 4))
+# Un breakpoint debe agregar al menos estos tokens al anterior
+# (escribir caché cuesta 1.25x)
+ANTHROPIC_CACHE_MIN_SEGMENT_TOKENS = int(
+    os.getenv('ANTHROPIC_CACHE_MIN_SEGMENT_TOKENS', 256)
+)
+
+# Prefijo mínimo cacheable por modelo (gana el prefijo de nombre más largo)
+MIN_CACHEABLE_TOKENS = {
+    "claude-3-haiku": 2048,
+    "claude-3-5-haiku": 2048,
+    "claude-haiku-4-5": 4096,
+    "claude-opus-4-5": 4096,
+}
+DEFAULT_MIN_CACHEABLE_TOKENS = 1024
+
+EPHEMERAL = {"type": "ephemeral"}
+
+
+def min_cacheable_tokens(model: str) -> int:
+    name = (model or "").lower()
+    matches = [prefix for prefix in MIN_CACHEABLE_TOKENS if name.startswith(prefix)]
+    if not matches:
+        return DEFAULT_MIN_CACHEABLE_TOKENS
+    return MIN_CACHEABLE_TOKENS[max(matches, key=len)]
+
+
+def _with_cache_control(block: Any) -> Optional[Dict[str, Any]]:
+    """Copia del bloque con cache_control (None si el bloque no admite la marca)"""
+    if isinstance(block, str):
+        block = {"type": "text", "text": block}
+    elif not isinstance(block, dict):
+        if not hasattr(block, 'model_dump'):
+            return None
+        block = block.model_dump(exclude_none=True)
+    if block.get("type") == "text" and not block.get("text"):
+        return None  # La API rechaza cache_control en bloques de texto vacíos
+    return dict(block, cache_control=EPHEMERAL)
+
+
+def _mark_message(message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    content = message.get("content")
+    blocks = [content] if isinstance(content, str) else list(content or [])
+    if not blocks:
+        return None
+    marked = _with_cache_control(blocks[-1])
+    if marked is None:
+        return None
+    return dict(message, content=blocks[:-1] + [marked])
+
+
+def strip_cache_control(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Quita marcas guardadas en el historial por versiones anteriores"""
+    content = message.get("content")
+    if isinstance(content, str) or not any(isinstance(block, dict)
+                                           and "cache_control" in block
+                                           for block in content or []):
+        return message
+    return dict(message, content=[
+        {key: value for key, value in block.items() if key != "cache_control"}
+        if isinstance(block, dict) else block
+        for block in content
+    ])
+
+
+def plan_cache_breakpoints(system_text: str, tools: List[Dict[str, Any]],
+                           messages: List[Dict[str, Any]],
+                           model: str, is_turn_start: Callable[[Dict[str, Any]], bool],
+                           counter: TokenCounter = token_counter,
+                           enabled: bool = ANTHROPIC_CACHE_PLANNER
+                           ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]],
+                                      List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Arma system, tools y messages con los breakpoints de caché del request
+
+    Un candidato se usa si el prefijo hasta él alcanza el mínimo cacheable del
+    modelo y agrega al menos ANTHROPIC_CACHE_MIN_SEGMENT_TOKENS al breakpoint
+    anterior; si sobran candidatos se conservan los últimos (cubren más).
+
+    Returns:
+        tuple: (bloques de system, tools, messages,
+                breakpoints [{"at", "prefix_tokens"}])
+    """
+    if not enabled:
+        return [{"type": "text", "text": system_text}], tools, messages, []
+
+    messages = [strip_cache_control(message) for message in messages]
+    static, dynamic = split_prompt(system_text)
+    system = [{"type": "text", "text": static}]
+    if dynamic:
+        # Las variables van en un bloque aparte, después del breakpoint del system
+        system.append({"type": "text", "text": dynamic})
+
+    # Candidatos en el orden del prefijo: (nombre, índice del
+    # mensaje, tokens acumulados)
+    candidates = []
+    prefix = counter.count_tools(tools, model)
+    if tools:
+        candidates.append(("tools", None, prefix))
+    prefix += counter.count_text(static, model)
+    candidates.append(("system", None, prefix))
+    prefix += counter.count_text(dynamic, model) if dynamic else 0
+
+    turn_start = max((i for i, message in enumerate(messages)
+                      if is_turn_start(message)), default=None)
+    last = len(messages) - 1
+    for i, message in enumerate(messages):
+        prefix += counter.count_message(message, model)
+        if i == turn_start:
+            candidates.append(("history", i, prefix))
+        elif i == last:
+            candidates.append(("rolling", i, prefix))
+
+    minimum = min_cacheable_tokens(model)
+    chosen, previous = [], 0
+    for name, index, tokens in candidates:
+        if tokens < minimum or tokens - previous < ANTHROPIC_CACHE_MIN_SEGMENT_TOKENS:
+            continue
+        chosen.append((name, index, tokens))
+        previous = tokens
+    chosen = chosen[-ANTHROPIC_CACHE_MAX_BREAKPOINTS:]
+
+    breakpoints = []
+    for name, index, tokens in chosen:
+        if name == "tools":
+            tools = tools[:-1] + [dict(tools[-1], cache_control=EPHEMERAL)]
+        elif name == "system":
+            system[0] = dict(system[0], cache_control=EPHEMERAL)
+        else:
+            marked = _mark_message(messages[index])
+            if marked is None:
+                continue
+            messages = messages[:index] + [marked] + messages[index + 1:]
+        breakpoints.append({"at": name, "prefix_tokens": tokens})
+    return system, tools, messages, breakpoints
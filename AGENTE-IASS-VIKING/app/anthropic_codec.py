@@ -0,0 +1,136 @@
+"""
+Anthropic Codec - Bloques de contenido compactos y serializables
+El SDK de Anthropic devuelve response.content como objetos pydantic. Guardarlos
+tal cual en el historial infla la memoria y json_default los convierte en su
+repr() al persistir en Redis, con lo que el turno siguiente envía texto basura
+en lugar del bloque. Este codec convierte cada bloque (text, tool_use,
+tool_result, thinking) al dict mínimo que la API acepta de vuelta y, al cargar,
+recupera los bloques de historiales guardados con el formato anterior.
+"""
+
+import ast
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Campos que la API necesita de vuelta por tipo de bloque (el resto se descarta)
+BLOCK_FIELDS = {
+    "text": ("text", "citations"),
+    "tool_use": ("id", "name", "input"),
+    "tool_result": ("tool_use_id", "content", "is_error"),
+    "thinking": ("thinking", "signature"),
+    "redacted_thinking": ("data",),
+    "image": ("source",),
+    "document": ("source", "title", "context", "citations"),
+}
+
+
+def _field(block: Any, key: str) -> Any:
+    return block.get(key) if isinstance(block, dict) else getattr(block, key, None)
+
+
+def _plain(value: Any) -> Any:
+    """Valores anidados del SDK (citas, fuentes) a tipos JSON"""
+    if hasattr(value, 'model_dump'):
+        return value.model_dump(exclude_none=True)
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    return value
+
+
+def encode_block(block: Any) -> Any:
+    """
+    Dict mínimo de un bloque de contenido
+
+    Se descartan los campos vacíos (None, False, listas vacías) y cache_control:
+    los breakpoints se planifican en cada request, no se guardan.
+    """
+    if isinstance(block, str):
+        return block
+    block_type = _field(block, "type")
+    fields = BLOCK_FIELDS.get(block_type)
+    if fields is None:
+        # Tipo desconocido: se conserva completo para no perder información
+        encoded = _plain(block) if not isinstance(block, dict) else dict(block)
+        encoded.pop("cache_control", None)
+        return encoded
+
+    encoded = {"type": block_type}
+    for key in fields:
+        value = _field(block, key)
+        if value is None or value is False or value == []:
+            continue
+        if key == "content" and isinstance(value, list):
+            value = [encode_block(item) for item in value]
+        encoded[key] = _plain(value)
+    if block_type == "tool_use" and "input" not in encoded:
+        # La API exige input aunque la herramienta no reciba argumentos
+        encoded["input"] = {}
+    return encoded
+
+
+def encode_content(content: Any) -> Any:
+    """Contenido de un mensaje (str o lista de bloques) en formato de almacenamiento"""
+    if isinstance(content, str) or content is None:
+        return content
+    return [encode_block(block) for block in content]
+
+
+def encode_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(message, content=encode_content(message.get("content")))
+
+
+def _parse_repr(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Recupera un bloque guardado como repr() del SDK, p. ej.
+    "ToolUseBlock(id='toolu_1', input={'a': 1}, name='f', type='tool_use')"
+    """
+    if not text.endswith(')') or '(' not in text:
+        return None
+    if not text.split('(', 1)[0].endswith('Block'):
+        return None
+    try:
+        call = ast.parse(text, mode='eval').body
+        if not isinstance(call, ast.Call):
+            return None
+        fields = {keyword.arg: ast.literal_eval(keyword.value)
+                  for keyword in call.keywords}
+    except (SyntaxError, ValueError):
+        return None
+    return encode_block(fields) if fields.get("type") else None
+
+
+def decode_block(block: Any) -> Any:
+    if isinstance(block, str):
+        parsed = _parse_repr(block)
+        if parsed is not None:
+            return parsed
+        return {"type": "text", "text": block}
+    if not isinstance(block, dict):
+        return encode_block(block)
+    return block
+
+
+def decode_message(message: Any) -> Any:
+    """Mensaje listo para la API; solo se copia si trae bloques del formato anterior"""
+    if not isinstance(message, dict):
+        return message
+    content = message.get("content")
+    if isinstance(content, str) or not content or all(isinstance(block, dict)
+                                                      for block in content):
+        return message
+    return dict(message, content=[decode_block(block) for block in content])
+
+
+def decode_messages(messages: Optional[List[Any]]) -> List[Any]:
+    """Historial cargado del almacenamiento con los bloques en formato de la API"""
+    decoded = [decode_message(message) for message in messages or []]
+    recovered = sum(1 for before, after in zip(messages or [], decoded, strict=True)
+                    if before is not after)
+    if recovered:
+        logger.info(f"🧩 [ANTHROPIC CODEC] {recovered} mensajes con bloques del "
+                    "formato anterior recuperados")
+    return decoded
@@ -3,12 +3,22 @@ Anthropic Handler - Manejador específico para Claude
 """
 
 import json
-import anthropic
 import threading
 import os
 import time
 import logging
-from functools import wraps
+from functools import partial
+
+from app.history import ConversationHistory
+from app.clients import get_anthropic_client, HTTP_TIMEOUT_SECONDS
+from app.retry import retry_call, remaining_timeout
+from app.tool_executor import ToolCall, run_tools
+from app.debug_capture import debug_capture
+from app.tool_registry import tool_registry, DEFAULT_ASSISTANT
+from app.prompt_cache import prompt_cache_stats
+from app.anthropic_cache import plan_cache_breakpoints, ANTHROPIC_CACHE_PLANNER
+from app.anthropic_codec import encode_content, decode_messages
+from app.utils.token_counter import token_counter, trim_messages
 
 # Servicios n8n eliminados - se manejará con MCP
 
@@ -17,30 +27,18 @@ logger = logging.getLogger(__name__)
 # Herramientas se manejarán vía MCP
 TOOL_FUNCTIONS = {}
 
-def retry_on_exception(max_retries=3, initial_wait=1):
-    """Reintenta llamadas a la API con backoff exponencial."""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            retries = 0
-            while retries < max_retries:
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    retries += 1
-                    wait_time = initial_wait * (2 ** retries)
-                    if retries >= max_retries:
-                        logger.error(f"Error definitivo tras {max_retries} intentos: {e}")
-                        raise
-                    logger.warning(f"Error en llamada a API (intento {retries}). Reintentando en {wait_time}s: {e}")
-                    time.sleep(wait_time)
-        return wrapper
-    return decorator
-
-@retry_on_exception(max_retries=3, initial_wait=1)
-def call_anthropic_api(client, **kwargs):
-    """Llama a la API de Anthropic con reintentos automáticos."""
-    return client.messages.create(**kwargs)
+def call_anthropic_api(client, deadline=None, **kwargs):
+    """
+    Llama a la API de Anthropic reintentando solo errores transitorios
+    (429, 5xx, timeouts)
+    """
+    def attempt():
+        # Cada intento usa lo que resta del plazo del turno como timeout
+        options = {}
+        if deadline:
+            options["timeout"] = remaining_timeout(HTTP_TIMEOUT_SECONDS, deadline)
+        return client.messages.create(**kwargs, **options)
+    return retry_call(attempt, "anthropic", deadline=deadline)
 
 def validate_conversation_history(history):
     """Valida que la estructura del historial sea correcta para Anthropic."""
@@ -64,6 +62,15 @@ def validate_conversation_history(history):
 
     return True
 
+def is_anthropic_turn_start(message):
+    """Mensaje de usuario que no sea un tool_result (su tool_use quedaría fuera)"""
+    if message.get("role") != "user":
+        return False
+    content = message.get("content")
+    return isinstance(content, str) or not any(get_field(block, "type") == "tool_result"
+                                               for block in content)
+
+
 def get_field(item, key):
     """Obtiene un campo de un objeto o diccionario de forma segura."""
     if item is None:
@@ -88,102 +95,153 @@ def generate_response(
     use_cache_control,
     llm_id=None,
     conversation_manager=None,
-    thread_locks=None
+    lock_manager=None,
+    deadline=None,
+    turn_metadata=None
     ):
     if not llm_id:
         llm_id = "claude-3-5-haiku-latest"
 
     logger.info("Intentando adquirir lock para thread_id: %s", thread_id)
-    lock = thread_locks.get(thread_id)
-    if not lock:
-        logger.error("No se encontró lock para thread_id: %s", thread_id)
-        thread_locks[thread_id] = threading.Lock()
-        lock = thread_locks[thread_id]
+    lock_timeout = max(0.0, deadline - time.time()) if deadline else None
+    lock = lock_manager.acquire(thread_id, timeout=lock_timeout, owner=subscriber_id)
+    if lock is None:
+        # El endpoint reporta el timeout al vencer el mismo plazo
+        logger.error("No se pudo adquirir lock para thread_id %s antes del plazo",
+                     thread_id)
+        return
 
     with lock:
         logger.info("Lock adquirido para thread_id: %s", thread_id)
         start_time = time.time()
+        # Payloads completos solo si el turno está muestreado o
+        # activado por /admin/debug
+        debug_capture.begin_turn(thread_id, subscriber_id)
         
         # Log del mensaje del usuario
         logger.info("👤 USUARIO MENSAJE para thread_id %s: %s", thread_id, message[:150] + "..." if len(message) > 150 else message)
 
+        # Unidad de trabajo del turno: una sola escritura del historial al final
+        uow = conversation_manager.unit_of_work(thread_id)
+
         try:
             # Obtener conversación actual
             conversation = conversation_manager.get(thread_id)
             if not conversation:
                 logger.error(f"Conversación {thread_id} no encontrada")
-                conversation_manager.set(thread_id, {
-                    "status": "error",
-                    "response": "Conversación no encontrada",
-                    "messages": []
-                })
+                uow.fail("Conversación no encontrada", {"messages": []})
                 return
 
-            client = anthropic.Anthropic(api_key=api_key)
-            conversation_history = conversation.get("messages", [])
+            uow.begin(conversation, turn_metadata)
+
+            # Cliente compartido: reutiliza conexiones entre turnos
+            client = get_anthropic_client(api_key)
+            # Historial inmutable: cada append crea una nueva versión sin copiar
+            # Los bloques guardados con el formato anterior (repr del
+            # SDK) se recuperan al cargar
+            conversation_history = ConversationHistory.of(
+                decode_messages(conversation.get("messages"))
+            )
 
             # Agregar el mensaje del usuario al historial
             user_message_content = {"type": "text", "text": message}
-            if use_cache_control:
+            if use_cache_control and not ANTHROPIC_CACHE_PLANNER:
                 user_message_content["cache_control"] = {"type": "ephemeral"}
-            conversation_history.append({
+            conversation_history = conversation_history.append({
                 "role": "user",
                 "content": [user_message_content]
             })
 
-            # Cargar herramientas
-            assistant_value = conversation.get("assistant")
-            assistant_str = str(assistant_value)
-            
-            # Cargar herramientas desde archivo único
-            tools_file_path = os.path.join(os.path.dirname(__file__), '..', 'tools', 'default_tools.json')
-            with open(tools_file_path, "r", encoding="utf-8") as tools_file:
-                tools = json.load(tools_file)
-
-            # Configurar sistema
-            assistant_content = [{"type": "text", "text": assistant_content_text}]
+            # Herramientas de default_tools.json ya convertidas al formato Anthropic
+            tools = tool_registry.toolset(DEFAULT_ASSISTANT).anthropic
 
             # Usar herramientas desde variable global
             tool_functions = TOOL_FUNCTIONS
 
+            # Pre-flight: system y herramientas son fijos; el
+            # historial se recorta si no cabe
+            max_tokens = 1000
+            history_budget = token_counter.input_budget(llm_id, max_tokens) - (
+                token_counter.count_text(assistant_content_text, llm_id)
+                + token_counter.count_tools(tools, llm_id)
+            )
+            # Tokens del turno (todas las rondas) para validar la
+            # tasa de aciertos de caché
+            turn_usage = {"input_tokens": 0, "output_tokens": 0,
+                          "cache_creation_input_tokens": 0,
+                          "cache_read_input_tokens": 0, "calls": 0}
+
             # Iniciar interacción con el modelo
             while True:
                 # Validar estructura de mensajes antes de enviar
-                if not validate_conversation_history(conversation_history):
-                    logger.error("Estructura de mensajes inválida: %s", conversation_history)
+                payload_messages, dropped, history_tokens = trim_messages(
+                    conversation_history.to_list(), history_budget, llm_id,
+                    is_anthropic_turn_start
+                )
+                logger.info("📏 [PREFLIGHT] ~%d tokens de historial (presupuesto "
+                            "%d, %d recortados, %s)",
+                            history_tokens, history_budget, dropped,
+                            token_counter.backend)
+                if not validate_conversation_history(payload_messages):
+                    logger.error("Estructura de mensajes inválida: %s",
+                                 payload_messages)
                     raise ValueError("Estructura de conversación inválida")
 
+                # Breakpoints de caché sobre copias: tools, system estático,
+                # inicio del turno y última ronda
+                (system_blocks, payload_tools, payload_messages,
+                 breakpoints) = plan_cache_breakpoints(
+                    assistant_content_text, tools, payload_messages, llm_id,
+                    is_anthropic_turn_start
+                )
+                logger.info("💾 [ANTHROPIC CACHE] Breakpoints: %s",
+                            ", ".join(f"{bp['at']}@~{bp['prefix_tokens']}"
+                                      for bp in breakpoints) or "ninguno")
+
                 try:
-                    logger.info("PAYLOAD ANTHROPIC: %s", conversation_history)
-                    # Llamar a la API con reintentos
+                    debug_capture.record("anthropic_request",
+                                         lambda: {"system": system_blocks,
+                                                  "tools": payload_tools,
+                                                  "messages": payload_messages})
+                    # Llamar a la API (reintenta errores transitorios dentro del plazo)
                     logger.info("Llamando a Anthropic API para thread_id: %s", thread_id)
                     response = call_anthropic_api(
                         client=client,
                         model=llm_id,
-                        max_tokens=1000,
+                        max_tokens=max_tokens,
                         temperature=0.8,
-                        system=assistant_content,
-                        tools=tools,
-                        messages=conversation_history
+                        system=system_blocks,
+                        tools=payload_tools,
+                        messages=payload_messages,
+                        deadline=deadline
                     )
-                    logger.info("RESPUESTA RAW ANTHROPIC: %s", response)
+                    logger.info("Respuesta Anthropic %s - stop_reason: %s",
+                                response.id, response.stop_reason)
+                    debug_capture.record("anthropic_response", lambda: response)
                     # Procesar respuesta
-                    conversation_history.append({
+                    # Bloques del SDK a dicts mínimos: serializables y con la
+                    # estructura que la API espera
+                    conversation_history = conversation_history.append({
                         "role": "assistant",
-                        "content": response.content
+                        "content": encode_content(response.content)
                     })
 
                     # Almacenar tokens
                     usage = {
                         "input_tokens": response.usage.input_tokens,
                         "output_tokens": response.usage.output_tokens,
-                        "cache_creation_input_tokens": response.usage.cache_creation_input_tokens,
-                        "cache_read_input_tokens": response.usage.cache_read_input_tokens,
+                        "cache_creation_input_tokens":
+                            response.usage.cache_creation_input_tokens or 0,
+                        "cache_read_input_tokens":
+                            response.usage.cache_read_input_tokens or 0,
                     }
+                    for key, value in usage.items():
+                        turn_usage[key] += value or 0
+                    turn_usage["calls"] += 1
                     
-                    # Actualizar conversación con tokens y mensajes
-                    conversation_manager.update(thread_id, {
-                        "usage": usage,
+                    # Acumular tokens y mensajes en la unidad de trabajo
+                    uow.stage({
+                        "usage": dict(turn_usage),
                         "messages": conversation_history
                     })
 
@@ -196,6 +254,22 @@ def generate_response(
                                 usage["cache_creation_input_tokens"])
                     logger.info("Cache Read Input Tokens: %d", 
                                 usage["cache_read_input_tokens"])
+                    # input_tokens de Anthropic no incluye los tokens
+                    # escritos ni leídos de caché
+                    cache_read = usage["cache_read_input_tokens"]
+                    cache_write = usage["cache_creation_input_tokens"]
+                    prompt_cache_stats.record(
+                        llm_id,
+                        usage["input_tokens"] + cache_write + cache_read,
+                        cache_read,
+                        cache_write
+                    )
+                    logger.info("💾 [ANTHROPIC CACHE] Turno (%d llamadas): escritura "
+                                "%d, lectura %d, sin caché %d",
+                                turn_usage["calls"],
+                                turn_usage["cache_creation_input_tokens"],
+                                turn_usage["cache_read_input_tokens"],
+                                turn_usage["input_tokens"])
 
                     # Procesar herramientas
                     if response.stop_reason == "tool_use":
@@ -211,37 +285,48 @@ def generate_response(
                             # Log de la respuesta final de la IA
                             logger.info("🤖 ANTHROPIC RESPUESTA FINAL para thread_id %s: %s", thread_id, assistant_response_text[:200] + "..." if len(assistant_response_text) > 200 else assistant_response_text)
                             
-                            conversation_manager.update(thread_id, {
+                            uow.commit({
                                 "response": assistant_response_text,
                                 "status": "completed",
                                 "messages": conversation_history
                             })
                             break
 
-                        # Procesar herramienta
-                        tool_use = tool_use_blocks[0]
-                        tool_name = get_field(tool_use, "name")
-                        tool_input = get_field(tool_use, "input")
-
-                        if tool_name in tool_functions:
-                            result = tool_functions[tool_name](tool_input, subscriber_id)
-                            result_json = json.dumps(result)
+                        # Procesar herramientas: cada tool_use necesita su tool_result
+                        unknown = [get_field(block, "name") for block in tool_use_blocks
+                                   if get_field(block, "name") not in tool_functions]
+                        if unknown:
+                            logger.warning("Herramienta desconocida: %s", unknown)
+                            uow.fail(f"Herramienta desconocida: {', '.join(unknown)}")
+                            break
 
-                            # Agregar resultado
-                            conversation_history.append({
-                                "role": "user",
-                                "content": [{
+                        # Llamadas independientes en paralelo, resultados
+                        # en el orden de los bloques
+                        results = run_tools([
+                            ToolCall(
+                                get_field(block, "name"),
+                                partial(tool_functions[get_field(block, "name")],
+                                        get_field(block, "input"), subscriber_id)
+                            )
+                            for block in tool_use_blocks
+                        ], deadline=deadline)
+
+                        # Agregar resultados en un solo mensaje de usuario
+                        conversation_history = conversation_history.append({
+                            "role": "user",
+                            "content": [
+                                {
                                     "type": "tool_result",
-                                    "tool_use_id": get_field(tool_use, "id"),
-                                    "content": result_json,
-                                }],
-                            })
-                            
-                            # Actualizar conversación con historial actualizado
-                            conversation_manager.update(thread_id, {"messages": conversation_history})
-                        else:
-                            logger.warning("Herramienta desconocida: %s", tool_name)
-                            break
+                                    "tool_use_id": get_field(block, "id"),
+                                    "content": json.dumps(result),
+                                }
+                                for block, result in zip(
+                                    tool_use_blocks, results, strict=True)
+                            ],
+                        })
+                        
+                        # Acumular historial actualizado
+                        uow.stage({"messages": conversation_history})
                     else:
                         # Respuesta final
                         assistant_response_text = ""
@@ -252,7 +337,7 @@ def generate_response(
                         # Log de la respuesta final de la IA
                         logger.info("🤖 ANTHROPIC RESPUESTA FINAL para thread_id %s: %s", thread_id, assistant_response_text[:200] + "..." if len(assistant_response_text) > 200 else assistant_response_text)
                         
-                        conversation_manager.update(thread_id, {
+                        uow.commit({
                             "response": assistant_response_text,
                             "status": "completed",
                             "messages": conversation_history
@@ -261,19 +346,16 @@ def generate_response(
 
                 except Exception as api_error:
                     logger.exception("Error en llamada a API para thread_id %s: %s", thread_id, api_error)
-                    conversation_manager.update(thread_id, {
-                        "response": f"Error de comunicación: {str(api_error)}",
-                        "status": "error"
-                    })
+                    uow.fail(f"Error de comunicación: {str(api_error)}")
                     break
 
         except Exception as e:
             logger.exception("Error en generate_response para thread_id %s: %s", thread_id, e)
-            conversation_manager.update(thread_id, {
-                "response": f"Error: {str(e)}",
-                "status": "error"
-            })
+            uow.fail(f"Error: {str(e)}")
         finally:
+            # Garantiza un estado terminal aunque el turno no haya hecho commit
+            uow.close()
+            debug_capture.end_turn()
             event.set()
             elapsed_time = time.time() - start_time
             logger.info("Generación completada en %.2f segundos para thread_id: %s", elapsed_time, thread_id)
\ No newline at end of file
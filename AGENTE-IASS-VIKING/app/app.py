@@ -8,26 +8,26 @@ import time
 from app.endpoints import init_endpoints
 from app.cleanup import start_cleanup_thread
 from app.conversation_manager import create_conversation_manager
+from app.conversation_archive import create_tiered_manager
+from app.lock_manager import create_lock_manager
+from app.logging_config import setup_logging
+from app.tool_registry import tool_registry
+from app.utils.token_counter import token_counter
 
 # Cargar variables de entorno
 load_dotenv()
 
 app = Flask(__name__)
 
-# Configuración del logging
-logging.basicConfig(
-    level=logging.INFO,  # Nivel de logging: DEBUG, INFO, WARNING, ERROR, CRITICAL
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.StreamHandler()  # Salida a la consola
-    ])
+# Configuración del logging: cola + listener en segundo plano
+# (LOG_LEVEL, LOG_FORMAT, LOG_LEVELS)
+setup_logging()
 
 
 logger = logging.getLogger(__name__)
 
 # Variables globales
 conversations = {}  # Mantenido para compatibilidad con MemoryConversationManager
-thread_locks = {}
 
 # Configuración Redis
 USE_REDIS = os.getenv('USE_REDIS', 'false').lower() == 'true'
@@ -59,15 +59,29 @@ except Exception as e:
     )
     logger.warning("Fallback a MemoryConversationManager")
 
+# Archivo en disco de conversaciones inactivas (ARCHIVE_ENABLED=true)
+conversation_manager = create_tiered_manager(conversation_manager)
+
+# Locks por thread_id: distribuidos si el almacenamiento es Redis
+lock_manager = create_lock_manager(
+    redis_client=getattr(conversation_manager, 'redis_client', None)
+)
+logger.info(f"LockManager inicializado - Tipo: {type(lock_manager).__name__}")
+
+# Herramientas de todos los assistants en memoria (se recargan si cambia el archivo)
+tool_registry.load_all()
+
+# Encodings de tiktoken cargados al iniciar (sin red se usa el conteo aproximado)
+token_counter.warm_up()
 
 
 
 
 # Inicializar endpoints
-init_endpoints(app, conversation_manager, thread_locks)
+init_endpoints(app, conversation_manager, lock_manager)
 
 # Iniciar hilo de limpieza
-start_cleanup_thread(conversation_manager, thread_locks)
+start_cleanup_thread(conversation_manager, lock_manager)
 
 if __name__ == '__main__':
     logger.info("Iniciando la aplicación Flask")
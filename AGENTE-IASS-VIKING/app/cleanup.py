@@ -1,35 +1,40 @@
+import os
 import time
 import threading
 import logging
 
+from app.conversation_manager import CONVERSATION_TTL_SECONDS
+from app.leader_election import create_leader_lease
+
 logger = logging.getLogger(__name__)
 
-def cleanup_inactive_conversations(conversation_manager, thread_locks):
-    """Limpia conversaciones inactivas después de 2 horas."""
-    expiration_time = 7200  # 2 horas en segundos (cambiado de 3h)
+# Intervalo entre limpiezas y expiración de conversaciones inactivas
+CLEANUP_INTERVAL_SECONDS = int(os.getenv('CLEANUP_INTERVAL_SECONDS', 3600))
+CONVERSATION_EXPIRATION_SECONDS = CONVERSATION_TTL_SECONDS
+
+def cleanup_inactive_conversations(conversation_manager, lock_manager, leader=None):
+    """
+    Limpia (o archiva, si el archivo está habilitado) conversaciones inactivas.
+    
+    Solo la réplica líder recorre el almacenamiento compartido; cada réplica
+    poda siempre su propio registro de locks.
+    """
+    expiration_time = CONVERSATION_EXPIRATION_SECONDS
     
     try:
-        # Usar el método cleanup_expired del manager
-        cleaned_conversations = conversation_manager.cleanup_expired(expiration_time)
-        
-        # Limpiar locks huérfanos
-        thread_ids = conversation_manager.get_all_thread_ids()
-        valid_thread_ids = set(thread_ids)
-        
-        # Eliminar locks de threads que ya no existen
-        locks_to_remove = []
-        for thread_id in list(thread_locks.keys()):
-            if thread_id not in valid_thread_ids:
-                locks_to_remove.append(thread_id)
+        cleaned_conversations = 0
+        if leader is None or leader.acquire():
+            # Usar el método cleanup_expired del manager
+            cleaned_conversations = conversation_manager.cleanup_expired(
+                expiration_time
+            )
+        else:
+            logger.debug("Limpieza global omitida - Líder actual: "
+                         f"{leader.current_leader()}")
         
-        cleaned_locks = 0
-        for thread_id in locks_to_remove:
-            try:
-                del thread_locks[thread_id]
-                cleaned_locks += 1
-                logger.debug(f"Lock huérfano eliminado: {thread_id}")
-            except Exception as e:
-                logger.error(f"Error al eliminar lock {thread_id}: {e}")
+        # Los locks se eliminan al quedar libres; solo se podan
+        # métricas de hilos inactivos
+        cleaned_locks = lock_manager.prune(expiration_time)
         
         if cleaned_conversations > 0 or cleaned_locks > 0:
             logger.info(f"Limpieza completada - Conversaciones: {cleaned_conversations}, Locks: {cleaned_locks}")
@@ -42,17 +47,28 @@ def cleanup_inactive_conversations(conversation_manager, thread_locks):
         logger.error(f"Error en cleanup_inactive_conversations: {e}")
         return 0
 
-def start_cleanup_thread(conversation_manager, thread_locks):
-    """Inicia un hilo que ejecuta la limpieza cada hora."""
+def start_cleanup_thread(conversation_manager, lock_manager):
+    """Inicia un hilo que ejecuta la limpieza cada CLEANUP_INTERVAL_SECONDS."""
+    # El lease dura dos intervalos: si la líder cae, otra réplica la reemplaza
+    leader = create_leader_lease(
+        getattr(conversation_manager, 'redis_client', None),
+        name="cleanup",
+        lease_seconds=CLEANUP_INTERVAL_SECONDS * 2
+    )
+
     def cleanup_worker():
         while True:
             try:
-                time.sleep(3600)  # Ejecutar cada hora
-                logger.info("Ejecutando limpieza programada (2h expiration)")
-                cleanup_inactive_conversations(conversation_manager, thread_locks)
+                time.sleep(CLEANUP_INTERVAL_SECONDS)
+                logger.info("Ejecutando limpieza programada "
+                            f"({CONVERSATION_EXPIRATION_SECONDS}s expiration)")
+                cleanup_inactive_conversations(conversation_manager, lock_manager,
+                                               leader)
             except Exception as e:
                 logger.error(f"Error en hilo de limpieza: {e}")
 
     cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
     cleanup_thread.start()
-    logger.info("Hilo de limpieza iniciado - TTL: 2 horas")
\ No newline at end of file
+    logger.info(f"Hilo de limpieza iniciado - Intervalo: {CLEANUP_INTERVAL_SECONDS}s, "
+                f"TTL: {CONVERSATION_EXPIRATION_SECONDS}s")
+    return leader
\ No newline at end of file
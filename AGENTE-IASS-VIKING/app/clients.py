@@ -0,0 +1,127 @@
+"""
+Clients - Clientes LLM compartidos por proceso
+Un cliente por (api key, base URL) con un pool de conexiones httpx reutilizado
+entre turnos: evita construir el cliente y repetir el handshake TLS en cada mensaje.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Pool de conexiones HTTP hacia los proveedores LLM
+HTTP_MAX_CONNECTIONS = int(os.getenv('LLM_HTTP_MAX_CONNECTIONS', 50))
+HTTP_MAX_KEEPALIVE = int(os.getenv('LLM_HTTP_MAX_KEEPALIVE', 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('LLM_HTTP_KEEPALIVE_EXPIRY', 60))
+HTTP_TIMEOUT_SECONDS = float(os.getenv('LLM_HTTP_TIMEOUT_SECONDS', 120))
+HTTP2_ENABLED = os.getenv('LLM_HTTP2', 'true').lower() == 'true'
+
+
+def _http2_available() -> bool:
+    """HTTP/2 en httpx requiere el paquete opcional h2 (pip install httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def build_http_client():
+    """Cliente httpx con keep-alive y límites de conexiones configurables"""
+    import httpx
+
+    return httpx.Client(
+        http2=HTTP2_ENABLED and _http2_available(),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=10.0)
+    )
+
+
+class ClientRegistry:
+    """
+    Registro de clientes por (api key, base URL)
+
+    Los clientes de OpenAI y Anthropic son seguros entre hilos, así que una
+    instancia sirve a todos los turnos concurrentes. La api key se guarda solo
+    como hash en la clave del registro.
+    """
+
+    def __init__(self, name: str, factory: Callable[[str, Optional[str]], Any]):
+        self.name = name
+        self._factory = factory
+        self._clients: Dict[Tuple[str, Optional[str]], Any] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    @staticmethod
+    def _key(api_key: str, base_url: Optional[str]) -> Tuple[str, Optional[str]]:
+        return hashlib.sha256((api_key or "").encode('utf-8')).hexdigest(), base_url
+
+    def get(self, api_key: str, base_url: Optional[str] = None) -> Any:
+        key = self._key(api_key, base_url)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self.reused += 1
+                return client
+            client = self._factory(api_key, base_url)
+            self._clients[key] = client
+            self.created += 1
+        logger.info(f"Cliente {self.name} creado (base_url: {base_url or 'default'}) - "
+                    f"Total: {len(self._clients)}")
+        return client
+
+    def close_all(self) -> None:
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                logger.debug(f"Error al cerrar cliente {self.name}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"clients": len(self._clients), "created": self.created,
+                    "reused": self.reused}
+
+
+def _create_openai(api_key: str, base_url: Optional[str]):
+    from openai import OpenAI
+
+    # Los reintentos los hace app.retry (clasificados y con presupuesto), no el SDK
+    kwargs = {"api_key": api_key, "http_client": build_http_client(), "max_retries": 0}
+    if base_url:
+        kwargs["base_url"] = base_url
+    return OpenAI(**kwargs)
+
+
+def _create_anthropic(api_key: str, base_url: Optional[str]):
+    import anthropic
+
+    kwargs = {"api_key": api_key, "http_client": build_http_client(), "max_retries": 0}
+    if base_url:
+        kwargs["base_url"] = base_url
+    return anthropic.Anthropic(**kwargs)
+
+
+openai_clients = ClientRegistry("OpenAI", _create_openai)
+anthropic_clients = ClientRegistry("Anthropic", _create_anthropic)
+
+
+def get_openai_client(api_key: str, base_url: Optional[str] = None):
+    """Cliente OpenAI compartido para la api key y base URL indicadas"""
+    return openai_clients.get(api_key, base_url or os.getenv('OPENAI_BASE_URL'))
+
+
+def get_anthropic_client(api_key: str, base_url: Optional[str] = None):
+    """Cliente Anthropic compartido para la api key y base URL indicadas"""
+    return anthropic_clients.get(api_key, base_url or os.getenv('ANTHROPIC_BASE_URL'))
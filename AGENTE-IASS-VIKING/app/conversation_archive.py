@@ -0,0 +1,405 @@
+"""
+Conversation Archive - Nivel frío para conversaciones inactivas
+Mueve las conversaciones inactivas del almacenamiento principal (memoria/Redis)
+a segmentos comprimidos por día en disco local y las rehidrata al volver a usarlas.
+"""
+
+import os
+import json
+import time
+import zlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Any, List
+
+from app.conversation_manager import ConversationManager, ConversationConflictError
+from app.history import json_default
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationArchive:
+    """
+    Segmentos append-only por día con un índice por thread_id y subscriber_id
+
+    Cada conversación archivada se guarda como JSON comprimido con zlib al final
+    del segmento del día (``YYYY-MM-DD.seg``). El índice (``index.jsonl``) registra
+    segmento, offset y longitud; la última entrada de un thread_id es la vigente.
+
+    El índice en memoria se actualiza leyendo solo las líneas nuevas del archivo,
+    así varias réplicas pueden compartir el directorio: la réplica líder de la
+    limpieza archiva y cualquiera rehidrata.
+    """
+
+    INDEX_FILE = "index.jsonl"
+    SEGMENT_SUFFIX = ".seg"
+
+    def __init__(self, archive_dir: str, retention_days: int = 30):
+        self.archive_dir = archive_dir
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._by_subscriber: Dict[str, set] = {}
+        self._archived = 0
+        self._loaded = 0
+        # Posición leída del índice e inode (cambia cuando la purga lo reescribe)
+        self._index_offset = 0
+        self._index_inode = None
+        os.makedirs(self.archive_dir, exist_ok=True)
+        with self._lock:
+            self._refresh_index()
+        logger.info(f"ConversationArchive inicializado - Dir: {archive_dir}, "
+                    f"Conversaciones: {len(self._entries)}")
+
+    def _index_path(self) -> str:
+        return os.path.join(self.archive_dir, self.INDEX_FILE)
+
+    def _segment_path(self, segment: str) -> str:
+        return os.path.join(self.archive_dir, segment)
+
+    def _refresh_index(self) -> None:
+        """Aplica al índice en memoria las entradas agregadas a index.jsonl"""
+        try:
+            stat = os.stat(self._index_path())
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._index_inode or stat.st_size < self._index_offset:
+            # Índice reescrito por una purga: reconstruir desde el inicio
+            self._entries.clear()
+            self._by_subscriber.clear()
+            self._index_offset = 0
+            self._index_inode = stat.st_ino
+        if stat.st_size == self._index_offset:
+            return
+        with open(self._index_path(), 'rb') as index_file:
+            index_file.seek(self._index_offset)
+            for line in index_file:
+                if not line.endswith(b"\n"):
+                    break  # Línea aún en escritura
+                self._index_offset += len(line)
+                try:
+                    entry = json.loads(line.decode('utf-8'))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    # Línea truncada por un cierre abrupto
+                    logger.warning("Entrada de índice de archivo inválida, se omite")
+                    continue
+                if entry.get("deleted"):
+                    self._forget(entry["thread_id"])
+                else:
+                    self._remember(entry)
+
+    def _remember(self, entry: Dict[str, Any]) -> None:
+        self._forget(entry["thread_id"])
+        self._entries[entry["thread_id"]] = entry
+        subscriber_id = entry.get("subscriber_id")
+        if subscriber_id:
+            threads = self._by_subscriber.setdefault(str(subscriber_id), set())
+            threads.add(entry["thread_id"])
+
+    def _forget(self, thread_id: str) -> None:
+        entry = self._entries.pop(thread_id, None)
+        if entry and entry.get("subscriber_id"):
+            subscriber_id = str(entry["subscriber_id"])
+            threads = self._by_subscriber.get(subscriber_id, set())
+            threads.discard(thread_id)
+            if not threads:
+                self._by_subscriber.pop(subscriber_id, None)
+
+    def _append_index(self, entry: Dict[str, Any]) -> None:
+        with open(self._index_path(), 'a', encoding='utf-8') as index_file:
+            index_file.write(json.dumps(entry) + "\n")
+
+    def archive(self, thread_id: str, conversation: Dict[str, Any]) -> bool:
+        """Agrega la conversación al segmento del día y la registra en el índice"""
+        text = json.dumps(conversation, default=json_default)
+        payload = zlib.compress(text.encode('utf-8'))
+        segment = datetime.now().strftime("%Y-%m-%d") + self.SEGMENT_SUFFIX
+        with self._lock:
+            self._refresh_index()
+            with open(self._segment_path(segment), 'ab') as segment_file:
+                offset = segment_file.tell()
+                segment_file.write(payload)
+            entry = {
+                "thread_id": thread_id,
+                "subscriber_id": conversation.get("subscriber_id"),
+                "assistant": conversation.get("assistant"),
+                "segment": segment,
+                "offset": offset,
+                "length": len(payload),
+                "archived_at": time.time()
+            }
+            self._append_index(entry)
+            self._remember(entry)
+            self._archived += 1
+        logger.debug(f"Conversación archivada: {thread_id} ({len(payload)} "
+                     f"bytes en {segment})")
+        return True
+
+    def load(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """Lee y descomprime la versión archivada de una conversación"""
+        with self._lock:
+            self._refresh_index()
+            entry = self._entries.get(thread_id)
+            if not entry:
+                return None
+            try:
+                with open(self._segment_path(entry["segment"]), 'rb') as segment_file:
+                    segment_file.seek(entry["offset"])
+                    payload = segment_file.read(entry["length"])
+                self._loaded += 1
+                return json.loads(zlib.decompress(payload).decode('utf-8'))
+            except (OSError, zlib.error, ValueError) as e:
+                logger.error(f"Error al leer conversación archivada {thread_id}: {e}")
+                return None
+
+    def contains(self, thread_id: str) -> bool:
+        with self._lock:
+            self._refresh_index()
+            return thread_id in self._entries
+
+    def remove(self, thread_id: str) -> bool:
+        """Marca la conversación como eliminada del archivo"""
+        with self._lock:
+            self._refresh_index()
+            if thread_id not in self._entries:
+                return False
+            self._append_index({"thread_id": thread_id, "deleted": True})
+            self._forget(thread_id)
+            return True
+
+    def find_by_subscriber(self, subscriber_id: str) -> List[Dict[str, Any]]:
+        """Conversaciones archivadas de un subscriber, la más reciente primero"""
+        with self._lock:
+            self._refresh_index()
+            entries = [dict(self._entries[thread_id])
+                       for thread_id in self._by_subscriber.get(str(subscriber_id), ())]
+        entries.sort(key=lambda entry: entry["archived_at"], reverse=True)
+        return entries
+
+    def purge(self, retention_days: Optional[int] = None) -> int:
+        """Elimina segmentos más antiguos que la retención y compacta el índice"""
+        if retention_days is None:
+            retention_days = self.retention_days
+        cutoff = (datetime.now() - timedelta(days=retention_days)).strftime("%Y-%m-%d")
+        removed = 0
+        with self._lock:
+            self._refresh_index()
+            expired_segments = [
+                name for name in os.listdir(self.archive_dir)
+                if name.endswith(self.SEGMENT_SUFFIX)
+                and name[:-len(self.SEGMENT_SUFFIX)] < cutoff
+            ]
+            if not expired_segments:
+                return 0
+            for thread_id, entry in list(self._entries.items()):
+                if entry["segment"] in expired_segments:
+                    self._forget(thread_id)
+                    removed += 1
+
+            # Reescribir el índice solo con las entradas vigentes
+            tmp_path = self._index_path() + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as index_file:
+                for entry in self._entries.values():
+                    index_file.write(json.dumps(entry) + "\n")
+            os.replace(tmp_path, self._index_path())
+            stat = os.stat(self._index_path())
+            self._index_inode, self._index_offset = stat.st_ino, stat.st_size
+
+            for name in expired_segments:
+                os.remove(self._segment_path(name))
+        logger.info(f"Archivo purgado - Segmentos: {len(expired_segments)}, "
+                    f"Conversaciones: {removed}")
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh_index()
+            segments = [name for name in os.listdir(self.archive_dir)
+                        if name.endswith(self.SEGMENT_SUFFIX)]
+            return {
+                "archived_threads": len(self._entries),
+                "subscribers": len(self._by_subscriber),
+                "segments": len(segments),
+                "segment_bytes": sum(os.path.getsize(self._segment_path(name))
+                                     for name in segments),
+                "archived_total": self._archived,
+                "rehydrated_total": self._loaded,
+                "retention_days": self.retention_days
+            }
+
+
+class TieredConversationManager(ConversationManager):
+    """
+    Almacenamiento en dos niveles: principal (memoria/Redis) y archivo en disco
+
+    La limpieza archiva las conversaciones inactivas en lugar de eliminarlas;
+    get/update/exists las encuentran en el archivo y las rehidratan al nivel
+    principal en el siguiente mensaje.
+    """
+
+    def __init__(self, hot: ConversationManager, archive: ConversationArchive,
+                 idle_seconds: int = 1800):
+        self.hot = hot
+        self.archive = archive
+        self.idle_seconds = idle_seconds
+        # Compartido con el LockManager cuando el nivel principal es Redis
+        self.redis_client = getattr(hot, 'redis_client', None)
+        logger.info("TieredConversationManager inicializado - Archivo tras "
+                    f"{idle_seconds}s de inactividad")
+
+    def _rehydrate(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Mueve la conversación archivada al nivel principal
+
+        La copia del archivo se elimina al rehidratar: los turnos siguientes solo
+        quedan en el nivel principal, y si este la expira por TTL (sin pasar por
+        cleanup_expired) no debe volver el historial viejo.
+        """
+        conversation = self.archive.load(thread_id)
+        if conversation is None:
+            return None
+        conversation["last_activity"] = time.time()
+        try:
+            # expected_version=0: solo si nadie la rehidrató o recreó antes
+            stored = self.hot.set(thread_id, conversation, expected_version=0)
+            if stored:
+                logger.info(f"Conversación rehidratada desde archivo: {thread_id}")
+        except ConversationConflictError:
+            logger.debug(f"Conversación {thread_id} ya presente en el nivel principal")
+            stored = True
+        if stored:
+            try:
+                self.archive.remove(thread_id)
+            except OSError as e:
+                logger.error("Error al retirar del archivo la conversación "
+                             f"rehidratada {thread_id}: {e}")
+        return self.hot.get(thread_id)
+
+    def get(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        conversation = self.hot.get(thread_id)
+        if conversation is None and self.archive.contains(thread_id):
+            conversation = self._rehydrate(thread_id)
+        return conversation
+
+    def set(self, thread_id: str, data: Dict[str, Any],
+            expected_version: Optional[int] = None) -> bool:
+        return self.hot.set(thread_id, data, expected_version)
+
+    def update(self, thread_id: str, updates: Dict[str, Any],
+               expected_version: Optional[int] = None) -> bool:
+        if not self.hot.exists(thread_id) and self.archive.contains(thread_id):
+            self._rehydrate(thread_id)
+        return self.hot.update(thread_id, updates, expected_version)
+
+    def delete(self, thread_id: str, expected_version: Optional[int] = None) -> bool:
+        deleted = self.hot.delete(thread_id, expected_version)
+        return self.archive.remove(thread_id) or deleted
+
+    def exists(self, thread_id: str) -> bool:
+        return self.hot.exists(thread_id) or self.archive.contains(thread_id)
+
+    def get_all_thread_ids(self) -> list:
+        """Solo los thread_ids del nivel principal"""
+        return self.hot.get_all_thread_ids()
+
+    def list_conversations(self, cursor: Optional[str] = None, limit: int = 50,
+                           filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Solo el nivel principal; las archivadas se consultan por subscriber"""
+        return self.hot.list_conversations(cursor, limit, filters)
+
+    def get_active_thread(self, subscriber_id: str,
+                          assistant: Any = None) -> Optional[str]:
+        """Hilo activo en el nivel principal o, si no hay, el archivado más reciente"""
+        thread_id = self.hot.get_active_thread(subscriber_id, assistant)
+        if thread_id:
+            return thread_id
+        for entry in self.archive.find_by_subscriber(subscriber_id):
+            if assistant is None or str(entry.get("assistant")) == str(assistant):
+                return entry["thread_id"]
+        return None
+
+    def get_stale(self, thread_id: str,
+                  min_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        conversation = self.hot.get_stale(thread_id, min_version)
+        if conversation is None and self.archive.contains(thread_id):
+            conversation = self._rehydrate(thread_id)
+        return conversation
+
+    def peek(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """Lee del nivel principal o del archivo sin rehidratar"""
+        conversation = self.hot.get_stale(thread_id)
+        if conversation is None:
+            conversation = self.archive.load(thread_id)
+            if conversation is not None:
+                conversation["archived"] = True
+        return conversation
+
+    def get_size_report(self, top_n: int = 20) -> Dict[str, Any]:
+        report = self.hot.get_size_report(top_n)
+        report["archive"] = self.archive.get_stats()
+        return report
+
+    def cleanup_expired(self, expiration_seconds: int) -> int:
+        """Archiva las conversaciones inactivas y purga segmentos vencidos"""
+        idle_seconds = min(self.idle_seconds, expiration_seconds)
+        current_time = time.time()
+        moved = 0
+
+        for thread_id in self.hot.get_all_thread_ids():
+            conversation = self.hot.get(thread_id)
+            if not conversation:
+                continue
+            idle = current_time - conversation.get("last_activity", 0)
+            if idle <= idle_seconds:
+                continue
+            # Versión leída antes de archivar (en memoria el
+            # registro es el mismo objeto)
+            version = conversation.get("version")
+
+            try:
+                self.archive.archive(thread_id, conversation)
+            except OSError as e:
+                # Sin copia archivada no se elimina: se reintenta en la próxima limpieza
+                logger.error("Error al archivar conversación "
+                             f"{thread_id}, se conserva: {e}")
+                continue
+
+            try:
+                # Si hubo actividad mientras se archivaba, la
+                # versión cambió y se conserva
+                if self.hot.delete(thread_id, expected_version=version):
+                    moved += 1
+            except ConversationConflictError:
+                logger.debug(f"Conversación {thread_id} activa durante el "
+                             "archivado, se conserva")
+
+        try:
+            self.archive.purge()
+        except OSError as e:
+            logger.error(f"Error al purgar archivo de conversaciones: {e}")
+
+        return moved
+
+
+def create_tiered_manager(hot: ConversationManager) -> ConversationManager:
+    """
+    Envuelve el manager principal con el nivel de archivo si está habilitado
+
+    Variables de entorno: ARCHIVE_ENABLED, ARCHIVE_DIR, ARCHIVE_IDLE_SECONDS,
+    ARCHIVE_RETENTION_DAYS.
+    """
+    if os.getenv('ARCHIVE_ENABLED', 'false').lower() != 'true':
+        return hot
+    try:
+        archive = ConversationArchive(
+            os.getenv('ARCHIVE_DIR', 'data/archive'),
+            retention_days=int(os.getenv('ARCHIVE_RETENTION_DAYS', 30))
+        )
+        return TieredConversationManager(
+            hot, archive, idle_seconds=int(os.getenv('ARCHIVE_IDLE_SECONDS', 1800))
+        )
+    except Exception as e:
+        logger.error("Falló inicialización del archivo de conversaciones, se usa solo "
+                     f"el nivel principal: {e}")
+        return hot
@@ -6,14 +6,60 @@ Implementa patrón Strategy para alternar entre almacenamiento Redis y memoria.
 import json
 import time
 import logging
+import contextlib
+import threading
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from typing import Dict, Optional, Any
 import os
 
+from app.history import ConversationHistory
+from app.conversation_quota import CONVERSATION_QUOTA, serialized_size
+
 logger = logging.getLogger(__name__)
 
+# Expiración de conversaciones inactivas (TTL de Redis y limpieza en memoria)
+CONVERSATION_TTL_SECONDS = int(
+    os.getenv('CONVERSATION_EXPIRATION_SECONDS', 2 * 60 * 60)
+)
+
+
+class ConversationConflictError(Exception):
+    """
+    Conflicto de escritura concurrente (compare-and-set fallido).
+    
+    Indica que otro escritor modificó la conversación después de leerla.
+    Es reintentable: el llamador debe releer la conversación y repetir el turno.
+    """
+    
+    retryable = True
+    
+    def __init__(self, thread_id: str, expected_version: int, current_version: int):
+        self.thread_id = thread_id
+        self.expected_version = expected_version
+        self.current_version = current_version
+        super().__init__(
+            f"Conflicto de concurrencia en {thread_id}: "
+            f"versión esperada {expected_version}, actual {current_version}"
+        )
+
+
 class ConversationManager(ABC):
-    """Interfaz abstracta para gestión de conversaciones"""
+    """
+    Interfaz abstracta para gestión de conversaciones
+    
+    Cada escritura (set/update) incrementa el campo ``version`` del registro.
+    Si se pasa ``expected_version``, la escritura solo se aplica cuando la
+    versión almacenada coincide; de lo contrario se lanza
+    ConversationConflictError en lugar de sobrescribir el historial.
+    
+    Cada escritura también registra ``size_bytes`` (tamaño serializado del
+    registro) y ``message_count``, y aplica la cuota por conversación al
+    historial antes de guardarlo.
+    """
+    
+    # Cuota por conversación (CONVERSATION_MAX_BYTES / CONVERSATION_MAX_MESSAGES)
+    quota = CONVERSATION_QUOTA
     
     @abstractmethod
     def get(self, thread_id: str) -> Optional[Dict[str, Any]]:
@@ -21,18 +67,20 @@ class ConversationManager(ABC):
         pass
     
     @abstractmethod
-    def set(self, thread_id: str, data: Dict[str, Any]) -> bool:
+    def set(self, thread_id: str, data: Dict[str, Any],
+            expected_version: Optional[int] = None) -> bool:
         """Crea/actualiza una conversación completa"""
         pass
     
     @abstractmethod
-    def update(self, thread_id: str, updates: Dict[str, Any]) -> bool:
+    def update(self, thread_id: str, updates: Dict[str, Any],
+               expected_version: Optional[int] = None) -> bool:
         """Actualiza campos específicos de una conversación"""
         pass
     
     @abstractmethod
-    def delete(self, thread_id: str) -> bool:
-        """Elimina una conversación"""
+    def delete(self, thread_id: str, expected_version: Optional[int] = None) -> bool:
+        """Elimina una conversación (solo si la versión coincide, cuando se indica)"""
         pass
     
     @abstractmethod
@@ -49,10 +97,244 @@ class ConversationManager(ABC):
     def cleanup_expired(self, expiration_seconds: int) -> int:
         """Limpia conversaciones expiradas, retorna cantidad eliminada"""
         pass
+    
+    @abstractmethod
+    def get_size_report(self, top_n: int = 20) -> Dict[str, Any]:
+        """Conversaciones más grandes y tamaño total del almacenamiento"""
+        pass
+    
+    @abstractmethod
+    def list_conversations(self, cursor: Optional[str] = None, limit: int = 50,
+                           filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Página de resúmenes de conversaciones (sin deserializar historiales)
+        
+        Args:
+            cursor: Cursor devuelto por la página anterior (None = inicio)
+            limit: Máximo de conversaciones por página
+            filters: status, assistant, min_idle, max_idle (segundos)
+        
+        Returns:
+            dict: {"conversations": [...], "next_cursor": str | None}
+        """
+        pass
+    
+    def peek(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """Lectura de inspección (no modifica el almacenamiento)"""
+        return self.get_stale(thread_id)
+    
+    def get_stale(self, thread_id: str,
+                  min_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Lectura que tolera cierto retraso (estado final, listados, exportaciones)
+        
+        Los backends con réplicas pueden servirla desde una réplica, pero nunca
+        devuelven una versión anterior a ``min_version`` ni a la última escrita
+        por este proceso (read-your-writes). Por defecto equivale a ``get``.
+        """
+        conversation = self.get(thread_id)
+        version = (conversation or {}).get("version") or 0
+        behind = min_version is not None and version < min_version
+        if conversation is not None and behind:
+            # Con un solo almacenamiento get ya es la última versión: el hilo se recreó
+            logger.warning(f"Conversación {thread_id} en versión "
+                           f"{conversation.get('version')}, se esperaba al "
+                           f"menos {min_version}")
+        return conversation
+    
+    @abstractmethod
+    def get_active_thread(self, subscriber_id: str,
+                          assistant: Any = None) -> Optional[str]:
+        """thread_id activo más reciente del subscriber (del asistente, si se indica)"""
+        pass
+    
+    @staticmethod
+    def _subscriber_keys(subscriber_id: Any, assistant: Any = None) -> list:
+        """Claves del índice subscriber -> hilo: general y por asistente"""
+        if not subscriber_id:
+            return []
+        keys = [str(subscriber_id)]
+        if assistant is not None:
+            keys.append(f"{subscriber_id}|{assistant}")
+        return keys
+    
+    # Campos del resumen de una conversación
+    SUMMARY_FIELDS = ["status", "assistant", "subscriber_id", "message_count",
+                      "size_bytes", "last_activity", "version"]
+    
+    @staticmethod
+    def _summary(thread_id: str, fields: Dict[str, Any], now: float) -> Dict[str, Any]:
+        """Resumen liviano a partir de los campos escalares del registro"""
+        def number(value, cast):
+            try:
+                return cast(value)
+            except (TypeError, ValueError):
+                return None
+        last_activity = number(fields.get("last_activity"), float)
+        return {
+            "thread_id": thread_id,
+            "status": fields.get("status"),
+            "assistant": fields.get("assistant"),
+            "subscriber_id": fields.get("subscriber_id"),
+            "message_count": number(fields.get("message_count"), int),
+            "size_bytes": number(fields.get("size_bytes"), int),
+            "last_activity": last_activity,
+            "idle_seconds": round(now - last_activity, 1) if last_activity else None,
+            "version": number(fields.get("version"), int)
+        }
+    
+    @staticmethod
+    def _matches(summary: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+        if not filters:
+            return True
+        if filters.get("status") and summary["status"] != filters["status"]:
+            return False
+        assistant = filters.get("assistant")
+        if assistant is not None and str(summary["assistant"]) != str(assistant):
+            return False
+        idle = summary["idle_seconds"] or 0
+        if filters.get("min_idle") is not None and idle < filters["min_idle"]:
+            return False
+        return filters.get("max_idle") is None or idle <= filters["max_idle"]
+    
+    def _prepare(self, thread_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Aplica la cuota al historial y registra la cantidad de mensajes"""
+        if "messages" not in data:
+            return data
+        messages, report = self.quota.apply(data["messages"])
+        if report["trimmed"] or report["compacted"]:
+            logger.info(f"Cuota aplicada a {thread_id} - Mensajes recortados: "
+                        f"{report['trimmed']}, compactados: {report['compacted']}")
+        prepared = dict(data)
+        prepared["messages"] = messages
+        prepared["message_count"] = len(messages) if messages else 0
+        return prepared
+    
+    def unit_of_work(self, thread_id: str) -> "TurnUnitOfWork":
+        """Crea una unidad de trabajo para un turno de conversación"""
+        return TurnUnitOfWork(self, thread_id)
+
+
+class TurnUnitOfWork:
+    """
+    Unidad de trabajo por turno.
+    
+    Acumula en memoria los cambios de un turno (historial, usage, respuesta) y
+    los escribe en una sola operación al final, en lugar de reserializar el
+    historial completo en cada iteración del handler. Las escrituras por turno
+    quedan acotadas: un checkpoint de estado opcional y un commit final.
+    
+    Si el turno falla, el historial parcial se descarta (el almacenado sigue
+    siendo el del último turno consistente) y solo se escribe el estado error.
+    Usado como context manager, garantiza que el turno termine siempre en un
+    estado terminal aunque el handler salga sin hacer commit.
+    """
+    
+    def __init__(self, manager: ConversationManager, thread_id: str):
+        self.manager = manager
+        self.thread_id = thread_id
+        self.pending: Dict[str, Any] = {}
+        self.finished = False
+        self.writes = 0
+        self.version: Optional[int] = None
+    
+    def begin(self, conversation: Dict[str, Any],
+              metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Inicia el turno sobre la conversación leída.
+        
+        Registra su versión para que las escrituras del turno sean
+        compare-and-set y marca el estado como processing. ``metadata``
+        (subscriber, teléfono, ... del request) se escribe en la misma
+        operación: el turno ya tiene el lock del hilo, así que no cambia la
+        versión de otro turno en curso.
+        """
+        self.version = conversation.get("version")
+        if not metadata:
+            return self.checkpoint("processing")
+        return self._write(dict(metadata, status="processing"))
+    
+    def _write(self, updates: Dict[str, Any]) -> bool:
+        """Escritura condicionada a la versión leída al iniciar el turno"""
+        self.writes += 1
+        result = self.manager.update(self.thread_id, updates,
+                                     expected_version=self.version)
+        if result and self.version is not None:
+            self.version += 1
+        return result
+    
+    def stage(self, updates: Dict[str, Any]) -> None:
+        """Registra cambios en memoria sin escribirlos en el almacenamiento"""
+        self.pending.update(updates)
+    
+    def checkpoint(self, status: str) -> bool:
+        """Escribe únicamente el campo status (no toca el historial)"""
+        return self._write({"status": status})
+    
+    def commit(self, updates: Optional[Dict[str, Any]] = None) -> bool:
+        """Escribe todos los cambios acumulados en una sola operación"""
+        if updates:
+            self.stage(updates)
+        self.finished = True
+        if not self.pending:
+            return True
+        
+        pending, self.pending = self.pending, {}
+        result = self._write(pending)
+        logger.debug(f"Turno confirmado para {self.thread_id} - "
+                     f"Escrituras: {self.writes}")
+        return result
+    
+    def fail(self, error_message: str,
+             updates: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Marca el turno como error descartando los cambios pendientes.
+        
+        Si la conversación no existe se crea con estado error para que el
+        endpoint pueda reportar el fallo en lugar de un 404. La escritura no
+        es condicionada: solo toca estado y respuesta, nunca el historial
+        de otro escritor.
+        """
+        self.pending = {}
+        self.finished = True
+        error_data = {"status": "error", "response": error_message}
+        if updates:
+            error_data.update(updates)
+        
+        self.writes += 1
+        if self.manager.update(self.thread_id, error_data):
+            return True
+        error_data.setdefault("messages", [])
+        return self.manager.set(self.thread_id, error_data)
+    
+    def close(self) -> None:
+        """Cierra el turno: confirma lo pendiente o lo marca como error si no terminó"""
+        if self.finished:
+            return
+        if self.pending:
+            self.commit()
+        else:
+            logger.warning(f"Turno de {self.thread_id} finalizado sin estado terminal")
+            self.fail("El turno finalizó sin generar respuesta")
+    
+    def __enter__(self) -> "TurnUnitOfWork":
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        if exc_type is not None and not self.finished:
+            self.fail(f"Error: {str(exc_value)}")
+        self.close()
+        return False
 
 
 class MemoryConversationManager(ConversationManager):
-    """Implementación en memoria - comportamiento actual"""
+    """
+    Implementación en memoria
+    
+    Cada escritura reemplaza el registro por uno nuevo (copy-on-write) y el
+    historial se guarda como ConversationHistory, así ``get`` entrega un
+    snapshot consistente en O(1) sin copiar los mensajes.
+    """
     
     def __init__(self, conversations_dict: Dict[str, Dict[str, Any]]):
         """
@@ -60,53 +342,106 @@ class MemoryConversationManager(ConversationManager):
             conversations_dict: Diccionario de conversaciones existente
         """
         self.conversations = conversations_dict
+        # Serializa la verificación de versión y la escritura (compare-and-set)
+        self._write_lock = threading.RLock()
+        # Bytes serializados por campo de cada conversación
+        self._field_sizes: Dict[str, Dict[str, int]] = {}
+        # Índice subscriber_id(|assistant) -> thread_id activo
+        self._subscriber_index: Dict[str, str] = {}
         logger.info("MemoryConversationManager inicializado")
     
     def get(self, thread_id: str) -> Optional[Dict[str, Any]]:
-        """Obtiene conversación de memoria"""
-        return self.conversations.get(thread_id)
+        """Obtiene un snapshot de la conversación en memoria"""
+        conversation = self.conversations.get(thread_id)
+        return dict(conversation) if conversation is not None else None
+    
+    @staticmethod
+    def _freeze(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Nuevo registro con el historial como ConversationHistory"""
+        record = dict(data)
+        if "messages" in record:
+            record["messages"] = ConversationHistory.of(record["messages"])
+        return record
+    
+    def _check_version(self, thread_id: str, expected_version: Optional[int]) -> int:
+        """Retorna la versión actual o lanza conflicto si no coincide"""
+        current_version = self.conversations.get(thread_id, {}).get("version", 0)
+        if expected_version is not None and expected_version != current_version:
+            raise ConversationConflictError(thread_id, expected_version,
+                                            current_version)
+        return current_version
+    
+    def _measure(self, thread_id: str, record: Dict[str, Any], fields=None) -> None:
+        """Actualiza size_bytes del registro con el tamaño de los campos escritos"""
+        sizes = {} if fields is None else dict(self._field_sizes.get(thread_id, {}))
+        for field in (record if fields is None else fields):
+            if field != "size_bytes":
+                sizes[field] = len(field) + serialized_size(record[field])
+        self._field_sizes[thread_id] = sizes
+        record["size_bytes"] = sum(sizes.values())
     
-    def set(self, thread_id: str, data: Dict[str, Any]) -> bool:
+    def set(self, thread_id: str, data: Dict[str, Any],
+            expected_version: Optional[int] = None) -> bool:
         """Establece conversación en memoria"""
-        try:
-            # Agregar timestamp de última actividad
-            data["last_activity"] = time.time()
-            self.conversations[thread_id] = data
-            logger.debug(f"Conversación establecida en memoria: {thread_id}")
-            return True
-        except Exception as e:
-            logger.error(f"Error al establecer conversación {thread_id}: {e}")
-            return False
+        with self._write_lock:
+            current_version = self._check_version(thread_id, expected_version)
+            try:
+                record = self._freeze(self._prepare(thread_id, data))
+                # Agregar timestamp de última actividad
+                record["last_activity"] = time.time()
+                record["version"] = current_version + 1
+                self._measure(thread_id, record)
+                self._unindex(thread_id, self.conversations.get(thread_id))
+                self.conversations[thread_id] = record
+                self._index(thread_id, record)
+                logger.debug(f"Conversación establecida en memoria: {thread_id}")
+                return True
+            except Exception as e:
+                logger.error(f"Error al establecer conversación {thread_id}: {e}")
+                return False
     
-    def update(self, thread_id: str, updates: Dict[str, Any]) -> bool:
+    def update(self, thread_id: str, updates: Dict[str, Any],
+               expected_version: Optional[int] = None) -> bool:
         """Actualiza campos específicos en memoria"""
-        try:
+        with self._write_lock:
             if thread_id not in self.conversations:
                 logger.warning(f"Conversación {thread_id} no existe para actualizar")
                 return False
-            
-            # Actualizar campos
-            self.conversations[thread_id].update(updates)
-            # Renovar timestamp
-            self.conversations[thread_id]["last_activity"] = time.time()
-            
-            logger.debug(f"Conversación actualizada en memoria: {thread_id}")
-            return True
-        except Exception as e:
-            logger.error(f"Error al actualizar conversación {thread_id}: {e}")
-            return False
+            current_version = self._check_version(thread_id, expected_version)
+            try:
+                # Nuevo registro: los snapshots entregados por get no cambian
+                conversation = dict(self.conversations[thread_id])
+                prepared = self._freeze(self._prepare(thread_id, updates))
+                conversation.update(prepared)
+                # Renovar timestamp y versión
+                conversation["last_activity"] = time.time()
+                conversation["version"] = current_version + 1
+                self._measure(thread_id, conversation,
+                              list(prepared) + ["last_activity", "version"])
+                self.conversations[thread_id] = conversation
+                if "subscriber_id" in prepared:
+                    self._index(thread_id, conversation)
+                
+                logger.debug(f"Conversación actualizada en memoria: {thread_id}")
+                return True
+            except Exception as e:
+                logger.error(f"Error al actualizar conversación {thread_id}: {e}")
+                return False
     
-    def delete(self, thread_id: str) -> bool:
+    def delete(self, thread_id: str, expected_version: Optional[int] = None) -> bool:
         """Elimina conversación de memoria"""
-        try:
-            if thread_id in self.conversations:
-                del self.conversations[thread_id]
+        with self._write_lock:
+            if thread_id not in self.conversations:
+                return False
+            self._check_version(thread_id, expected_version)
+            try:
+                self._unindex(thread_id, self.conversations.pop(thread_id))
+                self._field_sizes.pop(thread_id, None)
                 logger.debug(f"Conversación eliminada de memoria: {thread_id}")
                 return True
-            return False
-        except Exception as e:
-            logger.error(f"Error al eliminar conversación {thread_id}: {e}")
-            return False
+            except Exception as e:
+                logger.error(f"Error al eliminar conversación {thread_id}: {e}")
+                return False
     
     def exists(self, thread_id: str) -> bool:
         """Verifica existencia en memoria"""
@@ -116,6 +451,54 @@ class MemoryConversationManager(ConversationManager):
         """Obtiene todos los thread_ids de memoria"""
         return list(self.conversations.keys())
     
+    def _index(self, thread_id: str, record: Dict[str, Any]) -> None:
+        for key in self._subscriber_keys(record.get("subscriber_id"),
+                                         record.get("assistant")):
+            self._subscriber_index[key] = thread_id
+    
+    def _unindex(self, thread_id: str, record: Optional[Dict[str, Any]]) -> None:
+        """Quita las entradas del índice que aún apuntan a este hilo"""
+        if not record:
+            return
+        for key in self._subscriber_keys(record.get("subscriber_id"),
+                                         record.get("assistant")):
+            if self._subscriber_index.get(key) == thread_id:
+                del self._subscriber_index[key]
+    
+    def get_active_thread(self, subscriber_id: str,
+                          assistant: Any = None) -> Optional[str]:
+        keys = self._subscriber_keys(subscriber_id, assistant)
+        if not keys:
+            return None
+        thread_id = self._subscriber_index.get(keys[-1])
+        conversation = self.conversations.get(thread_id) if thread_id else None
+        if conversation is None:
+            return None
+        if str(conversation.get("subscriber_id")) != str(subscriber_id):
+            return None
+        return thread_id
+    
+    def list_conversations(self, cursor: Optional[str] = None, limit: int = 50,
+                           filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Recorre los thread_ids en orden; el cursor es el último thread_id devuelto"""
+        now = time.time()
+        page = []
+        thread_ids = sorted(tid for tid in list(self.conversations.keys())
+                            if cursor is None or tid > cursor)
+        last_seen = None
+        for thread_id in thread_ids:
+            last_seen = thread_id
+            conversation = self.conversations.get(thread_id)
+            if conversation is None:
+                continue
+            summary = self._summary(thread_id, conversation, now)
+            if self._matches(summary, filters):
+                page.append(summary)
+                if len(page) >= limit:
+                    break
+        done = last_seen is None or last_seen == thread_ids[-1]
+        return {"conversations": page, "next_cursor": None if done else last_seen}
+    
     def cleanup_expired(self, expiration_seconds: int) -> int:
         """Limpia conversaciones expiradas de memoria"""
         current_time = time.time()
@@ -128,18 +511,100 @@ class MemoryConversationManager(ConversationManager):
             
             if current_time - last_activity > expiration_seconds:
                 try:
-                    del self.conversations[thread_id]
+                    with self._write_lock:
+                        self._unindex(thread_id, self.conversations.pop(thread_id))
+                        self._field_sizes.pop(thread_id, None)
                     cleaned += 1
                     logger.info(f"Conversación expirada eliminada de memoria: {thread_id}")
                 except Exception as e:
                     logger.error(f"Error al limpiar conversación {thread_id}: {e}")
         
         return cleaned
+    
+    def get_size_report(self, top_n: int = 20) -> Dict[str, Any]:
+        """Conversaciones más grandes en memoria"""
+        with self._write_lock:
+            entries = [
+                {
+                    "thread_id": thread_id,
+                    "size_bytes": conversation.get("size_bytes", 0),
+                    "message_count": conversation.get("message_count", 0)
+                }
+                for thread_id, conversation in self.conversations.items()
+            ]
+        entries.sort(key=lambda entry: entry["size_bytes"], reverse=True)
+        return {
+            "backend": "memory",
+            "conversations": len(entries),
+            "total_bytes": sum(entry["size_bytes"] for entry in entries),
+            "largest": entries[:top_n]
+        }
 
 
 class RedisConversationManager(ConversationManager):
     """Implementación Redis con TTL automático y serialización JSON"""
     
+    # Escritura atómica con compare-and-set sobre el campo version.
+    # KEYS[1] = clave de la conversación, KEYS[2] = índice de tamaños (ZSET)
+    # ARGV[1] = versión esperada ('' = sin condición), ARGV[2] = TTL,
+    # ARGV[3] = '1' si reemplaza el hash completo (set), ARGV[4] = thread_id,
+    # ARGV[5..] = campo, valor
+    # Retorna {0, nueva_versión}, {-1, 0} si no existe, {-2,
+    # versión_actual} si hay conflicto
+    WRITE_SCRIPT = """
+    local exists = redis.call('EXISTS', KEYS[1])
+    if exists == 0 and ARGV[3] ~= '1' then
+        return {-1, 0}
+    end
+    local current = tonumber(redis.call('HGET', KEYS[1], 'version') or '0')
+    if ARGV[1] ~= '' and tonumber(ARGV[1]) ~= current then
+        return {-2, current}
+    end
+    if ARGV[3] == '1' then
+        redis.call('DEL', KEYS[1])
+    end
+    if #ARGV > 4 then
+        redis.call('HSET', KEYS[1], unpack(ARGV, 5))
+    end
+    redis.call('HSET', KEYS[1], 'version', current + 1)
+    -- Tamaño serializado del registro (nombres y valores de los campos)
+    local size = 0
+    for _, field in ipairs(redis.call('HKEYS', KEYS[1])) do
+        if field ~= 'size_bytes' then
+            size = size + #field + redis.call('HSTRLEN', KEYS[1], field)
+        end
+    end
+    redis.call('HSET', KEYS[1], 'size_bytes', size)
+    redis.call('ZADD', KEYS[2], size, ARGV[4])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return {0, current + 1}
+    """
+    
+    # Borrado condicionado a la versión (ARGV[1], '' = sin condición).
+    # KEYS[2] = índice de tamaños, ARGV[2] = thread_id
+    # Retorna 1 si se eliminó, 0 si no existe, -2 si la versión no coincide
+    DELETE_SCRIPT = """
+    if ARGV[1] ~= '' then
+        local current = redis.call('HGET', KEYS[1], 'version')
+        if current and tonumber(current) ~= tonumber(ARGV[1]) then
+            return -2
+        end
+    end
+    local deleted = redis.call('DEL', KEYS[1])
+    redis.call('ZREM', KEYS[2], ARGV[2])
+    return deleted
+    """
+    
+    # Elimina entradas del índice de subscriber que aún apuntan al hilo (ARGV[1])
+    UNINDEX_SCRIPT = """
+    for _, key in ipairs(KEYS) do
+        if redis.call('GET', key) == ARGV[1] then
+            redis.call('DEL', key)
+        end
+    end
+    return 1
+    """
+    
     def __init__(self, redis_config: Dict[str, Any]):
         """
         Args:
@@ -181,8 +646,37 @@ class RedisConversationManager(ConversationManager):
             ping_result = self.redis_client.ping()
             logger.info(f"Redis ping exitoso: {ping_result}")
             
-            self.ttl_seconds = redis_config.get('ttl_seconds', 7200)  # 2 horas por defecto
+            # Réplica opcional para lecturas que toleran retraso
+            replica_client = None
+            replica_url = redis_config.get('replica_url',
+                                           os.getenv('REDIS_REPLICA_URL'))
+            if replica_url:
+                try:
+                    replica_client = redis.from_url(
+                        replica_url,
+                        decode_responses=True,
+                        socket_connect_timeout=5,
+                        socket_timeout=5,
+                        retry_on_timeout=True
+                    )
+                    replica_client.ping()
+                    logger.info(f"Réplica Redis para lecturas: {replica_url[:20]}...")
+                except Exception as e:
+                    logger.warning("Réplica Redis no disponible, "
+                                   f"lecturas al primario: {e}")
+                    replica_client = None
+            self._setup_reads(replica_client)
+            
+            self.ttl_seconds = redis_config.get('ttl_seconds', CONVERSATION_TTL_SECONDS)
             self.key_prefix = "conversation"
+            # Fuera del patrón conversation:* para no confundirse con un hilo
+            self.sizes_key = "conversation_meta:sizes"
+            self.subscriber_prefix = "conversation_idx:subscriber"
+            self._unindex_script = self.redis_client.register_script(
+                self.UNINDEX_SCRIPT
+            )
+            self._write_script = self.redis_client.register_script(self.WRITE_SCRIPT)
+            self._delete_script = self.redis_client.register_script(self.DELETE_SCRIPT)
             
             logger.info(f"RedisConversationManager inicializado exitosamente - TTL: {self.ttl_seconds}s")
             
@@ -197,8 +691,37 @@ class RedisConversationManager(ConversationManager):
         """Genera clave Redis para thread_id"""
         return f"{self.key_prefix}:{thread_id}"
     
+    def _index(self, thread_id: str, data: Dict[str, Any]) -> None:
+        """Apunta el índice de subscriber a este hilo (mismo TTL que la conversación)"""
+        keys = self._subscriber_keys(data.get("subscriber_id"), data.get("assistant"))
+        if not keys:
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(f"{self.subscriber_prefix}:{key}", thread_id, ex=self.ttl_seconds)
+        pipe.execute()
+    
+    def get_active_thread(self, subscriber_id: str,
+                          assistant: Any = None) -> Optional[str]:
+        try:
+            keys = self._subscriber_keys(subscriber_id, assistant)
+            if not keys:
+                return None
+            thread_id = self.redis_client.get(f"{self.subscriber_prefix}:{keys[-1]}")
+            if not thread_id:
+                return None
+            # El hilo pudo expirar o cambiar de subscriber
+            owner = self.redis_client.hget(self._get_key(thread_id), "subscriber_id")
+            return thread_id if owner == str(subscriber_id) else None
+        except Exception as e:
+            logger.error("Error al consultar hilo activo de "
+                         f"{subscriber_id} en Redis: {e}")
+            return None
+    
     def _serialize_value(self, value: Any) -> str:
         """Serializa valores complejos a JSON"""
+        if isinstance(value, ConversationHistory):
+            return json.dumps(value.to_list())
         if isinstance(value, (dict, list)):
             return json.dumps(value)
         return str(value)
@@ -215,45 +738,132 @@ class RedisConversationManager(ConversationManager):
             # Si no es JSON válido, devolver como string
             return value
     
+    # Máximo de thread_ids con versión escrita recordada (LRU)
+    MAX_TRACKED_VERSIONS = 10000
+    
+    def _setup_reads(self, replica_client) -> None:
+        """Réplica de lectura y versiones escritas por el proceso (read-your-writes)"""
+        self.replica_client = replica_client
+        self._written_versions: "OrderedDict[str, int]" = OrderedDict()
+        self._versions_lock = threading.Lock()
+        self._read_stats = {"replica_reads": 0, "primary_fallbacks": 0}
+        self._read_stats_lock = threading.Lock()
+    
+    def _count_read(self, key: str) -> None:
+        with self._read_stats_lock:
+            self._read_stats[key] += 1
+    
+    def _remember_version(self, thread_id: str, version: Optional[int]) -> None:
+        with self._versions_lock:
+            if version is None:
+                self._written_versions.pop(thread_id, None)
+                return
+            self._written_versions[thread_id] = version
+            self._written_versions.move_to_end(thread_id)
+            while len(self._written_versions) > self.MAX_TRACKED_VERSIONS:
+                self._written_versions.popitem(last=False)
+    
+    @property
+    def _reader(self):
+        """Cliente para lecturas que toleran retraso"""
+        return self.replica_client or self.redis_client
+    
+    def get_stale(self, thread_id: str,
+                  min_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Lee de la réplica si no está atrasada respecto a la versión esperada"""
+        if self.replica_client is None:
+            return self.get(thread_id)
+        with self._versions_lock:
+            written = self._written_versions.get(thread_id)
+        required = max(v for v in (min_version, written, 0) if v is not None)
+        try:
+            data = self.replica_client.hgetall(self._get_key(thread_id))
+            conversation = self._decode(data)
+        except Exception as e:
+            logger.warning(f"Error leyendo {thread_id} de la réplica, se "
+                           f"usa el primario: {e}")
+            conversation = None
+        if conversation is not None and (conversation.get("version") or 0) >= required:
+            self._count_read("replica_reads")
+            return conversation
+        # Réplica atrasada (o hilo aún no replicado): el primario garantiza la versión
+        self._count_read("primary_fallbacks")
+        return self.get(thread_id)
+    
     def get(self, thread_id: str) -> Optional[Dict[str, Any]]:
         """Obtiene conversación de Redis"""
         try:
             key = self._get_key(thread_id)
-            raw_data = self.redis_client.hgetall(key)
-            
-            if not raw_data:
-                return None
-            
-            # Deserializar datos
-            conversation = {}
-            for field, value in raw_data.items():
-                if field in ['messages', 'usage']:  # Campos que son objetos/arrays
-                    conversation[field] = self._deserialize_value(value)
-                elif field in ['assistant', 'thinking']:  # Campos numéricos
-                    try:
-                        conversation[field] = int(value)
-                    except (ValueError, TypeError):
-                        conversation[field] = value
-                elif field == 'last_activity':  # Timestamp
-                    try:
-                        conversation[field] = float(value)
-                    except (ValueError, TypeError):
-                        conversation[field] = time.time()
-                else:
-                    conversation[field] = value
-            
-            logger.debug(f"Conversación obtenida de Redis: {thread_id}")
+            conversation = self._decode(self.redis_client.hgetall(key))
+            if conversation is not None:
+                logger.debug(f"Conversación obtenida de Redis: {thread_id}")
             return conversation
             
         except Exception as e:
             logger.error(f"Error al obtener conversación {thread_id} de Redis: {e}")
             return None
     
-    def set(self, thread_id: str, data: Dict[str, Any]) -> bool:
+    def _decode(self, raw_data: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """Deserializa el hash de una conversación"""
+        if not raw_data:
+            return None
+        
+        # Deserializar datos
+        conversation = {}
+        for field, value in raw_data.items():
+            if field in ['messages', 'usage']:  # Campos que son objetos/arrays
+                conversation[field] = self._deserialize_value(value)
+            elif field in ['assistant', 'thinking', 'version', 'size_bytes',
+                           'message_count',
+                           'response_chain_length']:  # Campos numéricos
+                try:
+                    conversation[field] = int(value)
+                except (ValueError, TypeError):
+                    conversation[field] = value
+            elif field == 'last_activity':  # Timestamp
+                try:
+                    conversation[field] = float(value)
+                except (ValueError, TypeError):
+                    conversation[field] = time.time()
+            else:
+                conversation[field] = value
+        
+        return conversation
+    
+    def _write(self, thread_id: str, fields: Dict[str, str],
+               expected_version: Optional[int], replace: bool) -> int:
+        """
+        Ejecuta el script de escritura atómica.
+        
+        Returns:
+            int: Nueva versión, o -1 si la conversación no existe
+        
+        Raises:
+            ConversationConflictError: Si la versión almacenada no coincide
+        """
+        args = ['' if expected_version is None else str(expected_version),
+                str(self.ttl_seconds),
+                '1' if replace else '0',
+                thread_id]
+        for field, value in fields.items():
+            if field in ("version", "size_bytes"):  # Los administra el script
+                continue
+            args.extend([field, value])
+        
+        keys = [self._get_key(thread_id), self.sizes_key]
+        status, version = self._write_script(keys=keys, args=args)
+        if status == -2:
+            raise ConversationConflictError(thread_id, expected_version, int(version))
+        if status == -1:
+            return -1
+        self._remember_version(thread_id, int(version))
+        return int(version)
+    
+    def set(self, thread_id: str, data: Dict[str, Any],
+            expected_version: Optional[int] = None) -> bool:
         """Establece conversación en Redis con TTL"""
         try:
-            key = self._get_key(thread_id)
-            
+            data = self._prepare(thread_id, data)
             # Agregar timestamp si no existe
             if "last_activity" not in data:
                 data["last_activity"] = time.time()
@@ -263,30 +873,25 @@ class RedisConversationManager(ConversationManager):
             for field, value in data.items():
                 redis_data[field] = self._serialize_value(value)
             
-            # Usar pipeline para atomicidad
-            pipe = self.redis_client.pipeline()
-            pipe.delete(key)  # Limpiar datos previos
-            pipe.hset(key, mapping=redis_data)
-            pipe.expire(key, self.ttl_seconds)
-            pipe.execute()
+            # Reemplazo completo del hash de forma atómica
+            version = self._write(thread_id, redis_data, expected_version, replace=True)
+            self._index(thread_id, data)
             
-            logger.debug(f"Conversación establecida en Redis: {thread_id} (TTL: {self.ttl_seconds}s)")
+            logger.debug(f"Conversación establecida en Redis: {thread_id} (TTL: "
+                         f"{self.ttl_seconds}s, versión: {version})")
             return True
             
+        except ConversationConflictError:
+            raise
         except Exception as e:
             logger.error(f"Error al establecer conversación {thread_id} en Redis: {e}")
             return False
     
-    def update(self, thread_id: str, updates: Dict[str, Any]) -> bool:
+    def update(self, thread_id: str, updates: Dict[str, Any],
+               expected_version: Optional[int] = None) -> bool:
         """Actualiza campos específicos en Redis"""
         try:
-            key = self._get_key(thread_id)
-            
-            # Verificar que la clave existe
-            if not self.redis_client.exists(key):
-                logger.warning(f"Conversación {thread_id} no existe en Redis para actualizar")
-                return False
-            
+            updates = self._prepare(thread_id, updates)
             # Preparar actualizaciones
             redis_updates = {}
             for field, value in updates.items():
@@ -295,30 +900,52 @@ class RedisConversationManager(ConversationManager):
             # Siempre actualizar timestamp
             redis_updates["last_activity"] = str(time.time())
             
-            # Usar pipeline para atomicidad
-            pipe = self.redis_client.pipeline()
-            pipe.hset(key, mapping=redis_updates)
-            pipe.expire(key, self.ttl_seconds)  # Renovar TTL
-            pipe.execute()
+            # Verificación de existencia, versión, escritura y TTL en una sola operación
+            version = self._write(thread_id, redis_updates, expected_version,
+                                  replace=False)
+            if version == -1:
+                logger.warning(f"Conversación {thread_id} no existe en "
+                               "Redis para actualizar")
+                return False
+            if "subscriber_id" in updates:
+                self._index(thread_id, updates)
             
-            logger.debug(f"Conversación actualizada en Redis: {thread_id}")
+            logger.debug(f"Conversación actualizada en Redis: {thread_id} "
+                         f"(versión: {version})")
             return True
             
+        except ConversationConflictError:
+            raise
         except Exception as e:
             logger.error(f"Error al actualizar conversación {thread_id} en Redis: {e}")
             return False
     
-    def delete(self, thread_id: str) -> bool:
+    def delete(self, thread_id: str, expected_version: Optional[int] = None) -> bool:
         """Elimina conversación de Redis"""
         try:
             key = self._get_key(thread_id)
-            deleted = self.redis_client.delete(key)
+            subscriber_id, assistant = self.redis_client.hmget(
+                key, ["subscriber_id", "assistant"])
+            expected = '' if expected_version is None else str(expected_version)
+            deleted = int(self._delete_script(keys=[key, self.sizes_key],
+                                              args=[expected, thread_id]))
+            if deleted == -2:
+                current = self.redis_client.hget(key, 'version')
+                raise ConversationConflictError(thread_id, expected_version,
+                                                int(current or 0))
+            index_keys = self._subscriber_keys(subscriber_id, assistant)
+            self._remember_version(thread_id, None)
+            if deleted and index_keys:
+                keys = [f"{self.subscriber_prefix}:{k}" for k in index_keys]
+                self._unindex_script(keys=keys, args=[thread_id])
             
             if deleted:
                 logger.debug(f"Conversación eliminada de Redis: {thread_id}")
                 return True
             return False
             
+        except ConversationConflictError:
+            raise
         except Exception as e:
             logger.error(f"Error al eliminar conversación {thread_id} de Redis: {e}")
             return False
@@ -336,7 +963,8 @@ class RedisConversationManager(ConversationManager):
         """Obtiene todos los thread_ids de Redis"""
         try:
             pattern = f"{self.key_prefix}:*"
-            keys = self.redis_client.keys(pattern)
+            # SCAN incremental en lugar de KEYS (no bloquea Redis)
+            keys = self.redis_client.scan_iter(match=pattern, count=500)
             
             # Extraer thread_ids de las claves
             thread_ids = []
@@ -350,6 +978,42 @@ class RedisConversationManager(ConversationManager):
             logger.error(f"Error al obtener thread_ids de Redis: {e}")
             return []
     
+    def list_conversations(self, cursor: Optional[str] = None, limit: int = 50,
+                           filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Página con SCAN + HMGET de campos escalares (en la réplica si existe)
+        
+        El cursor devuelto es el de SCAN.
+        """
+        try:
+            now = time.time()
+            page = []
+            scan_cursor = int(cursor or 0)
+            prefix = f"{self.key_prefix}:"
+            while True:
+                scan_cursor, keys = self._reader.scan(
+                    cursor=scan_cursor, match=f"{prefix}*", count=max(limit, 10)
+                )
+                if keys:
+                    pipe = self._reader.pipeline(transaction=False)
+                    for key in keys:
+                        pipe.hmget(key, self.SUMMARY_FIELDS)
+                    for key, values in zip(keys, pipe.execute(), strict=True):
+                        if not any(values):
+                            continue  # Expiró entre SCAN y HMGET
+                        fields = dict(zip(self.SUMMARY_FIELDS, values, strict=True))
+                        summary = self._summary(key[len(prefix):], fields, now)
+                        if self._matches(summary, filters):
+                            page.append(summary)
+                # SCAN puede devolver más claves que el límite: la página se completa
+                if scan_cursor == 0 or len(page) >= limit:
+                    break
+            return {"conversations": page, "next_cursor": None if scan_cursor == 0
+                    else str(scan_cursor)}
+        except Exception as e:
+            logger.error(f"Error al listar conversaciones de Redis: {e}")
+            return {"conversations": [], "next_cursor": None, "error": str(e)}
+    
     def cleanup_expired(self, expiration_seconds: int) -> int:
         """Limpia conversaciones expiradas de Redis (backup del TTL nativo)"""
         try:
@@ -370,11 +1034,64 @@ class RedisConversationManager(ConversationManager):
                         cleaned += 1
                         logger.info(f"Conversación expirada eliminada de Redis: {thread_id}")
             
+            self._prune_size_index()
             return cleaned
             
         except Exception as e:
             logger.error(f"Error en cleanup manual de Redis: {e}")
             return 0
+    
+    def _prune_size_index(self, batch_size: int = 500) -> int:
+        """Quita del índice de tamaños los hilos que expiraron por TTL"""
+        removed = 0
+        members = [member for member, _ in self.redis_client.zscan_iter(self.sizes_key)]
+        for start in range(0, len(members), batch_size):
+            batch = members[start:start + batch_size]
+            pipe = self.redis_client.pipeline(transaction=False)
+            for thread_id in batch:
+                pipe.exists(self._get_key(thread_id))
+            stale = [thread_id
+                     for thread_id, exists in zip(batch, pipe.execute(), strict=True)
+                     if not exists]
+            if stale:
+                removed += self.redis_client.zrem(self.sizes_key, *stale)
+        return removed
+    
+    def get_size_report(self, top_n: int = 20) -> Dict[str, Any]:
+        """Conversaciones más grandes según el índice de tamaños en Redis"""
+        try:
+            largest = []
+            for thread_id, size in self._reader.zrevrange(self.sizes_key, 0,
+                                                          max(top_n, 1) - 1,
+                                                          withscores=True):
+                key = self._get_key(thread_id)
+                message_count = self._reader.hget(key, "message_count")
+                if message_count is None and not self._reader.exists(key):
+                    continue  # Expirado por TTL; se poda en la próxima limpieza
+                largest.append({
+                    "thread_id": thread_id,
+                    "size_bytes": int(size),
+                    "message_count": int(message_count or 0)
+                })
+            
+            with self._read_stats_lock:
+                reads = dict(self._read_stats, replica=self.replica_client is not None)
+            report = {
+                "backend": "redis",
+                "conversations": self._reader.zcard(self.sizes_key),
+                "total_bytes": int(sum(size for _, size
+                                       in self._reader.zscan_iter(self.sizes_key))),
+                "largest": largest[:top_n],
+                "reads": reads
+            }
+            with contextlib.suppress(Exception):
+                memory = self.redis_client.info("memory")
+                report["redis_used_memory_bytes"] = memory.get("used_memory")
+            return report
+            
+        except Exception as e:
+            logger.error(f"Error al obtener tamaños de conversaciones en Redis: {e}")
+            return {"backend": "redis", "error": str(e)}
 
 
 def create_conversation_manager(use_redis: bool = False, 
@@ -399,7 +1116,7 @@ def create_conversation_manager(use_redis: bool = False,
             if redis_url:
                 redis_config = {
                     'url': redis_url,
-                    'ttl_seconds': 2 * 60 * 60  # 2 horas
+                    'ttl_seconds': CONVERSATION_TTL_SECONDS
                 }
                 logger.info(f"Usando REDIS_URL para conexión")
             else:
@@ -417,7 +1134,7 @@ def create_conversation_manager(use_redis: bool = False,
                             'db': int(os.getenv('REDIS_DB', 0)),
                             'password': password or os.getenv('REDIS_PASSWORD', None),
                             'pool_size': int(os.getenv('REDIS_CONNECTION_POOL_SIZE', 10)),
-                            'ttl_seconds': 2 * 60 * 60  # 2 horas
+                            'ttl_seconds': CONVERSATION_TTL_SECONDS
                         }
                         logger.info(f"Parseada URL Redis - Host: {host}, Port: {port}, Password: {'***' if password else 'None'}")
                     else:
@@ -428,7 +1145,7 @@ def create_conversation_manager(use_redis: bool = False,
                             'db': int(os.getenv('REDIS_DB', 0)),
                             'password': os.getenv('REDIS_PASSWORD', None),
                             'pool_size': int(os.getenv('REDIS_CONNECTION_POOL_SIZE', 10)),
-                            'ttl_seconds': 2 * 60 * 60  # 2 horas
+                            'ttl_seconds': CONVERSATION_TTL_SECONDS
                         }
                 else:
                     redis_config = {
@@ -437,7 +1154,7 @@ def create_conversation_manager(use_redis: bool = False,
                         'db': int(os.getenv('REDIS_DB', 0)),
                         'password': os.getenv('REDIS_PASSWORD', None),
                         'pool_size': int(os.getenv('REDIS_CONNECTION_POOL_SIZE', 10)),
-                        'ttl_seconds': 2 * 60 * 60  # 2 horas
+                        'ttl_seconds': CONVERSATION_TTL_SECONDS
                     }
         
         try:
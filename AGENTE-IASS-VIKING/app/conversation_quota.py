@@ -0,0 +1,149 @@
+"""
+Conversation Quota - Medición de tamaño y límites por conversación
+Mide los bytes serializados de cada registro y aplica cuotas por hilo
+compactando payloads de herramientas y recortando los mensajes más antiguos.
+"""
+
+import os
+import json
+from typing import Any, Dict, List, Tuple
+
+from app.history import ConversationHistory, json_default
+
+
+def serialized_size(value: Any) -> int:
+    """Bytes del valor tal como se guarda en Redis (JSON para objetos, str el resto)"""
+    if isinstance(value, (dict, list, ConversationHistory)):
+        text = json.dumps(value, default=json_default)
+    else:
+        text = str(value)
+    return len(text.encode('utf-8'))
+
+
+def _is_tool_message(message: Dict[str, Any]) -> bool:
+    """Mensajes con resultados de herramientas en formato OpenAI, Anthropic o Gemini"""
+    if not isinstance(message, dict):
+        return False
+    if message.get("role") == "tool" or message.get("type") == "function_call_output":
+        return True
+    blocks = message.get("content")
+    if not isinstance(blocks, list):
+        blocks = message.get("parts")
+    if isinstance(blocks, list):
+        return any(
+            isinstance(block, dict)
+            and (block.get("type") == "tool_result" or "functionResponse" in block)
+            for block in blocks
+        )
+    return False
+
+
+def _is_turn_start(message: Dict[str, Any]) -> bool:
+    """Un historial recortado empieza con un mensaje de usuario (no de herramienta)"""
+    return (isinstance(message, dict) and message.get("role") == "user"
+            and not _is_tool_message(message))
+
+
+class ConversationQuota:
+    """
+    Cuota por conversación
+
+    Args:
+        max_bytes: Bytes máximos del historial serializado (0 = sin límite)
+        max_messages: Mensajes máximos en el historial (0 = sin límite)
+        max_payload_chars: Longitud a la que se compactan los textos de herramientas
+    """
+
+    def __init__(self, max_bytes: int = 0, max_messages: int = 0,
+                 max_payload_chars: int = 2000):
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.max_payload_chars = max_payload_chars
+
+    @classmethod
+    def from_env(cls) -> "ConversationQuota":
+        return cls(
+            max_bytes=int(os.getenv('CONVERSATION_MAX_BYTES', 0)),
+            max_messages=int(os.getenv('CONVERSATION_MAX_MESSAGES', 0)),
+            max_payload_chars=int(os.getenv('CONVERSATION_TOOL_PAYLOAD_CHARS', 2000))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_bytes or self.max_messages)
+
+    def _compact_value(self, value: Any) -> Any:
+        """Trunca recursivamente textos largos (full_body de n8n, resultados de MCP)"""
+        if isinstance(value, str) and len(value) > self.max_payload_chars:
+            return (value[:self.max_payload_chars]
+                    + f"... [compactado: {len(value)} caracteres]")
+        if isinstance(value, dict):
+            return {key: self._compact_value(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._compact_value(item) for item in value]
+        return value
+
+    @staticmethod
+    def _align(messages: List[Any]) -> List[Any]:
+        """Descarta mensajes iniciales hasta el comienzo de un turno"""
+        start = 0
+        while start < len(messages) and not _is_turn_start(messages[start]):
+            start += 1
+        return messages[start:]
+
+    def apply(self, messages: Any) -> Tuple[Any, Dict[str, int]]:
+        """
+        Aplica la cuota al historial
+
+        Returns:
+            tuple: (historial resultante, {"trimmed": n, "compacted": n});
+            si no hay cambios se retorna el mismo objeto recibido
+        """
+        report = {"trimmed": 0, "compacted": 0}
+        if not self.enabled or not messages:
+            return messages, report
+
+        items = list(messages)
+        original_count = len(items)
+
+        if self.max_messages and len(items) > self.max_messages:
+            tail = items[-self.max_messages:]
+            items = self._align(tail) or tail
+
+        if self.max_bytes:
+            # Tamaño por mensaje (+2 por el separador de la lista JSON)
+            sizes = [serialized_size(message) + 2 for message in items]
+            total = sum(sizes)
+
+            # 1) Compactar payloads de herramientas, del más antiguo al más reciente
+            for index, message in enumerate(items[:-1]):
+                if total <= self.max_bytes:
+                    break
+                if _is_tool_message(message):
+                    compacted = self._compact_value(message)
+                    if compacted != message:
+                        items[index] = compacted
+                        new_size = serialized_size(compacted) + 2
+                        total += new_size - sizes[index]
+                        sizes[index] = new_size
+                        report["compacted"] += 1
+
+            # 2) Recortar turnos completos desde el inicio (se
+            # conserva el último mensaje)
+            start = 0
+            while total > self.max_bytes and start < len(items) - 1:
+                total -= sizes[start]
+                start += 1
+                while start < len(items) - 1 and not _is_turn_start(items[start]):
+                    total -= sizes[start]
+                    start += 1
+            items = items[start:]
+
+        report["trimmed"] = original_count - len(items)
+        if not report["trimmed"] and not report["compacted"]:
+            return messages, report
+        return ConversationHistory(items), report
+
+
+# Cuota configurada por variables de entorno
+CONVERSATION_QUOTA = ConversationQuota.from_env()
@@ -0,0 +1,200 @@
+"""
+Debug Capture - Captura de payloads completos bajo demanda
+Los logs INFO quedan en una línea compacta por evento; el payload completo
+(prompt, herramientas, respuesta cruda, cuerpos de n8n) solo se serializa
+cuando el turno está muestreado o su thread/subscriber fue activado, y se
+guarda en un buffer circular acotado que se consulta por /admin/debug.
+"""
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+import contextvars
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Fracción de turnos capturados sin activación explícita (0 = ninguno)
+DEBUG_CAPTURE_SAMPLE_RATE = float(os.getenv('DEBUG_CAPTURE_SAMPLE_RATE', 0))
+DEBUG_CAPTURE_MAX_ENTRIES = int(os.getenv('DEBUG_CAPTURE_MAX_ENTRIES', 500))
+# Caracteres máximos por payload capturado
+DEBUG_CAPTURE_MAX_CHARS = int(os.getenv('DEBUG_CAPTURE_MAX_CHARS', 50000))
+
+# Turno capturado en el contexto actual (se propaga a las herramientas del turno)
+_current_turn: contextvars.ContextVar = contextvars.ContextVar(
+    'debug_capture_turn', default=None
+)
+
+
+def _to_jsonable(value: Any) -> Any:
+    """Objetos del SDK (pydantic) a tipos JSON; el resto como texto"""
+    if hasattr(value, 'model_dump'):
+        return value.model_dump()
+    if hasattr(value, 'to_list'):
+        return value.to_list()
+    return str(value)
+
+
+class DebugCapture:
+    """
+    Buffer circular de capturas de depuración
+
+    Args:
+        max_entries: Capturas retenidas (las más antiguas se descartan)
+        sample_rate: Probabilidad de capturar un turno sin activación
+        max_chars: Longitud máxima de cada payload serializado
+    """
+
+    def __init__(self, max_entries: int = DEBUG_CAPTURE_MAX_ENTRIES,
+                 sample_rate: float = DEBUG_CAPTURE_SAMPLE_RATE,
+                 max_chars: int = DEBUG_CAPTURE_MAX_CHARS):
+        self.sample_rate = sample_rate
+        self.max_chars = max_chars
+        self._entries: deque = deque(maxlen=max_entries)
+        # Activaciones: ("thread" | "subscriber", id) -> expira en (time.time())
+        self._targets: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        self._stats = {"turns": 0, "captured_turns": 0, "entries": 0, "dropped": 0}
+
+    # ---- Activación ----
+
+    def enable(self, thread_id: Optional[str] = None,
+               subscriber_id: Optional[str] = None,
+               ttl_seconds: float = 3600) -> None:
+        """Captura todos los turnos del thread o subscriber durante ttl_seconds"""
+        with self._lock:
+            for key in self._target_keys(thread_id, subscriber_id):
+                self._targets[key] = time.time() + ttl_seconds
+        logger.info(f"🐞 [DEBUG CAPTURE] Activada - thread: {thread_id}, subscriber: "
+                    f"{subscriber_id}, ttl: {ttl_seconds}s")
+
+    def disable(self, thread_id: Optional[str] = None,
+                subscriber_id: Optional[str] = None) -> None:
+        with self._lock:
+            for key in self._target_keys(thread_id, subscriber_id):
+                self._targets.pop(key, None)
+        logger.info(f"🐞 [DEBUG CAPTURE] Desactivada - thread: {thread_id}, "
+                    f"subscriber: {subscriber_id}")
+
+    @staticmethod
+    def _target_keys(thread_id: Optional[str],
+                     subscriber_id: Optional[str]) -> List[tuple]:
+        keys = []
+        if thread_id:
+            keys.append(("thread", str(thread_id)))
+        if subscriber_id:
+            keys.append(("subscriber", str(subscriber_id)))
+        return keys
+
+    def get_targets(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            return [
+                {"type": kind, "id": target_id, "expires_in": round(expires_at - now)}
+                for (kind, target_id), expires_at in self._targets.items()
+                if expires_at > now
+            ]
+
+    def _is_targeted(self, thread_id: Optional[str],
+                     subscriber_id: Optional[str]) -> bool:
+        now = time.time()
+        with self._lock:
+            for key in self._target_keys(thread_id, subscriber_id):
+                expires_at = self._targets.get(key)
+                if expires_at is not None:
+                    if expires_at > now:
+                        return True
+                    del self._targets[key]
+        return False
+
+    # ---- Turnos ----
+
+    def begin_turn(self, thread_id: Optional[str],
+                   subscriber_id: Optional[str]) -> bool:
+        """
+        Decide una sola vez por turno si se captura y lo fija en el contexto
+
+        Returns:
+            bool: True si los payloads de este turno se capturan
+        """
+        captured = self._is_targeted(thread_id, subscriber_id) or (
+            self.sample_rate > 0 and random.random() < self.sample_rate
+        )
+        with self._lock:
+            self._stats["turns"] += 1
+            self._stats["captured_turns"] += int(captured)
+        _current_turn.set({"thread_id": thread_id, "subscriber_id": subscriber_id}
+                          if captured else None)
+        return captured
+
+    def end_turn(self) -> None:
+        _current_turn.set(None)
+
+    @staticmethod
+    def active() -> bool:
+        """True si el turno actual se está capturando"""
+        return _current_turn.get() is not None
+
+    def record(self, kind: str, producer: Callable[[], Any]) -> None:
+        """
+        Guarda un payload del turno actual
+
+        ``producer`` solo se evalúa si el turno se captura: el costo de
+        serializar prompts y respuestas no se paga en los turnos normales.
+        """
+        turn = _current_turn.get()
+        if turn is None:
+            return
+        try:
+            data = json.dumps(producer(), ensure_ascii=False, default=_to_jsonable)
+        except Exception as e:
+            data = f"<error serializando {kind}: {e}>"
+        if len(data) > self.max_chars:
+            data = data[:self.max_chars] + f"... [truncado: {len(data)} caracteres]"
+
+        entry = {"timestamp": time.time(), "kind": kind, "data": data, **turn}
+        with self._lock:
+            if len(self._entries) == self._entries.maxlen:
+                self._stats["dropped"] += 1
+            self._entries.append(entry)
+            self._stats["entries"] += 1
+
+    # ---- Consulta ----
+
+    def get_entries(self, thread_id: Optional[str] = None,
+                    subscriber_id: Optional[str] = None,
+                    kind: Optional[str] = None,
+                    limit: int = 50) -> List[Dict[str, Any]]:
+        """Capturas más recientes primero, filtradas por thread, subscriber o tipo"""
+        with self._lock:
+            entries = list(self._entries)
+        result = []
+        for entry in reversed(entries):
+            if thread_id and entry["thread_id"] != thread_id:
+                continue
+            if subscriber_id and str(entry["subscriber_id"]) != str(subscriber_id):
+                continue
+            if kind and entry["kind"] != kind:
+                continue
+            result.append(entry)
+            if len(result) >= limit:
+                break
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, buffered=len(self._entries),
+                        max_entries=self._entries.maxlen,
+                        sample_rate=self.sample_rate)
+
+
+# Captura compartida por handlers y bridge de n8n
+debug_capture = DebugCapture()
@@ -10,11 +10,19 @@ from datetime import timedelta
 import xmlrpc.client
 from bs4 import BeautifulSoup
 import os
-import re
 from threading import Thread, Event
 import time
 
 from app.utils import remove_thinking_block, create_svg_base64
+from app.history import json_default
+from app.clients import openai_clients, anthropic_clients
+from app.debug_capture import debug_capture
+from app.logging_config import get_logging_stats
+from app.tracing import tracer
+from app.retry import retry_engine
+from app.prompt_cache import render_prompt, prompt_cache_stats
+from app.tool_selection import mcp_tool_cache
+from app.tool_registry import ASSISTANT_TOOLS, tool_registry  # noqa: F401
 from app.anthropic_handler import generate_response
 from app.openai_responses_handler import generate_response_openai_mcp
 from app.gemini_handler import generate_response_gemini
@@ -56,6 +64,11 @@ def categorize_error(error_message):
     """
     error_message_lower = error_message.lower()
     
+    # Conflicto de escritura concurrente (409 Conflict) - reintentable
+    if 'conflicto de concurrencia' in error_message_lower:
+        return ("CONFLICT_ERROR", 409,
+                "La conversación fue modificada por otra solicitud, reintenta")
+    
     # Errores de API/LLM (502 Bad Gateway)
     if any(keyword in error_message_lower for keyword in [
         'error de comunicación', 'api', 'anthropic', 'openai', 'gemini', 
@@ -94,16 +107,18 @@ ASSISTANT_FILES = {
 }
 
 # Mapa para asociar valores de 'assistant' con archivos de herramientas function
-ASSISTANT_TOOLS = {
-    0: "tools/tools_0.json",
-    1: "tools/tools_1.json", 
-    2: "tools/tools_2.json",
-    3: "tools/tools_3.json",
-    4: "tools/tools_4.json",
-    5: "tools/default_tools.json"  # Default/fallback
-}
+# Archivos de herramientas por assistant: ver app.tool_registry
+
+# Tiempo máximo de espera por respuesta en /sendmensaje (también
+# límite para adquirir el lock)
+REQUEST_TIMEOUT_SECONDS = int(os.getenv('REQUEST_TIMEOUT_SECONDS', 180))
+
+# Si falta thread_id, continuar el hilo activo del subscriber
+# en lugar de crear uno nuevo
+RESUME_ACTIVE_THREAD = os.getenv('RESUME_ACTIVE_THREAD', 'false').lower() == 'true'
 
 # Configuración MCP para cada asistente - Simple y directo
+# "allowed_tools" (opcional) limita siempre las herramientas importadas del servidor
 ASSISTANT_MCP_SERVERS = {
     0: {
         "type": "mcp",
@@ -113,7 +128,14 @@ ASSISTANT_MCP_SERVERS = {
     }
 }
 
-def init_endpoints(app, conversation_manager, thread_locks):
+def _admin_authorized():
+    """Valida el token de administración (sin token, /admin queda deshabilitado)"""
+    admin_token = os.getenv('ADMIN_API_TOKEN')
+    if not admin_token:
+        return False
+    return request.headers.get('X-Admin-Token') == admin_token
+
+def init_endpoints(app, conversation_manager, lock_manager):
     """Inicializa todos los endpoints de la aplicación Flask"""
     
     @app.route('/sendmensaje', methods=['POST'])
@@ -147,6 +169,8 @@ def init_endpoints(app, conversation_manager, thread_locks):
         else:
             authorized_mcp = []
         use_cache_control = data.get('use_cache_control', False)  # Cache control flag
+        # Reanudar hilo activo si falta thread_id
+        resume_thread = data.get('resume_thread', RESUME_ACTIVE_THREAD)
 
         logger.info("MENSAJE CLIENTE: %s", message)
         # Extraer variables adicionales para sustitución
@@ -154,7 +178,7 @@ def init_endpoints(app, conversation_manager, thread_locks):
         keys_to_remove = [
             'api_key', 'message', 'assistant', 'thread_id', 'subscriber_id',
             'thinking', 'modelID', 'model_id', 'ai_provider', 'direccionCliente', 
-            'use_cache_control', 'llmID', 'llm_id'
+            'use_cache_control', 'llmID', 'llm_id', 'resume_thread'
         ]
         for key in keys_to_remove:
             variables.pop(key, None)
@@ -191,6 +215,14 @@ def init_endpoints(app, conversation_manager, thread_locks):
                 return jsonify({"error":
                                 "Configuración del servidor incompleta"}), 500
 
+        # Reanudar el hilo activo del subscriber si el cliente omitió thread_id
+        if not thread_id and resume_thread:
+            thread_id = conversation_manager.get_active_thread(subscriber_id,
+                                                               assistant_value)
+            if thread_id:
+                logger.info("Reanudando hilo activo %s para subscriber %s",
+                            thread_id, subscriber_id)
+
         # Generar o validar thread_id
         if not thread_id:
     # Solo generar nuevo UUID si NO viene thread_id
@@ -220,16 +252,9 @@ def init_endpoints(app, conversation_manager, thread_locks):
                         logger.info("Contenido del archivo cargado exitosamente - Longitud: %d caracteres", len(assistant_content))
                         logger.info("Primeras 200 caracteres del prompt: %s...", assistant_content[:200])
 
-                        # Sustitución de variables
-                        pattern = re.compile(r'\{\{(\w+)\}\}')
-                        
-                        def replace_placeholder(match):
-                            key = match.group(1)
-                            value = variables.get(key, "[UNDEFINED]")
-                            logger.debug("Reemplazando variable {{%s}} con: %s", key, value)
-                            return str(value)
-
-                        assistant_content = pattern.sub(replace_placeholder, assistant_content)
+                        # Sustitución de variables: prefijo estático y valores al
+                        # final (caché del proveedor)
+                        assistant_content = render_prompt(assistant_content, variables)
                         logger.info("Variables sustituidas en el prompt")
 
                     logger.info("✅ ARCHIVO DE ASISTENTE CARGADO EXITOSAMENTE: %s para assistant=%s", assistant_file, assistant_value)
@@ -252,32 +277,33 @@ def init_endpoints(app, conversation_manager, thread_locks):
         logger.info("=== FIN CARGA DE ASISTENTE ===")
         logger.info("Prompt final tiene %d caracteres", len(assistant_content))
 
-        # Inicializar/Mantener conversación
+        # Metadatos del request: el handler los escribe al iniciar el turno, ya con el
+        # lock del hilo (escribirlos aquí cambiaría la versión de un turno en curso)
+        turn_metadata = {
+            "subscriber_id": subscriber_id,
+            "telefono": telefono,
+            "direccionCliente": direccionCliente
+        }
+        if assistant_value:
+            turn_metadata["assistant"] = assistant_value
+
+        # Inicializar conversación
         if not conversation_manager.exists(thread_id):
             conversation_data = {
                 "status": "processing",
                 "response": None,
                 "messages": [],
                 "assistant": assistant_value,
+                "subscriber_id": subscriber_id,
                 "telefono": telefono,
                 "direccionCliente": direccionCliente,
                 "usage": None
             }
             conversation_manager.set(thread_id, conversation_data)
             logger.info("Nueva conversación creada: %s", thread_id)
-        else:
-            current_conversation = conversation_manager.get(thread_id)
-            updates = {
-                "assistant": assistant_value or current_conversation.get("assistant"),
-                "telefono": telefono,
-                "direccionCliente": direccionCliente
-            }
-            conversation_manager.update(thread_id, updates)
 
-        # --- Asegurar que haya un lock para este thread_id ---
-        if thread_id not in thread_locks:
-            thread_locks[thread_id] = threading.Lock()
-            logger.info("Lock creado para thread_id: %s", thread_id)
+        # Plazo del turno: el handler no espera el lock más allá de este punto
+        deadline = start_time + REQUEST_TIMEOUT_SECONDS
 
         # Crear y ejecutar hilo según el modelo
         event = Event()
@@ -293,7 +319,10 @@ def init_endpoints(app, conversation_manager, thread_locks):
                 thread = Thread(target=generate_response_gemini,
                                 args=(message, assistant_content,
                                       thread_id, event, subscriber_id),
-                                kwargs={'conversation_manager': conversation_manager, 'thread_locks': thread_locks})
+                                kwargs={'conversation_manager': conversation_manager,
+                                        'lock_manager': lock_manager,
+                                        'deadline': deadline,
+                                        'turn_metadata': turn_metadata})
                 logger.info("Ejecutando Gemini para thread_id: %s", thread_id)
 
             elif model_id == 'openai':
@@ -317,9 +346,11 @@ def init_endpoints(app, conversation_manager, thread_locks):
                                       thread_id, event, subscriber_id, llm_id),
                                 kwargs={
                                     'conversation_manager': conversation_manager, 
-                                    'thread_locks': thread_locks,
+                                    'lock_manager': lock_manager,
+                                    'deadline': deadline,
                                     'mcp_servers': mcp_servers,
-                                    'assistant_number': assistant_value
+                                    'assistant_number': assistant_value,
+                                    'turn_metadata': turn_metadata
                                 })
                 logger.info("Ejecutando OpenAI Responses con %d MCP(s) para thread_id: %s", len(mcp_servers), thread_id)
 
@@ -344,19 +375,22 @@ def init_endpoints(app, conversation_manager, thread_locks):
                                       thread_id, event, subscriber_id, llm_id),
                                 kwargs={
                                     'conversation_manager': conversation_manager, 
-                                    'thread_locks': thread_locks,
+                                    'lock_manager': lock_manager,
+                                    'deadline': deadline,
                                     'mcp_servers': mcp_servers,
-                                    'assistant_number': assistant_value
+                                    'assistant_number': assistant_value,
+                                    'turn_metadata': turn_metadata
                                 })
                 logger.info("Ejecutando OpenAI Responses default con %d MCP(s) para thread_id: %s", len(mcp_servers), thread_id)
 
             thread.start()
             
             # Esperar con timeout específico
-            timeout_occurred = not event.wait(timeout=180)
+            timeout_occurred = not event.wait(timeout=max(0.0, deadline - time.time()))
             
             if timeout_occurred:
-                logger.error(f"Timeout de 180 segundos alcanzado para thread_id: {thread_id}")
+                logger.error(f"Timeout de {REQUEST_TIMEOUT_SECONDS} segundos alcanzado "
+                             f"para thread_id: {thread_id}")
                 
                 # Calcular duración para el timeout
                 end_time = time.time()
@@ -384,8 +418,9 @@ def init_endpoints(app, conversation_manager, thread_locks):
                     "request_duration_ms": round(request_duration * 1000)
                 }), 408
 
-            # Preparar respuesta final
-            conversation = conversation_manager.get(thread_id)
+            # Preparar respuesta final (puede leerse de una réplica
+            # con la versión ya escrita)
+            conversation = conversation_manager.get_stale(thread_id)
             if not conversation:
                 # Calcular duración para el error 404
                 end_time = time.time()
@@ -508,6 +543,146 @@ def init_endpoints(app, conversation_manager, thread_locks):
             
             return jsonify(error_response), http_code
 
+    @app.route('/admin/locks', methods=['GET'])
+    def admin_locks():
+        """Métricas de espera de los locks y de contención por thread_id"""
+        if not _admin_authorized():
+            return jsonify({"error": "No autorizado"}), 403
+        top_n = request.args.get('top', default=20, type=int)
+        return jsonify({
+            "metrics": lock_manager.get_metrics(),
+            "contention": lock_manager.get_contention(top_n)
+        })
+
+    @app.route('/admin/clients', methods=['GET'])
+    def admin_clients():
+        """Clientes LLM compartidos: creados y reutilizados por proveedor"""
+        if not _admin_authorized():
+            return jsonify({"error": "No autorizado"}), 403
+        return jsonify({
+            "openai": openai_clients.get_stats(),
+            "anthropic": anthropic_clients.get_stats()
+        })
+
+    @app.route('/admin/debug', methods=['GET', 'POST', 'DELETE'])
+    def admin_debug():
+        """
+        Captura de payloads de depuración
+        GET: capturas recientes (?thread_id=&subscriber_id=&kind=&limit=)
+        POST: {"thread_id" | "subscriber_id", "enabled": true, "ttl_seconds": 3600}
+        DELETE: vacía el buffer
+        """
+        if not _admin_authorized():
+            return jsonify({"error": "No autorizado"}), 403
+
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            thread_id, subscriber_id = data.get('thread_id'), data.get('subscriber_id')
+            if not thread_id and not subscriber_id:
+                return jsonify({"error": "Se requiere thread_id o subscriber_id"}), 400
+            if data.get('enabled', True):
+                debug_capture.enable(thread_id, subscriber_id,
+                                     ttl_seconds=float(data.get('ttl_seconds', 3600)))
+            else:
+                debug_capture.disable(thread_id, subscriber_id)
+            return jsonify({"targets": debug_capture.get_targets()})
+
+        if request.method == 'DELETE':
+            debug_capture.clear()
+            return jsonify({"stats": debug_capture.get_stats()})
+
+        limit = min(max(request.args.get('limit', default=50, type=int), 1), 500)
+        return jsonify({
+            "stats": debug_capture.get_stats(),
+            "logging": get_logging_stats(),
+            "tracing": tracer.get_stats(),
+            "retries": retry_engine.get_stats(),
+            "targets": debug_capture.get_targets(),
+            "entries": debug_capture.get_entries(
+                thread_id=request.args.get('thread_id'),
+                subscriber_id=request.args.get('subscriber_id'),
+                kind=request.args.get('kind'),
+                limit=limit
+            )
+        })
+
+    @app.route('/admin/prompt-cache', methods=['GET', 'DELETE'])
+    def admin_prompt_cache():
+        """Tokens cacheados por modelo (DELETE reinicia los contadores)"""
+        if not _admin_authorized():
+            return jsonify({"error": "No autorizado"}), 403
+        if request.method == 'DELETE':
+            prompt_cache_stats.reset()
+        return jsonify(prompt_cache_stats.get_stats())
+
+    @app.route('/admin/tools', methods=['GET'])
+    def admin_tools():
+        """Herramientas cargadas por archivo y listas de herramientas MCP en caché"""
+        if not _admin_authorized():
+            return jsonify({"error": "No autorizado"}), 403
+        return jsonify(dict(tool_registry.get_stats(), mcp=mcp_tool_cache.get_stats()))
+
+    @app.route('/admin/conversations', methods=['GET'])
+    def admin_conversations():
+        """
+        Lista paginada de conversaciones
+        
+        Query: ?cursor=&limit=&status=&assistant=&min_idle=&max_idle=
+        """
+        if not _admin_authorized():
+            return jsonify({"error": "No autorizado"}), 403
+        limit = min(max(request.args.get('limit', default=50, type=int), 1), 500)
+        filters = {
+            "status": request.args.get('status'),
+            "assistant": request.args.get('assistant'),
+            "min_idle": request.args.get('min_idle', type=float),
+            "max_idle": request.args.get('max_idle', type=float)
+        }
+        return jsonify(conversation_manager.list_conversations(
+            cursor=request.args.get('cursor') or None,
+            limit=limit,
+            filters=filters
+        ))
+
+    @app.route('/admin/conversations/<thread_id>', methods=['GET'])
+    def admin_conversation_detail(thread_id):
+        """Conversación completa; ?last=N limita el historial a los últimos N"""
+        if not _admin_authorized():
+            return jsonify({"error": "No autorizado"}), 403
+        conversation = conversation_manager.peek(thread_id)
+        if conversation is None:
+            return jsonify({"error": "Conversación no encontrada",
+                            "thread_id": thread_id}), 404
+        # Historial inmutable y bloques del SDK a tipos JSON
+        conversation = json.loads(json.dumps(conversation, default=json_default))
+        last = request.args.get('last', type=int)
+        if last and isinstance(conversation.get("messages"), list):
+            conversation["messages"] = conversation["messages"][-last:]
+        conversation["thread_id"] = thread_id
+        return jsonify(conversation)
+
+    @app.route('/admin/conversations/sizes', methods=['GET'])
+    def admin_conversation_sizes():
+        """Conversaciones más grandes y tamaño total del almacenamiento"""
+        if not _admin_authorized():
+            return jsonify({"error": "No autorizado"}), 403
+        top_n = request.args.get('top', default=20, type=int)
+        return jsonify(conversation_manager.get_size_report(top_n))
+
+    @app.route('/admin/archive', methods=['GET'])
+    def admin_archive():
+        """Estado del archivo; ?subscriber_id= lista los hilos archivados"""
+        if not _admin_authorized():
+            return jsonify({"error": "No autorizado"}), 403
+        archive = getattr(conversation_manager, 'archive', None)
+        if archive is None:
+            return jsonify({"enabled": False})
+        result = {"enabled": True, "stats": archive.get_stats()}
+        subscriber_id = request.args.get('subscriber_id')
+        if subscriber_id:
+            result["threads"] = archive.find_by_subscriber(subscriber_id)
+        return jsonify(result)
+
     @app.route('/extract', methods=['POST'])
     def extract():
         logger.info("Endpoint /extract llamado")
@@ -1,5 +1,5 @@
 """
-Gemini Handler - Manejador específico para modelos Gemini con Langfuse
+Gemini Handler - Manejador específico para modelos Gemini con trazas en Langfuse
 """
 
 import json
@@ -7,33 +7,32 @@ import os
 import time
 import logging
 import threading
+from functools import partial
 import requests
 
-# Langfuse imports
-from langfuse import Langfuse, observe
-
 # Servicios n8n eliminados - se manejará con MCP
 from app.utils.cost_calculator import cost_calculator
+from app.history import ConversationHistory
+from app.tool_executor import ToolCall, run_tools
+from app.debug_capture import debug_capture
+from app.tracing import tracer
+from app.retry import retry_call, remaining_timeout, ProviderHTTPError
+from app.utils.token_counter import token_counter, trim_messages
+from app.tool_registry import (  # noqa: F401
+    tool_registry, DEFAULT_ASSISTANT, convert_tool_to_gemini_format
+)
 
 logger = logging.getLogger(__name__)
 
-# Inicializar cliente Langfuse
-langfuse = Langfuse()
-
 # Herramientas se manejarán vía MCP
 TOOL_FUNCTIONS = {}
 
-def convert_tool_to_gemini_format(openai_tool):
-    """Convierte una herramienta del formato OpenAI/Anthropic al formato Gemini."""
-    return {
-        "name": openai_tool["name"],
-        "description": openai_tool["description"],
-        "parameters": {
-            "type": "object",
-            "properties": openai_tool["parameters"]["properties"],
-            "required": openai_tool["parameters"].get("required", [])
-        }
-    }
+def is_gemini_turn_start(message):
+    """Mensaje de usuario sin functionResponse (su functionCall quedaría fuera)"""
+    parts = message.get("parts", [])
+    return message.get("role") == "user" and not any("functionResponse" in part
+                                                     for part in parts)
+
 
 def convert_legacy_history_to_gemini(legacy_history):
     """Convierte historial del formato Anthropic/OpenAI al formato Gemini."""
@@ -97,22 +96,14 @@ def convert_legacy_history_to_gemini(legacy_history):
     
     return gemini_history
 
-@observe(as_type="generation")
-def call_gemini_api(payload, api_key, thread_id, model_name="gemini-2.0-flash"):
+def call_gemini_api(payload, api_key, thread_id, model_name="gemini-2.0-flash",
+                    deadline=None):
     """
     Función separada para llamadas a Gemini API con observabilidad completa
+    Reintenta errores transitorios (429, 5xx, timeouts) dentro del plazo del turno
     """
-    
-    # Registrar input del span de generación con detalles del modelo
-    langfuse.update_current_generation(
-        input=payload,
-        model=model_name,
-        model_parameters={
-            "temperature": payload.get("generationConfig", {}).get("temperature", 0.8),
-            "maxOutputTokens": payload.get("generationConfig", {}).get("maxOutputTokens", 1000)
-        }
-    )
-    
+    start_time = time.time()
+
     headers = {
         "Content-Type": "application/json",
         "x-goog-api-key": api_key
@@ -121,27 +112,29 @@ def call_gemini_api(payload, api_key, thread_id, model_name="gemini-2.0-flash"):
     # La URL puede cambiar según el modelo
     api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent"
     
-    response = requests.post(
-        api_url,
-        headers=headers,
-        json=payload,
-        timeout=60
-    )
+    def attempt():
+        response = requests.post(
+            api_url,
+            headers=headers,
+            json=payload,
+            timeout=remaining_timeout(60, deadline)
+        )
+
+        if response.status_code != 200:
+            try:
+                error_json = response.json()
+                api_message = error_json.get("error", {}).get("message", response.text)
+            except Exception:
+                api_message = response.text
+            logger.error("Error en API de Gemini para thread_id %s: %s - %s",
+                         thread_id, response.status_code, api_message)
+            raise ProviderHTTPError(response.status_code, api_message,
+                                    dict(response.headers))
+        return response
+
+    http_response = retry_call(attempt, "gemini", deadline=deadline)
+    response_data = http_response.json()
 
-    if response.status_code != 200:
-        try:
-            error_json = response.json()
-            api_message = error_json.get("error", {}).get("message", response.text)
-        except Exception:
-            api_message = response.text
-        logger.error("Error en API de Gemini: %s - %s", response.status_code, api_message)
-        raise Exception(f"Error de API: {response.status_code} - {api_message}")
-
-    response_data = response.json()
-    
-    # Registrar output del span de generación
-    langfuse.update_current_generation(output=response_data)
-    
     # Captura y registro de métricas para Langfuse
     usage_metadata = response_data.get("usageMetadata", {})
     input_tokens = usage_metadata.get("promptTokenCount", 0)
@@ -150,17 +143,26 @@ def call_gemini_api(payload, api_key, thread_id, model_name="gemini-2.0-flash"):
     # Calcular nuestros costos personalizados para metadata
     custom_cost_details = cost_calculator.calculate_cost(model_name, input_tokens, output_tokens)
     
-    # Registrar métricas y detalles del span de generación (implementación simple que funcionaba)
-    langfuse.update_current_generation(
+    # Generation en la traza del turno (se exporta en segundo plano)
+    generation_config = payload.get("generationConfig", {})
+    tracer.generation(
+        "call_gemini_api",
         model=model_name,
-        usage_details={
+        input=payload,
+        output=response_data,
+        start_time=start_time,
+        model_parameters={
+            "temperature": generation_config.get("temperature", 0.8),
+            "maxOutputTokens": generation_config.get("maxOutputTokens", 1000)
+        },
+        usage={
             "input_tokens": input_tokens,
             "output_tokens": output_tokens,
             "total_tokens": input_tokens + output_tokens
         },
         metadata={
             "api_url": api_url,
-            "response_status": response.status_code,
+            "response_status": http_response.status_code,
             "custom_cost_calculation": {
                 "total_cost": custom_cost_details["total_cost"],
                 "currency": custom_cost_details["currency"],
@@ -169,16 +171,17 @@ def call_gemini_api(payload, api_key, thread_id, model_name="gemini-2.0-flash"):
         }
     )
     
-    logger.info(f"[LANGFUSE] Modelo: {model_name}, Input tokens: {input_tokens}, Output tokens: {output_tokens}")
+    logger.info(f"[LANGFUSE] Thread: {thread_id}, Modelo: {model_name}, Input tokens: "
+                f"{input_tokens}, Output tokens: {output_tokens}")
     
     return response_data
 
-@observe(as_type="span")
 def execute_function_call(tool_name, tool_args, subscriber_id):
     """
     Ejecuta una función tool con observabilidad individual
     """
-    
+    start_time = time.time()
+
     # Log para Langfuse - ejecución de tool
     logger.info(f"[LANGFUSE] Ejecutando tool: {tool_name} para subscriber: {subscriber_id}")
     
@@ -189,14 +192,16 @@ def execute_function_call(tool_name, tool_args, subscriber_id):
         
         # Log resultado para Langfuse
         logger.info(f"[LANGFUSE] Tool {tool_name} ejecutado exitosamente")
+        tracer.span(tool_name, input=tool_args, output=result, start_time=start_time)
         
         return result
     else:
         logger.warning("Herramienta desconocida: %s", tool_name)
         logger.warning(f"[LANGFUSE] Tool {tool_name} no encontrado")
+        tracer.span(tool_name, input=tool_args, start_time=start_time, level="WARNING",
+                    metadata={"error": "Herramienta desconocida"})
         return f"Función {tool_name} no encontrada"
 
-@observe(as_type="span")
 def generate_response_gemini(
     message,
     assistant_content_text,
@@ -204,8 +209,10 @@ def generate_response_gemini(
     event,
     subscriber_id,
     conversation_manager=None,
-    thread_locks=None,
-    model_name="gemini-2.0-flash"
+    lock_manager=None,
+    deadline=None,
+    model_name="gemini-2.0-flash",
+    turn_metadata=None
 ):
     """
     Genera respuesta usando Gemini con observabilidad completa de Langfuse
@@ -214,38 +221,45 @@ def generate_response_gemini(
     # Log inicio de trace para Langfuse
     logger.info(f"[LANGFUSE] Iniciando conversación - User: {subscriber_id}, Thread: {thread_id}, Modelo: {model_name}")
     
-    # Registrar input de la traza (solo el mensaje del usuario)
-    langfuse.update_current_trace(input={"user_message": message})
-    
     logger.info("Intentando adquirir lock para thread_id (Gemini): %s", thread_id)
-    lock = thread_locks.get(thread_id)
-    if not lock:
-        logger.error("No se encontró lock para thread_id (Gemini): %s", thread_id)
-        thread_locks[thread_id] = threading.Lock()
-        lock = thread_locks[thread_id]
+    lock_timeout = max(0.0, deadline - time.time()) if deadline else None
+    lock = lock_manager.acquire(thread_id, timeout=lock_timeout, owner=subscriber_id)
+    if lock is None:
+        # El endpoint reporta el timeout al vencer el mismo plazo
+        logger.error("No se pudo adquirir lock para thread_id "
+                     "(Gemini) %s antes del plazo", thread_id)
+        return
 
     with lock:
         logger.info("Lock adquirido para thread_id (Gemini): %s", thread_id)
         start_time = time.time()
+        # Payloads completos solo si el turno está muestreado o
+        # activado por /admin/debug
+        debug_capture.begin_turn(thread_id, subscriber_id)
+        # Traza del turno (muestreada): input solo el mensaje del usuario
+        tracer.start_trace("generate_response_gemini", thread_id, subscriber_id,
+                           input={"user_message": message},
+                           metadata={"model": model_name})
         
         # Log del mensaje del usuario
         logger.info("👤 USUARIO MENSAJE para thread_id %s: %s", thread_id, message[:150] + "..." if len(message) > 150 else message)
 
+        # Unidad de trabajo del turno: una sola escritura del historial al final
+        uow = conversation_manager.unit_of_work(thread_id)
+
         try:
             # Obtener conversación actual
             conversation = conversation_manager.get(thread_id)
             if not conversation:
                 logger.error(f"Conversación {thread_id} no encontrada")
-                conversation_manager.set(thread_id, {
-                    "status": "error",
-                    "response": "Conversación no encontrada",
-                    "messages": []
-                })
+                uow.fail("Conversación no encontrada", {"messages": []})
                 
                 # Log error para Langfuse
                 logger.error(f"[LANGFUSE] Error: Conversación {thread_id} no encontrada")
                 return
 
+            uow.begin(conversation, turn_metadata)
+
             # Configurar API key
             api_key = os.environ.get("GEMINI_API_KEY")
             if not api_key:
@@ -253,38 +267,38 @@ def generate_response_gemini(
                 logger.error(f"[LANGFUSE] Error: API key de Gemini no configurada")
                 raise Exception("API key de Gemini no configurada")
 
-            # Cargar y convertir herramientas al formato Gemini
-            assistant_value = conversation.get("assistant")
-            assistant_str = str(assistant_value)
-            
-            # Cargar herramientas desde archivo único
-            tools_file_path = os.path.join(os.path.dirname(__file__), '..', 'tools', 'default_tools.json')
-            with open(tools_file_path, "r", encoding="utf-8") as tools_file:
-                openai_tools = json.load(tools_file)
-
-            # Preparar herramientas para Gemini
+            # Herramientas de default_tools.json ya convertidas al formato Gemini
             gemini_tools = [{
-                "functionDeclarations": [convert_tool_to_gemini_format(tool) for tool in openai_tools]
+                "functionDeclarations": tool_registry.toolset(DEFAULT_ASSISTANT).gemini
             }]
 
             # ===== GESTIÓN DEL HISTORIAL EN FORMATO GEMINI =====
             
-            # Obtener historial existente (ya en formato Gemini)
-            gemini_history = conversation.get("messages", [])
+            # Obtener historial existente (ya en formato Gemini, inmutable)
+            gemini_history = ConversationHistory.of(conversation.get("messages"))
             
             # Si es la primera vez o el historial está en formato incorrecto, convertir
             if not gemini_history or (gemini_history and "content" in gemini_history[0]):
                 logger.info("Convirtiendo historial existente a formato Gemini")
-                gemini_history = convert_legacy_history_to_gemini(gemini_history)
+                gemini_history = ConversationHistory(
+                    convert_legacy_history_to_gemini(gemini_history)
+                )
 
             # Agregar mensaje actual del usuario al historial
-            gemini_history.append({
+            gemini_history = gemini_history.append({
                 "role": "user",
                 "parts": [{"text": message}]
             })
 
-            # Actualizar conversación con mensaje del usuario
-            conversation_manager.update(thread_id, {"messages": gemini_history})
+            # Acumular mensaje del usuario (se escribe al cerrar el turno)
+            uow.stage({"messages": gemini_history})
+
+            # Pre-flight: system y herramientas son fijos; el
+            # historial se recorta si no cabe
+            history_budget = token_counter.input_budget(model_name, 1000) - (
+                token_counter.count_text(assistant_content_text, model_name)
+                + token_counter.count_tools(gemini_tools, model_name)
+            )
 
             # ===== LOOP PRINCIPAL DE INTERACCIÓN =====
             iteration_count = 0
@@ -294,9 +308,17 @@ def generate_response_gemini(
                 # Log iteración para Langfuse
                 logger.info(f"[LANGFUSE] Iteración {iteration_count} iniciada")
                 try:
+                    contents, dropped, history_tokens = trim_messages(
+                        gemini_history.to_list(), history_budget, model_name,
+                        is_gemini_turn_start
+                    )
+                    logger.info("📏 [PREFLIGHT] ~%d tokens de historial "
+                                "(presupuesto %d, %d recortados)",
+                                history_tokens, history_budget, dropped)
+
                     # Preparar payload para Gemini
                     payload = {
-                        "contents": gemini_history,
+                        "contents": contents,
                         "systemInstruction": {
                             "parts": [{"text": assistant_content_text}]
                         },
@@ -310,7 +332,10 @@ def generate_response_gemini(
                     logger.info("Enviando solicitud a Gemini API para thread_id: %s", thread_id)
 
                     # Usar función instrumentada para llamar a Gemini API
-                    response_data = call_gemini_api(payload, api_key, thread_id, model_name)
+                    debug_capture.record("gemini_request", lambda: payload)
+                    response_data = call_gemini_api(payload, api_key, thread_id,
+                                                    model_name, deadline=deadline)
+                    debug_capture.record("gemini_response", lambda: response_data)
 
                     # Procesar respuesta
                     candidates = response_data.get("candidates", [])
@@ -343,7 +368,7 @@ def generate_response_gemini(
 
                     # Agregar respuesta del modelo al historial
                     if model_response_parts:
-                        gemini_history.append({
+                        gemini_history = gemini_history.append({
                             "role": "model", 
                             "parts": model_response_parts
                         })
@@ -351,29 +376,36 @@ def generate_response_gemini(
                     # ===== EJECUTAR FUNCTION CALLS =====
                     
                     if has_function_calls:
-                        # Ejecutar todas las funciones (soporte para parallel calling)
-                        function_responses = []
-                        
-                        for tool_name, tool_args, original_function_call in function_calls_to_execute:
+                        # Ejecutar todas las funciones en paralelo
+                        # (parallel calling), en orden
+                        results = run_tools([
                             # Usar función instrumentada para ejecutar tools
-                            result = execute_function_call(tool_name, tool_args, subscriber_id)
-                            
-                            function_responses.append({
+                            ToolCall(tool_name,
+                                     partial(execute_function_call, tool_name,
+                                             tool_args, subscriber_id))
+                            for tool_name, tool_args, _ in function_calls_to_execute
+                        ], deadline=deadline)
+
+                        function_responses = [
+                            {
                                 "functionResponse": {
                                     "name": tool_name,
                                     "response": {"result": result}
                                 }
-                            })
+                            }
+                            for (tool_name, _, _), result in zip(
+                                function_calls_to_execute, results, strict=True)
+                        ]
 
                         # Agregar respuestas de funciones al historial
                         if function_responses:
-                            gemini_history.append({
+                            gemini_history = gemini_history.append({
                                 "role": "user",
                                 "parts": function_responses
                             })
 
-                        # Actualizar historial en conversation_manager después de function calls
-                        conversation_manager.update(thread_id, {"messages": gemini_history})
+                        # Acumular historial después de function calls
+                        uow.stage({"messages": gemini_history})
                         
                         # Continuar el loop para procesar la siguiente respuesta
                         continue
@@ -407,7 +439,7 @@ def generate_response_gemini(
                         )
                         
                         # Registrar output de la traza (solo la respuesta final) con costos
-                        langfuse.update_current_trace(
+                        tracer.update_trace(
                             output={"response": final_text},
                             metadata={
                                 "total_usage": usage,
@@ -424,8 +456,8 @@ def generate_response_gemini(
                             }
                         )
                         
-                        # Actualizar conversación con respuesta final
-                        conversation_manager.update(thread_id, {
+                        # Confirmar el turno con la respuesta final
+                        uow.commit({
                             "response": final_text,
                             "status": "completed", 
                             "messages": gemini_history,
@@ -443,11 +475,9 @@ def generate_response_gemini(
                     
                     # Log error para Langfuse
                     logger.error(f"[LANGFUSE] Error en API: {str(api_error)}")
+                    tracer.update_trace(metadata={"error": str(api_error)})
                     
-                    conversation_manager.update(thread_id, {
-                        "response": f"Error de comunicación con Gemini: {str(api_error)}",
-                        "status": "error"
-                    })
+                    uow.fail(f"Error de comunicación con Gemini: {str(api_error)}")
                     break
 
         except Exception as e:
@@ -455,12 +485,14 @@ def generate_response_gemini(
             
             # Log error general para Langfuse
             logger.error(f"[LANGFUSE] Error general: {str(e)}")
+            tracer.update_trace(metadata={"error": str(e)})
             
-            conversation_manager.update(thread_id, {
-                "response": f"Error Gemini: {str(e)}",
-                "status": "error"
-            })
+            uow.fail(f"Error Gemini: {str(e)}")
         finally:
+            # Garantiza un estado terminal aunque el turno no haya hecho commit
+            uow.close()
+            debug_capture.end_turn()
+            tracer.end_trace()
             event.set()
             elapsed_time = time.time() - start_time
             logger.info("Generación completada en %.2f segundos para thread_id: %s", elapsed_time, thread_id)
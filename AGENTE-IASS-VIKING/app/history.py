@@ -0,0 +1,135 @@
+"""
+Conversation History - Historial inmutable con estructura compartida
+Los mensajes se agrupan en bloques inmutables enlazados: agregar un mensaje
+crea una nueva versión sin copiar el historial y las versiones anteriores
+siguen siendo válidas (snapshot O(1)).
+"""
+
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+
+class _Chunk:
+    """Bloque lleno de mensajes enlazado con el bloque anterior"""
+
+    __slots__ = ("previous", "items", "count")
+
+    def __init__(self, previous: Optional["_Chunk"], items: Tuple[Any, ...]):
+        self.previous = previous
+        self.items = items
+        self.count = len(items) + (previous.count if previous else 0)
+
+
+class ConversationHistory:
+    """
+    Lista persistente de mensajes
+
+    ``append``/``extend`` retornan un nuevo historial y nunca modifican el actual,
+    por lo que un lector que obtuvo el historial ve siempre un turno consistente
+    aunque un handler siga agregando mensajes. Los bloques completos se comparten
+    entre versiones; solo se copia la cola (como máximo CHUNK_SIZE elementos).
+    """
+
+    CHUNK_SIZE = 32
+
+    __slots__ = ("_chunks", "_tail", "_size", "_flat")
+
+    def __init__(self, items: Iterable[Any] = ()):
+        self._chunks: Optional[_Chunk] = None
+        self._tail: Tuple[Any, ...] = ()
+        self._size = 0
+        self._flat: Optional[Tuple[_Chunk, ...]] = None
+        for item in items:
+            self._push(item)
+
+    @classmethod
+    def _make(cls, chunks: Optional[_Chunk],
+              tail: Tuple[Any, ...]) -> "ConversationHistory":
+        history = cls.__new__(cls)
+        history._chunks = chunks
+        history._tail = tail
+        history._size = len(tail) + (chunks.count if chunks else 0)
+        history._flat = None
+        return history
+
+    @classmethod
+    def of(cls, value: Any) -> "ConversationHistory":
+        """Retorna el mismo historial o lo construye a partir de una lista"""
+        if isinstance(value, cls):
+            return value
+        return cls(value or ())
+
+    def _push(self, item: Any) -> None:
+        """Solo durante la construcción inicial"""
+        if len(self._tail) == self.CHUNK_SIZE:
+            self._chunks = _Chunk(self._chunks, self._tail)
+            self._tail = ()
+        self._tail = self._tail + (item,)
+        self._size += 1
+
+    def append(self, item: Any) -> "ConversationHistory":
+        """Nuevo historial con el mensaje agregado al final"""
+        if len(self._tail) == self.CHUNK_SIZE:
+            return self._make(_Chunk(self._chunks, self._tail), (item,))
+        return self._make(self._chunks, self._tail + (item,))
+
+    def extend(self, items: Iterable[Any]) -> "ConversationHistory":
+        history = self
+        for item in items:
+            history = history.append(item)
+        return history
+
+    def _chunk_list(self) -> Tuple[_Chunk, ...]:
+        """Bloques en orden cronológico (se calcula una vez por versión)"""
+        if self._flat is None:
+            chunks = []
+            chunk = self._chunks
+            while chunk is not None:
+                chunks.append(chunk)
+                chunk = chunk.previous
+            chunks.reverse()
+            self._flat = tuple(chunks)
+        return self._flat
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def __iter__(self) -> Iterator[Any]:
+        for chunk in self._chunk_list():
+            yield from chunk.items
+        yield from self._tail
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.to_list()[index]
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("índice fuera del historial")
+        full = self._size - len(self._tail)
+        if index >= full:
+            return self._tail[index - full]
+        chunk = self._chunk_list()[index // self.CHUNK_SIZE]
+        return chunk.items[index % self.CHUNK_SIZE]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (ConversationHistory, list, tuple)):
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other, strict=True))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ConversationHistory({self.to_list()!r})"
+
+    def to_list(self) -> List[Any]:
+        """Copia como lista (para serializar o enviar al proveedor)"""
+        return list(self)
+
+
+def json_default(value: Any) -> Any:
+    """Función ``default`` para json.dumps con historiales"""
+    if isinstance(value, ConversationHistory):
+        return value.to_list()
+    return str(value)
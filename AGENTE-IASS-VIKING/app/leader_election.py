@@ -0,0 +1,119 @@
+"""
+Leader Election - Réplica líder para tareas de mantenimiento
+Lease en Redis (SET NX PX con renovación) para que una sola réplica ejecute
+la limpieza global del almacenamiento.
+"""
+
+import os
+import uuid
+import socket
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLease:
+    """
+    Lease de liderazgo renovable
+
+    ``acquire`` renueva el lease si esta réplica ya es líder o intenta tomarlo
+    si está libre. Si la réplica líder muere, otra lo toma cuando vence.
+    """
+
+    # Renueva solo si el lease sigue siendo de esta réplica
+    RENEW_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+
+    # Libera solo si el lease sigue siendo de esta réplica
+    RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, redis_client, name: str = "cleanup",
+                 lease_seconds: float = 7200):
+        self.redis_client = redis_client
+        self.key = f"leader:{name}"
+        self.lease_ms = int(lease_seconds * 1000)
+        # Identificador legible de la réplica para depuración (GET leader:cleanup)
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._renew_script = redis_client.register_script(self.RENEW_SCRIPT)
+        self._release_script = redis_client.register_script(self.RELEASE_SCRIPT)
+        self._lock = threading.Lock()
+        self.is_leader = False
+
+    def acquire(self) -> bool:
+        """Renueva o toma el lease; retorna True si esta réplica es líder"""
+        with self._lock:
+            try:
+                renewed = self.is_leader and self._renew_script(
+                    keys=[self.key], args=[self.token, self.lease_ms])
+                if renewed:
+                    return True
+                acquired = bool(self.redis_client.set(self.key, self.token, nx=True,
+                                                      px=self.lease_ms))
+                if acquired:
+                    logger.info(f"Réplica {self.token} es líder de {self.key}")
+                elif self.is_leader:
+                    logger.warning(f"Réplica {self.token} perdió el "
+                                   f"liderazgo de {self.key}")
+                self.is_leader = acquired
+            except Exception as e:
+                # Sin Redis no hay forma de coordinar: no ejecutar la tarea global
+                logger.error(f"Error en elección de líder {self.key}: {e}")
+                self.is_leader = False
+            return self.is_leader
+
+    def release(self) -> None:
+        with self._lock:
+            if self.is_leader:
+                try:
+                    self._release_script(keys=[self.key], args=[self.token])
+                except Exception as e:
+                    logger.error(f"Error al liberar liderazgo {self.key}: {e}")
+                self.is_leader = False
+
+    def current_leader(self) -> Optional[str]:
+        try:
+            return self.redis_client.get(self.key)
+        except Exception:
+            return None
+
+
+class LocalLeaderLease:
+    """Sin Redis hay una sola réplica: siempre es líder"""
+
+    is_leader = True
+    token = "local"
+
+    def acquire(self) -> bool:
+        return True
+
+    def release(self) -> None:
+        pass
+
+    def current_leader(self) -> Optional[str]:
+        return self.token
+
+
+def create_leader_lease(redis_client=None, name: str = "cleanup",
+                        lease_seconds: float = 7200):
+    """
+    Factory para el lease de liderazgo
+
+    Args:
+        redis_client: Cliente Redis compartido; si es None la réplica es siempre líder
+        name: Tarea coordinada (forma la clave ``leader:<name>``)
+        lease_seconds: Duración del lease; debe superar el intervalo entre ejecuciones
+    """
+    if redis_client is None:
+        return LocalLeaderLease()
+    return LeaderLease(redis_client, name=name, lease_seconds=lease_seconds)
@@ -25,10 +25,10 @@ from bs4 import BeautifulSoup
 from openai import OpenAI
 from dotenv import load_dotenv
 import time
-from functools import wraps
 
 # Servicios n8n eliminados - se manejará con MCP
 from app.utils import remove_thinking_block, create_svg_base64
+from app.retry import retry_call
 
 logger = logging.getLogger(__name__)
 
@@ -37,30 +37,13 @@ TOOL_FUNCTIONS = {}
 
 # Función get_tools_file_name eliminada - ahora se usa un solo prompt del sistema
 
-def retry_on_exception(max_retries=3, initial_wait=1):
-    """Reintenta llamadas a la API con backoff exponencial."""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            retries = 0
-            while retries < max_retries:
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    retries += 1
-                    wait_time = initial_wait * (2 ** retries)
-                    if retries >= max_retries:
-                        logger.error(f"Error definitivo tras {max_retries} intentos: {e}")
-                        raise
-                    logger.warning(f"Error en llamada a API (intento {retries}). Reintentando en {wait_time}s: {e}")
-                    time.sleep(wait_time)
-        return wrapper
-    return decorator
-
-@retry_on_exception(max_retries=3, initial_wait=1)
-def call_anthropic_api(client, **kwargs):
-    """Llama a la API de Anthropic con reintentos automáticos."""
-    return client.messages.create(**kwargs)
+def call_anthropic_api(client, deadline=None, **kwargs):
+    """
+    Llama a la API de Anthropic reintentando solo errores transitorios
+    (429, 5xx, timeouts).
+    """
+    return retry_call(lambda: client.messages.create(**kwargs), "anthropic",
+                      deadline=deadline)
 
 def validate_conversation_history(history):
     """Valida que la estructura del historial sea correcta para Anthropic."""
@@ -0,0 +1,478 @@
+"""
+Lock Manager - Serialización de turnos por thread_id
+Implementa patrón Strategy: locks en proceso o locks distribuidos en Redis.
+"""
+
+import os
+import time
+import uuid
+import random
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import deque, OrderedDict
+from typing import Dict, Optional, Any, List
+
+logger = logging.getLogger(__name__)
+
+
+class LockTimeoutError(Exception):
+    """No se pudo adquirir el lock de un thread_id dentro del tiempo límite"""
+
+    def __init__(self, thread_id: str, timeout: Optional[float]):
+        self.thread_id = thread_id
+        self.timeout = timeout
+        super().__init__(f"Timeout esperando lock para {thread_id} ({timeout}s)")
+
+
+class LockHandle:
+    """Lock adquirido; se libera al salir del bloque with"""
+
+    def __init__(self, manager: "ThreadLockManager", thread_id: str, token: str,
+                 wait_seconds: float):
+        self.manager = manager
+        self.thread_id = thread_id
+        self.token = token
+        self.wait_seconds = wait_seconds
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.manager._release(self.thread_id, self.token)
+
+    def __enter__(self) -> "LockHandle":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        self.release()
+        return False
+
+
+class ThreadLockManager(ABC):
+    """Interfaz abstracta para locks por thread_id con métricas de espera"""
+
+    # Máximo de thread_ids con métricas de contención retenidas (LRU)
+    MAX_TRACKED_THREADS = 1000
+
+    def __init__(self):
+        self._metrics_lock = threading.Lock()
+        self._acquisitions = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._recent_waits = deque(maxlen=1000)
+        self._thread_stats: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    @abstractmethod
+    def _acquire(self, thread_id: str, timeout: Optional[float]) -> Optional[str]:
+        """Adquiere el lock; retorna un token o None si se agotó el tiempo"""
+        pass
+
+    def _queue_length(self, _thread_id: str) -> int:
+        """Turnos que tienen o esperan el lock de thread_id en este proceso"""
+        return 0
+
+    @abstractmethod
+    def _release(self, thread_id: str, token: str) -> None:
+        """Libera el lock identificado por token"""
+        pass
+
+    def acquire(self, thread_id: str, timeout: Optional[float] = None,
+                owner: Optional[str] = None) -> Optional[LockHandle]:
+        """
+        Adquiere el lock de un thread_id.
+
+        Args:
+            thread_id: Conversación a serializar
+            timeout: Segundos máximos de espera (None = sin límite)
+            owner: Etiqueta del solicitante (subscriber_id) para las métricas
+
+        Returns:
+            LockHandle para usar con ``with``, o None si se agotó el tiempo
+        """
+        # Turnos por delante al llegar (en este proceso)
+        queue_length = self._queue_length(thread_id)
+        start = time.monotonic()
+        token = self._acquire(thread_id, timeout)
+        wait_seconds = time.monotonic() - start
+        self._record_wait(wait_seconds, acquired=token is not None)
+        self._record_thread_wait(thread_id, wait_seconds, token is not None, owner,
+                                 queue_length)
+
+        if token is None:
+            logger.error(f"Timeout esperando lock para {thread_id} tras "
+                         f"{wait_seconds:.2f}s")
+            return None
+
+        logger.debug(f"Lock adquirido para {thread_id} tras "
+                     f"{wait_seconds:.3f}s de espera")
+        return LockHandle(self, thread_id, token, wait_seconds)
+
+    def lock(self, thread_id: str, timeout: Optional[float] = None,
+             owner: Optional[str] = None) -> LockHandle:
+        """Como acquire, pero lanza LockTimeoutError si se agota el tiempo"""
+        handle = self.acquire(thread_id, timeout, owner)
+        if handle is None:
+            raise LockTimeoutError(thread_id, timeout)
+        return handle
+
+    def _record_wait(self, wait_seconds: float, acquired: bool) -> None:
+        with self._metrics_lock:
+            if acquired:
+                self._acquisitions += 1
+            else:
+                self._timeouts += 1
+            self._total_wait += wait_seconds
+            self._max_wait = max(self._max_wait, wait_seconds)
+            self._recent_waits.append(wait_seconds)
+
+    def _record_thread_wait(self, thread_id: str, wait_seconds: float, acquired: bool,
+                            owner: Optional[str], queue_length: int) -> None:
+        """Acumula métricas de contención por thread_id (LRU acotado)"""
+        with self._metrics_lock:
+            stats = self._thread_stats.pop(thread_id, None)
+            if stats is None:
+                stats = {
+                    "acquisitions": 0,
+                    "timeouts": 0,
+                    "total_wait_seconds": 0.0,
+                    "max_wait_seconds": 0.0,
+                    "max_queue_length": 0,
+                    "owners": [],
+                }
+            stats["acquisitions" if acquired else "timeouts"] += 1
+            stats["total_wait_seconds"] += wait_seconds
+            stats["max_wait_seconds"] = max(stats["max_wait_seconds"], wait_seconds)
+            stats["max_queue_length"] = max(stats["max_queue_length"], queue_length)
+            stats["last_wait_seconds"] = wait_seconds
+            stats["last_seen"] = time.time()
+            if owner is not None and owner not in stats["owners"]:
+                # Solicitantes distintos que se serializan en el mismo hilo
+                stats["owners"] = (stats["owners"] + [owner])[-10:]
+
+            self._thread_stats[thread_id] = stats
+            while len(self._thread_stats) > self.MAX_TRACKED_THREADS:
+                self._thread_stats.popitem(last=False)
+
+    def get_contention(self, top_n: int = 20) -> List[Dict[str, Any]]:
+        """Hilos con mayor tiempo total de espera por el lock"""
+        with self._metrics_lock:
+            items = [dict(stats, thread_id=thread_id)
+                     for thread_id, stats in self._thread_stats.items()]
+        items.sort(key=lambda item: item["total_wait_seconds"], reverse=True)
+        for item in items:
+            item["total_wait_seconds"] = round(item["total_wait_seconds"], 6)
+            item["max_wait_seconds"] = round(item["max_wait_seconds"], 6)
+            item["last_wait_seconds"] = round(item["last_wait_seconds"], 6)
+        return items[:top_n]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Métricas de espera por lock (globales del proceso)"""
+        with self._metrics_lock:
+            recent = sorted(self._recent_waits)
+            attempts = self._acquisitions + self._timeouts
+
+            def percentile(p):
+                if not recent:
+                    return 0.0
+                return recent[min(len(recent) - 1, int(len(recent) * p))]
+
+            return {
+                "backend": type(self).__name__,
+                "acquisitions": self._acquisitions,
+                "timeouts": self._timeouts,
+                "avg_wait_seconds": round(self._total_wait / attempts, 6) if attempts
+                else 0.0,
+                "max_wait_seconds": round(self._max_wait, 6),
+                "p50_wait_seconds": round(percentile(0.50), 6),
+                "p95_wait_seconds": round(percentile(0.95), 6),
+            }
+
+    def prune(self, max_idle_seconds: float = 7200) -> int:
+        """Descarta métricas de hilos sin actividad reciente; retorna cuántas eliminó"""
+        cutoff = time.time() - max_idle_seconds
+        with self._metrics_lock:
+            stale = [thread_id for thread_id, stats in self._thread_stats.items()
+                     if stats.get("last_seen", 0) < cutoff]
+            for thread_id in stale:
+                del self._thread_stats[thread_id]
+        return len(stale)
+
+
+class LockRegistry:
+    """
+    Registro de locks por thread_id con conteo de referencias.
+
+    Cada entrada cuenta los turnos que tienen o esperan el lock. La entrada
+    se crea de forma atómica en la primera adquisición y se elimina en cuanto
+    el contador vuelve a cero, por lo que el registro solo contiene hilos con
+    turnos en curso y no necesita limpieza periódica.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._guard = threading.Lock()
+
+    def checkout(self, thread_id: str) -> threading.Lock:
+        """Obtiene (o crea) el lock de thread_id y registra al solicitante"""
+        with self._guard:
+            entry = self._entries.get(thread_id)
+            if entry is None:
+                entry = {"lock": threading.Lock(), "refs": 0}
+                self._entries[thread_id] = entry
+            entry["refs"] += 1
+            return entry["lock"]
+
+    def checkin(self, thread_id: str, release: bool = False) -> None:
+        """
+        Devuelve la referencia (liberando el lock si ``release``) y elimina
+        la entrada si nadie más la usa.
+        """
+        with self._guard:
+            entry = self._entries.get(thread_id)
+            if entry is None:
+                return
+            if release and entry["lock"].locked():
+                entry["lock"].release()
+            entry["refs"] -= 1
+            if entry["refs"] <= 0:
+                del self._entries[thread_id]
+
+    def refs(self, thread_id: str) -> int:
+        """Turnos que tienen o esperan el lock de thread_id"""
+        with self._guard:
+            entry = self._entries.get(thread_id)
+            return entry["refs"] if entry else 0
+
+    def __len__(self) -> int:
+        with self._guard:
+            return len(self._entries)
+
+
+class InProcessLockManager(ThreadLockManager):
+    """Locks en memoria - válidos solo dentro de un proceso"""
+
+    def __init__(self):
+        super().__init__()
+        self._registry = LockRegistry()
+        logger.info("InProcessLockManager inicializado")
+
+    def _queue_length(self, thread_id: str) -> int:
+        return self._registry.refs(thread_id)
+
+    def _acquire(self, thread_id: str, timeout: Optional[float]) -> Optional[str]:
+        lock = self._registry.checkout(thread_id)
+        acquired = lock.acquire(timeout=-1 if timeout is None else max(0.0, timeout))
+        if not acquired:
+            self._registry.checkin(thread_id)
+            return None
+        return uuid.uuid4().hex
+
+    def _release(self, thread_id: str, _token: str) -> None:
+        # El lock local pertenece al hilo que lo adquirió: el token no hace falta
+        self._registry.checkin(thread_id, release=True)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        metrics = super().get_metrics()
+        metrics["active_locks"] = len(self._registry)
+        return metrics
+
+
+class RedisLockManager(ThreadLockManager):
+    """
+    Locks distribuidos en Redis.
+
+    - Token por adquisición: solo el dueño puede renovar o liberar.
+    - Lease con TTL (SET NX PX) renovado en segundo plano mientras el
+      handler se ejecuta; si el proceso muere, el lock expira solo.
+    - Cola FIFO por thread_id (ZSET) para que los turnos se atiendan en
+      orden de llegada. Cada espera mantiene un heartbeat; las entradas de
+      esperas abandonadas se descartan al llegar a la cabeza de la cola.
+    """
+
+    # KEYS[1] = lock, KEYS[2] = cola
+    # ARGV[1] = token, ARGV[2] = lease ms, ARGV[3] = prefijo heartbeat,
+    # ARGV[4] = score de llegada, ARGV[5] = TTL heartbeat ms
+    ACQUIRE_SCRIPT = """
+    redis.call('ZADD', KEYS[2], 'NX', ARGV[4], ARGV[1])
+    redis.call('PEXPIRE', KEYS[2], ARGV[2] * 4)
+    redis.call('SET', ARGV[3] .. ARGV[1], '1', 'PX', ARGV[5])
+    while true do
+        local head = redis.call('ZRANGE', KEYS[2], 0, 0)[1]
+        if not head or head == ARGV[1]
+                or redis.call('EXISTS', ARGV[3] .. head) == 1 then
+            break
+        end
+        redis.call('ZREM', KEYS[2], head)
+    end
+    if redis.call('ZRANGE', KEYS[2], 0, 0)[1] ~= ARGV[1] then
+        return 0
+    end
+    if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+        redis.call('ZREM', KEYS[2], ARGV[1])
+        redis.call('DEL', ARGV[3] .. ARGV[1])
+        return 1
+    end
+    return 0
+    """
+
+    RENEW_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+
+    RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, redis_client, lease_seconds: float = 30,
+                 poll_interval: float = 0.05):
+        """
+        Args:
+            redis_client: Cliente Redis (decode_responses=True)
+            lease_seconds: Duración del lease; se renueva cada lease/3
+            poll_interval: Intervalo base entre intentos de adquisición
+        """
+        super().__init__()
+        self.redis_client = redis_client
+        self.lease_ms = int(lease_seconds * 1000)
+        self.poll_interval = poll_interval
+        self.heartbeat_ms = max(1000, int(poll_interval * 1000 * 20))
+        self.key_prefix = "lock:thread"
+
+        self._acquire_script = redis_client.register_script(self.ACQUIRE_SCRIPT)
+        self._renew_script = redis_client.register_script(self.RENEW_SCRIPT)
+        self._release_script = redis_client.register_script(self.RELEASE_SCRIPT)
+
+        # Locks en poder de este proceso: token -> thread_id
+        self._held: Dict[str, str] = {}
+        # Turnos de este proceso esperando o con el lock, por thread_id
+        self._local_refs: Dict[str, int] = {}
+        self._held_guard = threading.Lock()
+        self._renewer = threading.Thread(target=self._renew_loop, daemon=True)
+        self._renewer.start()
+
+        logger.info(f"RedisLockManager inicializado - Lease: {lease_seconds}s")
+
+    def _lock_key(self, thread_id: str) -> str:
+        return f"{self.key_prefix}:{thread_id}"
+
+    def _queue_length(self, thread_id: str) -> int:
+        with self._held_guard:
+            return self._local_refs.get(thread_id, 0)
+
+    def _change_local_refs(self, thread_id: str, delta: int) -> None:
+        with self._held_guard:
+            refs = self._local_refs.get(thread_id, 0) + delta
+            if refs > 0:
+                self._local_refs[thread_id] = refs
+            else:
+                self._local_refs.pop(thread_id, None)
+
+    def _acquire(self, thread_id: str, timeout: Optional[float]) -> Optional[str]:
+        self._change_local_refs(thread_id, 1)
+        try:
+            token = self._wait_for_lock(thread_id, timeout)
+        except Exception:
+            self._change_local_refs(thread_id, -1)
+            raise
+        if token is None:
+            self._change_local_refs(thread_id, -1)
+        return token
+
+    def _wait_for_lock(self, thread_id: str, timeout: Optional[float]) -> Optional[str]:
+        token = uuid.uuid4().hex
+        lock_key = self._lock_key(thread_id)
+        queue_key = f"{lock_key}:queue"
+        waiter_prefix = f"{lock_key}:waiter:"
+        arrival = int(time.time() * 1000)
+        deadline = None if timeout is None else time.monotonic() + max(0.0, timeout)
+
+        while True:
+            acquired = self._acquire_script(
+                keys=[lock_key, queue_key],
+                args=[token, self.lease_ms, waiter_prefix, arrival, self.heartbeat_ms]
+            )
+            if acquired:
+                with self._held_guard:
+                    self._held[token] = thread_id
+                return token
+
+            if deadline is not None and time.monotonic() >= deadline:
+                # Abandonar la cola para no bloquear a los siguientes
+                pipe = self.redis_client.pipeline()
+                pipe.zrem(queue_key, token)
+                pipe.delete(f"{waiter_prefix}{token}")
+                pipe.execute()
+                return None
+
+            sleep_time = self.poll_interval * random.uniform(0.5, 1.5)
+            if deadline is not None:
+                sleep_time = min(sleep_time, max(0.0, deadline - time.monotonic()))
+            time.sleep(sleep_time)
+
+    def _release(self, thread_id: str, token: str) -> None:
+        with self._held_guard:
+            self._held.pop(token, None)
+        self._change_local_refs(thread_id, -1)
+        try:
+            released = self._release_script(keys=[self._lock_key(thread_id)],
+                                            args=[token])
+            if not released:
+                logger.warning(f"Lock de {thread_id} ya no pertenecía a "
+                               "este proceso al liberar")
+        except Exception as e:
+            logger.error(f"Error liberando lock de {thread_id}: {e}")
+
+    def _renew_loop(self) -> None:
+        """Renueva los leases de los locks en poder de este proceso"""
+        interval = self.lease_ms / 3000
+        while True:
+            time.sleep(interval)
+            with self._held_guard:
+                held = list(self._held.items())
+            for token, thread_id in held:
+                try:
+                    renewed = self._renew_script(keys=[self._lock_key(thread_id)],
+                                                 args=[token, self.lease_ms])
+                    if not renewed:
+                        logger.error(f"Lease perdido para {thread_id}: otro proceso "
+                                     "puede haber tomado el lock")
+                        with self._held_guard:
+                            self._held.pop(token, None)
+                except Exception as e:
+                    logger.warning(f"Error renovando lease de {thread_id}: {e}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        metrics = super().get_metrics()
+        with self._held_guard:
+            metrics["held_locks"] = len(self._held)
+        metrics["lease_seconds"] = self.lease_ms / 1000
+        return metrics
+
+
+def create_lock_manager(redis_client=None) -> ThreadLockManager:
+    """
+    Factory para crear el ThreadLockManager apropiado
+
+    Args:
+        redis_client: Cliente Redis compartido; si es None se usan locks en proceso
+
+    Returns:
+        ThreadLockManager: Locks distribuidos si hay Redis y USE_DISTRIBUTED_LOCKS=true
+    """
+    use_distributed = os.getenv('USE_DISTRIBUTED_LOCKS', 'true').lower() == 'true'
+    if redis_client is not None and use_distributed:
+        try:
+            lease_seconds = float(os.getenv('LOCK_LEASE_SECONDS', 30))
+            return RedisLockManager(redis_client, lease_seconds=lease_seconds)
+        except Exception as e:
+            logger.error("Falló inicialización de locks Redis, fallback a "
+                         f"locks en proceso: {e}")
+    return InProcessLockManager()
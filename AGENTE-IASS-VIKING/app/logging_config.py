@@ -0,0 +1,190 @@
+"""
+Logging Config - Logging asíncrono vía cola
+Los hilos de request y de handlers solo encolan el registro; un único hilo
+(QueueListener) formatea y escribe en stdout, así la contrapresión del
+recolector de logs del contenedor no detiene los turnos.
+"""
+
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+# Argumentos que se pueden pasar al hilo del listener sin renderizar (inmutables)
+_IMMUTABLE_ARG_TYPES = (str, int, float, bool, bytes, type(None))
+
+# Atributos estándar de LogRecord: el resto son campos extra
+# (logger.info(..., extra={...}))
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None)))
+_STANDARD_ATTRS |= {"message", "asctime"}
+
+_listener: Optional["DrainingQueueListener"] = None
+_queue_handler: Optional["BoundedQueueHandler"] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro con los campos extra del registro"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    QueueHandler con política ante cola llena
+
+    - ``drop``: los registros DEBUG/INFO se descartan (y se cuentan) si la cola
+      está llena; WARNING o superior esperan hasta ``block_timeout``.
+    - ``block``: todos los registros esperan hasta ``block_timeout``.
+    """
+
+    def __init__(self, log_queue: queue.Queue, policy: str = "drop",
+                 block_timeout: float = 1.0):
+        super().__init__(log_queue)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Copia del registro para el listener, sin formatear
+
+        QueueHandler.prepare() formatea el mensaje y el traceback en el hilo
+        que llama; aquí solo se renderiza el mensaje si sus argumentos son
+        mutables (podrían cambiar antes de que el listener lo escriba).
+        exc_info viaja intacto y el formatter del listener lo procesa.
+        """
+        record = copy.copy(record)
+        args = record.args
+        if args and not all(isinstance(arg, _IMMUTABLE_ARG_TYPES)
+                            for arg in (args.values() if isinstance(args, dict)
+                                        else args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            if self.policy == "drop" and record.levelno < logging.WARNING:
+                self.queue.put_nowait(record)
+            else:
+                self.queue.put(record, block=True, timeout=self.block_timeout)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+
+class DrainingQueueListener(QueueListener):
+    """Al detenerse espera lugar en la cola llena en lugar de fallar con queue.Full"""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+def _parse_levels(value: str) -> Dict[str, str]:
+    """LOG_LEVELS="app.openai_responses_handler=WARNING,werkzeug=ERROR" """
+    levels = {}
+    for item in (value or "").split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(stream=None, level: Optional[str] = None, fmt: Optional[str] = None,
+                  policy: Optional[str] = None, queue_size: Optional[int] = None,
+                  module_levels: Optional[Dict[str, str]] = None) -> QueueListener:
+    """
+    Configura el logging raíz con cola y listener en segundo plano
+
+    Los parámetros omitidos se leen del entorno (después de load_dotenv):
+    LOG_LEVEL, LOG_FORMAT (json | text), LOG_QUEUE_POLICY (drop | block),
+    LOG_QUEUE_SIZE, LOG_QUEUE_BLOCK_TIMEOUT y LOG_LEVELS por módulo.
+
+    Returns:
+        QueueListener: el listener iniciado (stop_logging lo detiene al salir)
+    """
+    global _listener, _queue_handler
+
+    level = level or os.getenv('LOG_LEVEL', 'INFO').upper()
+    fmt = fmt or os.getenv('LOG_FORMAT', 'json').lower()
+    policy = policy or os.getenv('LOG_QUEUE_POLICY', 'drop').lower()
+    if queue_size is None:
+        queue_size = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    if module_levels is None:
+        module_levels = _parse_levels(os.getenv('LOG_LEVELS', ''))
+
+    stop_logging()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s '
+                                              '[%(levelname)s] %(message)s'))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    _queue_handler = BoundedQueueHandler(
+        log_queue,
+        policy=policy,
+        block_timeout=float(os.getenv('LOG_QUEUE_BLOCK_TIMEOUT', 1.0))
+    )
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    for name, module_level in module_levels.items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = DrainingQueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging() -> None:
+    """Escribe lo pendiente en la cola y detiene el listener"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# Al salir del proceso se vacía la cola
+atexit.register(stop_logging)
+
+
+def get_logging_stats() -> Dict[str, Any]:
+    """Registros en cola y descartados por cola llena"""
+    if _queue_handler is None:
+        return {"configured": False}
+    return {
+        "configured": True,
+        "policy": _queue_handler.policy,
+        "queued": _queue_handler.queue.qsize(),
+        "capacity": _queue_handler.queue.maxsize,
+        "dropped": _queue_handler.dropped,
+    }
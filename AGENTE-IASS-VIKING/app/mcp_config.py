@@ -7,6 +7,8 @@ import logging
 import json
 import requests
 
+from app.tool_registry import tool_registry
+
 logger = logging.getLogger(__name__)
 
 
@@ -47,27 +49,8 @@ class SimpleMCPClient:
         self._load_tools_for_assistant()
     
     def _load_tools_for_assistant(self):
-        """Carga las herramientas específicas para este assistant usando ASSISTANT_TOOLS"""
-        # Importar mapeo desde endpoints
-        try:
-            from app.endpoints import ASSISTANT_TOOLS
-            tools_file = ASSISTANT_TOOLS.get(self.assistant_number, ASSISTANT_TOOLS[5])
-        except ImportError:
-            # Fallback si no se puede importar
-            tools_file = f"tools/tools_{self.assistant_number}.json" if self.assistant_number != 5 else "tools/default_tools.json"
-        
-        tools_path = os.path.join(os.path.dirname(__file__), '..', tools_file)
-        
-        try:
-            with open(tools_path, 'r', encoding='utf-8') as f:
-                self.tools = json.load(f)
-                logger.info(f"Cargadas {len(self.tools)} herramientas desde {tools_file} para MCP {self.server_label}")
-        except FileNotFoundError:
-            logger.warning(f"Archivo de herramientas no encontrado: {tools_path}")
-            self.tools = []
-        except Exception as e:
-            logger.error(f"Error cargando herramientas: {str(e)}")
-            self.tools = []
+        """Herramientas de este assistant desde el registro en memoria (sin disco)"""
+        self.tools = tool_registry.toolset(self.assistant_number).openai
     
     def get_available_tools(self):
         """Retorna las herramientas disponibles en formato OpenAI"""
@@ -1,9 +1,11 @@
 import os
-import json
+import time
 import logging
 from datetime import datetime, timezone
 import requests
 
+from app.debug_capture import debug_capture
+
 logger = logging.getLogger(__name__)
 
 # Mapea cada function tool a su webhook/config de n8n.
@@ -56,8 +58,10 @@ def execute_n8n_function_tool(tool_name, tool_args, assistant_number, subscriber
 
     try:
         logger.info(f"🔗 [N8N BRIDGE] Enviando {tool_name} a {url}")
-        logger.info(f"🔗 [N8N BRIDGE] Payload: {json.dumps(payload, indent=2)}")
+        debug_capture.record("n8n_request",
+                             lambda: {"url": url, "method": method, "payload": payload})
         
+        start = time.time()
         resp = requests.request(method, url, json=payload, headers=headers, timeout=timeout)
         
     except requests.Timeout:
@@ -67,46 +71,25 @@ def execute_n8n_function_tool(tool_name, tool_args, assistant_number, subscriber
         logger.error(f"🔗 [N8N BRIDGE] Error de red: {str(e)} para {tool_name}")
         return {"error": f"error de red: {str(e)}", "tool_name": tool_name}
 
+    elapsed_ms = round((time.time() - start) * 1000)
+    # Headers y cuerpo completos solo en la captura de depuración
+    debug_capture.record("n8n_response", lambda: {
+        "status": resp.status_code, "headers": dict(resp.headers), "body": resp.text
+    })
+
     if 200 <= resp.status_code < 300:
-        logger.info(f"🔗 [N8N BRIDGE] ✅ Respuesta exitosa de {tool_name}: HTTP {resp.status_code}")
-        logger.info(f"🔗 [N8N BRIDGE] ✅ Status Code: {resp.status_code}")
-        logger.info(f"🔗 [N8N BRIDGE] ✅ Response Headers: {dict(resp.headers)}")
-        logger.info(f"🔗 [N8N BRIDGE] ✅ Response Size: {len(resp.text)} characters")
-        
-        # Log del contenido completo de la respuesta
-        if resp.text:
-            logger.info(f"🔗 [N8N BRIDGE] ✅ Raw Response Body: {resp.text}")
-        else:
-            logger.info(f"🔗 [N8N BRIDGE] ⚠️ Empty response body")
+        logger.info(f"🔗 [N8N BRIDGE] ✅ {tool_name}: HTTP {resp.status_code}, "
+                    f"{len(resp.text)} chars, {elapsed_ms}ms")
         
         try:
-            result = resp.json()
-            logger.info(f"🔗 [N8N BRIDGE] ✅ Parsed JSON Response:")
-            logger.info(f"🔗 [N8N BRIDGE] {json.dumps(result, indent=2, ensure_ascii=False)}")
-            
-            # Log de campos específicos si existen
-            if isinstance(result, dict):
-                if 'success' in result:
-                    logger.info(f"🔗 [N8N BRIDGE] ✅ Success: {result['success']}")
-                if 'message' in result:
-                    logger.info(f"🔗 [N8N BRIDGE] ✅ Message: {result['message']}")
-                if 'data' in result:
-                    logger.info(f"🔗 [N8N BRIDGE] ✅ Data: {result['data']}")
-            
-            return result
+            return resp.json()
         except ValueError as json_error:
-            logger.info(f"🔗 [N8N BRIDGE] ⚠️ Response no es JSON válido: {str(json_error)}")
-            logger.info(f"🔗 [N8N BRIDGE] ✅ Text Response: {resp.text}")
+            logger.info(f"🔗 [N8N BRIDGE] ⚠️ Response de {tool_name} no es JSON "
+                        f"válido: {str(json_error)}")
             return {"ok": True, "data": resp.text, "raw_response": resp.text}
     else:
-        # Log detallado de errores HTTP
-        logger.error(f"🔗 [N8N BRIDGE] ❌ Error HTTP {resp.status_code} para {tool_name}")
-        logger.error(f"🔗 [N8N BRIDGE] ❌ Error Headers: {dict(resp.headers)}")
-        
         body_preview = (resp.text or "")[:1000]
-        logger.error(f"🔗 [N8N BRIDGE] ❌ Error Body (first 1000 chars): {body_preview}")
-        
-        if len(resp.text) > 1000:
-            logger.error(f"🔗 [N8N BRIDGE] ❌ Full Error Body: {resp.text}")
+        logger.error(f"🔗 [N8N BRIDGE] ❌ Error HTTP {resp.status_code} para "
+                     f"{tool_name} ({elapsed_ms}ms): {body_preview}")
         
         return {"error": f"HTTP {resp.status_code}", "body": body_preview, "tool_name": tool_name, "full_body": resp.text}
\ No newline at end of file
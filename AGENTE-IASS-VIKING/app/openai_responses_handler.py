@@ -5,20 +5,30 @@ OpenAI Handler - VERSIÓN SIMPLIFICADA PARA TEST MÍNIMO
 import json
 import os
 import time
+import hashlib
 import logging
 import threading
-from openai import OpenAI
-
-# Langfuse imports
-from langfuse import Langfuse, observe
+from functools import partial
 
 from app.utils.cost_calculator import cost_calculator
+from app.utils.token_counter import token_counter, trim_messages
+from app.history import ConversationHistory
+from app.clients import get_openai_client
+from app.retry import retry_call, remaining_timeout
+from app.tool_executor import ToolCall, run_tools
+from app.debug_capture import debug_capture
+from app.tool_registry import tool_registry
+from app.tracing import tracer
+from app.prompt_cache import split_prompt, prompt_cache_key, prompt_cache_stats
+from app.tool_selection import select_tools, mcp_tool_cache
 from app.mcp_config import get_mcp_client, convert_mcp_tools_to_openai
 
 logger = logging.getLogger(__name__)
 
-# Inicializar cliente Langfuse
-langfuse = Langfuse()
+# Con un previous_response_id válido se envía solo el mensaje nuevo
+# (OpenAI conserva el contexto)
+INCREMENTAL_INPUT_ENABLED = os.getenv('OPENAI_INCREMENTAL_INPUT',
+                                      'true').lower() == 'true'
 
 
 # Bridge genérico a n8n para function tools
@@ -78,171 +88,147 @@ def _fallback_route_b(client, responses_input, openai_tools, llm_id,
     raise ValueError("Ruta B eliminada: role:'tool' no es válido en Responses API. Solo usar submit_tool_outputs.")
 
 
-def handle_tool_calls_responses_api(client, initial_response, responses_input, openai_tools, 
-                                   llm_id, thread_id, model_parameters, assistant_number, 
-                                   mcp_servers=None, function_tool_calls=None, subscriber_id=None):
-    """Maneja tool calls y hace segunda llamada a Responses API"""
-    try:
-        logger.info(f"🔧 [TOOL HANDLER] Iniciando manejo de tool calls")
-        
-        # Usar function_tool_calls si está disponible, sino usar initial_response.tool_calls (fallback)
-        tool_calls_to_process = function_tool_calls if function_tool_calls else getattr(initial_response, 'tool_calls', [])
-        
-        if not tool_calls_to_process:
-            logger.warning(f"🔧 [TOOL HANDLER] No se encontraron tool calls para procesar")
-            return initial_response
-        
-        logger.info(f"🔧 [TOOL HANDLER] Procesando {len(tool_calls_to_process)} tool calls")
-        
-        # NO agregamos mensaje assistant con tool_calls - esto causa error 400
-        # En Responses API, 'tool_call' NO es un tipo válido en la entrada
-        logger.info(f"🔧 [TOOL HANDLER] Saltando mensaje assistant inválido (previene error 400)")
-        
-        # Preparar tool_outputs para submit_tool_outputs
-        tool_outputs = []
-        response_id = getattr(initial_response, 'id', None)
-        logger.info(f"🔧 [TOOL HANDLER] Response ID para submit_tool_outputs: {response_id}")
-        
-        # Separar herramientas Function de MCP para procesamiento diferente
-        function_tool_outputs = []
-        mcp_tools_to_process = []
-        
-        # 1. Clasificar y ejecutar herramientas según su tipo
-        for tool_call in tool_calls_to_process:
-            # Manejar diferencias entre ResponseFunctionToolCall y formato anterior
-            tool_name = getattr(tool_call, 'name', 'unknown')
-            tool_id = getattr(tool_call, 'call_id', getattr(tool_call, 'id', 'unknown'))
-            
-            # Para ResponseFunctionToolCall, los argumentos vienen como string JSON
-            if hasattr(tool_call, 'arguments') and isinstance(tool_call.arguments, str):
-                try:
-                    tool_args = json.loads(tool_call.arguments)
-                except json.JSONDecodeError:
-                    tool_args = {}
-            else:
-                tool_args = getattr(tool_call, 'arguments', {})
-            
-            logger.info(f"🔧 [TOOL HANDLER] Clasificando herramienta: {tool_name}")
-            
-            # Determinar si es herramienta Function o MCP
-            is_function_tool = False
-            
-            # Verificar si está en herramientas Function (soporta name en nivel superior y anidado)
-            function_tools = load_function_tools_for_assistant(assistant_number)
-            for func_tool in function_tools:
-                name_top = func_tool.get('name')  # Formato correcto con name en nivel superior
-                name_nested = func_tool.get('function', {}).get('name')  # Fallback para formato anidado
-                if name_top == tool_name or name_nested == tool_name:
-                    is_function_tool = True
-                    break
-            
-            if is_function_tool:
-                # FUNCTION TOOL: Ejecutar via N8N bridge
-                logger.info(f"🔧 [FUNCTION TOOL] Ejecutando {tool_name} via N8N bridge")
-                result = execute_function_tool(tool_name, tool_args, assistant_number, subscriber_id, thread_id)
-                
-                # Agregar a tool_outputs para submit_tool_outputs
-                function_tool_outputs.append({
-                    "tool_call_id": tool_id,
-                    "output": json.dumps(result, ensure_ascii=False)
-                })
-                logger.info(f"🔧 [FUNCTION TOOL] Output preparado para {tool_name} (call_id: {tool_id})")
-                
-            else:
-                # MCP TOOL: Agregar a lista para procesamiento MCP
-                logger.info(f"🛠️ [MCP TOOL] Agregando {tool_name} para procesamiento MCP")
-                mcp_tools_to_process.append({
-                    'tool_call': tool_call,
-                    'tool_name': tool_name,
-                    'tool_id': tool_id,
-                    'tool_args': tool_args
-                })
-        
-        # 2. Procesar TODAS las herramientas Function PRIMERO (si las hay) - ENVIADAS A N8N
-        if function_tool_outputs:
-            logger.info(f"🔧 [FUNCTION TOOLS] ✅ {len(function_tool_outputs)} herramientas Function enviadas a N8N")
-            
-            logger.info(f"🔧 [FUNCTION TOOLS] Datos enviados a N8N webhooks:")
-            for i, output in enumerate(function_tool_outputs):
-                logger.info(f"🔧 [FUNCTION TOOLS] Tool {i+1}: call_id={output['tool_call_id']}")
-                logger.info(f"🔧 [FUNCTION TOOLS] N8N Response: {output['output'][:200]}...")
-                
-            # CRÍTICO: Hacer 2ª llamada a Responses API enviando tool_result con previous_response_id
-            logger.info(f"🔧 [FUNCTION TOOLS] Preparando 2ª llamada con tool_result y previous_response_id: {response_id}")
-            
-            try:
-                # Construir input para 2ª llamada con function_call_output (sin role)
-                tool_input = []
-                for output in function_tool_outputs:
-                    tool_input.append({
-                        "type": "function_call_output",
-                        "call_id": output['tool_call_id'],
-                        "output": output['output']  # Texto o JSON stringificado
-                    })
-                
-                logger.info(f"🔧 [FUNCTION TOOLS] Haciendo 2ª llamada con {len(tool_input)} tool_results")
-                
-                # 2ª llamada a Responses API con tool_result
-                final_response = client.responses.create(
-                    model=llm_id,
-                    previous_response_id=response_id,
-                    input=tool_input,
-                    temperature=model_parameters.get("temperature"),
-                    max_output_tokens=model_parameters.get("max_completion_tokens")
-                )
-                
-                logger.info(f"🔧 [FUNCTION TOOLS] ✅ 2ª llamada exitosa - Response ID: {final_response.id}")
-                logger.info(f"🔧 [FUNCTION TOOLS] ✅ Final response output_text: {len(getattr(final_response, 'output_text', ''))} chars")
-                
-                # Si también hay MCP tools, ya fueron procesadas automáticamente en la 1ª llamada
-                if mcp_tools_to_process:
-                    logger.info(f"🛠️ [MCP TOOLS] {len(mcp_tools_to_process)} herramientas MCP fueron procesadas automáticamente en la 1ª llamada")
-                
-                return final_response
-                
-            except Exception as second_call_error:
-                logger.error(f"🔧 [FUNCTION TOOLS] ❌ Error en 2ª llamada: {str(second_call_error)}")
-                logger.info(f"🔧 [FUNCTION TOOLS] Fallback: devolviendo initial_response")
-                return initial_response
-        
-        # 3. Manejar SOLO herramientas MCP (sin Function tools) - FLUJO AUTOMÁTICO
-        if mcp_tools_to_process:
-            logger.info(f"🔧 [RESUMEN] Caso MCP: {len(mcp_tools_to_process)} MCP tools → procesamiento automático")
-            return initial_response
-        
-        # 4. Sin herramientas - respuesta normal
-        logger.info(f"🔧 [RESUMEN] Sin herramientas - respuesta normal")
-        return initial_response
-        
-    except Exception as e:
-        logger.error(f"🔧 [TOOL HANDLER] Error en handle_tool_calls: {e}")
-        # Retornar respuesta de error
-        class ErrorResponse:
-            def __init__(self, error_msg):
-                self.output_text = f"Error ejecutando herramientas: {error_msg}"
-                self.usage = None
-                
-        return ErrorResponse(str(e))
+# Rondas máximas de herramientas por turno y plazo de cada llamada al modelo
+MAX_TOOL_ROUNDS = int(os.getenv('OPENAI_MAX_TOOL_ROUNDS', 5))
+TOOL_ROUND_TIMEOUT_SECONDS = float(os.getenv('OPENAI_TOOL_ROUND_TIMEOUT_SECONDS', 60))
 
 
-def load_function_tools_for_assistant(assistant_number):
-    """Carga herramientas function basadas en ASSISTANT_TOOLS"""
-    from app.endpoints import ASSISTANT_TOOLS
-    
-    tools_file = ASSISTANT_TOOLS.get(assistant_number, ASSISTANT_TOOLS[5])
-    tools_path = os.path.join(os.path.dirname(__file__), '..', tools_file)
-    
-    try:
-        with open(tools_path, 'r', encoding='utf-8') as f:
-            tools = json.load(f)
-            logger.info(f"🔧 [FUNCTION TOOLS] Cargadas {len(tools)} herramientas desde {tools_file} para assistant {assistant_number}")
-            return tools
-    except FileNotFoundError:
-        logger.warning(f"🔧 [FUNCTION TOOLS] Archivo no encontrado: {tools_path}")
-        return []
-    except Exception as e:
-        logger.error(f"🔧 [FUNCTION TOOLS] Error cargando {tools_path}: {e}")
-        return []
+def unavailable_tool_output(tool_name):
+    """Output de error para una function call que el assistant no tiene"""
+    return {"error": f"Herramienta no disponible: {tool_name}"}
+
+
+def execute_function_calls(function_calls, assistant_number, subscriber_id=None,
+                           thread_id=None, deadline=None):
+    """
+    Ejecuta las function calls de una ronda vía n8n, en paralelo y en orden
+
+    Las herramientas MCP las resuelve OpenAI dentro de la misma llamada (mcp_call),
+    así que una function call desconocida recibe un error como output para que
+    el modelo pueda continuar.
+
+    Returns:
+        list: items function_call_output para la siguiente llamada
+    """
+    toolset = tool_registry.toolset(assistant_number)
+
+    calls = []
+    for tool_call in function_calls:
+        tool_name = getattr(tool_call, 'name', 'unknown')
+
+        # Para ResponseFunctionToolCall, los argumentos vienen como string JSON
+        try:
+            tool_args = json.loads(tool_call.arguments or "{}")
+        except (json.JSONDecodeError, TypeError):
+            tool_args = {}
+
+        if tool_name in toolset:
+            logger.info(f"🔧 [FUNCTION TOOL] Ejecutando {tool_name} via N8N bridge "
+                        f"(call_id: {getattr(tool_call, 'call_id', None)})")
+            fn = partial(execute_function_tool, tool_name, tool_args, assistant_number,
+                         subscriber_id, thread_id)
+        else:
+            logger.warning("🔧 [FUNCTION TOOL] Herramienta desconocida para assistant "
+                           f"{assistant_number}: {tool_name}")
+            fn = partial(unavailable_tool_output, tool_name)
+        calls.append(ToolCall(tool_name, fn))
+
+    results = run_tools(calls, deadline=deadline)
+    return [
+        {
+            "type": "function_call_output",
+            "call_id": getattr(tool_call, 'call_id',
+                               getattr(tool_call, 'id', 'unknown')),
+            # Texto o JSON stringificado
+            "output": json.dumps(result, ensure_ascii=False)
+        }
+        for tool_call, result in zip(function_calls, results, strict=True)
+    ]
+
+
+def run_responses_rounds(client, responses_input, openai_tools, llm_id, thread_id,
+                         model_parameters,
+                         assistant_number, previous_response_id=None,
+                         subscriber_id=None, deadline=None,
+                         cache_key=None):
+    """
+    Bucle de herramientas sobre Responses API
+
+    La primera llamada y las siguientes usan el mismo camino: cada ronda envía
+    los function_call_output de la anterior con su previous_response_id hasta
+    que el modelo responde sin pedir herramientas. La última ronda permitida
+    usa tool_choice="none" para forzar una respuesta de texto.
+
+    Returns:
+        tuple: (respuesta final, lista de rondas con herramientas y tokens)
+    """
+    rounds = []
+    round_input = responses_input
+
+    for round_number in range(1, MAX_TOOL_ROUNDS + 2):
+        # Plazo de la ronda: el menor entre el configurado y lo que resta del turno
+        timeout = TOOL_ROUND_TIMEOUT_SECONDS
+        if deadline:
+            timeout = min(timeout, deadline - time.time())
+            if timeout <= 0:
+                raise TimeoutError("Plazo del turno agotado antes de la "
+                                   f"ronda {round_number}")
+
+        is_last_round = round_number == MAX_TOOL_ROUNDS + 1
+        round_start = time.time()
+        try:
+            # Errores transitorios se reintentan; cada intento
+            # usa lo que resta del plazo
+            response = retry_call(lambda: call_openai_responses_api(
+                client,
+                round_input,
+                openai_tools,
+                llm_id,
+                thread_id,
+                model_parameters,
+                previous_response_id,
+                timeout=remaining_timeout(timeout, deadline),
+                tool_choice="none" if is_last_round and round_number > 1 else None,
+                cache_key=cache_key
+            ), "openai", deadline=deadline)
+        except Exception as round_error:
+            if round_number == 1:
+                raise
+            # Las herramientas ya se ejecutaron: no se debe repetir el turno completo
+            raise RuntimeError(f"Error en ronda {round_number} de "
+                               f"herramientas: {round_error}") from round_error
+
+        function_calls = [
+            item for item in (getattr(response, 'output', None) or [])
+            if getattr(item, 'type', None) == 'function_call'
+        ]
+        usage = getattr(response, 'usage', None)
+        rounds.append({
+            "round": round_number,
+            "function_calls": [getattr(call, 'name', 'unknown')
+                               for call in function_calls],
+            "input_tokens": getattr(usage, 'input_tokens', 0) or 0,
+            "output_tokens": getattr(usage, 'output_tokens', 0) or 0,
+            "cached_tokens": cached_input_tokens(usage) if usage else 0,
+            "elapsed_ms": round((time.time() - round_start) * 1000)
+        })
+        logger.info(f"🔁 [TOOL ROUND {round_number}] {len(function_calls)} function "
+                    "calls - Tokens: "
+                    f"{rounds[-1]['input_tokens']}+{rounds[-1]['output_tokens']} - "
+                    f"{rounds[-1]['elapsed_ms']}ms")
+
+        if not function_calls:
+            return response, rounds
+        if is_last_round:
+            logger.warning(f"🔁 [TOOL ROUND] Límite de {MAX_TOOL_ROUNDS} rondas "
+                           "alcanzado con herramientas pendientes")
+            return response, rounds
+
+        round_input = execute_function_calls(function_calls, assistant_number,
+                                             subscriber_id, thread_id, deadline)
+        previous_response_id = response.id
+
+    return response, rounds
 
 
 def clean_conversation_history(history):
@@ -277,6 +263,112 @@ def clean_conversation_history(history):
     return cleaned_history
 
 
+def build_full_input(assistant_content_text, messages_history, message,
+                     dynamic_context=None):
+    """
+    Input completo para Responses API: system prompt, historial limpio y mensaje actual
+
+    dynamic_context (valores de las variables del prompt) va justo antes del
+    mensaje actual: system prompt e historial quedan como prefijo cacheable.
+    """
+    # Agregar system message (OpenAI tiene caché automático del prefijo)
+    responses_input = [{
+        "role": "system",
+        "content": [{"type": "input_text", "text": assistant_content_text}]
+    }]
+
+    # Agregar historial limpio (sin tool calls) - user usa "input_text",
+    # assistant usa "output_text"
+    for hist_msg in clean_conversation_history(messages_history):
+        is_assistant = hist_msg["role"] == "assistant"
+        content_type = "output_text" if is_assistant else "input_text"
+        responses_input.append({
+            "role": hist_msg["role"],
+            "content": [{"type": content_type, "text": hist_msg["content"]}]
+        })
+
+    if dynamic_context:
+        responses_input.append({
+            "role": "system",
+            "content": [{"type": "input_text", "text": dynamic_context}]
+        })
+
+    # Agregar mensaje actual del usuario
+    responses_input.append({
+        "role": "user",
+        "content": [{"type": "input_text", "text": message}]
+    })
+    return responses_input
+
+
+def is_responses_turn_start(item):
+    """Un recorte del input puede empezar en un mensaje de usuario o de contexto"""
+    return isinstance(item, dict) and item.get("role") in ("user", "system")
+
+
+def last_assistant_reply(messages_history):
+    """Último texto del asistente en el historial (señal para elegir herramientas)"""
+    for index in range(len(messages_history) - 1, -1, -1):
+        entry = messages_history[index]
+        if (isinstance(entry, dict) and entry.get('role') == 'assistant'
+                and isinstance(entry.get('content'), str)):
+            return entry['content']
+    return None
+
+
+def cached_input_tokens(usage):
+    """Tokens de input servidos desde la caché (input_tokens_details.cached_tokens)"""
+    details = getattr(usage, 'input_tokens_details', None)
+    if details is None and isinstance(usage, dict):
+        details = usage.get('input_tokens_details')
+    if isinstance(details, dict):
+        return details.get('cached_tokens') or 0
+    return getattr(details, 'cached_tokens', 0) or 0
+
+
+def prompt_fingerprint(assistant_content_text, model_name):
+    """
+    Hash del prefijo estático del system prompt y del modelo de la cadena
+
+    La sección de variables ({{fecha_hora}}, ...) cambia en cada turno y se
+    envía aparte, así que no forma parte del hash ni invalida la cadena.
+    """
+    static_prompt, _ = split_prompt(assistant_content_text)
+    digest = hashlib.sha256(f"{model_name}\n{static_prompt}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def response_chain_status(conversation, history_length, fingerprint):
+    """
+    Determina si se puede continuar la cadena de OpenAI con previous_response_id
+
+    La cadena solo es válida si el historial local no cambió desde la última
+    respuesta (otro proveedor, cuota o turno fallido) y el prompt es el mismo.
+
+    Returns:
+        tuple: (puede continuar, motivo)
+    """
+    if not INCREMENTAL_INPUT_ENABLED:
+        return False, "modo incremental deshabilitado"
+    if not conversation.get("previous_response_id"):
+        return False, "sin previous_response_id"
+    if conversation.get("response_chain_length") != history_length:
+        return False, "historial modificado fuera de la cadena"
+    if conversation.get("prompt_hash") != fingerprint:
+        return False, "system prompt o modelo cambiaron"
+    return True, "cadena válida"
+
+
+def is_invalid_previous_response_error(error):
+    """Errores de OpenAI por un previous_response_id expirado, borrado o inexistente"""
+    if getattr(error, 'param', None) == 'previous_response_id':
+        return True
+    text = str(error).lower()
+    return getattr(error, 'status_code', None) in (400, 404) and (
+        'previous_response' in text or 'previous response' in text
+    )
+
+
 def get_model_parameters(model_name):
     """Obtiene los parámetros adecuados para cada modelo específico."""
     if model_name.lower().startswith("gpt-5"):
@@ -291,7 +383,9 @@ def get_model_parameters(model_name):
         }
 
 
-def call_openai_responses_api(client, input_messages, tools, model_name, thread_id, model_parameters, previous_response_id=None):
+def call_openai_responses_api(client, input_messages, tools, model_name, thread_id,
+                              model_parameters, previous_response_id=None,
+                              timeout=None, tool_choice=None, cache_key=None):
     """Llamada a OpenAI Responses API con MCP support y observabilidad."""
     logger.info(f"🔥 [RESPONSES API] Llamando OpenAI Responses API - Modelo: {model_name}")
     logger.info(f"🔥 [RESPONSES API] Input messages: {len(input_messages)}, Tools: {len(tools) if tools else 0}")
@@ -307,56 +401,32 @@ def call_openai_responses_api(client, input_messages, tools, model_name, thread_
     # Agregar previous_response_id si existe (para conversaciones)
     if previous_response_id:
         responses_payload["previous_response_id"] = previous_response_id
-        logger.info(f"🔥 [RESPONSES API] Using previous_response_id: {previous_response_id}")
+    
+    if tool_choice:
+        responses_payload["tool_choice"] = tool_choice
+
+    # Enruta las requests del mismo asistente a la misma caché de prefijos
+    if cache_key:
+        responses_payload["prompt_cache_key"] = cache_key
     
     try:
-        logger.info(f"🔥 [RESPONSES API] ===== PAYLOAD COMPLETO A OPENAI =====\n")
-        logger.info(f"🔥 [RESPONSES API] Payload keys: {list(responses_payload.keys())}")
-        logger.info(f"🔥 [RESPONSES API] Modelo: {responses_payload.get('model')}")
-        logger.info(f"🔥 [RESPONSES API] Temperature: {responses_payload.get('temperature')}")
-        logger.info(f"🔥 [RESPONSES API] Max tokens: {responses_payload.get('max_output_tokens')}")
-        logger.info(f"🔥 [RESPONSES API] Previous response ID: {responses_payload.get('previous_response_id')}")
-        
-        # Log completo del payload
-        logger.info(f"🔥 [RESPONSES API] PAYLOAD COMPLETO: {json.dumps(responses_payload, indent=2, ensure_ascii=False)}")
-        
-        logger.info(f"🔥 [RESPONSES API] Input messages count: {len(input_messages)}")
-        for i, msg in enumerate(input_messages):
-            role = msg.get("role", "unknown")
-            content = msg.get("content", [])
-            if content and isinstance(content, list) and len(content) > 0:
-                text_content = content[0].get("text", "") if isinstance(content[0], dict) else str(content[0])
-                content_preview = text_content[:50] + "..." if len(text_content) > 50 else text_content
-            else:
-                content_preview = str(content)[:50]
-            logger.info(f"🔥 [RESPONSES API] Input {i+1}: {role} = '{content_preview}'")
-        
-        # Logging detallado de tools
-        if tools:
-            logger.info(f"🔥 [RESPONSES API] ===== HERRAMIENTAS ENVIADAS ({len(tools)}) =====")
-            for i, tool in enumerate(tools):
-                logger.info(f"🔥 [RESPONSES API] Tool {i+1} COMPLETA: {json.dumps(tool, indent=2, ensure_ascii=False)}")
-                
-                tool_type = tool.get("type", "unknown")
-                if tool_type == "mcp":
-                    logger.info(f"🔥 [RESPONSES API] Tool {i+1}: MCP server '{tool.get('server_label')}' -> {tool.get('server_url')}")
-                    allowed_tools = tool.get('allowed_tools', [])
-                    logger.info(f"🔥 [RESPONSES API] Tool {i+1}: Herramientas permitidas ({len(allowed_tools)}): {allowed_tools}")
-                    logger.info(f"🔥 [RESPONSES API] Tool {i+1}: Require approval: {tool.get('require_approval')}")
-                else:
-                    logger.info(f"🔥 [RESPONSES API] Tool {i+1}: {tool_type}")
-            logger.info(f"🔥 [RESPONSES API] =======================================\n")
-        else:
-            logger.warning(f"🔥 [RESPONSES API] ❌ NO HAY HERRAMIENTAS CONFIGURADAS")
+        # Una línea compacta; el payload completo solo si el turno se captura
+        tool_labels = [tool.get("server_label") or tool.get("name") or tool.get("type")
+                       for tool in tools or []]
+        logger.info(f"🔥 [RESPONSES API] {model_name} - inputs: {len(input_messages)}, "
+                    f"tools: {tool_labels}, previous: {previous_response_id}, "
+                    f"tool_choice: {tool_choice}")
+        debug_capture.record("openai_request", lambda: responses_payload)
         
-        logger.info(f"🔥 [RESPONSES API] ===========================================\n")
-        
-        response = client.responses.create(**responses_payload)
-        logger.info(f"🔥 [RESPONSES API] Respuesta recibida exitosamente")
-        logger.info(f"🔥 [RESPONSES API] Response ID: {response.id}")
-        logger.info(f"🔥 [RESPONSES API] Output text length: {len(response.output_text) if hasattr(response, 'output_text') else 'No output_text'}")
-        if hasattr(response, 'output_text') and response.output_text:
-            logger.info(f"🔥 [RESPONSES API] Output preview: '{response.output_text[:200]}...'")
+        # El plazo de la ronda es una opción de la petición, no parte del payload
+        request_options = {"timeout": timeout} if timeout else {}
+        response = client.responses.create(**responses_payload, **request_options)
+        logger.info(f"🔥 [RESPONSES API] Respuesta {response.id} - output_text: "
+                    f"{len(getattr(response, 'output_text', '') or '')} chars")
+        debug_capture.record("openai_response", lambda: response)
+        # Listas de herramientas que OpenAI importó de los
+        # servidores MCP (para allowed_tools)
+        mcp_tool_cache.update_from_response(response)
             
     except Exception as api_error:
         # Manejo específico de errores 400 relacionados con tool_calls
@@ -364,7 +434,7 @@ def call_openai_responses_api(client, input_messages, tools, model_name, thread_
         if "400" in error_str and "tool_call" in error_str:
             logger.error(f"🔥 [RESPONSES API ERROR 400] Error de tool_call detectado: {error_str}")
             logger.error(f"🔥 [RESPONSES API ERROR 400] Este error indica uso incorrecto de 'tool_call' en input")
-            logger.error(f"🔥 [RESPONSES API ERROR 400] Payload problemático: {json.dumps(responses_payload, indent=2)}")
+            debug_capture.record("openai_request_error", lambda: responses_payload)
             raise ValueError(f"Error en formato de tool_calls para OpenAI Responses API: {error_str}")
         else:
             logger.error(f"🔥 [RESPONSES API ERROR] Error en llamada OpenAI: {str(api_error)}")
@@ -373,15 +443,18 @@ def call_openai_responses_api(client, input_messages, tools, model_name, thread_
     # Logging de caché automático de OpenAI
     if hasattr(response, 'usage') and response.usage:
         usage = response.usage
-        # OpenAI reporta tokens cacheados en cached_tokens
-        cached_tokens = getattr(usage, 'cached_tokens', 0)
-        total_input_tokens = getattr(usage, 'input_tokens', getattr(usage, 'prompt_tokens', 0))
+        # OpenAI reporta tokens cacheados en input_tokens_details.cached_tokens
+        cached_tokens = cached_input_tokens(usage)
+        total_input_tokens = getattr(usage, 'input_tokens',
+                                     getattr(usage, 'prompt_tokens', 0)) or 0
+        prompt_cache_stats.record(model_name, total_input_tokens, cached_tokens)
         
         if cached_tokens > 0:
             cache_hit_rate = (cached_tokens / total_input_tokens * 100) if total_input_tokens > 0 else 0
             savings = cached_tokens * 0.5  # 50% descuento en tokens cacheados
             logger.info(f"💰 [OPENAI CACHE] ✅ Cache automático activo: {cached_tokens}/{total_input_tokens} tokens ({cache_hit_rate:.1f}%)")
-            logger.info(f"💰 [OPENAI SAVINGS] 50% descuento aplicado a {cached_tokens} tokens cacheados")
+            logger.info(f"💰 [OPENAI SAVINGS] 50% descuento aplicado a {cached_tokens} "
+                        f"tokens cacheados (≈{savings:.0f} tokens de input ahorrados)")
         else:
             logger.info(f"💰 [OPENAI CACHE] ❌ Sin tokens cacheados en esta llamada")
             if total_input_tokens < 1024:
@@ -389,12 +462,9 @@ def call_openai_responses_api(client, input_messages, tools, model_name, thread_
     else:
         logger.info(f"💰 [OPENAI CACHE] ❓ Sin información de usage disponible")
 
-    # Langfuse tracking now handled manually in parent function
-
     return response
 
 
-@observe(as_type="generation")
 def generate_response_openai_mcp(
     message,
     assistant_content_text,
@@ -403,9 +473,11 @@ def generate_response_openai_mcp(
     subscriber_id,
     llm_id=None,
     conversation_manager=None,
-    thread_locks=None,
+    lock_manager=None,
     mcp_servers=None,
-    assistant_number=None
+    assistant_number=None,
+    deadline=None,
+    turn_metadata=None
 ):
     """Genera respuesta usando TEST MÍNIMO SIMPLIFICADO."""
     
@@ -415,28 +487,34 @@ def generate_response_openai_mcp(
     logger.info(f"🚀 [HANDLER START] Iniciando Responses API - User: {subscriber_id}, Thread: {thread_id}, Modelo: {llm_id}")
     logger.info(f"🚀 [HANDLER START] Mensaje del usuario: {message[:100]}...")
     
-    # Capturar input y metadata para Langfuse
-    langfuse.update_current_trace(
-        input=message,  # Solo el mensaje del usuario
-        metadata={
-            "model": llm_id,
-            "assistant_number": assistant_number,
-            "mcp_servers_count": len(mcp_servers) if mcp_servers else 0,
-            "thread_id": thread_id,
-            "subscriber_id": subscriber_id
-        }
-    )
-
     logger.info("Intentando adquirir lock para thread_id (OpenAI MCP): %s", thread_id)
-    lock = thread_locks.get(thread_id)
-    if not lock:
-        logger.error("No se encontró lock para thread_id (OpenAI MCP): %s", thread_id)
-        thread_locks[thread_id] = threading.Lock()
-        lock = thread_locks[thread_id]
+    lock_timeout = max(0.0, deadline - time.time()) if deadline else None
+    lock = lock_manager.acquire(thread_id, timeout=lock_timeout, owner=subscriber_id)
+    if lock is None:
+        # El endpoint reporta el timeout al vencer el mismo plazo
+        logger.error("No se pudo adquirir lock para thread_id (OpenAI "
+                     "MCP) %s antes del plazo", thread_id)
+        return
 
     with lock:
         logger.info("Lock adquirido para thread_id (OpenAI MCP): %s", thread_id)
         start_time = time.time()
+        # Payloads completos solo si el turno está muestreado o
+        # activado por /admin/debug
+        debug_capture.begin_turn(thread_id, subscriber_id)
+        # Traza del turno (muestreada); se encola al final sin esperar a Langfuse
+        tracer.start_trace(
+            "generate_response_openai_mcp", thread_id, subscriber_id,
+            input=message,  # Solo el mensaje del usuario
+            metadata={
+                "model": llm_id,
+                "assistant_number": assistant_number,
+                "mcp_servers_count": len(mcp_servers) if mcp_servers else 0
+            }
+        )
+
+        # Unidad de trabajo del turno: una sola escritura del historial al final
+        uow = conversation_manager.unit_of_work(thread_id)
 
         try:
             api_key = os.environ.get("OPENAI_API_KEY")
@@ -448,400 +526,238 @@ def generate_response_openai_mcp(
             conversation = conversation_manager.get(thread_id)
             if not conversation:
                 logger.error(f"Conversación {thread_id} no encontrada")
-                conversation_manager.set(thread_id, {
-                    "status": "error",
-                    "response": "Conversación no encontrada",
-                    "messages": []
-                })
+                uow.fail("Conversación no encontrada", {"messages": []})
                 return
 
-            client = OpenAI(api_key=api_key)
+            uow.begin(conversation, turn_metadata)
 
-            # ===== OBTENER HISTORIAL REAL DE LA CONVERSACIÓN =====
-            messages_history = conversation.get("messages", [])
-            
-            # Construir input para Responses API: formato diferente
-            responses_input = []
-            
-            # Agregar system message (OpenAI tiene caché automático)
-            responses_input.append({
-                "role": "system", 
-                "content": [{
-                    "type": "input_text", 
-                    "text": assistant_content_text
-                }]
-            })
-            
-            # Agregar historial limpio (sin tool calls) - convertir formato
-            if messages_history:
-                cleaned_history = clean_conversation_history(messages_history)
-                for hist_msg in cleaned_history:
-                    # Para Responses API: user usa "input_text", assistant usa "output_text"
-                    if hist_msg["role"] == "user":
-                        content_type = "input_text"
-                    elif hist_msg["role"] == "assistant":
-                        content_type = "output_text"
-                    else:
-                        content_type = "input_text"  # Fallback para otros roles
-                    
-                    responses_input.append({
-                        "role": hist_msg["role"],
-                        "content": [{"type": content_type, "text": hist_msg["content"]}]
-                    })
-                logger.info(f"🔄 [HISTORY] Agregando {len(cleaned_history)} mensajes del historial")
-            
-            # Agregar mensaje actual del usuario
-            responses_input.append({
-                "role": "user", 
-                "content": [{"type": "input_text", "text": message}]
-            })
-            
-            logger.info(f"📝 [RESPONSES INPUT] Total input messages: {len(responses_input)}")
-            logger.info(f"📝 [RESPONSES INPUT] System: 1, Historial: {len(messages_history)}, Usuario actual: 1")
-            logger.info(f"📝 [RESPONSES INPUT] Mensaje usuario: '{message[:100]}...'")
-            logger.info(f"📝 [RESPONSES INPUT] System length: {len(assistant_content_text)} chars")
+            # Cliente compartido: reutiliza conexiones entre turnos
+            client = get_openai_client(api_key)
 
-            # ===== HABILITAR MCP: CARGAR HERRAMIENTAS =====
-            openai_tools = []
-            mcp_clients = []
-            
-            if mcp_servers:
-                logger.info("🛠️ [MCP TOOLS] Configurando servidores MCP para Responses API")
-                logger.info(f"🛠️ [MCP TOOLS] Total de servidores MCP a procesar: {len(mcp_servers)}")
-                
-                for i, mcp_server_info in enumerate(mcp_servers):
-                    mcp_config = mcp_server_info['config']
-                    mcp_number = mcp_server_info['number']
-                    
-                    logger.info(f"🛠️ [MCP SERVER #{i+1}] Procesando MCP #{mcp_number}")
-                    logger.info(f"🛠️ [MCP SERVER #{i+1}] Config: {mcp_config}")
-                    
-                    # Para Responses API: agregar servidor MCP directamente
-                    mcp_server_config = {
-                        "type": "mcp",
-                        "server_url": mcp_config["server_url"],
-                        "server_label": mcp_config["server_label"],
-                        "require_approval": mcp_config.get("require_approval", "never")
-                    }
-                    
-                    logger.info(f"🛠️ [MCP SERVER #{i+1}] Configuración base MCP: {mcp_server_config}")
-                    
-                    # MCP servers tienen acceso completo sin restricciones
-                    logger.info(f"🛠️ [MCP SERVER #{i+1}] Configurando servidor MCP sin restricciones de herramientas")
-                    
-                    openai_tools.append(mcp_server_config)
-                    logger.info(f"🛠️ [MCP SERVER #{i+1}] ✅ Servidor MCP agregado: {mcp_config['server_label']} -> {mcp_config['server_url']}")
-                    logger.info(f"🛠️ [MCP SERVER #{i+1}] Configuración MCP: {mcp_server_config}")
+            # ===== OBTENER HISTORIAL REAL DE LA CONVERSACIÓN =====
+            messages_history = ConversationHistory.of(conversation.get("messages"))
+            
+            # Construir input para Responses API: incremental si la
+            # cadena de OpenAI sigue válida
+            # Prefijo estático (cacheable) y valores de variables
+            # que cambian en cada request
+            static_prompt, dynamic_context = split_prompt(assistant_content_text)
+            full_input = build_full_input(static_prompt, messages_history, message,
+                                          dynamic_context)
+            fingerprint = prompt_fingerprint(static_prompt, llm_id)
+            cache_key = prompt_cache_key(assistant_number, static_prompt)
+            incremental, chain_reason = response_chain_status(
+                conversation, len(messages_history), fingerprint)
+
+            if incremental:
+                # OpenAI ya tiene system prompt e historial en la
+                # cadena: solo lo nuevo del turno
+                new_items = 2 if dynamic_context else 1
+                previous_response_id = conversation.get("previous_response_id")
+                responses_input = full_input[-new_items:]
+                tokens_saved = token_counter.count_messages(
+                    full_input[:-new_items], llm_id)
+                logger.info("🔄 [HISTORY] Modo incremental sobre "
+                            f"{previous_response_id} - ~{tokens_saved} tokens omitidos")
             else:
-                logger.info("🛠️ [MCP TOOLS] No hay servidores MCP configurados")
+                # Historial completo sin previous_response_id: OpenAI
+                # no concilia dos contextos
+                previous_response_id = None
+                responses_input = full_input
+                tokens_saved = 0
+                logger.info(f"🔄 [HISTORY] Input completo ({chain_reason}) - "
+                            f"{len(messages_history)} mensajes en el historial")
+            
+            logger.info(f"📝 [RESPONSES INPUT] Inputs: {len(responses_input)}, "
+                        f"Historial: {len(messages_history)}, Incremental: "
+                        f"{incremental}, System: {len(static_prompt)} chars "
+                        f"estáticos + {len(dynamic_context or '')} de variables, "
+                        f"cache_key: {cache_key}")
 
-            # Cargar herramientas function para este assistant
-            function_tools = load_function_tools_for_assistant(assistant_number)
-            if function_tools:
-                logger.info(f"🔧 [FUNCTION TOOLS] Agregando {len(function_tools)} herramientas function")
-                openai_tools.extend(function_tools)
-            else:
-                logger.info("🔧 [FUNCTION TOOLS] No hay herramientas function configuradas")
+            # ===== HABILITAR MCP: CARGAR HERRAMIENTAS =====
+            # Servidores MCP con allowed_tools y function tools
+            # relevantes para este turno
+            toolset = tool_registry.toolset(assistant_number)
+            openai_tools, tool_selection = select_tools(
+                toolset.openai,
+                [mcp_server_info['config'] for mcp_server_info in mcp_servers or []],
+                message,
+                previous_reply=last_assistant_reply(messages_history),
+                keywords=toolset.keywords,
+                always=toolset.always
+            )
+            tool_selection["schema_tokens_saved"] = token_counter.count_tools(
+                [toolset.by_name[name] for name in tool_selection["omitted"]], llm_id
+            )
+            logger.info("🧰 [TOOL SELECTION] Function tools "
+                        f"{tool_selection['function_tools']} "
+                        f"({tool_selection['function_reason']}), MCP allowed_tools: "
+                        f"{tool_selection['mcp_allowed_tools']}, "
+                        f"~{tool_selection['schema_tokens_saved']} tokens de "
+                        "esquemas omitidos")
 
-            logger.info(f"🛠️ [TOOLS SUMMARY] ===== RESUMEN FINAL =====\n")
-            logger.info(f"🛠️ [TOOLS SUMMARY] Total herramientas configuradas: {len(openai_tools)}")
-            
             mcp_count = sum(1 for tool in openai_tools if tool.get('type') == 'mcp')
             function_count = sum(1 for tool in openai_tools if tool.get('type') == 'function')
             
-            logger.info(f"🛠️ [TOOLS SUMMARY] Servidores MCP: {mcp_count}")
-            logger.info(f"🔧 [TOOLS SUMMARY] Herramientas Function: {function_count}")
-            
-            for i, tool_config in enumerate(openai_tools):
-                tool_type = tool_config.get('type', 'unknown')
-                if tool_type == 'mcp':
-                    logger.info(f"🛠️ [MCP #{i+1}] {tool_config.get('server_label', 'Sin etiqueta')} -> {tool_config.get('server_url', 'Sin URL')}")
-                elif tool_type == 'function':
-                    function_name = tool_config.get('name', tool_config.get('function', {}).get('name', 'Sin nombre'))
-                    logger.info(f"🔧 [FUNCTION #{i+1}] {function_name}")
-            
-            logger.info(f"🛠️ [TOOLS SUMMARY] ================================\n")
-            
             model_parameters = get_model_parameters(llm_id)
-            logger.info(f"🔧 [PARAMETERS] temperature={model_parameters['temperature']}, max_tokens={model_parameters['max_completion_tokens']}")
+
+            # ===== PRE-FLIGHT: TAMAÑO DEL REQUEST =====
+            # OpenAI factura y limita por el contexto completo
+            # (también en modo incremental)
+            budget = token_counter.input_budget(llm_id,
+                                                model_parameters['max_completion_tokens'])
+            fixed_tokens = (token_counter.count_tools(openai_tools, llm_id)
+                            + token_counter.count_message(full_input[0], llm_id))
+            history_tokens = token_counter.count_messages(full_input[1:], llm_id)
+            estimated_input_tokens = fixed_tokens + history_tokens
+            if estimated_input_tokens > budget:
+                # El historial más antiguo no cabe: se recorta antes de enviar, no
+                # tras un error de contexto
+                kept, dropped, kept_tokens = trim_messages(
+                    full_input[1:], budget - fixed_tokens, llm_id,
+                    is_responses_turn_start)
+                full_input = full_input[:1] + kept
+                estimated_input_tokens = fixed_tokens + kept_tokens
+                if incremental:
+                    # La cadena de OpenAI ya no cabe: se reinicia
+                    # con el historial recortado
+                    incremental, previous_response_id, tokens_saved = False, None, 0
+                responses_input = full_input
+            estimated_cost = None
+            if cost_calculator.get_model_info(llm_id):
+                estimated_cost = cost_calculator.calculate_cost(
+                    llm_id, estimated_input_tokens, 0)["input_cost"]
+            logger.info(f"📏 [PREFLIGHT] ~{estimated_input_tokens}/{budget} tokens "
+                        f"de input ({token_counter.backend}), costo de input "
+                        f"estimado: {estimated_cost}")
 
             # LLAMADA A RESPONSES API CON HERRAMIENTAS
-            logger.info(f"🔥 [RESPONSES API] Llamando Responses API con {len(openai_tools)} herramientas total ({mcp_count} MCP + {function_count} Function)")
-            
-            # Obtener previous_response_id si existe en el historial
-            previous_response_id = conversation.get("previous_response_id")
-            
-            # Crear generation manual para Langfuse
-            with langfuse.start_as_current_generation(
-                name="openai-responses-call",
+            logger.info(f"🛠️ [TOOLS] {mcp_count} MCP + {function_count} Function - "
+                        f"temperature={model_parameters['temperature']}, "
+                        f"max_tokens={model_parameters['max_completion_tokens']}")
+            
+            # Mismo camino para la primera llamada y las rondas de herramientas
+            generation_start = time.time()
+            round_args = (openai_tools, llm_id, thread_id, model_parameters,
+                          assistant_number)
+            try:
+                response, rounds = run_responses_rounds(
+                    client, responses_input, *round_args,
+                    previous_response_id=previous_response_id,
+                    subscriber_id=subscriber_id,
+                    deadline=deadline,
+                    cache_key=cache_key
+                )
+            except Exception as chain_error:
+                if not (incremental
+                        and is_invalid_previous_response_error(chain_error)):
+                    raise
+                # Respuesta expirada o inexistente en OpenAI: reintentar
+                # con el historial completo
+                logger.warning("🔄 [HISTORY] previous_response_id "
+                               f"{previous_response_id} inválido ({chain_error}) - "
+                               "reenviando historial completo")
+                incremental, previous_response_id, tokens_saved = False, None, 0
+                responses_input = full_input
+                response, rounds = run_responses_rounds(
+                    client, responses_input, *round_args,
+                    subscriber_id=subscriber_id,
+                    deadline=deadline,
+                    cache_key=cache_key
+                )
+
+            output_text = getattr(response, 'output_text', None) or ""
+
+            # Usage data
+            usage_data = {}
+            if hasattr(response, 'usage') and response.usage:
+                # Tokens acumulados de todas las rondas del turno
+                rounds_input = sum(r["input_tokens"] for r in rounds)
+                rounds_output = sum(r["output_tokens"] for r in rounds)
+                usage_data = {
+                    "input_tokens": rounds_input,
+                    "output_tokens": rounds_output,
+                    "total_tokens": rounds_input + rounds_output,
+                }
+
+                # Monitoreo de caché automático de OpenAI (todas las rondas)
+                cached_tokens = sum(r["cached_tokens"] for r in rounds)
+                if cached_tokens > 0:
+                    total_input = usage_data.get("input_tokens", 0)
+                    cache_rate = cached_tokens * 100 / total_input if total_input else 0
+                    logger.info(f"💰 [OPENAI CACHE FINAL] ✅ {cached_tokens} tokens "
+                                f"cacheados ({cache_rate:.1f}% del input)")
+                    logger.info("💰 [COST SAVINGS] 50% descuento en "
+                                f"{cached_tokens} tokens = "
+                                f"~${cached_tokens * 0.0000025:.6f} USD ahorrados")
+                    usage_data["cached_tokens"] = cached_tokens
+                else:
+                    logger.info(f"💰 [OPENAI CACHE FINAL] ❌ Sin caché automático "
+                                "aplicado")
+                    usage_data["cached_tokens"] = 0
+
+            # Generation en la traza del turno (se exporta en segundo plano)
+            tracer.generation(
+                "openai-responses-call",
                 model=llm_id,
                 input=responses_input,
+                output=output_text or "Sin respuesta",
+                usage=usage_data,
+                model_parameters=model_parameters,
+                start_time=generation_start,
                 metadata={
                     "api_type": "responses",
+                    "response_id": getattr(response, 'id', None),
                     "tools_count": len(openai_tools),
-                    "has_mcp": any(t.get("type") == "mcp" for t in openai_tools),
                     "mcp_servers": [t.get("server_label") for t in openai_tools if t.get("type") == "mcp"],
-                    "previous_response_id": previous_response_id
+                    "previous_response_id": previous_response_id,
+                    "incremental_input": incremental,
+                    "input_tokens_saved": tokens_saved,
+                    "tool_selection": tool_selection,
+                    "rounds": rounds
                 }
-            ) as generation:
-                response = call_openai_responses_api(
-                    client, 
-                    responses_input, 
-                    openai_tools, 
-                    llm_id, 
-                    thread_id, 
-                    model_parameters,
-                    previous_response_id
-                )
-                
-                # DEBUG: Response RAW completo de OpenAI
-                logger.info(f"🔥 [OPENAI RAW] ===== RESPONSE COMPLETO =====")
-                logger.info(f"🔥 [OPENAI RAW] Response object: {response}")
-                logger.info(f"🔥 [OPENAI RAW] Response type: {type(response)}")
-                logger.info(f"🔥 [OPENAI RAW] Response dict: {response.__dict__ if hasattr(response, '__dict__') else 'No dict'}")
-                logger.info(f"🔥 [OPENAI RAW] Atributos disponibles: {dir(response)}")
-                
-                # Verificar output_text
-                if hasattr(response, 'output_text'):
-                    logger.info(f"🔥 [OPENAI RAW] output_text existe: {repr(response.output_text)}")
-                else:
-                    logger.warning(f"🔥 [OPENAI RAW] ❌ NO TIENE output_text attribute")
-                
-                # Verificar choices (Chat Completions)
-                if hasattr(response, 'choices'):
-                    logger.info(f"🔥 [OPENAI RAW] choices: {response.choices}")
-                    if response.choices:
-                        for i, choice in enumerate(response.choices):
-                            logger.info(f"🔥 [OPENAI RAW] choice[{i}]: {choice}")
-                            logger.info(f"🔥 [OPENAI RAW] choice[{i}] dict: {choice.__dict__ if hasattr(choice, '__dict__') else 'No dict'}")
-                else:
-                    logger.info(f"🔥 [OPENAI RAW] No choices attribute")
-                
-                # Verificar tool_calls
-                if hasattr(response, 'tool_calls'):
-                    logger.info(f"🔥 [OPENAI RAW] tool_calls: {response.tool_calls}")
-                else:
-                    logger.info(f"🔥 [OPENAI RAW] No tool_calls attribute")
-                
-                # Verificar output para tool calls
-                if hasattr(response, 'output'):
-                    logger.info(f"🔥 [OPENAI RAW] output length: {len(response.output) if response.output else 0}")
-                    if response.output:
-                        for i, item in enumerate(response.output):
-                            logger.info(f"🔥 [OPENAI RAW] output[{i}]: {item}, type: {type(item)}")
-                            if hasattr(item, 'type'):
-                                logger.info(f"🔥 [OPENAI RAW] output[{i}].type: {item.type}")
-                else:
-                    logger.info(f"🔥 [OPENAI RAW] No output attribute")
-                
-                # Verificar finish_reason
-                if hasattr(response, 'finish_reason'):
-                    logger.info(f"🔥 [OPENAI RAW] finish_reason: {response.finish_reason}")
-                else:
-                    logger.info(f"🔥 [OPENAI RAW] No finish_reason attribute")
-                
-                # Verificar usage data
-                if hasattr(response, 'usage'):
-                    logger.info(f"🔥 [OPENAI RAW] usage: {response.usage}")
-                    logger.info(f"🔥 [OPENAI RAW] usage dict: {response.usage.__dict__ if hasattr(response.usage, '__dict__') else 'No dict'}")
-                else:
-                    logger.info(f"🔥 [OPENAI RAW] No usage attribute")
-                
-                logger.info(f"🔥 [OPENAI RAW] ===== FIN RESPONSE DEBUG =====\n")
-                
-                # ===== VERIFICAR SI HAY TOOL CALLS EN response.output =====
-                function_tool_calls = []
-                if hasattr(response, 'output') and response.output:
-                    logger.info(f"🔧 [TOOL CALLS] Analizando response.output para tool calls")
-                    logger.info(f"🔧 [TOOL CALLS] Elementos en response.output: {len(response.output)}")
-                    for i, item in enumerate(response.output):
-                        logger.info(f"🔧 [TOOL CALLS] Output item[{i}]: {item}, type: {type(item)}")
-                        logger.info(f"🔧 [TOOL CALLS] Output item[{i}] attributes: {dir(item) if hasattr(item, '__dict__') else 'No attributes'}")
-                        
-                        # Verificar si es un ResponseFunctionToolCall
-                        if hasattr(item, 'type') and item.type == 'function_call':
-                            function_tool_calls.append(item)
-                            logger.info(f"🔧 [TOOL CALLS] ✅ Found function_call: {item.name} with call_id: {item.call_id}")
-                            logger.info(f"🔧 [TOOL CALLS] ✅ Arguments: {item.arguments}")
-                        else:
-                            logger.info(f"🔧 [TOOL CALLS] ❌ Item[{i}] is not a function_call (type: {getattr(item, 'type', 'No type')})")
-                else:
-                    logger.info(f"🔧 [TOOL CALLS] No response.output disponible")
-                
-                if function_tool_calls:
-                    logger.info(f"🔧 [TOOL CALLS] ========== RESUMEN DE TOOL CALLS ==========")
-                    logger.info(f"🔧 [TOOL CALLS] Detectadas {len(function_tool_calls)} herramientas FUNCTION a ejecutar en response.output")
-                    for i, tool_call in enumerate(function_tool_calls):
-                        logger.info(f"🔧 [TOOL CALLS] Function Tool {i+1}: {tool_call.name} (call_id: {tool_call.call_id})")
-                    logger.info(f"🔧 [TOOL CALLS] =======================================")
-                    
-                    # Manejar SOLO Function tool calls (las que van a N8N)
-                    logger.info(f"🔧 [TOOL CALLS] Procesando Function tools via N8N bridge")
-                    
-                    response = handle_tool_calls_responses_api(
-                        client, response, responses_input, openai_tools, 
-                        llm_id, thread_id, model_parameters, assistant_number, 
-                        mcp_servers=mcp_servers, function_tool_calls=function_tool_calls,
-                        subscriber_id=subscriber_id
-                    )
-                    
-                    # Continuar con el response de la segunda llamada
-                    logger.info(f"🔧 [TOOL CALLS] ✅ Procesamiento de Function tools completado exitosamente")
-                    logger.info(f"🔧 [TOOL CALLS] Procesando respuesta final del modelo")
-                else:
-                    logger.info(f"🔧 [TOOL CALLS] ❌ No se encontraron Function tool calls - MCP tools se procesan automáticamente")
-                    logger.info(f"🔧 [TOOL CALLS] Continuando con respuesta normal (MCP automático)")
-                
-                # DEBUG: Análisis detallado del response para output
-                logger.info(f"📊 [OUTPUT DEBUG] === DEBUGGING OUTPUT PARA LANGFUSE ===")
-                logger.info(f"📊 [OUTPUT DEBUG] response object: {type(response)}")
-                logger.info(f"📊 [OUTPUT DEBUG] response attributes: {dir(response)}")
-                logger.info(f"📊 [OUTPUT DEBUG] hasattr output_text: {hasattr(response, 'output_text')}")
-                
-                output_text = ""
-                if hasattr(response, 'output_text'):
-                    raw_output = response.output_text
-                    logger.info(f"📊 [OUTPUT DEBUG] raw output_text: {repr(raw_output)}")
-                    logger.info(f"📊 [OUTPUT DEBUG] output_text type: {type(raw_output)}")
-                    logger.info(f"📊 [OUTPUT DEBUG] output_text is None: {raw_output is None}")
-                    logger.info(f"📊 [OUTPUT DEBUG] output_text == '': {raw_output == ''}")
-                    output_text = raw_output if raw_output is not None else ""
-                else:
-                    logger.error(f"📊 [OUTPUT DEBUG] response NO TIENE output_text attribute!")
-                
-                logger.info(f"📊 [OUTPUT DEBUG] final output_text: {repr(output_text)}")
-                logger.info(f"📊 [OUTPUT DEBUG] final output length: {len(output_text)}")
-                logger.info(f"📊 [OUTPUT DEBUG] === FIN DEBUG OUTPUT ===")
-                
-                # Usage data
-                usage_data = {}
-                if hasattr(response, 'usage') and response.usage:
-                    usage = response.usage
-                    usage_data = {
-                        "input_tokens": getattr(usage, 'input_tokens', getattr(usage, 'prompt_tokens', 0)),
-                        "output_tokens": getattr(usage, 'output_tokens', getattr(usage, 'completion_tokens', 0)),
-                        "total_tokens": getattr(usage, 'total_tokens', 0),
-                    }
-                    
-                    # Monitoreo de caché automático de OpenAI
-                    cached_tokens = getattr(usage, 'cached_tokens', 0)
-                    if cached_tokens > 0:
-                        total_input = usage_data.get("input_tokens", 0)
-                        cache_rate = (cached_tokens / total_input * 100) if total_input > 0 else 0
-                        logger.info(f"💰 [OPENAI CACHE FINAL] ✅ {cached_tokens} tokens cacheados ({cache_rate:.1f}% del input)")
-                        logger.info(f"💰 [COST SAVINGS] 50% descuento en {cached_tokens} tokens = ~${cached_tokens * 0.0000025:.6f} USD ahorrados")
-                        usage_data["cached_tokens"] = cached_tokens
-                    else:
-                        logger.info(f"💰 [OPENAI CACHE FINAL] ❌ Sin caché automático aplicado")
-                        usage_data["cached_tokens"] = 0
-                
-                # LANGFUSE UPDATE CORRECTO PARA FUNCIÓN DECORADA
-                try:
-                    logger.info(f"📊 [LANGFUSE] Actualizando generation con output...")
-                    simple_output = str(output_text) if output_text else "Sin respuesta"
-                    
-                    generation.update(
-                        output=simple_output,
-                        usage=usage_data,
-                        metadata={
-                            "response_id": getattr(response, 'id', None),
-                            "api_type": "responses",
-                            "output_length": len(simple_output),
-                            "function_name": "call_openai_responses_api"
-                        }
-                    )
-                    logger.info(f"📊 [LANGFUSE] ✅ Update exitoso - Output: {repr(simple_output[:50])}...")
-                    
-                except Exception as e:
-                    logger.error(f"📊 [LANGFUSE] ❌ Error en update: {str(e)}")
-                    
-                    # Fallback: solo metadata
-                    try:
-                        generation.update(
-                            usage=usage_data,
-                            metadata={
-                                "final_output": simple_output,
-                                "output_length": len(simple_output),
-                                "api_type": "responses",
-                                "error": "No se pudo enviar output directamente"
-                            }
-                        )
-                        logger.info(f"📊 [LANGFUSE] ✅ Fallback exitoso (output en metadata)")
-                    except Exception as fallback_error:
-                        logger.error(f"📊 [LANGFUSE] ❌ Fallback también falló: {str(fallback_error)}")
-
-            # ===== LOGGING GRANULAR DEL RESPONSE =====
-            logger.info("🔍 [RESPONSE DEBUG] Analizando respuesta de Responses API:")
-            logger.info(f"🔍 [RESPONSE DEBUG] Response object type: {type(response)}")
-            logger.info(f"🔍 [RESPONSE DEBUG] Response ID: {getattr(response, 'id', 'No ID')}")
-            logger.info(f"🔍 [RESPONSE DEBUG] Has output_text: {hasattr(response, 'output_text')}")
-            
-            if hasattr(response, 'output_text'):
-                output_text = response.output_text
-                logger.info(f"🔍 [RESPONSE DEBUG] Output text type: {type(output_text)}")
-                logger.info(f"🔍 [RESPONSE DEBUG] Output text length: {len(output_text) if output_text else 'None'}")
-                logger.info(f"🔍 [RESPONSE DEBUG] Output text preview: '{str(output_text)[:200]}...'")
-            else:
-                logger.error("🔍 [RESPONSE DEBUG] NO output_text EN RESPONSE!")
-            
+            )
+
             # ===== MANEJAR RESPONSE DE RESPONSES API =====
             total_input_tokens = 0
             total_output_tokens = 0
             final_text = ""
             
-            # Extraer usage de Responses API
-            if hasattr(response, 'usage') and response.usage:
-                total_input_tokens = getattr(response.usage, 'input_tokens', 0)
-                total_output_tokens = getattr(response.usage, 'output_tokens', 0)
-                logger.info(f"📊 [USAGE] Input tokens: {total_input_tokens}, Output tokens: {total_output_tokens}")
+            # Extraer usage de Responses API: suma de todas las rondas
+            total_input_tokens = sum(r["input_tokens"] for r in rounds)
+            total_output_tokens = sum(r["output_tokens"] for r in rounds)
+            logger.info(f"📊 [USAGE] Input tokens: {total_input_tokens}, Output "
+                        f"tokens: {total_output_tokens}, Rondas: {len(rounds)}")
             
             # En Responses API, el texto final ya viene procesado con MCP
             if hasattr(response, 'output_text') and response.output_text:
                 final_text = response.output_text
-                logger.info(f"🎯 [FINAL RESPONSE] Respuesta de Responses API: '{final_text[:200]}...'")
+                logger.info(f"🎯 [FINAL RESPONSE] {response.id} - "
+                            f"{len(final_text)} chars")
             else:
                 final_text = ""
                 logger.warning(f"🎯 [FINAL RESPONSE] No se encontró output_text en la respuesta")
             
-            logger.info(f"🎯 [RESPONSE] Length: {len(final_text)}")
-            logger.info(f"📊 [TOKENS] Total - Input: {total_input_tokens}, Output: {total_output_tokens}")
-            
-            # ===== LANGFUSE UPDATE PARA GENERATE_RESPONSE_OPENAI_MCP (MISMA LÓGICA QUE INPUT) =====
-            try:
-                logger.info(f"📊 [LANGFUSE MCP] Actualizando observación con output...")
-                
-                # Usar la misma lógica que funciona para el input
-                langfuse.update_current_observation(
-                    output=final_text,  # La respuesta final
-                    usage={
+            tracer.update_trace(
+                output=final_text,  # La respuesta final
+                metadata={
+                    "usage": {
                         "input_tokens": total_input_tokens,
                         "output_tokens": total_output_tokens,
                         "total_tokens": total_input_tokens + total_output_tokens
                     },
-                    metadata={
-                        "model": llm_id,
-                        "assistant_number": assistant_number,
-                        "mcp_servers_count": len(mcp_servers) if mcp_servers else 0,
-                        "thread_id": thread_id,
-                        "subscriber_id": subscriber_id,
-                        "api_type": "responses",
-                        "function_name": "generate_response_openai_mcp",
-                        "response_id": getattr(response, 'id', None),
-                        "output_length": len(final_text)
-                    }
-                )
-                
-                logger.info(f"📊 [LANGFUSE MCP] ✅ Observación actualizada exitosamente")
-                logger.info(f"📊 [LANGFUSE MCP] Output enviado: {repr(final_text[:50])}...")
-                
-            except Exception as langfuse_error:
-                logger.error(f"📊 [LANGFUSE MCP] ❌ Error en update_current_observation: {str(langfuse_error)}")
-                logger.error(f"📊 [LANGFUSE MCP] ❌ Exception details: {type(langfuse_error).__name__}: {str(langfuse_error)}")
-            
+                    "response_id": getattr(response, 'id', None),
+                    "output_length": len(final_text)
+                }
+            )
+
             # ===== GUARDAR RESULTADO FINAL =====
-            current_history = conversation.get("messages", [])
-            current_history.append({"role": "user", "content": message})
-            current_history.append({"role": "assistant", "content": final_text})
+            # Nueva versión del historial: los lectores siguen viendo
+            # el turno anterior completo
+            current_history = messages_history.extend([
+                {"role": "user", "content": message},
+                {"role": "assistant", "content": final_text}
+            ])
             
             # Guardar response_id para conversaciones continuadas
             update_data = {
@@ -852,46 +768,49 @@ def generate_response_openai_mcp(
                     "input_tokens": total_input_tokens,
                     "output_tokens": total_output_tokens,
                     "cache_creation_input_tokens": 0,
-                    "cache_read_input_tokens": 0,
+                    "cache_read_input_tokens": sum(r["cached_tokens"] for r in rounds),
+                    "input_tokens_saved": tokens_saved,
+                    "estimated_input_tokens": estimated_input_tokens,
+                    "rounds": len(rounds),
                 },
             }
-            
-            # Agregar response_id si está disponible
-            if hasattr(response, 'id') and response.id:
+            if incremental:
+                logger.info(f"💰 [INCREMENTAL] ~{tokens_saved} tokens de historial no "
+                            "reenviados en este turno")
+            
+            # Agregar response_id si está disponible, con el
+            # estado que valida la cadena.
+            # Una respuesta con function_calls sin resultado no se puede continuar.
+            pending_calls = any(getattr(item, 'type', None) == 'function_call'
+                                for item in (getattr(response, 'output', None) or []))
+            if hasattr(response, 'id') and response.id and not pending_calls:
                 update_data["previous_response_id"] = response.id
+                update_data["response_chain_length"] = len(current_history)
+                update_data["prompt_hash"] = fingerprint
                 logger.info(f"💾 [SAVE] Guardando response_id para próxima conversación: {response.id}")
             
-            # FLUSH LANGFUSE ANTES DE GUARDAR
-            try:
-                from langfuse import Langfuse
-                langfuse_instance = Langfuse()
-                langfuse_instance.flush()
-                logger.info(f"📊 [LANGFUSE] ✅ Flush manual ejecutado exitosamente")
-            except Exception as flush_error:
-                logger.error(f"📊 [LANGFUSE] ❌ Error en flush manual: {str(flush_error)}")
-            
             # Validar que tenemos texto final antes de marcar como completado
             if final_text and final_text.strip():
                 update_data["status"] = "completed"
-                conversation_manager.update(thread_id, update_data)
-                logger.info(f"✅ [COMPLETED] OpenAI MCP handler completado exitosamente con respuesta: '{final_text[:100]}...'")
+                uow.commit(update_data)
+                logger.info("✅ [COMPLETED] OpenAI MCP handler completado - "
+                            f"{len(final_text)} chars")
             else:
                 # Sin texto final válido - marcar como error
-                conversation_manager.update(thread_id, {
-                    "response": "No se pudo generar una respuesta final válida",
-                    "status": "error",
-                    "messages": current_history
-                })
+                uow.fail("No se pudo generar una respuesta final válida",
+                         {"messages": current_history})
                 logger.warning(f"⚠️ [NO OUTPUT] Handler completado pero sin texto final válido")
                 
         except Exception as e:
             logger.exception("🧪 [MINIMAL TEST] ❌ Error en test mínimo: %s", e)
-            conversation_manager.update(thread_id, {
-                "response": f"Error en test mínimo: {str(e)}",
-                "status": "error",
-                "messages": [{"role": "user", "content": message}]
-            })
+            tracer.update_trace(metadata={"error": str(e)})
+            # El historial almacenado se conserva: solo se marca el turno como error
+            uow.fail(f"Error en test mínimo: {str(e)}")
         finally:
+            # Garantiza un estado terminal aunque el turno no haya hecho commit
+            uow.close()
+            debug_capture.end_turn()
+            tracer.end_trace()
             # MOVER event.set() al final - solo después de guardar estado final
             event.set()
             elapsed_time = time.time() - start_time
@@ -0,0 +1,114 @@
+"""
+Prompt Cache - Ensamblado del prompt pensando en la caché del proveedor
+Las cachés de OpenAI y Anthropic reutilizan el prefijo idéntico más largo del
+prompt. Las variables ({{fecha_hora}}, {{name}}, ...) cambian en cada request,
+así que el prompt se arma con un prefijo estático byte a byte (la plantilla con
+referencias [variable]) y los valores al final, en una sección que los handlers
+pueden enviar después del historial. También lleva la cuenta de tokens
+cacheados por modelo para verificar el ahorro.
+"""
+
+import os
+import re
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# false = sustitución en línea como antes (el prefijo cambia en cada request)
+PROMPT_CACHE_LAYOUT = os.getenv('PROMPT_CACHE_LAYOUT', 'true').lower() == 'true'
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{(\w+)\}\}')
+
+# Separa el prefijo estático de los valores de las variables
+DYNAMIC_SECTION_TITLE = "## VARIABLES DE LA CONVERSACIÓN"
+DYNAMIC_SECTION_HEADER = (f"\n\n{DYNAMIC_SECTION_TITLE}\n"
+                          "Valores de las referencias [variable] del prompt:\n")
+
+
+def render_prompt(template: str, variables: Dict[str, Any]) -> str:
+    """
+    Sustituye las variables de la plantilla del asistente
+
+    Con PROMPT_CACHE_LAYOUT cada {{variable}} queda como [variable] en el
+    prefijo y sus valores se agregan al final, en el orden de aparición.
+    """
+    if not PROMPT_CACHE_LAYOUT:
+        return PLACEHOLDER_PATTERN.sub(
+            lambda match: str(variables.get(match.group(1), "[UNDEFINED]")), template
+        )
+
+    used = []
+
+    def reference(match):
+        key = match.group(1)
+        if key not in used:
+            used.append(key)
+        return f"[{key}]"
+
+    static = PLACEHOLDER_PATTERN.sub(reference, template)
+    if not used:
+        return static
+    values = "\n".join(f"- {key}: {variables.get(key, '[UNDEFINED]')}" for key in used)
+    logger.debug("Variables del prompt movidas al final: %s", used)
+    return static.rstrip() + DYNAMIC_SECTION_HEADER + values
+
+
+def split_prompt(prompt: str) -> Tuple[str, Optional[str]]:
+    """
+    Separa el prompt en prefijo estático y sección de variables
+
+    Returns:
+        tuple: (prefijo estático, sección de variables o None si no hay)
+    """
+    static, header, values = prompt.partition(DYNAMIC_SECTION_HEADER)
+    if not header:
+        return prompt, None
+    return static, DYNAMIC_SECTION_HEADER.lstrip() + values
+
+
+def prompt_cache_key(assistant_number: Any, static_prompt: str) -> str:
+    """Clave estable por asistente; cambia solo si cambia la plantilla"""
+    digest = hashlib.sha256(static_prompt.encode('utf-8')).hexdigest()[:12]
+    return f"assistant-{assistant_number}-{digest}"
+
+
+class PromptCacheStats:
+    """Tokens de input y tokens cacheados por modelo"""
+
+    def __init__(self):
+        self._models: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, input_tokens: int, cached_tokens: int,
+               cache_write_tokens: int = 0) -> None:
+        """input_tokens incluye los cacheados y los escritos en caché (Anthropic)"""
+        with self._lock:
+            stats = self._models.setdefault(model, {"requests": 0, "hits": 0,
+                                                    "input_tokens": 0,
+                                                    "cached_tokens": 0,
+                                                    "cache_write_tokens": 0})
+            stats["requests"] += 1
+            stats["hits"] += int(cached_tokens > 0)
+            stats["input_tokens"] += input_tokens
+            stats["cached_tokens"] += cached_tokens
+            stats["cache_write_tokens"] += cache_write_tokens
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                model: dict(stats, cached_ratio=round(stats["cached_tokens"]
+                                                      / stats["input_tokens"], 4)
+                            if stats["input_tokens"] else 0.0)
+                for model, stats in self._models.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._models.clear()
+
+
+# Estadísticas compartidas por los handlers
+prompt_cache_stats = PromptCacheStats()
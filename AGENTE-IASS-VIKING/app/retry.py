@@ -0,0 +1,282 @@
+"""
+Retry - Reintentos compartidos para las llamadas a proveedores LLM
+Solo se reintentan los errores transitorios (429, 5xx, timeouts y fallos de
+conexión); un 400/401 falla de inmediato. La espera respeta Retry-After o usa
+backoff exponencial con jitter completo, nunca pasa del plazo del turno, y un
+presupuesto de reintentos por proceso evita que los reintentos multipliquen la
+carga cuando el proveedor está caído.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Intentos totales por llamada (el primero incluido)
+LLM_RETRY_MAX_ATTEMPTS = int(os.getenv('LLM_RETRY_MAX_ATTEMPTS', 3))
+# Backoff: espera aleatoria entre 0 y base * 2^reintento (con tope)
+LLM_RETRY_BASE_DELAY_SECONDS = float(os.getenv('LLM_RETRY_BASE_DELAY_SECONDS', 1))
+LLM_RETRY_MAX_DELAY_SECONDS = float(os.getenv('LLM_RETRY_MAX_DELAY_SECONDS', 20))
+# Un Retry-After mayor que esto no se espera: el error se propaga
+LLM_RETRY_AFTER_MAX_SECONDS = float(os.getenv('LLM_RETRY_AFTER_MAX_SECONDS', 30))
+# Presupuesto: reintentos permitidos en la ventana = mínimo + proporción de llamadas
+LLM_RETRY_BUDGET_RATIO = float(os.getenv('LLM_RETRY_BUDGET_RATIO', 0.2))
+LLM_RETRY_BUDGET_MIN = int(os.getenv('LLM_RETRY_BUDGET_MIN', 10))
+LLM_RETRY_BUDGET_WINDOW_SECONDS = float(
+    os.getenv('LLM_RETRY_BUDGET_WINDOW_SECONDS', 60)
+)
+
+# 409/529: conflicto temporal de OpenAI y "overloaded" de Anthropic
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504, 529})
+# 429 que no se resuelven esperando
+TERMINAL_MARKERS = ("insufficient_quota", "billing")
+# Excepciones transitorias de httpx, requests y los SDK (por nombre, sin importarlos)
+RETRYABLE_EXCEPTIONS = frozenset({
+    "APITimeoutError", "APIConnectionError", "TimeoutException", "ConnectError",
+    "ReadError",
+    "WriteError", "RemoteProtocolError", "Timeout", "ReadTimeout", "ConnectTimeout",
+    "ChunkedEncodingError",
+})
+
+
+class ProviderHTTPError(Exception):
+    """Respuesta HTTP de error de un proveedor llamado sin SDK (p. ej. Gemini)"""
+
+    def __init__(self, status_code: int, message: str,
+                 headers: Optional[Dict[str, str]] = None):
+        super().__init__(f"Error de API: {status_code} - {message}")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    for source in (error, getattr(error, 'response', None)):
+        for attribute in ('status_code', 'code', 'status'):
+            value = getattr(source, attribute, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def _headers(error: BaseException) -> Dict[str, str]:
+    headers = getattr(error, 'headers', None)
+    if not headers:
+        headers = getattr(getattr(error, 'response', None), 'headers', None)
+    try:
+        return {str(key).lower(): value for key, value in dict(headers or {}).items()}
+    except (TypeError, ValueError):
+        return {}
+
+
+def parse_retry_after(headers: Dict[str, str]) -> Optional[float]:
+    """Segundos indicados por retry-after-ms o Retry-After (segundos o fecha HTTP)"""
+    value = headers.get('retry-after-ms')
+    if value is not None:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error: BaseException) -> Tuple[bool, str, Optional[float]]:
+    """
+    Clasifica un error de una llamada a proveedor
+
+    Returns:
+        tuple: (reintentable, motivo, segundos de Retry-After o None)
+    """
+    status = _status_code(error)
+    if status is not None:
+        if status not in RETRYABLE_STATUS:
+            return False, f"http_{status}", None
+        if any(marker in str(error) for marker in TERMINAL_MARKERS):
+            return False, f"http_{status}_quota", None
+        return True, f"http_{status}", parse_retry_after(_headers(error))
+
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & RETRYABLE_EXCEPTIONS or isinstance(error,
+                                                  (TimeoutError, ConnectionError)):
+        return True, type(error).__name__, None
+    return False, type(error).__name__, None
+
+
+class RetryBudget:
+    """
+    Presupuesto de reintentos por proceso en una ventana deslizante
+
+    Cada llamada suma ``ratio`` reintentos permitidos; con el proveedor caído
+    los reintentos se cortan al agotarse y la carga extra queda acotada.
+    """
+
+    def __init__(self, ratio: float = LLM_RETRY_BUDGET_RATIO,
+                 min_retries: int = LLM_RETRY_BUDGET_MIN,
+                 window_seconds: float = LLM_RETRY_BUDGET_WINDOW_SECONDS):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window_seconds = window_seconds
+        self._calls = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float) -> None:
+        for timestamps in (self._calls, self._retries):
+            while timestamps and now - timestamps[0] > self.window_seconds:
+                timestamps.popleft()
+
+    def record_call(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            self._calls.append(now)
+
+    def try_acquire(self) -> bool:
+        """Reserva un reintento si queda presupuesto"""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            if len(self._retries) >= self.min_retries + self.ratio * len(self._calls):
+                return False
+            self._retries.append(now)
+            return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._prune(time.monotonic())
+            return {
+                "calls_in_window": len(self._calls),
+                "retries_in_window": len(self._retries),
+                "allowed_in_window": int(self.min_retries
+                                         + self.ratio * len(self._calls))
+            }
+
+
+class RetryEngine:
+    """
+    Ejecuta llamadas con reintentos clasificados
+
+    Args:
+        max_attempts: Intentos totales por llamada
+        base_delay: Base del backoff exponencial
+        max_delay: Tope de una espera de backoff
+        budget: Presupuesto de reintentos compartido
+        sleep: Función de espera (inyectable en pruebas)
+    """
+
+    def __init__(self, max_attempts: int = LLM_RETRY_MAX_ATTEMPTS,
+                 base_delay: float = LLM_RETRY_BASE_DELAY_SECONDS,
+                 max_delay: float = LLM_RETRY_MAX_DELAY_SECONDS,
+                 budget: Optional[RetryBudget] = None,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self._sleep = sleep
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, operation: str, key: str) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(operation, {
+                "calls": 0, "retries": 0, "succeeded_after_retry": 0,
+                "terminal": 0, "exhausted": 0, "budget_exhausted": 0, "deadline": 0
+            })
+            stats[key] += 1
+
+    def backoff(self, retry_number: int) -> float:
+        """Jitter completo: aleatorio entre 0 y base * 2^reintento"""
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * (2 ** retry_number)))
+
+    def call(self, func: Callable[[], Any], operation: str,
+             deadline: Optional[float] = None) -> Any:
+        """
+        Ejecuta ``func`` reintentando solo errores transitorios
+
+        Args:
+            func: Llamada sin argumentos (recalcula su timeout con el plazo si aplica)
+            operation: Nombre para logs y estadísticas ("openai", "anthropic", ...)
+            deadline: Plazo absoluto del turno (time.time()); no se espera más allá
+        """
+        self._count(operation, "calls")
+        self.budget.record_call()
+        attempt = 1
+        while True:
+            try:
+                result = func()
+                if attempt > 1:
+                    self._count(operation, "succeeded_after_retry")
+                return result
+            except Exception as e:
+                retryable, reason, retry_after = classify_error(e)
+                if not retryable:
+                    self._count(operation, "terminal")
+                    raise
+                if attempt >= self.max_attempts:
+                    self._count(operation, "exhausted")
+                    logger.error(f"♻️ [RETRY] {operation}: error definitivo tras "
+                                 f"{attempt} intentos ({reason}): {e}")
+                    raise
+                if (retry_after or 0) > LLM_RETRY_AFTER_MAX_SECONDS:
+                    self._count(operation, "exhausted")
+                    logger.error(f"♻️ [RETRY] {operation}: Retry-After de "
+                                 f"{retry_after:.0f}s excede el máximo ({reason})")
+                    raise
+
+                wait = retry_after if retry_after is not None else self.backoff(attempt)
+                if deadline and time.time() + wait >= deadline:
+                    self._count(operation, "deadline")
+                    logger.warning(f"♻️ [RETRY] {operation}: sin tiempo para reintentar "
+                                   f"({reason}, espera {wait:.1f}s)")
+                    raise
+                if not self.budget.try_acquire():
+                    self._count(operation, "budget_exhausted")
+                    logger.warning(f"♻️ [RETRY] {operation}: presupuesto de "
+                                   f"reintentos agotado ({reason})")
+                    raise
+
+                self._count(operation, "retries")
+                logger.warning(f"♻️ [RETRY] {operation}: intento {attempt} falló "
+                               f"({reason}); reintentando en {wait:.2f}s: {e}")
+                self._sleep(wait)
+                attempt += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            operations = {operation: dict(stats)
+                          for operation, stats in self._stats.items()}
+        return {"operations": operations, "budget": self.budget.get_stats()}
+
+
+# Motor compartido por todos los handlers (un solo presupuesto por proceso)
+retry_engine = RetryEngine()
+
+
+def retry_call(func: Callable[[], Any], operation: str,
+               deadline: Optional[float] = None) -> Any:
+    """Ejecuta ``func`` con el motor de reintentos compartido"""
+    return retry_engine.call(func, operation, deadline=deadline)
+
+
+def remaining_timeout(default: float, deadline: Optional[float] = None) -> float:
+    """Timeout de un intento: el configurado o lo que resta del plazo"""
+    if deadline:
+        return max(0.1, min(default, deadline - time.time()))
+    return default
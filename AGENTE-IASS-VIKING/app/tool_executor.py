@@ -0,0 +1,146 @@
+"""
+Tool Executor - Ejecución concurrente de herramientas
+Pool de hilos acotado y compartido por todos los handlers: las llamadas
+independientes de una misma respuesta del modelo se ejecutan en paralelo,
+cada una con su plazo, y los resultados se devuelven en el orden pedido.
+"""
+
+import os
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Hilos máximos para herramientas (compartidos por todos los turnos)
+TOOL_MAX_WORKERS = int(os.getenv('TOOL_MAX_WORKERS', 8))
+# Plazo por herramienta; TOOL_TIMEOUTS permite ajustar por nombre
+# ("crear_pedido=90,cambiar_nombre=30")
+TOOL_TIMEOUT_SECONDS = float(os.getenv('TOOL_TIMEOUT_SECONDS', 60))
+
+
+def _parse_timeouts(value: str) -> Dict[str, float]:
+    timeouts = {}
+    for item in (value or "").split(','):
+        name, _, seconds = item.partition('=')
+        if name.strip() and seconds.strip():
+            try:
+                timeouts[name.strip()] = float(seconds)
+            except ValueError:
+                logger.warning("Plazo inválido para herramienta "
+                               f"{name.strip()}: {seconds}")
+    return timeouts
+
+
+TOOL_TIMEOUTS = _parse_timeouts(os.getenv('TOOL_TIMEOUTS', ''))
+
+
+class ToolCall:
+    """Una llamada de herramienta: nombre y función sin argumentos que la ejecuta"""
+
+    __slots__ = ("name", "fn", "timeout")
+
+    def __init__(self, name: str, fn: Callable[[], Any],
+                 timeout: Optional[float] = None):
+        self.name = name
+        self.fn = fn
+        self.timeout = timeout
+
+
+class ToolExecutor:
+    """
+    Ejecutor de herramientas con pool acotado
+
+    Un hilo no se puede interrumpir: una herramienta que vence su plazo sigue
+    ocupando un worker hasta terminar, pero el turno continúa con un resultado
+    de error. Por eso cada herramienta debe tener además su propio timeout de red.
+    """
+
+    def __init__(self, max_workers: int = TOOL_MAX_WORKERS,
+                 default_timeout: float = TOOL_TIMEOUT_SECONDS,
+                 timeouts: Optional[Dict[str, float]] = None):
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self.timeouts = timeouts if timeouts is not None else TOOL_TIMEOUTS
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix="tool")
+        self._lock = threading.Lock()
+        self._stats = {"batches": 0, "executed": 0, "errors": 0, "timeouts": 0,
+                       "parallel_batches": 0}
+
+    def _timeout_for(self, call: ToolCall) -> float:
+        if call.timeout is not None:
+            return call.timeout
+        return self.timeouts.get(call.name, self.default_timeout)
+
+    def _count(self, **increments: int) -> None:
+        with self._lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+    @staticmethod
+    def _error(call: ToolCall, message: str) -> Dict[str, Any]:
+        return {"error": message, "tool_name": call.name}
+
+    def run(self, calls: List[ToolCall], deadline: Optional[float] = None) -> List[Any]:
+        """
+        Ejecuta las herramientas y retorna sus resultados en el mismo orden
+
+        Una excepción o un plazo vencido producen {"error": ..., "tool_name": ...}
+        en la posición de esa herramienta; nunca se propaga al handler.
+
+        Args:
+            calls: Herramientas independientes de una misma respuesta del modelo
+            deadline: Plazo absoluto del turno (time.time()); acota cada herramienta
+        """
+        if not calls:
+            return []
+        self._count(batches=1, executed=len(calls),
+                    parallel_batches=int(len(calls) > 1))
+        start = time.time()
+
+        # Cada herramienta corre en una copia del contexto para
+        # conservar la traza de Langfuse
+        futures = [self._pool.submit(contextvars.copy_context().run, call.fn)
+                   for call in calls]
+
+        results = []
+        for call, future in zip(calls, futures, strict=True):
+            ends_at = start + self._timeout_for(call)
+            if deadline:
+                ends_at = min(ends_at, deadline)
+            try:
+                results.append(future.result(timeout=max(0.0, ends_at - time.time())))
+            except FutureTimeoutError:
+                future.cancel()
+                self._count(timeouts=1)
+                logger.error(f"⏱️ [TOOLS] {call.name} superó su plazo de "
+                             f"{ends_at - start:.1f}s")
+                results.append(self._error(call, f"timeout ejecutando {call.name}"))
+            except Exception as e:
+                self._count(errors=1)
+                logger.exception(f"❌ [TOOLS] Error ejecutando {call.name}: {e}")
+                results.append(self._error(call, str(e)))
+
+        logger.info(f"🛠️ [TOOLS] {len(calls)} herramientas ejecutadas en "
+                    f"{time.time() - start:.2f}s: {[call.name for call in calls]}")
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, max_workers=self.max_workers)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False)
+
+
+# Ejecutor compartido por los handlers
+tool_executor = ToolExecutor()
+
+
+def run_tools(calls: List[ToolCall], deadline: Optional[float] = None) -> List[Any]:
+    """Ejecuta herramientas en el ejecutor compartido (ver ToolExecutor.run)"""
+    return tool_executor.run(calls, deadline=deadline)
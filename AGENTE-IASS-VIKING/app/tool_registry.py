@@ -0,0 +1,218 @@
+"""
+Tool Registry - Herramientas por assistant cargadas una sola vez
+Lee los JSON de tools/ al iniciar, precalcula las representaciones de
+OpenAI, Anthropic y Gemini y recarga un archivo solo cuando cambia su mtime.
+Clasificar una tool call es una búsqueda O(1) por nombre.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, FrozenSet, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Archivo de herramientas por número de assistant
+ASSISTANT_TOOLS = {
+    0: "tools/tools_0.json",
+    1: "tools/tools_1.json",
+    2: "tools/tools_2.json",
+    3: "tools/tools_3.json",
+    4: "tools/tools_4.json",
+    5: "tools/default_tools.json"  # Default/fallback
+}
+DEFAULT_ASSISTANT = 5
+
+# Segundos entre comprobaciones de mtime de un mismo archivo
+TOOL_REGISTRY_CHECK_SECONDS = float(os.getenv('TOOL_REGISTRY_CHECK_SECONDS', 5))
+
+BASE_DIR = os.path.join(os.path.dirname(__file__), '..')
+
+
+def normalize_tool(tool: Dict[str, Any]) -> Dict[str, Any]:
+    """Formato Responses API de OpenAI; acepta también el anidado de Chat Completions"""
+    definition = tool.get("function", tool)
+    normalized = {
+        "type": "function",
+        "name": definition["name"],
+        "description": definition.get("description", ""),
+        "parameters": definition.get("parameters")
+        or {"type": "object", "properties": {}},
+    }
+    if "strict" in definition:
+        normalized["strict"] = definition["strict"]
+    return normalized
+
+
+def convert_tool_to_anthropic_format(tool: Dict[str, Any]) -> Dict[str, Any]:
+    """Convierte una herramienta normalizada al formato de Anthropic (input_schema)."""
+    return {
+        "name": tool["name"],
+        "description": tool["description"],
+        "input_schema": tool["parameters"]
+    }
+
+
+def convert_tool_to_gemini_format(openai_tool: Dict[str, Any]) -> Dict[str, Any]:
+    """Convierte una herramienta del formato OpenAI/Anthropic al formato Gemini."""
+    return {
+        "name": openai_tool["name"],
+        "description": openai_tool["description"],
+        "parameters": {
+            "type": "object",
+            "properties": openai_tool["parameters"]["properties"],
+            "required": openai_tool["parameters"].get("required", [])
+        }
+    }
+
+
+class ToolSet:
+    """
+    Herramientas de un assistant con sus representaciones por proveedor
+
+    Es inmutable: una recarga crea un ToolSet nuevo, así que un turno que ya
+    obtuvo el suyo no ve cambios a mitad de camino.
+    """
+
+    def __init__(self, tools_file: str, tools: List[Dict[str, Any]],
+                 mtime: Optional[float] = None):
+        self.tools_file = tools_file
+        self.mtime = mtime
+        self.openai: List[Dict[str, Any]] = [normalize_tool(tool) for tool in tools]
+        self.anthropic: List[Dict[str, Any]] = [convert_tool_to_anthropic_format(tool)
+                                                for tool in self.openai]
+        self.gemini: List[Dict[str, Any]] = [convert_tool_to_gemini_format(tool)
+                                             for tool in self.openai]
+        self.by_name: Dict[str, Dict[str, Any]] = {tool["name"]: tool
+                                                   for tool in self.openai}
+        self.names: FrozenSet[str] = frozenset(self.by_name)
+        # Campos propios (no se envían al proveedor) para la selección por turno:
+        # "keywords" activan la herramienta y "always": true la envía siempre
+        self.keywords: Dict[str, List[str]] = {
+            normalized["name"]: list(tool.get("keywords") or [])
+            for tool, normalized in zip(tools, self.openai, strict=True)
+        }
+        self.always: FrozenSet[str] = frozenset(
+            normalized["name"]
+            for tool, normalized in zip(tools, self.openai, strict=True)
+            if tool.get("always")
+        )
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def __len__(self) -> int:
+        return len(self.openai)
+
+
+class ToolRegistry:
+    """
+    Registro de herramientas con recarga por mtime
+
+    Args:
+        assistant_tools: Archivo de herramientas por número de assistant
+        base_dir: Directorio base de las rutas relativas
+        check_interval: Segundos entre comprobaciones de mtime de un archivo
+    """
+
+    def __init__(self, assistant_tools: Optional[Dict[int, str]] = None,
+                 base_dir: str = BASE_DIR,
+                 check_interval: float = TOOL_REGISTRY_CHECK_SECONDS):
+        if assistant_tools is None:
+            assistant_tools = ASSISTANT_TOOLS
+        self.assistant_tools = assistant_tools
+        self.base_dir = base_dir
+        self.check_interval = check_interval
+        self._toolsets: Dict[str, ToolSet] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._by_name: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def _path(self, tools_file: str) -> str:
+        return os.path.join(self.base_dir, tools_file)
+
+    def _mtime(self, tools_file: str) -> Optional[float]:
+        try:
+            return os.stat(self._path(tools_file)).st_mtime
+        except OSError:
+            return None
+
+    def _load(self, tools_file: str, mtime: Optional[float]) -> ToolSet:
+        """Lee y precalcula un archivo; si falla se conserva la versión anterior"""
+        previous = self._toolsets.get(tools_file)
+        if mtime is None:
+            if previous is None or previous.mtime is not None:
+                logger.warning("🔧 [TOOL REGISTRY] Archivo no "
+                               f"encontrado: {tools_file}")
+            return ToolSet(tools_file, [], None)
+        try:
+            with open(self._path(tools_file), 'r', encoding='utf-8') as f:
+                toolset = ToolSet(tools_file, json.load(f), mtime)
+        except Exception as e:
+            logger.error(f"🔧 [TOOL REGISTRY] Error cargando {tools_file}: {e}")
+            if previous is not None:
+                return previous
+            return ToolSet(tools_file, [], mtime)
+        logger.info(f"🔧 [TOOL REGISTRY] {len(toolset)} herramientas cargadas desde "
+                    f"{tools_file}: {sorted(toolset.names)}")
+        return toolset
+
+    def _rebuild_name_index(self) -> None:
+        by_name = {}
+        for toolset in self._toolsets.values():
+            for name, tool in toolset.by_name.items():
+                by_name.setdefault(name, tool)
+        self._by_name = by_name
+
+    def load_all(self) -> None:
+        """Carga todos los archivos configurados (al iniciar la aplicación)"""
+        with self._lock:
+            now = time.time()
+            for tools_file in set(self.assistant_tools.values()):
+                self._toolsets[tools_file] = self._load(tools_file,
+                                                        self._mtime(tools_file))
+                self._checked_at[tools_file] = now
+            self._rebuild_name_index()
+
+    def toolset(self, assistant_number: Optional[int]) -> ToolSet:
+        """Herramientas del assistant (o de default), recargadas si el archivo cambió"""
+        tools_file = self.assistant_tools.get(assistant_number,
+                                              self.assistant_tools[DEFAULT_ASSISTANT])
+        toolset = self._toolsets.get(tools_file)
+        now = time.time()
+        checked_at = self._checked_at.get(tools_file, 0)
+        if toolset is not None and now - checked_at < self.check_interval:
+            return toolset
+
+        with self._lock:
+            self._checked_at[tools_file] = now
+            toolset = self._toolsets.get(tools_file)
+            mtime = self._mtime(tools_file)
+            if toolset is None or toolset.mtime != mtime:
+                if toolset is not None:
+                    self.reloads += 1
+                    logger.info(f"🔧 [TOOL REGISTRY] {tools_file} cambió - recargando")
+                toolset = self._load(tools_file, mtime)
+                self._toolsets[tools_file] = toolset
+                self._rebuild_name_index()
+            return toolset
+
+    def get_tool(self, name: str) -> Optional[Dict[str, Any]]:
+        """Definición de una herramienta por nombre en cualquier assistant"""
+        return self._by_name.get(name)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "files": {tools_file: len(toolset)
+                          for tools_file, toolset in self._toolsets.items()},
+                "tools": len(self._by_name),
+                "reloads": self.reloads
+            }
+
+
+# Registro compartido por endpoints y handlers
+tool_registry = ToolRegistry()
@@ -0,0 +1,231 @@
+"""
+Tool Selection - Subconjunto de herramientas por turno
+Cada esquema enviado a Responses API cuesta tokens de input en todos los
+turnos. Esta etapa elige, con señales simples (palabras del mensaje actual y
+de la última respuesta del asistente contra nombre, descripción y keywords
+de cada herramienta), qué function tools se envían y qué herramientas de
+cada servidor MCP se permiten (allowed_tools). La lista de herramientas de
+cada servidor MCP se toma de los items mcp_list_tools de las respuestas y se
+guarda en caché.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+import unicodedata
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TOOL_SELECTION_ENABLED = os.getenv('TOOL_SELECTION_ENABLED', 'true').lower() == 'true'
+# Con menos herramientas que esto se envían todas (no compensa el riesgo)
+TOOL_SELECTION_MIN_TOOLS = int(os.getenv('TOOL_SELECTION_MIN_TOOLS', 5))
+# Sin coincidencias: "all" envía todas, "none" ninguna
+TOOL_SELECTION_FALLBACK = os.getenv('TOOL_SELECTION_FALLBACK', 'all').lower()
+# Vigencia de la lista de herramientas de un servidor MCP
+MCP_TOOLS_CACHE_TTL_SECONDS = float(os.getenv('MCP_TOOLS_CACHE_TTL_SECONDS', 3600))
+
+_WORD_PATTERN = re.compile(r'[a-z0-9]+')
+# Palabras sin valor como señal de intención
+_STOPWORDS = frozenset({
+    "para", "como", "esta", "este", "esto", "pero", "porque", "cual", "cuales", "donde",
+    "cuando",
+    "quiero", "necesito", "puede", "puedes", "tiene", "tengo", "sobre", "entre",
+    "desde", "hasta",
+    "todo", "todos", "todas", "muy", "mas", "hola", "gracias", "favor", "cliente",
+    "sistema",
+    "with", "from", "that", "this", "tool", "function",
+})
+
+
+def signal_words(text: Optional[str]) -> FrozenSet[str]:
+    """Palabras normalizadas (minúsculas, sin tildes, 4+ letras) de un texto"""
+    if not text:
+        return frozenset()
+    normalized = unicodedata.normalize('NFKD', str(text).lower())
+    plain = normalized.encode('ascii', 'ignore').decode('ascii')
+    return frozenset(
+        word for word in _WORD_PATTERN.findall(plain.replace('_', ' '))
+        if len(word) >= 4 and word not in _STOPWORDS
+    )
+
+
+def _stem(word: str) -> str:
+    """Plurales y género simples: pedido/pedidos/pedida comparten raíz"""
+    if len(word) > 5 and word[-2:] in ("os", "as", "es"):
+        return word[:-2]
+    if len(word) > 4 and word[-1] in "aeos":
+        return word[:-1]
+    return word
+
+
+def _stems(words: Iterable[str]) -> FrozenSet[str]:
+    return frozenset(_stem(word) for word in words)
+
+
+def tool_words(name: str, description: str = "",
+               keywords: Iterable[str] = ()) -> FrozenSet[str]:
+    """Raíces que activan una herramienta"""
+    return _stems(signal_words(f"{name} {description} {' '.join(keywords)}"))
+
+
+def _matches(signals: FrozenSet[str], words: FrozenSet[str]) -> bool:
+    return bool(signals & words)
+
+
+def select_function_tools(tools: List[Dict[str, Any]], signals: FrozenSet[str],
+                          keywords: Optional[Dict[str, List[str]]] = None,
+                          always: Iterable[str] = ()
+                          ) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    Function tools relevantes para el turno, en el orden original
+
+    Returns:
+        tuple: (herramientas a enviar, motivo)
+    """
+    if not TOOL_SELECTION_ENABLED:
+        return tools, "selección deshabilitada"
+    if len(tools) < TOOL_SELECTION_MIN_TOOLS:
+        return tools, f"menos de {TOOL_SELECTION_MIN_TOOLS} herramientas"
+
+    keywords = keywords or {}
+    always = set(always)
+    stems = _stems(signals)
+    selected = [
+        tool for tool in tools
+        if tool["name"] in always or _matches(
+            stems, tool_words(tool["name"], tool.get("description", ""),
+                              keywords.get(tool["name"], ())))
+    ]
+    if len(selected) == len(always & {tool["name"] for tool in tools}):
+        if TOOL_SELECTION_FALLBACK == "none":
+            return selected, "sin coincidencias"
+        return tools, "sin coincidencias (se envían todas)"
+    return selected, "coincidencias"
+
+
+class MCPToolCache:
+    """
+    Lista de herramientas por servidor MCP (server_label)
+
+    Se llena con los items ``mcp_list_tools`` que OpenAI devuelve al importar
+    las herramientas de un servidor, o con seed() desde un listado local.
+    """
+
+    def __init__(self, ttl_seconds: float = MCP_TOOLS_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._servers: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def seed(self, server_label: str, tools: List[Dict[str, Any]]) -> None:
+        entries = [
+            {"name": tool.get("name"), "description": tool.get("description") or "",
+             "words": tool_words(tool.get("name", ""), tool.get("description") or "")}
+            for tool in tools if tool.get("name")
+        ]
+        with self._lock:
+            self._servers[server_label] = {"tools": entries, "updated_at": time.time()}
+        logger.info(f"🧰 [MCP TOOLS] {server_label}: {len(entries)} "
+                    "herramientas en caché")
+
+    def update_from_response(self, response: Any) -> None:
+        """Guarda las listas mcp_list_tools presentes en la salida de una respuesta"""
+        for item in getattr(response, 'output', None) or []:
+            if getattr(item, 'type', None) != 'mcp_list_tools':
+                continue
+            tools = [
+                tool if isinstance(tool, dict)
+                else {"name": getattr(tool, 'name', None),
+                      "description": getattr(tool, 'description', None)}
+                for tool in getattr(item, 'tools', None) or []
+            ]
+            self.seed(getattr(item, 'server_label', None) or "", tools)
+
+    def get(self, server_label: str) -> Optional[List[Dict[str, Any]]]:
+        """Herramientas del servidor o None si no hay lista vigente"""
+        with self._lock:
+            entry = self._servers.get(server_label)
+            if entry is None or time.time() - entry["updated_at"] > self.ttl_seconds:
+                return None
+            return entry["tools"]
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            return {
+                label: {"tools": [tool["name"] for tool in entry["tools"]],
+                        "age_seconds": round(now - entry["updated_at"])}
+                for label, entry in self._servers.items()
+            }
+
+
+# Caché compartida por los turnos de OpenAI
+mcp_tool_cache = MCPToolCache()
+
+
+def build_mcp_tool(mcp_config: Dict[str, Any], signals: FrozenSet[str],
+                   cache: MCPToolCache = mcp_tool_cache) -> Dict[str, Any]:
+    """
+    Herramienta {"type": "mcp"} con allowed_tools si se puede acotar
+
+    ``allowed_tools`` de la configuración del servidor siempre se respeta;
+    además, con la lista en caché se dejan solo las herramientas relevantes.
+    """
+    tool = {
+        "type": "mcp",
+        "server_url": mcp_config["server_url"],
+        "server_label": mcp_config["server_label"],
+        "require_approval": mcp_config.get("require_approval", "never")
+    }
+    configured = mcp_config.get("allowed_tools")
+    cached = cache.get(mcp_config["server_label"])
+
+    allowed = None
+    if (cached is not None and TOOL_SELECTION_ENABLED
+            and len(cached) >= TOOL_SELECTION_MIN_TOOLS):
+        stems = _stems(signals)
+        matched = [entry["name"] for entry in cached if _matches(stems, entry["words"])]
+        if matched:
+            allowed = matched
+        elif TOOL_SELECTION_FALLBACK == "none":
+            allowed = []
+    if configured is not None:
+        allowed = [name for name in (allowed if allowed is not None else configured)
+                   if name in configured]
+    if allowed is not None:
+        tool["allowed_tools"] = allowed
+    return tool
+
+
+def select_tools(function_tools: List[Dict[str, Any]],
+                 mcp_configs: List[Dict[str, Any]],
+                 message: str, previous_reply: Optional[str] = None,
+                 keywords: Optional[Dict[str, List[str]]] = None,
+                 always: Iterable[str] = ()) -> Tuple[List[Dict[str, Any]],
+                                                      Dict[str, Any]]:
+    """
+    Herramientas del turno: MCP (con allowed_tools) y function tools relevantes
+
+    Las señales son el mensaje del usuario y la última respuesta del asistente
+    (si el asistente preguntó por el nombre, "Juan Pérez" sigue necesitando
+    la herramienta del nombre).
+
+    Returns:
+        tuple: (tools para Responses API, resumen de la selección)
+    """
+    signals = signal_words(message) | signal_words(previous_reply)
+    tools = [build_mcp_tool(config, signals) for config in mcp_configs]
+    selected, reason = select_function_tools(function_tools, signals, keywords, always)
+    tools.extend(selected)
+
+    summary = {
+        "function_tools": f"{len(selected)}/{len(function_tools)}",
+        "function_reason": reason,
+        "mcp_allowed_tools": {tool["server_label"]: tool.get("allowed_tools")
+                              for tool in tools if tool["type"] == "mcp"},
+        "omitted": sorted({tool["name"] for tool in function_tools}
+                          - {tool["name"] for tool in selected}),
+    }
+    return tools, summary
@@ -0,0 +1,456 @@
+"""
+Tracing - Exportador de trazas a Langfuse en segundo plano
+Los handlers solo agregan eventos en memoria; al cerrar el turno la traza se
+encola (cola acotada, descarta y cuenta si está llena) y un único hilo la
+envía por lotes a la API de ingesta de Langfuse. Si Langfuse no responde,
+los lotes se guardan en un spool local y se reenvían cuando vuelve.
+La latencia del usuario no depende del backend de trazas.
+"""
+
+import os
+import json
+import time
+import contextlib
+import uuid
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Credenciales y host (las mismas variables que usa el SDK de Langfuse)
+LANGFUSE_PUBLIC_KEY = os.getenv('LANGFUSE_PUBLIC_KEY')
+LANGFUSE_SECRET_KEY = os.getenv('LANGFUSE_SECRET_KEY')
+LANGFUSE_HOST = os.getenv('LANGFUSE_HOST', 'https://cloud.langfuse.com').rstrip('/')
+LANGFUSE_TRACING_ENABLED = os.getenv('LANGFUSE_TRACING_ENABLED',
+                                     'true').lower() == 'true'
+LANGFUSE_TRACING_ENVIRONMENT = os.getenv('LANGFUSE_TRACING_ENVIRONMENT')
+
+# Fracción de turnos trazados
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+# Trazas pendientes de envío; con la cola llena se descartan
+TRACE_QUEUE_SIZE = int(os.getenv('TRACE_QUEUE_SIZE', 1000))
+TRACE_BATCH_SIZE = int(os.getenv('TRACE_BATCH_SIZE', 50))
+TRACE_FLUSH_INTERVAL_SECONDS = float(os.getenv('TRACE_FLUSH_INTERVAL_SECONDS', 2))
+TRACE_EXPORT_TIMEOUT_SECONDS = float(os.getenv('TRACE_EXPORT_TIMEOUT_SECONDS', 10))
+# Spool local mientras Langfuse no está disponible
+TRACE_SPOOL_PATH = os.getenv('TRACE_SPOOL_PATH', 'logs/trace_spool.jsonl')
+TRACE_SPOOL_MAX_BYTES = int(os.getenv('TRACE_SPOOL_MAX_BYTES', 50 * 1024 * 1024))
+
+# Traza del turno en el contexto actual (se propaga a las herramientas del turno)
+_current_trace: contextvars.ContextVar = contextvars.ContextVar(
+    'current_trace', default=None
+)
+
+
+def _timestamp(seconds: Optional[float] = None) -> str:
+    moment = datetime.fromtimestamp(seconds if seconds is not None else time.time(),
+                                    timezone.utc)
+    return moment.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _to_jsonable(value: Any) -> Any:
+    """Objetos del SDK (pydantic) a tipos JSON; el resto como texto"""
+    if hasattr(value, 'model_dump'):
+        return value.model_dump()
+    if hasattr(value, 'to_list'):
+        return value.to_list()
+    return str(value)
+
+
+class TraceRejectedError(Exception):
+    """Langfuse rechazó el lote (4xx distinto de 429): reenviarlo no cambia nada"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class Trace:
+    """
+    Traza de un turno: eventos en memoria hasta que el exportador la encola
+
+    Los payloads se guardan por referencia y se serializan en el hilo del
+    exportador; los handlers no pagan el costo de json.dumps.
+    """
+
+    def __init__(self, name: str, thread_id: Optional[str],
+                 subscriber_id: Optional[str],
+                 input: Any = None, metadata: Optional[Dict[str, Any]] = None):
+        self.id = uuid.uuid4().hex
+        self.start_time = time.time()
+        self.body: Dict[str, Any] = {
+            "id": self.id,
+            "name": name,
+            "userId": str(subscriber_id) if subscriber_id is not None else None,
+            "sessionId": thread_id,
+            "input": input,
+            "metadata": dict(metadata or {}),
+        }
+        if LANGFUSE_TRACING_ENVIRONMENT:
+            self.body["environment"] = LANGFUSE_TRACING_ENVIRONMENT
+        self.observations: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def update(self, output: Any = None,
+               metadata: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            if output is not None:
+                self.body["output"] = output
+            if metadata:
+                self.body["metadata"].update(metadata)
+
+    def add(self, event_type: str, body: Dict[str, Any]) -> None:
+        body = dict(body, id=uuid.uuid4().hex, traceId=self.id)
+        with self._lock:
+            self.observations.append({"type": event_type, "body": body})
+
+    def events(self) -> List[Dict[str, Any]]:
+        """Eventos de la API de ingesta: la traza y sus observaciones"""
+        created = _timestamp(self.start_time)
+        with self._lock:
+            body = dict(self.body, timestamp=created)
+            events = [{"id": uuid.uuid4().hex, "type": "trace-create",
+                       "timestamp": created, "body": body}]
+            for observation in self.observations:
+                events.append({"id": uuid.uuid4().hex, "type": observation["type"],
+                               "timestamp": created, "body": observation["body"]})
+        return events
+
+
+class TraceExporter:
+    """
+    Exportador de trazas con muestreo, cola acotada y spool local
+
+    Args:
+        sender: Envía un lote de eventos; lanza excepción si falla
+            (por defecto POST a /api/public/ingestion de Langfuse)
+        enabled: Si es False no se crean trazas
+        sample_rate: Probabilidad de trazar un turno
+        queue_size: Trazas pendientes máximas antes de descartar
+        batch_size: Eventos máximos por envío
+        flush_interval: Segundos máximos que una traza espera en la cola
+        spool_path: Archivo JSONL para lotes no enviados (None = sin spool)
+        spool_max_bytes: Tamaño máximo del spool; lo que exceda se descarta
+    """
+
+    def __init__(self, sender: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+                 enabled: Optional[bool] = None,
+                 sample_rate: float = TRACE_SAMPLE_RATE,
+                 queue_size: int = TRACE_QUEUE_SIZE,
+                 batch_size: int = TRACE_BATCH_SIZE,
+                 flush_interval: float = TRACE_FLUSH_INTERVAL_SECONDS,
+                 spool_path: Optional[str] = TRACE_SPOOL_PATH,
+                 spool_max_bytes: int = TRACE_SPOOL_MAX_BYTES):
+        if enabled is None:
+            enabled = LANGFUSE_TRACING_ENABLED and bool(LANGFUSE_PUBLIC_KEY
+                                                        and LANGFUSE_SECRET_KEY)
+        self.enabled = enabled
+        self.sender = sender or self._post_ingestion
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self.spool_max_bytes = spool_max_bytes
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._session = None
+        self._stats = {"traces": 0, "sampled": 0, "exported_events": 0, "dropped": 0,
+                       "spooled_events": 0, "replayed_events": 0, "export_errors": 0,
+                       "rejected_events": 0}
+        # Códigos de rechazo ya registrados en el log (se avisa una vez por código)
+        self._rejected_status = set()
+
+    # ---- API de los handlers ----
+
+    def start_trace(self, name: str, thread_id: Optional[str],
+                    subscriber_id: Optional[str],
+                    input: Any = None,
+                    metadata: Optional[Dict[str, Any]] = None) -> Optional[Trace]:
+        """
+        Decide una sola vez por turno si se traza y fija la traza en el contexto
+
+        Returns:
+            Trace o None si el turno no se traza
+        """
+        sampled = (self.enabled and self.sample_rate > 0
+                   and random.random() < self.sample_rate)
+        with self._lock:
+            self._stats["traces"] += 1
+            self._stats["sampled"] += int(sampled)
+        trace = None
+        if sampled:
+            trace = Trace(name, thread_id, subscriber_id, input, metadata)
+        _current_trace.set(trace)
+        return trace
+
+    @staticmethod
+    def current() -> Optional[Trace]:
+        return _current_trace.get()
+
+    def update_trace(self, output: Any = None,
+                     metadata: Optional[Dict[str, Any]] = None) -> None:
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.update(output, metadata)
+
+    def generation(self, name: str, model: str, input: Any = None, output: Any = None,
+                   usage: Optional[Dict[str, int]] = None,
+                   metadata: Optional[Dict[str, Any]] = None,
+                   model_parameters: Optional[Dict[str, Any]] = None,
+                   start_time: Optional[float] = None, end_time: Optional[float] = None,
+                   level: Optional[str] = None) -> None:
+        """Llamada al LLM en la traza actual (sin efecto si el turno no se traza)"""
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        body = {
+            "name": name,
+            "model": model,
+            "input": input,
+            "output": output,
+            "metadata": metadata,
+            "modelParameters": model_parameters,
+            "startTime": _timestamp(start_time),
+            "endTime": _timestamp(end_time),
+        }
+        if usage:
+            body["usageDetails"] = {key: value for key, value in usage.items()
+                                    if isinstance(value, int)}
+        if level:
+            body["level"] = level
+        trace.add("generation-create", body)
+
+    def span(self, name: str, input: Any = None, output: Any = None,
+             metadata: Optional[Dict[str, Any]] = None,
+             start_time: Optional[float] = None, end_time: Optional[float] = None,
+             level: Optional[str] = None) -> None:
+        """Paso del turno (p. ej. una herramienta) dentro de la traza actual"""
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        body = {
+            "name": name,
+            "input": input,
+            "output": output,
+            "metadata": metadata,
+            "startTime": _timestamp(start_time),
+            "endTime": _timestamp(end_time),
+        }
+        if level:
+            body["level"] = level
+        trace.add("span-create", body)
+
+    def end_trace(self) -> None:
+        """Encola la traza del turno sin bloquear; con la cola llena se descarta"""
+        trace = _current_trace.get()
+        _current_trace.set(None)
+        if trace is None:
+            return
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+            logger.warning(f"📊 [TRACING] Cola llena - traza {trace.id} descartada")
+
+    # ---- Hilo exportador ----
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="trace-exporter",
+                                                daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            batch: List[Dict[str, Any]] = []
+            traces = 0
+            try:
+                trace = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._replay_spool()
+                continue
+            deadline = time.time() + self.flush_interval
+            while True:
+                batch.extend(trace.events())
+                traces += 1
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    trace = self._queue.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+            try:
+                self._export(batch)
+            finally:
+                for _ in range(traces):
+                    self._queue.task_done()
+
+    def _serialize(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Round-trip JSON: los objetos del SDK quedan como tipos JSON"""
+        return json.loads(json.dumps(events, ensure_ascii=False, default=_to_jsonable))
+
+    def _export(self, events: List[Dict[str, Any]]) -> bool:
+        try:
+            events = self._serialize(events)
+            self.sender(events)
+        except TraceRejectedError as e:
+            self._reject(events, e)
+            return False
+        except Exception as e:
+            with self._lock:
+                self._stats["export_errors"] += 1
+            logger.warning(f"📊 [TRACING] Langfuse no disponible ({e}) - "
+                           f"{len(events)} eventos al spool")
+            self._spool(events)
+            return False
+        with self._lock:
+            self._stats["exported_events"] += len(events)
+        self._replay_spool()
+        return True
+
+    def _post_ingestion(self, events: List[Dict[str, Any]]) -> None:
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+            self._session.auth = (LANGFUSE_PUBLIC_KEY, LANGFUSE_SECRET_KEY)
+        response = self._session.post(
+            f"{LANGFUSE_HOST}/api/public/ingestion",
+            json={"batch": events},
+            timeout=TRACE_EXPORT_TIMEOUT_SECONDS
+        )
+        # 5xx y 429: transitorios (al spool); otro 4xx: credenciales o payload inválidos
+        if response.status_code >= 500 or response.status_code == 429:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        if response.status_code >= 400:
+            raise TraceRejectedError(response.status_code)
+        # 207: aceptado con errores por evento (no se reintenta)
+        if response.status_code == 207:
+            errors = response.json().get("errors", [])
+            if errors:
+                logger.warning(f"📊 [TRACING] {len(errors)} eventos rechazados por "
+                               f"Langfuse: {errors[:3]}")
+
+    def _reject(self, events: List[Dict[str, Any]], error: TraceRejectedError) -> None:
+        """Descarta un lote rechazado; el log se emite una vez por código HTTP"""
+        with self._lock:
+            self._stats["rejected_events"] += len(events)
+            first = error.status_code not in self._rejected_status
+            self._rejected_status.add(error.status_code)
+        if first:
+            logger.error(f"📊 [TRACING] Langfuse rechazó un lote ({error}) - se "
+                         "descartan los lotes rechazados; revisar "
+                         "LANGFUSE_PUBLIC_KEY/LANGFUSE_SECRET_KEY y el payload")
+
+    # ---- Spool local ----
+
+    def _spool(self, events: List[Dict[str, Any]]) -> None:
+        if not self.spool_path:
+            with self._lock:
+                self._stats["dropped"] += len(events)
+            return
+        line = json.dumps(events, ensure_ascii=False) + "\n"
+        try:
+            size = 0
+            if os.path.exists(self.spool_path):
+                size = os.path.getsize(self.spool_path)
+            if size + len(line) > self.spool_max_bytes:
+                with self._lock:
+                    self._stats["dropped"] += len(events)
+                return
+            os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+            with open(self.spool_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError as e:
+            logger.error(f"📊 [TRACING] Error escribiendo spool {self.spool_path}: {e}")
+            with self._lock:
+                self._stats["dropped"] += len(events)
+            return
+        with self._lock:
+            self._stats["spooled_events"] += len(events)
+
+    def _replay_spool(self) -> None:
+        """Reenvía los lotes del spool; se detiene al primer fallo transitorio"""
+        if not self.spool_path:
+            return
+        replaying = self.spool_path + ".replay"
+        if not os.path.exists(self.spool_path) and not os.path.exists(replaying):
+            return
+        try:
+            if os.path.exists(self.spool_path):
+                if os.path.exists(replaying):
+                    # Quedó un .replay de un intento anterior: se le
+                    # agrega el spool, no se pisa
+                    with open(self.spool_path, 'r', encoding='utf-8') as src, \
+                            open(replaying, 'a', encoding='utf-8') as dst:
+                        # El salto inicial aísla una última línea
+                        # truncada; las vacías se ignoran
+                        dst.write("\n" + src.read())
+                    os.remove(self.spool_path)
+                else:
+                    os.replace(self.spool_path, replaying)
+            with open(replaying, 'r', encoding='utf-8') as f:
+                lines = [line for line in f if line.strip()]
+        except OSError as e:
+            logger.error(f"📊 [TRACING] Error leyendo spool {self.spool_path}: {e}")
+            return
+
+        batches = []
+        for line in lines:
+            try:
+                batches.append(json.loads(line))
+            except ValueError:
+                # Línea truncada (p. ej. disco lleno al escribir): no se puede reenviar
+                logger.warning(f"📊 [TRACING] Línea inválida en {replaying} descartada")
+
+        for i, events in enumerate(batches):
+            try:
+                self.sender(events)
+            except TraceRejectedError as e:
+                self._reject(events, e)
+                continue
+            except Exception:
+                # Lo no enviado vuelve al spool para el próximo intento
+                for pending in batches[i:]:
+                    self._spool(pending)
+                    with self._lock:
+                        self._stats["spooled_events"] -= len(pending)
+                break
+            with self._lock:
+                self._stats["replayed_events"] += len(events)
+        with contextlib.suppress(OSError):
+            os.remove(replaying)
+
+    # ---- Control ----
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Espera a que se exporten las trazas encoladas (tests y apagado)"""
+        end = time.time() + timeout
+        while self._queue.unfinished_tasks:
+            if time.time() >= end:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, enabled=self.enabled, sample_rate=self.sample_rate,
+                        queued=self._queue.qsize(), capacity=self._queue.maxsize)
+
+
+# Exportador compartido por los handlers
+tracer = TraceExporter()
+
+# Al salir del proceso se exporta lo pendiente (acotado)
+atexit.register(tracer.flush, 2.0)
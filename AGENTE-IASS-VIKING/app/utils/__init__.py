@@ -1,5 +1,6 @@
 # Utils package
 from .cost_calculator import cost_calculator
+from .token_counter import token_counter
 
 # Importar funciones del módulo utils original
 import random
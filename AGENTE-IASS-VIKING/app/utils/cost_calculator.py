@@ -8,6 +8,8 @@ import os
 import logging
 from typing import Dict, Optional
 
+from .token_counter import token_counter
+
 logger = logging.getLogger(__name__)
 
 class CostCalculator:
@@ -151,7 +153,10 @@ class CostCalculator:
             logger.error("Error al recargar configuración de costos")
             return False
     
-    def estimate_conversation_cost(self, model_name: str, message_length: int, expected_response_length: int = None) -> Dict:
+    def estimate_conversation_cost(self, model_name: str, message_length: int,
+                                   expected_response_length: int = None,
+                                   message_text: Optional[str] = None,
+                                   input_tokens: Optional[int] = None) -> Dict:
         """
         Estima el costo de una conversación basado en longitud de mensaje
         
@@ -159,16 +164,27 @@ class CostCalculator:
             model_name: Nombre del modelo
             message_length: Longitud aproximada del mensaje en caracteres
             expected_response_length: Longitud esperada de respuesta (si no se proporciona, se estima)
+            message_text: Texto del mensaje; si se da, se cuenta con el tokenizador
+            input_tokens: Tokens de input ya contados (p. ej. el request del pre-flight)
             
         Returns:
             Estimación de costo
         """
-        # Estimación aproximada: 1 token ≈ 4 caracteres para texto en español
-        estimated_input_tokens = max(1, message_length // 4)
+        if input_tokens is not None or message_text is not None:
+            # Conteo con el tokenizador del modelo (tiktoken o
+            # aproximación por proveedor)
+            if input_tokens is None:
+                input_tokens = token_counter.count_text(message_text, model_name)
+            estimated_input_tokens = max(1, input_tokens)
+            estimation_note = f"Estimación con tokenizador ({token_counter.backend})"
+        else:
+            # Estimación aproximada: 1 token ≈ 4 caracteres para texto en español
+            estimated_input_tokens = max(1, message_length // 4)
+            estimation_note = "Estimación basada en ~4 caracteres por token"
         estimated_output_tokens = expected_response_length // 4 if expected_response_length else estimated_input_tokens // 2
         
         cost_result = self.calculate_cost(model_name, estimated_input_tokens, estimated_output_tokens)
-        cost_result["estimation_note"] = "Estimación basada en ~4 caracteres por token"
+        cost_result["estimation_note"] = estimation_note
         cost_result["estimated_input_tokens"] = estimated_input_tokens
         cost_result["estimated_output_tokens"] = estimated_output_tokens
         
@@ -0,0 +1,259 @@
+"""
+Token Counter - Conteo local de tokens antes de llamar al proveedor
+Usa el BPE de tiktoken para modelos de OpenAI (si está instalado y su archivo
+de encoding se pudo cargar) y una aproximación por caracteres para Anthropic,
+Gemini y como respaldo. Con el conteo los
+handlers dimensionan cada request, recortan el historial más antiguo si no
+cabe en la ventana de contexto y estiman el costo antes del round trip.
+"""
+
+import os
+import json
+import math
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # Sin tiktoken se usa la aproximación por caracteres
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Ventana de contexto por prefijo de modelo (gana el prefijo más largo)
+CONTEXT_WINDOWS = {
+    "gpt-5": 400000,
+    "gpt-4.1": 1047576,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5": 16385,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+    "claude": 200000,
+    "gemini-1.5-pro": 2097152,
+    "gemini": 1048576,
+}
+DEFAULT_CONTEXT_WINDOW = 128000
+
+# Caracteres por token de la aproximación (texto en español)
+CHARS_PER_TOKEN = {"openai": 4.0, "anthropic": 3.5, "gemini": 4.0}
+
+# Tope de tokens de input por request (0 = la ventana de contexto del modelo)
+LLM_MAX_INPUT_TOKENS = int(os.getenv('LLM_MAX_INPUT_TOKENS', 0))
+# Margen para el formato de mensajes que el conteo local no ve
+TOKEN_SAFETY_MARGIN = float(os.getenv('TOKEN_SAFETY_MARGIN', 0.05))
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv('TOKEN_COUNT_CACHE_SIZE', 4096))
+# Encodings que se cargan al iniciar (tiktoken descarga el BPE la primera vez;
+# con TIKTOKEN_CACHE_DIR apuntando a una copia local no hay descarga)
+TOKEN_WARMUP_MODELS = [name.strip() for name in
+                       os.getenv('TOKEN_WARMUP_MODELS', 'gpt-5,gpt-4').split(',')
+                       if name.strip()]
+
+# Tokens de formato por mensaje (rol y separadores)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _parse_windows(value: str) -> Dict[str, int]:
+    """LLM_CONTEXT_WINDOWS="gpt-5-mini=272000,claude-3-haiku=200000" """
+    windows = {}
+    for item in (value or "").split(','):
+        name, _, tokens = item.partition('=')
+        if name.strip() and tokens.strip():
+            windows[name.strip()] = int(tokens)
+    return windows
+
+
+CONTEXT_WINDOWS.update(_parse_windows(os.getenv('LLM_CONTEXT_WINDOWS', '')))
+
+
+def _to_jsonable(value: Any) -> Any:
+    """Bloques del SDK (pydantic) a tipos JSON; el resto como texto"""
+    if hasattr(value, 'model_dump'):
+        return value.model_dump()
+    if hasattr(value, 'to_list'):
+        return value.to_list()
+    return str(value)
+
+
+def provider_for(model: str) -> str:
+    name = (model or "").lower()
+    if name.startswith("claude"):
+        return "anthropic"
+    if name.startswith("gemini"):
+        return "gemini"
+    return "openai"
+
+
+class TokenCounter:
+    """
+    Conteo de tokens con caché LRU de textos ya contados
+
+    El system prompt, los esquemas de herramientas y los mensajes del
+    historial se repiten turno a turno: solo se tokenizan una vez.
+    """
+
+    def __init__(self, cache_size: int = TOKEN_COUNT_CACHE_SIZE,
+                 use_tiktoken: bool = True):
+        self.cache_size = cache_size
+        self.use_tiktoken = use_tiktoken
+        self._cache: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self._encodings: Dict[str, Any] = {}
+        self._tiktoken_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    @property
+    def backend(self) -> str:
+        if self.use_tiktoken and tiktoken is not None and self._tiktoken_error is None:
+            return "tiktoken"
+        return "aproximado"
+
+    def _encoding(self, model: str):
+        """Encoding de tiktoken del modelo (o200k_base si no lo conoce) o None"""
+        if (not self.use_tiktoken or tiktoken is None
+                or self._tiktoken_error is not None):
+            return None
+        encoding = self._encodings.get(model)
+        if encoding is None:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                # Sin red ni TIKTOKEN_CACHE_DIR la descarga del BPE
+                # falla: se usa la aproximación
+                self._tiktoken_error = f"{type(e).__name__}: {e}"
+                logger.warning("📏 [TOKENS] tiktoken no disponible "
+                               f"({self._tiktoken_error}) - conteo aproximado")
+                return None
+            self._encodings[model] = encoding
+        return encoding
+
+    def warm_up(self, models: List[str] = TOKEN_WARMUP_MODELS) -> str:
+        """Carga los encodings al iniciar para que la descarga no ocurra en un turno"""
+        for model in models:
+            if provider_for(model) == "openai":
+                self._encoding(model)
+        logger.info(f"📏 [TOKENS] Conteo de tokens: {self.backend}")
+        return self.backend
+
+    def _tokenizer_key(self, model: str) -> str:
+        provider = provider_for(model)
+        encoding = self._encoding(model) if provider == "openai" else None
+        if encoding is not None:
+            return f"tiktoken:{encoding.name}"
+        return f"aprox:{provider}"
+
+    def count_text(self, text: str, model: str) -> int:
+        """Tokens de un texto para el modelo"""
+        if not text:
+            return 0
+        key = (self._tokenizer_key(model), text)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self._stats["hits"] += 1
+                return cached
+            self._stats["misses"] += 1
+
+        encoding = None
+        if key[0].startswith("tiktoken:"):
+            encoding = self._encodings.get(model)
+        if encoding is not None:
+            tokens = len(encoding.encode(text, disallowed_special=()))
+        else:
+            tokens = math.ceil(len(text) / CHARS_PER_TOKEN[provider_for(model)])
+
+        with self._lock:
+            self._cache[key] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_tools(self, tools: List[Dict[str, Any]], model: str) -> int:
+        """Tokens de los esquemas de herramientas (cacheado por contenido)"""
+        if not tools:
+            return 0
+        text = json.dumps(tools, ensure_ascii=False, sort_keys=True,
+                          default=_to_jsonable)
+        return self.count_text(text, model)
+
+    def count_message(self, message: Any, model: str) -> int:
+        content = message
+        if isinstance(message, dict):
+            content = message.get("content", message.get("parts"))
+        if isinstance(content, str):
+            text = content
+        else:
+            text = json.dumps(content, ensure_ascii=False, default=_to_jsonable)
+        return self.count_text(text, model) + MESSAGE_OVERHEAD_TOKENS
+
+    def count_messages(self, messages: List[Any], model: str) -> int:
+        return sum(self.count_message(message, model) for message in messages)
+
+    def context_window(self, model: str) -> int:
+        name = (model or "").lower()
+        matches = [prefix for prefix in CONTEXT_WINDOWS if name.startswith(prefix)]
+        if not matches:
+            return DEFAULT_CONTEXT_WINDOW
+        return CONTEXT_WINDOWS[max(matches, key=len)]
+
+    def input_budget(self, model: str, max_output_tokens: int = 0) -> int:
+        """Input permitido: ventana (o LLM_MAX_INPUT_TOKENS) menos salida y margen"""
+        window = self.context_window(model) - (max_output_tokens or 0)
+        if LLM_MAX_INPUT_TOKENS:
+            window = min(window, LLM_MAX_INPUT_TOKENS)
+        return int(window * (1 - TOKEN_SAFETY_MARGIN))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, backend=self.backend, cached=len(self._cache),
+                        tiktoken_error=self._tiktoken_error)
+
+
+# Contador compartido por los handlers
+token_counter = TokenCounter()
+
+
+def trim_messages(messages: List[Any], budget: int, model: str,
+                  is_turn_start: Callable[[Any], bool],
+                  counter: TokenCounter = token_counter) -> Tuple[List[Any], int, int]:
+    """
+    Descarta los mensajes más antiguos hasta que el resto quepa en el presupuesto
+
+    El primer mensaje conservado siempre es un inicio de turno válido según
+    ``is_turn_start`` (p. ej. un mensaje de usuario que no sea un tool_result
+    huérfano). El último mensaje (el actual) nunca se descarta; si el turno
+    actual por sí solo excede el presupuesto se conserva completo.
+
+    Returns:
+        tuple: (mensajes conservados, mensajes descartados, tokens conservados)
+    """
+    sizes = [counter.count_message(message, model) for message in messages]
+    total = sum(sizes)
+    start = 0
+    last = len(messages) - 1
+    while total > budget and start < last:
+        total -= sizes[start]
+        start += 1
+        # Avanzar hasta un inicio de turno para no dejar pares incompletos
+        while start < last and not is_turn_start(messages[start]):
+            total -= sizes[start]
+            start += 1
+    if start and not is_turn_start(messages[start]):
+        # No quedó un inicio de turno: cortar dentro del turno actual
+        # dejaría un tool_result huérfano
+        start = max((i for i in range(start) if is_turn_start(messages[i])), default=0)
+        total = sum(sizes[start:])
+        logger.warning(f"📏 [PREFLIGHT] El turno actual excede {budget} tokens "
+                       f"({model}); se envía completo")
+    if start:
+        logger.warning(f"📏 [PREFLIGHT] {start} mensajes antiguos recortados para "
+                       f"caber en {budget} tokens ({model})")
+    return messages[start:], start, total
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark del codec de bloques de Anthropic
+Compara el tamaño del historial guardado (JSON) y en memoria: bloques del SDK
+serializados con json_default (repr), con model_dump completo y con el codec.
+
+Uso: python bench_anthropic_codec.py [turnos] [repeticiones]
+"""
+
+import os
+import sys
+import json
+import timeit
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.anthropic_codec import encode_content, decode_messages
+from app.history import json_default
+
+try:
+    from anthropic.types import Message
+except ImportError:  # Sin SDK se mide sobre el JSON que devuelve la API
+    Message = None
+
+
+def _api_message(i):
+    """Respuesta de la API con texto y una llamada a herramienta"""
+    return {
+        "id": f"msg_{i:04d}", "type": "message", "role": "assistant",
+        "model": "claude-3-5-haiku-latest",
+        "stop_reason": "tool_use", "stop_sequence": None,
+        "usage": {"input_tokens": 1200, "output_tokens": 80,
+                  "cache_creation_input_tokens": 0, "cache_read_input_tokens": 1024},
+        "content": [
+            {"type": "text", "text": "Voy a consultar el estado del "
+                                     f"pedido {i} en el sistema.", "citations": None},
+            {"type": "tool_use", "id": f"toolu_{i:04d}", "name": "consultar_pedido",
+             "input": {"pedido": f"A-{i}", "incluir_detalle": True}},
+        ],
+    }
+
+
+def _response_content(i):
+    data = _api_message(i)
+    if Message is None:
+        return data["content"]
+    return Message.model_validate(data).content
+
+
+def _deep_size(value, seen=None):
+    """Bytes en memoria aproximados de una estructura (objetos, dicts y listas)"""
+    seen = seen if seen is not None else set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_deep_size(item, seen) for item in value)
+    elif hasattr(value, '__dict__'):
+        size += _deep_size(vars(value), seen)
+    return size
+
+
+def _history(turns, content_for):
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user",
+                         "content": [{"type": "text",
+                                      "text": f"¿Cómo va mi pedido {i}?"}]})
+        messages.append({"role": "assistant", "content": content_for(i)})
+        messages.append({"role": "user",
+                         "content": [{"type": "tool_result",
+                                      "tool_use_id": f"toolu_{i:04d}",
+                                      "content": json.dumps({"estado": "en ruta"})}]})
+    return messages
+
+
+def bench(turns, repeats):
+    raw = _history(turns, _response_content)
+    dumped = _history(turns, lambda i: [
+        block.model_dump() if hasattr(block, 'model_dump') else dict(block)
+        for block in _response_content(i)
+    ])
+    encoded = _history(turns, lambda i: encode_content(_response_content(i)))
+
+    formats = {"model_dump completo": dumped, "codec": encoded}
+    if Message is not None:
+        # Formato actual del historial: objetos del SDK que
+        # json_default guarda como repr()
+        formats = dict({"SDK + json_default (repr)": raw}, **formats)
+    print(f"📊 Historial de {turns} turnos ({len(encoded)} mensajes) - bloques "
+          f"{'del SDK' if Message else 'JSON de la API'}")
+    for name, messages in formats.items():
+        stored = json.dumps(messages, default=json_default,
+                            ensure_ascii=False).encode('utf-8')
+        print(f"   {name:<28} {len(stored):>9,} bytes JSON  "
+              f"{_deep_size(messages):>10,} bytes en memoria")
+
+    content = _response_content(0)
+    stored = json.loads(json.dumps(encoded, ensure_ascii=False))
+    encode_us = timeit.timeit(lambda: encode_content(content),
+                              number=repeats) / repeats * 1e6
+    decode_us = timeit.timeit(lambda: decode_messages(stored),
+                              number=repeats) / repeats * 1e6
+    print(f"   encode (respuesta de 2 bloques)   {encode_us:10.2f} µs")
+    print(f"   decode historial (codec)          {decode_us:10.2f} µs")
+    if Message is not None:
+        legacy = json.loads(json.dumps(raw, default=json_default))
+        legacy_repeats = max(1, repeats // 10)
+        legacy_us = timeit.timeit(lambda: decode_messages(legacy),
+                                  number=legacy_repeats) / legacy_repeats * 1e6
+        print(f"   decode historial (repr anterior)  {legacy_us:10.2f} µs")
+    else:
+        print("   (instala anthropic para medir los objetos del SDK y su repr)")
+
+
+def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    for size in sorted({5, turns}):
+        bench(size, repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark de clientes LLM compartidos
+Compara crear un cliente OpenAI por turno contra el cliente compartido de
+app.clients, contra un servidor local que imita la API (sin TLS: en producción
+el ahorro es mayor porque cada conexión nueva paga además el handshake TLS).
+
+Uso: python bench_clients.py [turnos]
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.clients import get_openai_client, openai_clients
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Responde GET /v1/models con keep-alive"""
+
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        StandInHandler.connections += 1
+
+    def do_GET(self):
+        body = json.dumps({"object": "list", "data": []}).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(label, make_client, turns):
+    StandInHandler.connections = 0
+    start = time.perf_counter()
+    for _ in range(turns):
+        make_client().models.list()
+    elapsed = time.perf_counter() - start
+    print(f"   {label:<28} {elapsed / turns * 1000:8.2f} ms/turno   conexiones TCP: "
+          f"{StandInHandler.connections}")
+
+
+def main():
+    try:
+        from openai import OpenAI
+    except ImportError:
+        print("❌ El benchmark requiere el paquete openai instalado")
+        return
+
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    print(f"📊 {turns} turnos contra {base_url}")
+    run("cliente nuevo por turno", lambda: OpenAI(api_key="bench", base_url=base_url),
+        turns)
+    run("cliente compartido", lambda: get_openai_client("bench", base_url), turns)
+    print(f"   registro: {openai_clients.get_stats()}")
+
+    openai_clients.close_all()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Benchmark del logging por turno
+Reproduce los logs INFO que el handler de OpenAI y el bridge de n8n emitían
+en cada turno (payload con indent=2, cada herramienta, dir(response),
+__dict__, headers y cuerpo de n8n) y los compara con las líneas compactas
+más la captura de depuración no muestreada.
+
+Uso: python bench_debug_capture.py [turnos]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import logging
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.debug_capture import DebugCapture
+
+
+class FakeItem:
+    def __init__(self, i):
+        self.type = "message"
+        self.id = f"msg_{i}"
+        self.content = [{"type": "output_text", "text": "Respuesta del "
+                                                        "asistente " * 20}]
+
+    def __repr__(self):
+        return f"FakeItem({self.__dict__})"
+
+
+class FakeResponse:
+    """Objeto con el tamaño y repr aproximados de un Response del SDK"""
+
+    def __init__(self):
+        self.id = "resp_0123456789"
+        self.model = "gpt-5"
+        self.output = [FakeItem(i) for i in range(3)]
+        self.output_text = "Respuesta del asistente " * 20
+        self.usage = {"input_tokens": 3200, "output_tokens": 180, "total_tokens": 3380}
+        self.metadata = {"x": "y" * 200}
+
+    def __repr__(self):
+        return f"Response({self.__dict__})"
+
+
+def build_fixture():
+    system_prompt = "Eres el asistente de Energitel. " * 280  # ~8.7 KB
+    history = [
+        {"role": "user" if i % 2 == 0 else "assistant",
+         "content": [{"type": "input_text" if i % 2 == 0 else "output_text",
+                      "text": f"mensaje {i} " * 15}]}
+        for i in range(20)
+    ]
+    tools = [
+        {"type": "function", "name": f"herramienta_{i}",
+         "description": "Descripción de la herramienta " * 5,
+         "parameters": {"type": "object",
+                        "properties": {f"campo_{j}": {"type": "string",
+                                                      "description": "campo"}
+                                       for j in range(6)}}}
+        for i in range(8)
+    ]
+    payload = {
+        "model": "gpt-5",
+        "input": [{"role": "system",
+                   "content": [{"type": "input_text",
+                                "text": system_prompt}]}] + history,
+        "tools": tools,
+        "temperature": 1.0,
+        "max_output_tokens": 4096,
+    }
+    n8n = {"status": 200, "headers": {f"x-header-{i}": "v" * 40 for i in range(15)},
+           "body": json.dumps({"data": "d" * 2000})}
+    return payload, FakeResponse(), n8n
+
+
+def legacy_turn(logger, payload, response, n8n):
+    """Los logs eliminados, tal como se formateaban antes en cada turno"""
+    logger.info("🔥 [RESPONSES API] PAYLOAD COMPLETO: "
+                f"{json.dumps(payload, indent=2, ensure_ascii=False)}")
+    for i, msg in enumerate(payload["input"]):
+        text_content = msg["content"][0].get("text", "")
+        logger.info(f"🔥 [RESPONSES API] Input {i+1}: {msg['role']} = "
+                    f"'{text_content[:50]}'")
+    for i, tool in enumerate(payload["tools"]):
+        logger.info(f"🔥 [RESPONSES API] Tool {i+1} COMPLETA: "
+                    f"{json.dumps(tool, indent=2, ensure_ascii=False)}")
+    logger.info(f"🔥 [OPENAI RAW] Response object: {response}")
+    logger.info(f"🔥 [OPENAI RAW] Response dict: {response.__dict__}")
+    logger.info(f"🔥 [OPENAI RAW] Atributos disponibles: {dir(response)}")
+    for i, item in enumerate(response.output):
+        logger.info(f"🔥 [OPENAI RAW] output[{i}]: {item}, type: {type(item)}")
+        logger.info(f"🔧 [TOOL CALLS] Output item[{i}] attributes: {dir(item)}")
+    logger.info(f"📊 [OUTPUT DEBUG] response attributes: {dir(response)}")
+    logger.info(f"📊 [OUTPUT DEBUG] raw output_text: {repr(response.output_text)}")
+    logger.info("🔍 [RESPONSE DEBUG] Output text preview: "
+                f"'{str(response.output_text)[:200]}...'")
+    logger.info(f"🔗 [N8N BRIDGE] ✅ Response Headers: {n8n['headers']}")
+    logger.info(f"🔗 [N8N BRIDGE] ✅ Raw Response Body: {n8n['body']}")
+    logger.info("🔗 [N8N BRIDGE] "
+                f"{json.dumps(json.loads(n8n['body']), indent=2, ensure_ascii=False)}")
+
+
+def compact_turn(logger, capture, payload, response, n8n):
+    """Líneas compactas actuales; la captura solo serializa turnos muestreados"""
+    tool_labels = [tool.get("name") for tool in payload["tools"]]
+    logger.info(f"🔥 [RESPONSES API] gpt-5 - inputs: {len(payload['input'])}, tools: "
+                f"{tool_labels}, previous: None, tool_choice: None")
+    capture.record("openai_request", lambda: payload)
+    logger.info(f"🔥 [RESPONSES API] Respuesta {response.id} - output_text: "
+                f"{len(response.output_text)} chars")
+    capture.record("openai_response", lambda: response)
+    logger.info(f"🔗 [N8N BRIDGE] ✅ herramienta_0: HTTP {n8n['status']}, "
+                f"{len(n8n['body'])} chars, 120ms")
+    capture.record("n8n_response", lambda: n8n)
+
+
+def measure(label, fn, turns):
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for _ in range(turns):
+        fn()
+    cpu = (time.process_time() - cpu_start) / turns * 1000
+    wall = (time.perf_counter() - wall_start) / turns * 1000
+    print(f"   {label:<32} CPU {cpu:7.3f} ms/turno   latencia {wall:7.3f} ms/turno")
+    return wall
+
+
+def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+
+    # Logger INFO con formato y stream como en producción
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - '
+                                           '%(levelname)s - %(message)s'))
+    logger = logging.getLogger("bench")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    payload, response, n8n = build_fixture()
+    capture = DebugCapture(sample_rate=0)
+    capture.begin_turn("thread_bench", "sub_bench")
+
+    print(f"📊 {turns} turnos, prompt {len(json.dumps(payload)) // 1024} KB")
+    legacy = measure("logs anteriores (INFO)",
+                     lambda: legacy_turn(logger, payload, response, n8n), turns)
+    legacy_bytes = stream.tell() // turns
+    stream.seek(0)
+    stream.truncate()
+    compact = measure("compacto + captura inactiva",
+                      lambda: compact_turn(logger, capture, payload, response, n8n),
+                      turns)
+    compact_bytes = stream.tell() // turns
+    print(f"   log por turno: {legacy_bytes // 1024} KB -> {compact_bytes} bytes; "
+          f"reducción de latencia {legacy / compact:.0f}x")
+
+    # Turno capturado: el costo de serializar se paga solo aquí
+    capture.enable(thread_id="thread_bench")
+    capture.begin_turn("thread_bench", "sub_bench")
+    measure("compacto + captura activa",
+            lambda: compact_turn(logger, capture, payload, response, n8n), turns)
+
+
+if __name__ == "__main__":
+    main()
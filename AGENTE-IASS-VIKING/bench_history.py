@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Benchmark del historial de conversaciones
+Compara ConversationHistory contra copiar una lista en cada snapshot/append.
+
+Uso: python bench_history.py [mensajes_en_historial] [repeticiones]
+"""
+
+import os
+import sys
+import timeit
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.history import ConversationHistory
+
+
+def _message(i):
+    return {"role": "user" if i % 2 == 0 else "assistant", "content": f"mensaje {i}"}
+
+
+def bench(history_size, repeats):
+    plain = [_message(i) for i in range(history_size)]
+    persistent = ConversationHistory(plain)
+
+    def list_snapshot():
+        return list(plain)
+
+    def history_snapshot():
+        return persistent
+
+    def list_turn():
+        # Copia defensiva + mensajes del turno
+        history = list(plain)
+        history.append(_message(0))
+        history.append(_message(1))
+        return history
+
+    def history_turn():
+        return persistent.append(_message(0)).append(_message(1))
+
+    results = {
+        "snapshot (lista copiada)": timeit.timeit(list_snapshot, number=repeats),
+        "snapshot "
+        "(ConversationHistory)": timeit.timeit(history_snapshot, number=repeats),
+        "turno (lista copiada)": timeit.timeit(list_turn, number=repeats),
+        "turno (ConversationHistory)": timeit.timeit(history_turn, number=repeats),
+    }
+
+    print(f"📊 Historial de {history_size} mensajes, {repeats} repeticiones")
+    for name, seconds in results.items():
+        print(f"   {name:<32} {seconds / repeats * 1e6:10.2f} µs/op")
+
+
+def main():
+    history_size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    for size in sorted({20, history_size, history_size * 10}):
+        bench(size, repeats)
+
+
+if __name__ == "__main__":
+    main()
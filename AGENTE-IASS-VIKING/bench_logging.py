@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark del logging con stdout lento
+Simula la contrapresión del recolector de logs (cada write tarda) y mide
+cuánto tardan los hilos de turno en emitir sus logs con el StreamHandler
+síncrono anterior y con la cola de app.logging_config.
+
+Uso: python bench_logging.py [hilos] [logs_por_hilo] [ms_por_write]
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.logging_config import setup_logging, stop_logging, get_logging_stats
+
+
+class SlowStream:
+    """stdout con contrapresión: cada write bloquea"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.lines = 0
+
+    def write(self, text):
+        time.sleep(self.delay)
+        self.lines += 1
+
+    def flush(self):
+        pass
+
+
+def run_turns(threads, per_thread):
+    logger = logging.getLogger("bench.turn")
+
+    def turn(n):
+        for i in range(per_thread):
+            logger.info("turno %d - evento %d", n, i,
+                        extra={"thread_id": f"thread_{n}"})
+
+    workers = [threading.Thread(target=turn, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def report(label, elapsed, total):
+    print(f"   {label:<30} {elapsed * 1000:8.1f} ms en hilos de turno   "
+          f"{total / elapsed:10.0f} logs/s")
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    delay = (float(sys.argv[3]) if len(sys.argv) > 3 else 1.0) / 1000
+    total = threads * per_thread
+    print(f"📊 {threads} hilos x {per_thread} logs, stdout con "
+          f"{delay * 1000:.1f} ms por write")
+
+    # Anterior: StreamHandler síncrono en el hilo que loguea
+    root = logging.getLogger()
+    stream = SlowStream(delay)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+    report("StreamHandler síncrono", run_turns(threads, per_thread), total)
+
+    for policy, size in (("block", total * 2), ("drop", total // 4)):
+        stream = SlowStream(delay)
+        setup_logging(stream=stream, level="INFO", fmt="json", policy=policy,
+                      queue_size=size,
+                                 module_levels={})
+        elapsed = run_turns(threads, per_thread)
+        stats = get_logging_stats()
+        report(f"cola {policy} (capacidad {size})", elapsed, total)
+        drain_start = time.perf_counter()
+        stop_logging()
+        print(f"      escritos: {stream.lines}, descartados: {stats['dropped']}, "
+              "vaciado en segundo plano: "
+              f"{(time.perf_counter() - drain_start) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la selección de herramientas por turno
+Compara los tokens de esquemas enviados en cada turno con todas las
+herramientas (antes) y con el subconjunto elegido (después), y mide el
+costo de la etapa de selección. Los tokens se estiman como en el handler
+(~4 caracteres por token); la latencia de OpenAI no se mide aquí porque
+requiere la API real.
+
+Uso: python bench_tool_selection.py [iteraciones]
+"""
+
+import os
+import sys
+import json
+import time
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.tool_registry import ToolSet
+from app.tool_selection import MCPToolCache, build_mcp_tool, select_tools, signal_words
+
+
+def function_tool(name, description, fields):
+    return {
+        "type": "function", "name": name, "description": description,
+        "parameters": {"type": "object", "required": fields[:1], "properties": {
+            field: {"type": "string",
+                    "description": f"{field.replace('_', ' ').capitalize()} "
+                                   "del cliente"}
+            for field in fields
+        }},
+    }
+
+
+FUNCTION_TOOLS = [
+    function_tool("cambiar_nombre", "Cambia el nombre del cliente en el sistema",
+                  ["nombre"]),
+    function_tool("crear_pedido",
+                  "Crea un pedido con los productos elegidos y la forma de entrega",
+                  ["productos", "direccion", "forma_pago", "observaciones"]),
+    function_tool("consultar_pedido", "Consulta el estado de un pedido",
+                  ["numero_pedido"]),
+    function_tool("cancelar_pedido", "Cancela un pedido que aún no fue despachado",
+                  ["numero_pedido", "motivo"]),
+    function_tool("actualizar_direccion", "Actualiza la dirección de entrega del "
+                                          "cliente", ["direccion", "barrio", "ciudad"]),
+    function_tool("consultar_factura", "Consulta facturas pendientes y su valor",
+                  ["numero_factura"]),
+    function_tool("registrar_pago", "Registra un pago realizado por el cliente",
+                  ["valor", "medio_pago", "referencia"]),
+    function_tool("agendar_visita", "Agenda una visita técnica de instalación",
+                  ["fecha", "franja", "direccion"]),
+    function_tool("consultar_cobertura", "Verifica si hay cobertura del servicio "
+                                         "en una dirección", ["direccion", "ciudad"]),
+    function_tool("escalar_asesor", "Transfiere la conversación a un asesor humano",
+                  ["motivo"]),
+]
+MCP_LIST = [
+    {"name": name, "description": description}
+    for name, description in [
+        ("buscar_pedido", "Busca un pedido por número o teléfono"),
+        ("buscar_cliente", "Busca un cliente por teléfono o documento"),
+        ("listar_productos", "Lista productos y planes disponibles"),
+        ("consultar_inventario", "Inventario de equipos por bodega"),
+        ("consultar_precios", "Precios vigentes de planes y equipos"),
+        ("historial_facturas", "Historial de facturas del cliente"),
+        ("estado_instalacion", "Estado de la instalación programada"),
+        ("zonas_cobertura", "Zonas con cobertura del servicio"),
+    ]
+]
+MCP_CONFIG = {"type": "mcp", "server_url": "https://mcp.local/sse",
+              "server_label": "mcp-sql"}
+# Esquema aproximado que OpenAI importa por cada herramienta MCP
+MCP_SCHEMA_CHARS = 450
+
+TURNS = [
+    ("Hola, buenas tardes", None),
+    ("Quiero hacer un pedido del plan de 300 megas", "¡Hola! ¿En qué te puedo ayudar?"),
+    ("Calle 45 #12-30, barrio Laureles", "Perfecto. ¿Cuál es la dirección de entrega?"),
+    ("¿Cuánto debo en la factura de este mes?", None),
+    ("¿Cuándo llega el técnico para la instalación?", None),
+    ("Me llamo Juan Pérez", "¿Me confirmas tu nombre completo?"),
+    ("ok gracias", "Tu pedido quedó registrado."),
+]
+
+
+def tokens(items):
+    return len(json.dumps(items, ensure_ascii=False)) // 4
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    toolset = ToolSet("bench.json", FUNCTION_TOOLS)
+    cache = MCPToolCache()
+    cache.seed("mcp-sql", MCP_LIST)
+
+    all_tokens = tokens(toolset.openai) + len(MCP_LIST) * MCP_SCHEMA_CHARS // 4
+    print(f"📊 {len(FUNCTION_TOOLS)} function tools + {len(MCP_LIST)} herramientas "
+          f"MCP: ~{all_tokens} tokens de esquemas por llamada")
+    print(f"   {'mensaje':<48} {'function':>9} {'mcp':>5} {'tokens':>7}")
+    total_after = 0
+    for message, previous in TURNS:
+        tools, summary = select_tools(toolset.openai, [], message, previous,
+                                      toolset.keywords, toolset.always)
+        signals = signal_words(message) | signal_words(previous)
+        allowed = build_mcp_tool(MCP_CONFIG, signals, cache).get("allowed_tools")
+        mcp_count = len(MCP_LIST) if allowed is None else len(allowed)
+        after = tokens(tools) + mcp_count * MCP_SCHEMA_CHARS // 4
+        total_after += after
+        print(f"   {message[:48]:<48} {summary['function_tools']:>9} "
+              f"{mcp_count:>5} {after:>7}")
+    average = total_after / len(TURNS)
+    print(f"   promedio: ~{all_tokens} -> ~{average:.0f} tokens de esquemas por "
+          f"llamada ({(1 - average / all_tokens) * 100:.0f}% menos)")
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        message, previous = TURNS[i % len(TURNS)]
+        signals = signal_words(message) | signal_words(previous)
+        select_tools(toolset.openai, [], message, previous, toolset.keywords,
+                     toolset.always)
+        build_mcp_tool(MCP_CONFIG, signals, cache)
+    elapsed = (time.perf_counter() - start) / iterations * 1000
+    print(f"   costo de la selección: {elapsed:.3f} ms por turno")
+
+
+if __name__ == "__main__":
+    main()
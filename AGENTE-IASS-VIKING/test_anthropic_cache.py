@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Pruebas del planificador de breakpoints cache_control de Anthropic
+"""
+
+import os
+import sys
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.anthropic_cache import plan_cache_breakpoints, min_cacheable_tokens
+from app.anthropic_handler import is_anthropic_turn_start
+from app.prompt_cache import render_prompt
+from app.utils.token_counter import TokenCounter
+
+MODEL = "claude-3-5-sonnet-latest"
+SYSTEM = render_prompt("Eres el asistente de Energitel. " * 300
+                       + "Hoy es {{fecha_hora}}", {"fecha_hora": "10:00"})
+TOOLS = [
+    {"name": f"herramienta_{i}", "description": "Consulta datos del cliente " * 20,
+     "input_schema": {"type": "object", "properties": {}}}
+    for i in range(8)
+]
+
+
+def marks(system, tools, messages):
+    """Cantidad de bloques con cache_control en el request"""
+    blocks = list(system) + list(tools)
+    for message in messages:
+        content = message["content"]
+        blocks.extend(content if isinstance(content, list) else [])
+    return sum(1 for block in blocks if isinstance(block, dict)
+               and "cache_control" in block)
+
+
+def test_system_and_tools_breakpoints():
+    """Tools y system estático llevan breakpoint; las variables quedan después"""
+    print("🧪 TESTING SYSTEM Y TOOLS")
+    messages = [{"role": "user", "content": [{"type": "text", "text": "hola"}]}]
+    system, tools, payload, breakpoints = plan_cache_breakpoints(
+        SYSTEM, TOOLS, messages, MODEL, is_anthropic_turn_start, TokenCounter())
+
+    assert [bp["at"] for bp in breakpoints] == ["tools", "system"], breakpoints
+    assert "cache_control" in tools[-1] and "cache_control" not in TOOLS[-1]
+    assert "cache_control" in system[0] and "[fecha_hora]" in system[0]["text"]
+    assert "10:00" in system[1]["text"] and "cache_control" not in system[1]
+    assert payload == messages
+    print(f"✅ Breakpoints: {breakpoints}")
+
+
+def test_rolling_history_breakpoint():
+    """Con rondas de herramientas el breakpoint va en el último mensaje"""
+    print("🧪 TESTING HISTORIAL")
+    filler = "Detalle del pedido del cliente. " * 60
+    messages = [
+        {"role": "user",
+         "content": [{"type": "text", "text": "mensaje anterior " + filler,
+                      "cache_control": {"type": "ephemeral"}}]},
+        {"role": "assistant", "content": [{"type": "text", "text": filler}]},
+        {"role": "user", "content": "consulta mi pedido " + filler},
+        {"role": "assistant", "content": [{"type": "tool_use", "id": "t1",
+                                           "name": "herramienta_1", "input": {}}]},
+        {"role": "user",
+         "content": [{"type": "tool_result", "tool_use_id": "t1", "content": filler}]},
+    ]
+    system, tools, payload, breakpoints = plan_cache_breakpoints(
+        SYSTEM, TOOLS, messages, MODEL, is_anthropic_turn_start, TokenCounter())
+
+    assert [bp["at"] for bp in breakpoints] == ["tools", "system", "history",
+                                                "rolling"], breakpoints
+    assert marks(system, tools, payload) == 4
+    assert "cache_control" not in payload[0]["content"][0]  # marca antigua eliminada
+    assert payload[2]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert payload[4]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert isinstance(messages[2]["content"], str)
+    assert "cache_control" not in messages[4]["content"][-1]
+    print(f"✅ {len(breakpoints)} breakpoints, historial intacto")
+
+
+def test_small_prompts_are_not_marked():
+    """Por debajo del mínimo cacheable del modelo no se marca nada"""
+    print("🧪 TESTING PROMPT PEQUEÑO")
+    assert min_cacheable_tokens("claude-3-haiku-20240307") == 2048
+    assert min_cacheable_tokens("claude-sonnet-4-5") == 1024
+    messages = [{"role": "user", "content": "hola"}]
+    system, tools, payload, breakpoints = plan_cache_breakpoints(
+        "Eres un asistente "
+        "útil.", TOOLS[:1], messages, MODEL, is_anthropic_turn_start, TokenCounter())
+    assert breakpoints == [] and marks(system, tools, payload) == 0
+    print("✅ Sin breakpoints")
+
+
+def main():
+    """Función principal"""
+    print("🚀 ANTHROPIC CACHE TEST SUITE")
+    print("=" * 50)
+    test_system_and_tools_breakpoints()
+    test_rolling_history_breakpoint()
+    test_small_prompts_are_not_marked()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Pruebas del codec de bloques de contenido de Anthropic
+"""
+
+import os
+import sys
+import json
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.anthropic_codec import encode_content, decode_messages
+from app.history import ConversationHistory, json_default
+
+
+class SDKBlock:
+    """Imita un bloque pydantic del SDK (atributos, model_dump y repr)"""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def model_dump(self, exclude_none=False):
+        return {key: value for key, value in self.__dict__.items()
+                if not (exclude_none and value is None)}
+
+    def __repr__(self):
+        name = "TextBlock" if self.type == "text" else "ToolUseBlock"
+        fields = ', '.join(f'{key}={value!r}'
+                           for key, value in sorted(self.__dict__.items()))
+        return f"{name}({fields})"
+
+
+RESPONSE_CONTENT = [
+    SDKBlock(type="text", text="Reviso tu pedido", citations=None),
+    SDKBlock(type="tool_use", id="toolu_01", name="consultar_pedido",
+             input={"pedido": "A-17", "detalle": True}),
+]
+
+
+def test_encode_is_minimal_and_serializable():
+    """Los bloques del SDK quedan como dicts mínimos que sobreviven a JSON"""
+    print("🧪 TESTING CODIFICACIÓN")
+    content = encode_content(RESPONSE_CONTENT)
+    assert content == [
+        {"type": "text", "text": "Reviso tu pedido"},
+        {"type": "tool_use", "id": "toolu_01", "name": "consultar_pedido",
+         "input": {"pedido": "A-17", "detalle": True}},
+    ], content
+
+    tool_result = encode_content([{"type": "tool_result", "tool_use_id": "toolu_01",
+                                   "content": "{}",
+                                   "is_error": False,
+                                   "cache_control": {"type": "ephemeral"}}])
+    assert tool_result == [{"type": "tool_result", "tool_use_id": "toolu_01",
+                            "content": "{}"}]
+    assert encode_content("hola") == "hola"
+
+    history = ConversationHistory.of([{"role": "assistant", "content": content}])
+    stored = json.loads(json.dumps({"messages": history},
+                                   default=json_default))["messages"]
+    assert decode_messages(stored) == stored and stored[0]["content"] == content
+    print("✅ Bloques mínimos y serializables")
+
+
+def test_decode_recovers_legacy_reprs():
+    """Historiales guardados con repr() del SDK se recuperan como bloques"""
+    print("🧪 TESTING FORMATO ANTERIOR")
+    legacy = json.loads(json.dumps([
+        {"role": "user", "content": [{"type": "text", "text": "¿y mi pedido?"}]},
+        {"role": "assistant", "content": RESPONSE_CONTENT},
+    ], default=json_default))
+    assert legacy[1]["content"][1].startswith("ToolUseBlock(")
+
+    decoded = decode_messages(legacy)
+    assert decoded[0] is legacy[0]  # sin bloques antiguos no se copia
+    assert decoded[1]["content"] == encode_content(RESPONSE_CONTENT), decoded[1]
+
+    unknown = decode_messages([{"role": "assistant", "content": ["texto suelto"]}])
+    assert unknown[0]["content"] == [{"type": "text", "text": "texto suelto"}]
+    print("✅ Bloques recuperados")
+
+
+def main():
+    """Función principal"""
+    print("🚀 ANTHROPIC CODEC TEST SUITE")
+    print("=" * 50)
+    test_encode_is_minimal_and_serializable()
+    test_decode_recovers_legacy_reprs()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la limpieza programada
+Verifica que solo la réplica líder recorra el almacenamiento compartido
+"""
+
+import os
+import sys
+import time
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.cleanup import cleanup_inactive_conversations
+from app.conversation_manager import MemoryConversationManager
+from app.lock_manager import InProcessLockManager
+
+
+class StaticLeader:
+    """Lease con resultado fijo, para simular réplicas líder y seguidora"""
+
+    def __init__(self, is_leader):
+        self.is_leader = is_leader
+
+    def acquire(self):
+        return self.is_leader
+
+    def current_leader(self):
+        return "otra-replica"
+
+
+def _stale_manager():
+    manager = MemoryConversationManager({})
+    manager.set("thread_stale", {"status": "completed", "messages": []})
+    manager.conversations["thread_stale"]["last_activity"] = time.time() - 10 ** 6
+    return manager
+
+
+def test_only_leader_sweeps_store():
+    """La réplica seguidora no limpia conversaciones pero sí poda sus locks"""
+    print("🧪 TESTING LIMPIEZA CON LÍDER")
+    manager = _stale_manager()
+    lock_manager = InProcessLockManager()
+    lock_manager.acquire("thread_stale").release()
+    lock_manager._thread_stats["thread_stale"]["last_seen"] -= 10 ** 6
+
+    cleanup_inactive_conversations(manager, lock_manager, StaticLeader(False))
+    assert manager.exists("thread_stale")
+    assert lock_manager.get_contention() == []
+
+    leader = StaticLeader(True)
+    assert cleanup_inactive_conversations(manager, lock_manager, leader) == 1
+    assert not manager.exists("thread_stale")
+    print("✅ Solo la líder recorre el almacenamiento")
+
+
+def main():
+    """Función principal"""
+    print("🚀 CLEANUP TEST SUITE")
+    print("=" * 50)
+    test_only_leader_sweeps_store()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Pruebas del registro de clientes LLM compartidos
+"""
+
+import os
+import sys
+import threading
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.clients import ClientRegistry
+
+
+class DummyClient:
+    def __init__(self, api_key, base_url):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_registry_reuses_clients():
+    """Un cliente por (api key, base URL), compartido entre hilos"""
+    print("🧪 TESTING REGISTRO DE CLIENTES")
+    registry = ClientRegistry("Dummy", DummyClient)
+    results = []
+
+    def turn():
+        results.append(registry.get("sk-test"))
+
+    workers = [threading.Thread(target=turn) for _ in range(10)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert len({id(client) for client in results}) == 1
+    assert registry.get("sk-test", "http://localhost:9000") is not results[0]
+    assert registry.get("sk-other") is not results[0]
+
+    stats = registry.get_stats()
+    assert stats == {"clients": 3, "created": 3, "reused": 9}
+
+    registry.close_all()
+    assert results[0].closed
+    assert registry.get_stats()["clients"] == 0
+    print(f"✅ Estadísticas: {stats}")
+
+
+def main():
+    """Función principal"""
+    print("🚀 CLIENTS TEST SUITE")
+    print("=" * 50)
+    test_registry_reuses_clients()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
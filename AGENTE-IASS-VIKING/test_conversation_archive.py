@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Pruebas del archivo de conversaciones inactivas
+Verifica archivado en segmentos, rehidratación y el índice por subscriber
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.conversation_manager import MemoryConversationManager
+from app.conversation_archive import ConversationArchive, TieredConversationManager
+
+
+def _tiered_manager(archive_dir):
+    hot = MemoryConversationManager({})
+    archive = ConversationArchive(archive_dir)
+    return hot, TieredConversationManager(hot, archive, idle_seconds=60)
+
+
+def _age(hot, thread_id, seconds):
+    hot.conversations[thread_id]["last_activity"] = time.time() - seconds
+
+
+def test_archive_and_rehydrate():
+    """Una conversación inactiva sale del nivel principal y vuelve con su historial"""
+    print("🧪 TESTING ARCHIVO Y REHIDRATACIÓN")
+    with tempfile.TemporaryDirectory() as archive_dir:
+        hot, manager = _tiered_manager(archive_dir)
+        manager.set("thread_old", {
+            "status": "completed",
+            "subscriber_id": "sub_1",
+            "messages": [{"role": "user", "content": "Mi dirección es Calle 1"}]
+        })
+        manager.set("thread_new",
+                    {"status": "completed", "subscriber_id": "sub_2", "messages": []})
+        _age(hot, "thread_old", 120)
+
+        assert manager.cleanup_expired(7200) == 1
+        assert not hot.exists("thread_old")
+        assert hot.exists("thread_new")
+        assert manager.exists("thread_old")
+
+        # El índice sobrevive a un reinicio del proceso
+        reopened = ConversationArchive(archive_dir)
+        entries = reopened.find_by_subscriber("sub_1")
+        assert [entry["thread_id"] for entry in entries] == ["thread_old"]
+
+        # El hilo archivado sigue siendo el activo del subscriber
+        assert manager.get_active_thread("sub_1") == "thread_old"
+
+        conversation = manager.get("thread_old")
+        assert conversation["messages"][0]["content"] == "Mi dirección es Calle 1"
+        assert hot.exists("thread_old")
+        assert not manager.archive.contains("thread_old")
+        assert manager.update("thread_old", {"status": "processing"})
+        print(f"✅ Estadísticas: {manager.archive.get_stats()}")
+
+
+def test_activity_during_archive_is_kept():
+    """Si la conversación cambia mientras se archiva, sigue en el nivel principal"""
+    print("🧪 TESTING ACTIVIDAD DURANTE EL ARCHIVADO")
+    with tempfile.TemporaryDirectory() as archive_dir:
+        hot, manager = _tiered_manager(archive_dir)
+        manager.set("thread_busy", {"status": "completed", "messages": []})
+        _age(hot, "thread_busy", 120)
+
+        original_archive = manager.archive.archive
+
+        def archive_with_concurrent_write(thread_id, conversation):
+            result = original_archive(thread_id, conversation)
+            hot.update(thread_id, {"status": "processing"})
+            return result
+
+        manager.archive.archive = archive_with_concurrent_write
+        assert manager.cleanup_expired(7200) == 0
+        assert hot.get("thread_busy")["status"] == "processing"
+        print("✅ Escritura concurrente preservada")
+
+
+def test_hot_expiry_after_rehydrate():
+    """Si expira la conversación rehidratada no vuelve la copia archivada vieja"""
+    print("🧪 TESTING EXPIRACIÓN TRAS REHIDRATAR")
+    with tempfile.TemporaryDirectory() as archive_dir:
+        hot, manager = _tiered_manager(archive_dir)
+        manager.set("thread_ttl",
+                    {"status": "completed",
+                     "messages": [{"role": "user", "content": "turno 1"}]})
+        _age(hot, "thread_ttl", 120)
+        assert manager.cleanup_expired(7200) == 1
+
+        # Rehidratar y agregar un turno nuevo
+        conversation = manager.get("thread_ttl")
+        messages = list(conversation["messages"])
+        messages.append({"role": "user", "content": "turno 2"})
+        manager.update("thread_ttl", {"messages": messages})
+
+        # Expiración por TTL de Redis: el nivel principal la
+        # pierde sin pasar por el archivo
+        hot.delete("thread_ttl")
+        assert manager.get("thread_ttl") is None
+        assert not manager.exists("thread_ttl")
+        print("✅ Sin historial desactualizado")
+
+
+def test_archive_failure_keeps_hot_copy():
+    """Si archivar falla la conversación se conserva hasta la próxima limpieza"""
+    print("🧪 TESTING FALLO AL ARCHIVAR")
+    with tempfile.TemporaryDirectory() as archive_dir:
+        hot, manager = _tiered_manager(archive_dir)
+        manager.set("thread_disk", {"status": "completed", "messages": []})
+        _age(hot, "thread_disk", 10 ** 5)  # Inactiva por más que la expiración
+
+        original_archive = manager.archive.archive
+
+        def disk_full(_thread_id, _conversation):
+            raise OSError(28, "No space left on device")
+
+        manager.archive.archive = disk_full
+        assert manager.cleanup_expired(7200) == 0
+        assert hot.exists("thread_disk")
+
+        manager.archive.archive = original_archive
+        assert manager.cleanup_expired(7200) == 1
+        assert not hot.exists("thread_disk") and manager.archive.contains("thread_disk")
+        print("✅ Conversación conservada hasta archivarla")
+
+
+def test_delete_and_purge():
+    """Eliminar borra ambos niveles y la purga descarta segmentos vencidos"""
+    print("🧪 TESTING ELIMINACIÓN Y PURGA")
+    with tempfile.TemporaryDirectory() as archive_dir:
+        archive = ConversationArchive(archive_dir)
+        archive.archive("thread_a", {"subscriber_id": "sub_1", "messages": []})
+        archive.archive("thread_b", {"subscriber_id": "sub_1", "messages": []})
+
+        hot = MemoryConversationManager({})
+        manager = TieredConversationManager(hot, archive)
+        assert manager.delete("thread_a")
+        assert not ConversationArchive(archive_dir).contains("thread_a")
+
+        # Un segmento de hace dos días se elimina con retención de 1 día
+        old_segment = os.path.join(archive_dir,
+                                   "2000-01-01" + ConversationArchive.SEGMENT_SUFFIX)
+        os.replace(os.path.join(archive_dir, archive._entries["thread_b"]["segment"]),
+                   old_segment)
+        archive._entries["thread_b"]["segment"] = os.path.basename(old_segment)
+        assert archive.purge(retention_days=1) == 1
+        assert not os.path.exists(old_segment)
+        assert archive.find_by_subscriber("sub_1") == []
+        assert not ConversationArchive(archive_dir).contains("thread_b")
+        print("✅ Purga completada")
+
+
+def test_shared_directory_between_replicas():
+    """Una réplica ve lo que archiva otra en el mismo directorio"""
+    print("🧪 TESTING DIRECTORIO COMPARTIDO")
+    with tempfile.TemporaryDirectory() as archive_dir:
+        leader = ConversationArchive(archive_dir)
+        follower = ConversationArchive(archive_dir)
+
+        leader.archive("thread_shared",
+                       {"subscriber_id": "sub_1",
+                        "messages": [{"role": "user", "content": "Hola"}]})
+        assert follower.contains("thread_shared")
+        assert follower.load("thread_shared")["messages"][0]["content"] == "Hola"
+
+        follower.remove("thread_shared")
+        assert not leader.contains("thread_shared")
+        print("✅ Índice sincronizado entre réplicas")
+
+
+def main():
+    """Función principal"""
+    print("🚀 CONVERSATION ARCHIVE TEST SUITE")
+    print("=" * 50)
+    test_archive_and_rehydrate()
+    test_activity_during_archive_is_kept()
+    test_hot_expiry_after_rehydrate()
+    test_archive_failure_keeps_hot_copy()
+    test_delete_and_purge()
+    test_shared_directory_between_replicas()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
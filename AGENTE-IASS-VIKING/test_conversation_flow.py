@@ -26,9 +26,12 @@ logging.basicConfig(
 
 # Importar los módulos necesarios
 from app.conversation_manager import MemoryConversationManager
+from app.lock_manager import InProcessLockManager
 from app.openai_responses_handler import generate_response_openai_mcp
 
-def send_message_to_thread(conversation_manager, thread_locks, thread_id, message, assistant_content, subscriber_id="test_user", llm_id="gpt-5"):
+def send_message_to_thread(conversation_manager, lock_manager, thread_id, message,
+                           assistant_content, subscriber_id="test_user",
+                           llm_id="gpt-5"):
     """Envía un mensaje a un thread específico."""
     print(f"\n🔥 [MESSAGE {len(conversation_manager.get(thread_id).get('messages', [])) // 2 + 1}] Enviando: '{message}'")
     
@@ -41,7 +44,7 @@ def send_message_to_thread(conversation_manager, thread_locks, thread_id, messag
         args=(message, assistant_content, thread_id, event, subscriber_id, llm_id),
         kwargs={
             'conversation_manager': conversation_manager,
-            'thread_locks': thread_locks,
+            'lock_manager': lock_manager,
             'mcp_servers': [],
             'assistant_number': 0
         }
@@ -74,7 +77,7 @@ def test_conversation_flow():
     
     # Inicializar conversation manager
     conversation_manager = MemoryConversationManager({})
-    thread_locks = {test_thread_id: threading.Lock()}
+    lock_manager = InProcessLockManager()
     
     # Crear conversación inicial
     conversation_manager.set(test_thread_id, {
@@ -88,7 +91,7 @@ def test_conversation_flow():
     # MENSAJE 1
     print(f"\n" + "="*60)
     response1 = send_message_to_thread(
-        conversation_manager, thread_locks, test_thread_id, 
+        conversation_manager, lock_manager, test_thread_id, 
         "Hola, ¿cómo estás?", test_assistant_content
     )
     
@@ -106,7 +109,7 @@ def test_conversation_flow():
     # MENSAJE 2
     print(f"\n" + "="*60)
     response2 = send_message_to_thread(
-        conversation_manager, thread_locks, test_thread_id, 
+        conversation_manager, lock_manager, test_thread_id, 
         "¿Cuál es tu nombre?", test_assistant_content
     )
     
@@ -124,7 +127,7 @@ def test_conversation_flow():
     # MENSAJE 3
     print(f"\n" + "="*60)
     response3 = send_message_to_thread(
-        conversation_manager, thread_locks, test_thread_id, 
+        conversation_manager, lock_manager, test_thread_id, 
         "¿Recuerdas mi primera pregunta?", test_assistant_content
     )
     
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Pruebas del ConversationManager en modo memoria
+Cubre la unidad de trabajo por turno y las operaciones básicas del manager,
+y las lecturas desde réplica del backend Redis con clientes falsos
+"""
+
+import os
+import sys
+import threading
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.conversation_manager import (MemoryConversationManager,
+                                      RedisConversationManager,
+                                      ConversationConflictError)
+from app.conversation_quota import ConversationQuota
+
+
+class CountingMemoryManager(MemoryConversationManager):
+    """Manager en memoria que cuenta las escrituras realizadas"""
+
+    def __init__(self):
+        super().__init__({})
+        self.update_calls = []
+
+    def update(self, thread_id, updates, expected_version=None):
+        self.update_calls.append(dict(updates))
+        return super().update(thread_id, updates, expected_version)
+
+
+def _new_manager(thread_id="thread_uow"):
+    manager = CountingMemoryManager()
+    manager.set(thread_id, {
+        "status": "completed",
+        "response": "respuesta anterior",
+        "messages": [{"role": "user", "content": "Hola"}],
+        "usage": None
+    })
+    return manager
+
+
+def test_unit_of_work_single_commit():
+    """Varias etapas dentro de un turno producen una sola escritura final"""
+    print("🧪 TESTING UNIT OF WORK - COMMIT")
+    thread_id = "thread_uow"
+    manager = _new_manager(thread_id)
+
+    with manager.unit_of_work(thread_id) as uow:
+        uow.checkpoint("processing")
+        history = list(manager.get(thread_id)["messages"])
+        for i in range(5):
+            history.append({"role": "assistant", "content": f"paso {i}"})
+            uow.stage({"messages": history})
+        uow.commit({"status": "completed", "response": "listo"})
+
+    assert len(manager.update_calls) == 2, manager.update_calls
+    assert manager.update_calls[0] == {"status": "processing"}
+    stored = manager.get(thread_id)
+    assert stored["status"] == "completed"
+    assert len(stored["messages"]) == 6
+    print(f"✅ Escrituras por turno: {uow.writes}")
+
+
+def test_unit_of_work_fail_keeps_history():
+    """Un fallo descarta el historial parcial y deja el estado error"""
+    print("🧪 TESTING UNIT OF WORK - FAIL")
+    thread_id = "thread_uow"
+    manager = _new_manager(thread_id)
+
+    uow = manager.unit_of_work(thread_id)
+    uow.stage({"messages": [{"role": "user", "content": "parcial"}]})
+    uow.fail("Error de comunicación: timeout")
+    uow.close()
+
+    stored = manager.get(thread_id)
+    assert stored["status"] == "error"
+    assert stored["messages"] == [{"role": "user", "content": "Hola"}]
+    print("✅ Historial previo conservado tras el error")
+
+
+def test_unit_of_work_crash_marks_error():
+    """Una excepción dentro del turno termina siempre en estado error"""
+    print("🧪 TESTING UNIT OF WORK - CRASH")
+    thread_id = "thread_uow"
+    manager = _new_manager(thread_id)
+
+    try:
+        with manager.unit_of_work(thread_id) as uow:
+            uow.stage({"response": "a medias"})
+            raise RuntimeError("fallo inesperado")
+    except RuntimeError:
+        pass
+
+    stored = manager.get(thread_id)
+    assert stored["status"] == "error"
+    assert "fallo inesperado" in stored["response"]
+
+    # Un turno que no existe en el almacenamiento se crea con estado error
+    missing = CountingMemoryManager()
+    missing.unit_of_work("thread_missing").fail("Conversación no encontrada")
+    assert missing.get("thread_missing")["status"] == "error"
+    print("✅ Estado terminal garantizado")
+
+
+def test_versioned_compare_and_set():
+    """Cada escritura incrementa la versión; un escritor desfasado recibe conflicto"""
+    print("🧪 TESTING VERSIONED COMPARE-AND-SET")
+    thread_id = "thread_cas"
+    manager = _new_manager(thread_id)
+    assert manager.get(thread_id)["version"] == 1
+
+    # Dos turnos leen la misma versión
+    first = manager.unit_of_work(thread_id)
+    second = manager.unit_of_work(thread_id)
+    first.version = second.version = manager.get(thread_id)["version"]
+
+    first.commit({"messages": [{"role": "user", "content": "turno 1"}]})
+    assert manager.get(thread_id)["version"] == 2
+
+    try:
+        second.commit({"messages": [{"role": "user", "content": "turno 2"}]})
+        raise AssertionError("Se esperaba ConversationConflictError")
+    except ConversationConflictError as conflict:
+        assert conflict.retryable
+        assert conflict.current_version == 2
+
+    # El historial del primer escritor no se pierde
+    assert manager.get(thread_id)["messages"] == [{"role": "user",
+                                                   "content": "turno 1"}]
+
+    # Las escrituras sin versión esperada siguen siendo incondicionales
+    assert manager.update(thread_id, {"status": "error"})
+    assert manager.get(thread_id)["version"] == 3
+    print("✅ Conflicto detectado sin pérdida de historial")
+
+
+def test_size_accounting_and_quota():
+    """Cada escritura registra tamaño y mensajes; la cuota compacta y recorta"""
+    print("🧪 TESTING TAMAÑO Y CUOTAS")
+    manager = MemoryConversationManager({})
+    manager.set("thread_small", {"status": "completed",
+                                 "messages": [{"role": "user", "content": "Hola"}]})
+    small = manager.get("thread_small")
+    assert small["message_count"] == 1
+    assert small["size_bytes"] > 0
+
+    manager.quota = ConversationQuota(max_bytes=3000, max_payload_chars=100)
+    history = []
+    for i in range(10):
+        history.append({"role": "user", "content": f"consulta {i}"})
+        history.append({"role": "tool", "content": "x" * 1000})  # full_body de n8n
+        history.append({"role": "assistant", "content": f"respuesta {i}"})
+    manager.set("thread_big", {"status": "completed", "messages": history})
+
+    big = manager.get("thread_big")
+    messages = list(big["messages"])
+    # Los payloads de herramientas se compactan antes de descartar turnos
+    assert big["message_count"] == len(history)
+    assert all(len(m["content"]) < 200 for m in messages if m["role"] == "tool")
+
+    # Con un límite menor se descartan turnos completos desde el inicio
+    manager.quota = ConversationQuota(max_bytes=400, max_payload_chars=100)
+    manager.update("thread_big", {"messages": messages})
+    trimmed = list(manager.get("thread_big")["messages"])
+    assert trimmed[0]["role"] == "user" and trimmed[0]["content"].startswith("consulta")
+    assert trimmed[-1] == messages[-1]
+    assert len(trimmed) < len(messages)
+
+    report = manager.get_size_report(top_n=1)
+    assert report["conversations"] == 2
+    assert report["largest"][0]["thread_id"] == "thread_big"
+    big = manager.get("thread_big")
+    assert report["total_bytes"] == small["size_bytes"] + big["size_bytes"]
+
+    # Límite por cantidad de mensajes
+    manager.quota = ConversationQuota(max_messages=4)
+    manager.update("thread_big", {"messages": history})
+    assert manager.get("thread_big")["message_count"] <= 4
+    print(f"✅ Reporte de tamaños: {report['largest']}")
+
+
+def test_list_conversations_pagination():
+    """El listado pagina con cursor y filtra por estado, asistente e inactividad"""
+    print("🧪 TESTING LISTADO PAGINADO")
+    manager = MemoryConversationManager({})
+    for i in range(7):
+        manager.set(f"thread_{i}", {
+            "status": "error" if i == 3 else "completed",
+            "assistant": i % 2,
+            "messages": [{"role": "user", "content": "Hola"}] * i
+        })
+    manager.conversations["thread_5"]["last_activity"] -= 3600
+
+    seen = []
+    cursor = None
+    while True:
+        page = manager.list_conversations(cursor=cursor, limit=3)
+        seen.extend(entry["thread_id"] for entry in page["conversations"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [f"thread_{i}" for i in range(7)]
+
+    summary = manager.list_conversations(limit=1)["conversations"][0]
+    assert "messages" not in summary
+    assert summary["message_count"] == 0 and summary["size_bytes"] > 0
+
+    def ids(**filters):
+        page = manager.list_conversations(limit=10, filters=filters)
+        return [e["thread_id"] for e in page["conversations"]]
+
+    assert ids(status="error") == ["thread_3"]
+    assert ids(assistant="1") == ["thread_1", "thread_3", "thread_5"]
+    assert ids(min_idle=600) == ["thread_5"]
+    assert "thread_5" not in ids(max_idle=600)
+    print("✅ Paginación y filtros correctos")
+
+
+def test_subscriber_active_thread_index():
+    """El índice subscriber -> hilo sigue a las escrituras, borrados y expiraciones"""
+    print("🧪 TESTING ÍNDICE DE HILO ACTIVO")
+    manager = MemoryConversationManager({})
+    manager.set("thread_a", {"status": "completed", "subscriber_id": "sub_1",
+                             "assistant": 1, "messages": []})
+    manager.set("thread_b", {"status": "completed", "subscriber_id": "sub_1",
+                             "assistant": 2, "messages": []})
+
+    assert manager.get_active_thread("sub_1", 1) == "thread_a"
+    assert manager.get_active_thread("sub_1", 2) == "thread_b"
+    assert manager.get_active_thread("sub_1") == "thread_b"
+    assert manager.get_active_thread("sub_2") is None
+
+    # Un nuevo mensaje en thread_a lo vuelve el más reciente del subscriber
+    manager.update("thread_a", {"subscriber_id": "sub_1", "assistant": 1})
+    assert manager.get_active_thread("sub_1") == "thread_a"
+
+    manager.delete("thread_a")
+    assert manager.get_active_thread("sub_1", 1) is None
+
+    manager.conversations["thread_b"]["last_activity"] -= 10 ** 6
+    manager.cleanup_expired(7200)
+    assert manager.get_active_thread("sub_1", 2) is None
+    assert manager._subscriber_index == {}
+    print("✅ Índice sincronizado")
+
+
+class FakeRedis:
+    """Cliente Redis mínimo: hashes en memoria"""
+
+    def __init__(self):
+        self.hashes = {}
+        self.reads = 0
+
+    def hgetall(self, key):
+        self.reads += 1
+        return dict(self.hashes.get(key, {}))
+
+
+class BrokenReplica(FakeRedis):
+    def hgetall(self, _key):
+        raise ConnectionError("réplica caída")
+
+
+def _redis_manager(replica):
+    """RedisConversationManager sobre clientes falsos (sin conexión ni scripts Lua)"""
+    manager = RedisConversationManager.__new__(RedisConversationManager)
+    manager.redis_client = FakeRedis()
+    manager.key_prefix = "conversation"
+    manager.sizes_key = "conversation_meta:sizes"
+    manager.ttl_seconds = 60
+    manager._setup_reads(replica)
+
+    def write_script(keys, args):
+        # Versión simplificada de WRITE_SCRIPT: sin compare-and-set ni TTL
+        stored = manager.redis_client.hashes.setdefault(keys[0], {})
+        stored.update(zip(args[4::2], args[5::2], strict=True))
+        stored["version"] = str(int(stored.get("version", 0)) + 1)
+        return [0, int(stored["version"])]
+    manager._write_script = write_script
+    return manager
+
+
+def _replicate(manager, thread_id):
+    key = manager._get_key(thread_id)
+    manager.replica_client.hashes[key] = dict(manager.redis_client.hashes[key])
+
+
+def test_redis_replica_reads():
+    """La réplica atrasada nunca devuelve una versión anterior a la escrita aquí"""
+    print("🧪 TESTING LECTURAS DESDE RÉPLICA")
+    manager = _redis_manager(FakeRedis())
+    primary, replica = manager.redis_client, manager.replica_client
+
+    manager.set("thread_r", {"status": "processing"})
+    _replicate(manager, "thread_r")
+    assert manager.get_stale("thread_r")["version"] == 1
+    assert manager._read_stats == {"replica_reads": 1, "primary_fallbacks": 0}
+
+    # Réplica atrasada: read-your-writes obliga a leer del primario
+    manager.update("thread_r", {"status": "completed"})
+    assert manager._written_versions["thread_r"] == 2
+    conversation = manager.get_stale("thread_r")
+    assert conversation["version"] == 2 and conversation["status"] == "completed"
+    assert manager._read_stats["primary_fallbacks"] == 1
+
+    # Réplica al día: vuelve a servir la lectura
+    _replicate(manager, "thread_r")
+    primary_reads = primary.reads
+    assert manager.get_stale("thread_r")["status"] == "completed"
+    assert primary.reads == primary_reads and manager._read_stats["replica_reads"] == 2
+
+    # min_version del llamador por encima de lo replicado
+    assert manager.get_stale("thread_r", min_version=3)["version"] == 2
+    assert primary.reads == primary_reads + 1
+
+    # Hilo escrito por otro proceso y aún no replicado
+    primary.hashes[manager._get_key("thread_otro")] = {"status": "completed",
+                                                       "version": "4"}
+    assert manager.get_stale("thread_otro")["version"] == 4
+    assert replica.reads > 0
+    print("✅ Réplica usada solo con la versión esperada")
+
+
+def test_redis_replica_missing_or_down():
+    """Sin réplica configurada o con la réplica caída se lee del primario"""
+    print("🧪 TESTING RÉPLICA AUSENTE")
+    manager = _redis_manager(None)
+    manager.set("thread_p", {"status": "completed"})
+    assert manager.get_stale("thread_p")["version"] == 1
+    assert manager._read_stats == {"replica_reads": 0, "primary_fallbacks": 0}
+
+    manager = _redis_manager(BrokenReplica())
+    manager.set("thread_p", {"status": "completed"})
+    assert manager.get_stale("thread_p")["status"] == "completed"
+    assert manager._read_stats["primary_fallbacks"] == 1
+
+    # Borrar olvida la versión y la memoria de versiones es acotada
+    manager.MAX_TRACKED_VERSIONS = 3
+    for i in range(5):
+        manager._remember_version(f"thread_{i}", i + 1)
+    assert list(manager._written_versions) == ["thread_2", "thread_3", "thread_4"]
+    manager._remember_version("thread_3", None)
+    assert "thread_3" not in manager._written_versions
+    print("✅ Lecturas al primario")
+
+
+def test_redis_read_stats_threadsafe():
+    """Los contadores de lecturas no pierden incrementos entre hilos"""
+    print("🧪 TESTING CONTADORES DE LECTURA")
+    manager = _redis_manager(FakeRedis())
+    manager.set("thread_s", {"status": "completed"})
+    _replicate(manager, "thread_s")
+
+    def read():
+        for _ in range(500):
+            manager.get_stale("thread_s")
+    workers = [threading.Thread(target=read) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert manager._read_stats["replica_reads"] == 4000
+    print("✅ 4000 lecturas contadas")
+
+
+def main():
+    """Función principal"""
+    print("🚀 CONVERSATION MANAGER TEST SUITE")
+    print("=" * 50)
+    test_unit_of_work_single_commit()
+    test_unit_of_work_fail_keeps_history()
+    test_unit_of_work_crash_marks_error()
+    test_versioned_compare_and_set()
+    test_size_accounting_and_quota()
+    test_list_conversations_pagination()
+    test_subscriber_active_thread_index()
+    test_redis_replica_reads()
+    test_redis_replica_missing_or_down()
+    test_redis_read_stats_threadsafe()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
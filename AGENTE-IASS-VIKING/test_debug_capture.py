@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la captura de depuración
+"""
+
+import os
+import sys
+import time
+import threading
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.debug_capture import DebugCapture
+from app.tool_executor import ToolCall, ToolExecutor
+
+
+def test_lazy_when_not_captured():
+    """Sin muestreo ni activación el payload no se serializa"""
+    print("🧪 TESTING CAPTURA PEREZOSA")
+    capture = DebugCapture(max_entries=10, sample_rate=0)
+    evaluated = []
+
+    assert capture.begin_turn("thread_1", "sub_1") is False
+    capture.record("openai_request", lambda: evaluated.append(1) or {"big": "x" * 1000})
+    capture.end_turn()
+
+    assert evaluated == []
+    assert capture.get_entries() == []
+    print("✅ Producer no evaluado")
+
+
+def test_targeted_capture_and_ring_buffer():
+    """Activación por subscriber, buffer acotado y propagación a herramientas"""
+    print("🧪 TESTING CAPTURA POR SUBSCRIBER")
+    capture = DebugCapture(max_entries=3, sample_rate=0, max_chars=100)
+    capture.enable(subscriber_id="sub_1", ttl_seconds=60)
+
+    def turn():
+        assert capture.begin_turn("thread_1", "sub_1") is True
+        capture.record("request", lambda: {"prompt": "p" * 500})
+        # Las herramientas del turno corren en otro hilo con el contexto copiado
+        executor = ToolExecutor(max_workers=2, default_timeout=5, timeouts={})
+        executor.run([ToolCall("n8n", lambda: capture.record("n8n_response",
+                                                             lambda: {"status": 200}))])
+        executor.shutdown()
+        capture.end_turn()
+
+    worker = threading.Thread(target=turn)
+    worker.start()
+    worker.join()
+
+    entries = capture.get_entries(subscriber_id="sub_1")
+    assert [entry["kind"] for entry in entries] == ["n8n_response", "request"]
+    assert entries[0]["thread_id"] == "thread_1"
+    assert "truncado" in entries[1]["data"]
+
+    # Otro subscriber no se captura
+    assert capture.begin_turn("thread_2", "sub_2") is False
+    capture.end_turn()
+
+    # El buffer retiene solo las últimas max_entries capturas
+    capture.begin_turn("thread_1", "sub_1")
+    for i in range(5):
+        capture.record(f"round_{i}", lambda: i)
+    capture.end_turn()
+    kinds = [entry["kind"] for entry in capture.get_entries()]
+    assert kinds == ["round_4", "round_3", "round_2"]
+    assert capture.get_stats()["dropped"] == 4
+
+    # La activación expira
+    capture.enable(thread_id="thread_3", ttl_seconds=0.05)
+    time.sleep(0.1)
+    assert capture.begin_turn("thread_3", None) is False
+    capture.end_turn()
+    print(f"✅ Estadísticas: {capture.get_stats()}")
+
+
+def main():
+    """Función principal"""
+    print("🚀 DEBUG CAPTURE TEST SUITE")
+    print("=" * 50)
+    test_lazy_when_not_captured()
+    test_targeted_capture_and_ring_buffer()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Pruebas de call_gemini_api contra un requests.post simulado
+"""
+
+import os
+import sys
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app.gemini_handler as gemini_handler
+from app.retry import retry_engine, ProviderHTTPError
+
+PAYLOAD = {"contents": [{"role": "user", "parts": [{"text": "hola"}]}],
+           "generationConfig": {"temperature": 0.8, "maxOutputTokens": 1000}}
+
+
+class FakeResponse:
+    def __init__(self, status_code, data, headers=None):
+        self.status_code = status_code
+        self._data = data
+        self.headers = headers or {}
+        self.text = str(data)
+
+    def json(self):
+        return self._data
+
+
+class FakePost:
+    """Devuelve las respuestas indicadas en orden y guarda cada llamada"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def __call__(self, url, headers=None, json=None, timeout=None):
+        self.calls.append({"url": url, "timeout": timeout})
+        return self.responses.pop(0)
+
+
+def ok_response():
+    return FakeResponse(200, {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": "¡Hola!"}]}}],
+        "usageMetadata": {"promptTokenCount": 12, "candidatesTokenCount": 3}
+    })
+
+
+def run_with(post):
+    original_post, original_sleep = gemini_handler.requests.post, retry_engine._sleep
+    gemini_handler.requests.post = post
+    retry_engine._sleep = lambda seconds: None
+    try:
+        return gemini_handler.call_gemini_api(PAYLOAD, "key", "thread_gemini",
+                                              "gemini-2.0-flash")
+    finally:
+        gemini_handler.requests.post = original_post
+        retry_engine._sleep = original_sleep
+
+
+def test_successful_call():
+    """Una respuesta 200 devuelve el JSON de Gemini"""
+    print("🧪 TESTING LLAMADA EXITOSA")
+    post = FakePost(ok_response())
+    data = run_with(post)
+    assert data["candidates"][0]["content"]["parts"][0]["text"] == "¡Hola!"
+    assert len(post.calls) == 1
+    assert post.calls[0]["url"].endswith("gemini-2.0-flash:generateContent")
+    print("✅ Respuesta recibida")
+
+
+def test_transient_error_is_retried():
+    """Un 503 se reintenta; un 400 falla sin reintentar"""
+    print("🧪 TESTING REINTENTOS")
+    post = FakePost(FakeResponse(503, {"error": {"message": "overloaded"}}),
+                    ok_response())
+    assert run_with(post)["usageMetadata"]["promptTokenCount"] == 12
+    assert len(post.calls) == 2
+
+    post = FakePost(FakeResponse(400, {"error": {"message": "bad request"}}))
+    try:
+        run_with(post)
+        raise AssertionError("un 400 debe propagarse")
+    except ProviderHTTPError as e:
+        assert e.status_code == 400 and "bad request" in str(e)
+    assert len(post.calls) == 1
+    print("✅ Reintentos correctos")
+
+
+def main():
+    """Función principal"""
+    print("🚀 GEMINI API TEST SUITE")
+    print("=" * 50)
+    test_successful_call()
+    test_transient_error_is_retried()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
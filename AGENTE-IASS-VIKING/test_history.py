@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Pruebas del historial inmutable de conversaciones
+Verifica structural sharing, snapshots y lecturas consistentes en modo memoria
+"""
+
+import os
+import sys
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.history import ConversationHistory
+from app.conversation_manager import MemoryConversationManager
+
+
+def test_append_does_not_modify_snapshot():
+    """Las versiones anteriores no cambian y comparten los bloques completos"""
+    print("🧪 TESTING APPEND PERSISTENTE")
+    size = ConversationHistory.CHUNK_SIZE * 3 + 5
+    history = ConversationHistory({"n": i} for i in range(size))
+    snapshot = history
+    longer = history.append({"n": size})
+
+    assert len(snapshot) == size
+    assert len(longer) == size + 1
+    assert longer[-1] == {"n": size}
+    assert snapshot[-1] == {"n": size - 1}
+    assert [item["n"] for item in longer] == list(range(size + 1))
+    index = ConversationHistory.CHUNK_SIZE + 1
+    assert longer[index] == {"n": index}
+    # Los bloques completos son los mismos objetos en ambas versiones
+    assert longer._chunks is snapshot._chunks
+
+    # Dos ramas desde el mismo snapshot son independientes
+    branch_a = snapshot.append("a")
+    branch_b = snapshot.append("b")
+    assert branch_a[-1] == "a" and branch_b[-1] == "b"
+    assert ConversationHistory([1, 2]) == [1, 2]
+    print("✅ Snapshots intactos tras append")
+
+
+def test_memory_manager_returns_consistent_snapshot():
+    """Un lector en modo memoria no ve los mensajes de un turno a medias"""
+    print("🧪 TESTING SNAPSHOT EN MODO MEMORIA")
+    manager = MemoryConversationManager({})
+    manager.set("thread_snap", {"status": "completed",
+                                "messages": [{"role": "user", "content": "Hola"}]})
+
+    reader_view = manager.get("thread_snap")
+    history = ConversationHistory.of(manager.get("thread_snap")["messages"])
+    history = history.append({"role": "assistant", "content": "Hola, ¿en qué ayudo?"})
+
+    # Aún no se guarda: el lector y el almacenamiento conservan el turno anterior
+    assert len(reader_view["messages"]) == 1
+    assert len(manager.get("thread_snap")["messages"]) == 1
+
+    manager.update("thread_snap", {"messages": history, "status": "completed"})
+    assert len(manager.get("thread_snap")["messages"]) == 2
+    assert len(reader_view["messages"]) == 1
+    assert reader_view["version"] == 1
+
+    # Modificar el snapshot no altera el registro almacenado
+    reader_view["status"] = "error"
+    assert manager.get("thread_snap")["status"] == "completed"
+    print("✅ Lectores aislados de escrituras en curso")
+
+
+def main():
+    """Función principal"""
+    print("🚀 CONVERSATION HISTORY TEST SUITE")
+    print("=" * 50)
+    test_append_does_not_modify_snapshot()
+    test_memory_manager_returns_consistent_snapshot()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
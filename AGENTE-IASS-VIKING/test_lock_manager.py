@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Pruebas del LockManager en proceso
+Verifica serialización por thread_id, timeouts y métricas de espera
+"""
+
+import os
+import sys
+import time
+import threading
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.lock_manager import InProcessLockManager, LockTimeoutError
+
+
+def test_serializes_same_thread():
+    """Dos turnos del mismo thread_id nunca se ejecutan a la vez"""
+    print("🧪 TESTING SERIALIZACIÓN POR THREAD_ID")
+    manager = InProcessLockManager()
+    active = []
+    overlaps = []
+
+    def turn():
+        with manager.lock("thread_a", timeout=5):
+            active.append(1)
+            if len(active) > 1:
+                overlaps.append(1)
+            time.sleep(0.02)
+            active.pop()
+
+    workers = [threading.Thread(target=turn) for _ in range(5)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert not overlaps
+    assert manager.get_metrics()["acquisitions"] == 5
+    print(f"✅ Métricas: {manager.get_metrics()}")
+
+
+def test_timeout_and_independent_threads():
+    """El timeout respeta el plazo y otros thread_id no esperan"""
+    print("🧪 TESTING TIMEOUT")
+    manager = InProcessLockManager()
+
+    with manager.lock("thread_a"):
+        assert manager.acquire("thread_a", timeout=0.05) is None
+        try:
+            manager.lock("thread_a", timeout=0.01)
+            raise AssertionError("Se esperaba LockTimeoutError")
+        except LockTimeoutError:
+            pass
+
+        other = manager.acquire("thread_b", timeout=0.05)
+        assert other is not None
+        other.release()
+
+    metrics = manager.get_metrics()
+    assert metrics["timeouts"] == 2
+    assert metrics["max_wait_seconds"] >= 0.04
+    print(f"✅ Timeouts registrados: {metrics['timeouts']}")
+
+
+def test_registry_and_contention():
+    """El registro elimina locks libres y registra la contención por hilo"""
+    print("🧪 TESTING REGISTRO Y CONTENCIÓN")
+    manager = InProcessLockManager()
+    holder = manager.acquire("thread_hot", owner="sub_1")
+    results = []
+
+    def waiter(owner):
+        handle = manager.acquire("thread_hot", timeout=5, owner=owner)
+        results.append(handle is not None)
+        handle.release()
+
+    workers = [threading.Thread(target=waiter, args=(f"sub_{i}",)) for i in range(2, 4)]
+    for worker in workers:
+        worker.start()
+    time.sleep(0.05)
+    assert manager.get_metrics()["active_locks"] == 1
+    holder.release()
+    for worker in workers:
+        worker.join()
+
+    assert results == [True, True]
+    # Sin turnos en curso el registro queda vacío
+    assert manager.get_metrics()["active_locks"] == 0
+
+    cold = manager.acquire("thread_cold", owner="sub_9")
+    cold.release()
+
+    contention = manager.get_contention(top_n=1)
+    assert len(contention) == 1
+    hot = contention[0]
+    assert hot["thread_id"] == "thread_hot"
+    assert hot["acquisitions"] == 3
+    assert hot["max_queue_length"] >= 1
+    assert "sub_2" in hot["owners"] and "sub_3" in hot["owners"]
+
+    # La poda solo descarta estadísticas de hilos inactivos
+    assert manager.prune(max_idle_seconds=3600) == 0
+    assert manager.prune(max_idle_seconds=0) == 2
+    assert manager.get_contention() == []
+    print(f"✅ Hilo con más contención: {hot['thread_id']}")
+
+
+def main():
+    """Función principal"""
+    print("🚀 LOCK MANAGER TEST SUITE")
+    print("=" * 50)
+    test_serializes_same_thread()
+    test_timeout_and_independent_threads()
+    test_registry_and_contention()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Pruebas del logging asíncrono con cola
+"""
+
+import io
+import os
+import sys
+import json
+import logging
+import threading
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.logging_config import setup_logging, stop_logging, get_logging_stats
+
+
+class BlockedStream:
+    """stdout detenido hasta que se libera"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.lines = []
+
+    def write(self, text):
+        self.release.wait()
+        self.lines.append(text)
+
+    def flush(self):
+        pass
+
+
+def test_json_output_and_module_levels():
+    """Una línea JSON por registro con campos extra y niveles por módulo"""
+    print("🧪 TESTING SALIDA JSON")
+    root_handlers = logging.getLogger().handlers[:]
+    stream = io.StringIO()
+    setup_logging(stream=stream, level="INFO", fmt="json", policy="drop",
+                  queue_size=100,
+                  module_levels={"test.silenciado": "WARNING"})
+    try:
+        logging.getLogger("test.turno").info("turno %s", "completado",
+                                             extra={"thread_id": "thread_1"})
+        logging.getLogger("test.silenciado").info("no se escribe")
+    finally:
+        stop_logging()
+        logging.getLogger().handlers = root_handlers
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(lines) == 1, lines
+    assert lines[0]["message"] == "turno completado"
+    assert lines[0]["logger"] == "test.turno" and lines[0]["level"] == "INFO"
+    assert lines[0]["thread_id"] == "thread_1"
+    print(f"✅ {lines[0]}")
+
+
+def test_exception_formatted_by_listener():
+    """El traceback llega al formatter del listener como campo exc_info"""
+    print("🧪 TESTING EXCEPCIONES")
+    root_handlers = logging.getLogger().handlers[:]
+    stream = io.StringIO()
+    setup_logging(stream=stream, level="INFO", fmt="json", policy="drop",
+                  queue_size=100, module_levels={})
+    datos = {"intento": 1}
+    try:
+        try:
+            raise ValueError("pedido inválido")
+        except ValueError:
+            logging.getLogger("test.turno").exception("Error en turno %s con %s",
+                                                      "thread_1", datos)
+        datos["intento"] = 2  # mutar después de encolar no cambia el mensaje
+    finally:
+        stop_logging()
+        logging.getLogger().handlers = root_handlers
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(lines) == 1, lines
+    message = lines[0]["message"]
+    assert message == "Error en turno thread_1 con {'intento': 1}", message
+    assert "Traceback" in lines[0]["exc_info"]
+    assert "ValueError: pedido inválido" in lines[0]["exc_info"]
+    print("✅ Traceback en exc_info")
+
+
+def test_drop_policy_keeps_warnings():
+    """Con la cola llena se descartan INFO pero no WARNING"""
+    print("🧪 TESTING POLÍTICA DROP")
+    root_handlers = logging.getLogger().handlers[:]
+    stream = BlockedStream()
+    setup_logging(stream=stream, level="INFO", fmt="text", policy="drop", queue_size=5,
+                  module_levels={})
+    logger = logging.getLogger("test.drop")
+    try:
+        for i in range(50):
+            logger.info("evento %d", i)
+        dropped = get_logging_stats()["dropped"]
+        warning = threading.Thread(target=logger.warning, args=("advertencia",))
+        warning.start()
+        stream.release.set()
+        warning.join()
+    finally:
+        stop_logging()
+        logging.getLogger().handlers = root_handlers
+
+    assert dropped >= 40, dropped
+    assert any("advertencia" in line for line in stream.lines)
+    print(f"✅ Descartados: {dropped}, escritos: {len(stream.lines)}")
+
+
+def main():
+    """Función principal"""
+    print("🚀 LOGGING CONFIG TEST SUITE")
+    print("=" * 50)
+    test_json_output_and_module_levels()
+    test_exception_formatted_by_listener()
+    test_drop_policy_keeps_warnings()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -26,6 +26,7 @@ logging.basicConfig(
 
 # Importar los módulos necesarios
 from app.conversation_manager import MemoryConversationManager
+from app.lock_manager import InProcessLockManager
 from app.openai_responses_handler import generate_response_openai_mcp
 
 def test_minimal_handler():
@@ -46,7 +47,7 @@ def test_minimal_handler():
     
     # Inicializar conversation manager
     conversation_manager = MemoryConversationManager({})
-    thread_locks = {test_thread_id: threading.Lock()}
+    lock_manager = InProcessLockManager()
     
     # Crear conversación inicial (como lo hace endpoints.py)
     conversation_manager.set(test_thread_id, {
@@ -75,7 +76,7 @@ def test_minimal_handler():
         ),
         kwargs={
             'conversation_manager': conversation_manager,
-            'thread_locks': thread_locks,
+            'lock_manager': lock_manager,
             'mcp_servers': [],  # Sin MCP servers para test mínimo
             'assistant_number': 0
         }
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Pruebas del ensamblado de prompts para la caché del proveedor
+"""
+
+import os
+import sys
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.prompt_cache import (render_prompt, split_prompt, prompt_cache_key,
+                              PromptCacheStats)
+
+TEMPLATE = (
+    "Eres el asistente de Energitel.\n"
+    "  - El nombre del Usuario en el sistema  es {{name}}\n"
+    "- La fecha y hora de hoy es: {{fecha_hora}}\n"
+    "Saluda a {{name}} por su nombre.\n"
+)
+
+
+def test_static_prefix_is_byte_stable():
+    """El prefijo no cambia entre requests aunque cambien las variables"""
+    print("🧪 TESTING PREFIJO ESTÁTICO")
+    first = render_prompt(TEMPLATE, {"name": "Ana", "fecha_hora": "2026-10-19 10:00"})
+    second = render_prompt(TEMPLATE, {"name": "Luis", "fecha_hora": "2026-10-19 10:01"})
+
+    static_1, dynamic_1 = split_prompt(first)
+    static_2, dynamic_2 = split_prompt(second)
+    assert static_1 == static_2
+    assert "{{" not in static_1 and "[fecha_hora]" in static_1 and "Ana" not in static_1
+    assert dynamic_1.splitlines()[-2:] == ["- name: Ana", "- fecha_hora: "
+                                                          "2026-10-19 10:00"]
+    assert "Luis" in dynamic_2
+    assert first.startswith(static_1)
+    print(f"✅ Prefijo de {len(static_1)} caracteres idéntico")
+
+
+def test_prompt_without_variables():
+    """Sin variables el prompt queda igual y no hay sección dinámica"""
+    print("🧪 TESTING PROMPT SIN VARIABLES")
+    assert render_prompt("Eres un asistente útil.", {}) == "Eres un asistente útil."
+    assert split_prompt("Eres un asistente útil.") == ("Eres un asistente útil.", None)
+    assert "- name: [UNDEFINED]" in render_prompt("Hola {{name}}", {})
+    print("✅ Sin cambios")
+
+
+def test_cache_key_and_stats():
+    """Clave estable por asistente y ratio de tokens cacheados por modelo"""
+    print("🧪 TESTING CLAVE Y ESTADÍSTICAS")
+    static, _ = split_prompt(render_prompt(TEMPLATE, {"name": "Ana"}))
+    assert prompt_cache_key(1, static) == prompt_cache_key(1, static)
+    assert prompt_cache_key(1, static) != prompt_cache_key(2, static)
+    assert prompt_cache_key(1, static) != prompt_cache_key(1, static + " ")
+
+    stats = PromptCacheStats()
+    stats.record("gpt-5", 2000, 0)
+    stats.record("gpt-5", 2100, 1920)
+    stats.record("claude", 500, 0)
+    result = stats.get_stats()
+    assert result["gpt-5"]["requests"] == 2 and result["gpt-5"]["hits"] == 1
+    assert result["gpt-5"]["cached_ratio"] == round(1920 / 4100, 4)
+    assert result["claude"]["cached_ratio"] == 0.0
+    print(f"✅ {result}")
+
+
+def main():
+    """Función principal"""
+    print("🚀 PROMPT CACHE TEST SUITE")
+    print("=" * 50)
+    test_static_prefix_is_byte_stable()
+    test_prompt_without_variables()
+    test_cache_key_and_stats()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
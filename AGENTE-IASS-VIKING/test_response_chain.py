@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Pruebas del modo incremental de Responses API (cadena de previous_response_id)
+"""
+
+import contextlib
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app.openai_responses_handler as handler
+from app.prompt_cache import render_prompt
+
+TEMPLATE = ("Eres el asistente de Energitel.\n"
+            "La fecha y hora de hoy es: {{fecha_hora}}\n")
+MODEL = "gpt-5"
+
+
+def prompt(fecha_hora):
+    return render_prompt(TEMPLATE, {"fecha_hora": fecha_hora})
+
+
+def chained_conversation(messages, fecha_hora="2026-10-19 10:00"):
+    return {
+        "messages": messages,
+        "previous_response_id": "resp_old",
+        "response_chain_length": len(messages),
+        "prompt_hash": handler.prompt_fingerprint(prompt(fecha_hora), MODEL),
+    }
+
+
+class OpenAIError(Exception):
+    """Imita un error 400 del SDK de OpenAI"""
+
+    def __init__(self, message, status_code=400, param=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.param = param
+
+
+def test_fingerprint_ignores_variables():
+    """El hash solo cambia con el prefijo estático o el modelo"""
+    print("🧪 TESTING HUELLA DEL PROMPT")
+    first = handler.prompt_fingerprint(prompt("2026-10-19 10:00"), MODEL)
+    assert first == handler.prompt_fingerprint(prompt("2026-10-19 10:05"), MODEL)
+    assert first != handler.prompt_fingerprint(prompt("2026-10-19 10:00"), "gpt-4o")
+    other = render_prompt("Otro asistente {{fecha_hora}}", {})
+    assert first != handler.prompt_fingerprint(other, MODEL)
+    print(f"✅ Huella estable: {first}")
+
+
+def test_chain_status_reasons():
+    """Cada motivo de invalidación de la cadena"""
+    print("🧪 TESTING ESTADO DE LA CADENA")
+    messages = [{"role": "user", "content": "hola"},
+                {"role": "assistant", "content": "¡Hola!"}]
+    fingerprint = handler.prompt_fingerprint(prompt("2026-10-19 11:00"), MODEL)
+    conversation = chained_conversation(messages)
+
+    status = handler.response_chain_status
+    assert status(conversation, 2, fingerprint) == (True, "cadena válida")
+    unchained = dict(conversation, previous_response_id=None)
+    assert status(unchained, 2, fingerprint)[1] == "sin previous_response_id"
+    assert status(conversation, 4, fingerprint)[1] == ("historial modificado fuera "
+                                                       "de la cadena")
+    other = handler.prompt_fingerprint(prompt("x"), "gpt-4o")
+    assert status(conversation, 2, other)[1] == "system prompt o modelo cambiaron"
+
+    original = handler.INCREMENTAL_INPUT_ENABLED
+    handler.INCREMENTAL_INPUT_ENABLED = False
+    try:
+        disabled = (False, "modo incremental deshabilitado")
+        assert status(conversation, 2, fingerprint) == disabled
+    finally:
+        handler.INCREMENTAL_INPUT_ENABLED = original
+    print("✅ Motivos correctos")
+
+
+def test_invalid_previous_response_detection():
+    """Solo los errores del previous_response_id activan el reenvío completo"""
+    print("🧪 TESTING ERRORES DE CADENA")
+    is_invalid = handler.is_invalid_previous_response_error
+    assert is_invalid(OpenAIError("Invalid", param="previous_response_id"))
+    assert is_invalid(OpenAIError("Previous response with id 'resp_1' not found.", 404))
+    assert not is_invalid(OpenAIError("Invalid 'input'"))
+    assert not is_invalid(OpenAIError("previous_response overloaded", 500))
+    assert not is_invalid(RuntimeError("Error en ronda 2: previous_response"))
+    print("✅ Detección correcta")
+
+
+class FakeClient:
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+        self.responses = self
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class Store:
+    """ConversationManager y unidad de trabajo en memoria"""
+
+    def __init__(self, conversation):
+        self.conversation = conversation
+
+    def get(self, _thread_id):
+        return dict(self.conversation)
+
+    def unit_of_work(self, _thread_id):
+        store = self
+
+        class UnitOfWork:
+            def begin(self, conversation, _metadata=None):
+                pass
+
+            def stage(self, data):
+                pass
+
+            def commit(self, data):
+                store.conversation.update(data)
+
+            def fail(self, error, _data=None):
+                store.conversation["error"] = error
+
+            def close(self):
+                pass
+        return UnitOfWork()
+
+
+class Locks:
+    def acquire(self, _thread_id, **_options):
+        return contextlib.nullcontext()
+
+
+def test_expired_chain_falls_back_to_full_history():
+    """Con previous_response_id inválido el turno se repite con el historial completo"""
+    print("🧪 TESTING REENVÍO COMPLETO")
+    messages = [{"role": "user", "content": "hola"},
+                {"role": "assistant", "content": "¡Hola! ¿En qué te ayudo?"}]
+    store = Store(chained_conversation(messages))
+    answer = SimpleNamespace(id="resp_new", output=[],
+                             output_text="Tu pedido va en camino",
+                             usage=SimpleNamespace(input_tokens=300, output_tokens=8))
+    expired = OpenAIError("Previous response with id 'resp_old' not found.", 400,
+                          param="previous_response_id")
+    client = FakeClient(expired, answer)
+
+    originals = handler.get_openai_client, os.environ.get("OPENAI_API_KEY")
+    handler.get_openai_client = lambda _api_key: client
+    os.environ["OPENAI_API_KEY"] = "sk-test"
+    try:
+        handler.generate_response_openai_mcp("¿y mi pedido?",
+                                             prompt("2026-10-19 10:05"), "thread_chain",
+                                             threading.Event(), "sub_1", MODEL, store,
+                                             Locks(), None, 1)
+    finally:
+        handler.get_openai_client = originals[0]
+        if originals[1] is None:
+            os.environ.pop("OPENAI_API_KEY", None)
+        else:
+            os.environ["OPENAI_API_KEY"] = originals[1]
+
+    assert len(client.calls) == 2, store.conversation.get("error")
+    assert client.calls[0]["previous_response_id"] == "resp_old"
+    assert len(client.calls[0]["input"]) == 2  # variables + mensaje nuevo
+    assert "previous_response_id" not in client.calls[1]
+    texts = [item["content"][0]["text"] for item in client.calls[1]["input"]]
+    assert "hola" in texts and "¡Hola! ¿En qué te ayudo?" in texts
+    assert texts[-1] == "¿y mi pedido?"
+    assert store.conversation["status"] == "completed"
+    assert store.conversation["previous_response_id"] == "resp_new"
+    assert store.conversation["usage"]["input_tokens_saved"] == 0
+    print("✅ Historial completo reenviado y cadena reiniciada")
+
+
+def main():
+    """Función principal"""
+    print("🚀 RESPONSE CHAIN TEST SUITE")
+    print("=" * 50)
+    test_fingerprint_ignores_variables()
+    test_chain_status_reasons()
+    test_invalid_previous_response_detection()
+    test_expired_chain_falls_back_to_full_history()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
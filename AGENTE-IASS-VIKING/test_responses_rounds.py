@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Pruebas del bucle de herramientas sobre Responses API (run_responses_rounds)
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+from types import SimpleNamespace
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app.openai_responses_handler as handler
+from app.tool_registry import ToolRegistry
+
+TOOLS = [{"type": "function", "name": "consultar_pedido",
+          "description": "Estado de un pedido",
+          "parameters": {"type": "object",
+                         "properties": {"pedido": {"type": "string"}}}}]
+FULL_INPUT = [{"role": "system",
+               "content": [{"type": "input_text", "text": "Eres X."}]},
+              {"role": "user",
+               "content": [{"type": "input_text", "text": "¿Y mi pedido?"}]}]
+PARAMETERS = {"temperature": 1.0, "max_completion_tokens": 100}
+
+
+def function_call(name, call_id, arguments='{"pedido": "A-17"}'):
+    return SimpleNamespace(type="function_call", name=name, call_id=call_id,
+                           arguments=arguments)
+
+
+def text_response(response_id, text="Tu pedido va en camino"):
+    return SimpleNamespace(id=response_id, output=[SimpleNamespace(type="message")],
+                           output_text=text,
+                           usage=SimpleNamespace(input_tokens=100, output_tokens=10))
+
+
+def calls_response(response_id, *calls):
+    return SimpleNamespace(id=response_id, output=list(calls), output_text="",
+                           usage=SimpleNamespace(input_tokens=100, output_tokens=5))
+
+
+class FakeClient:
+    """responses.create devuelve (o lanza) los elementos indicados en orden"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+        self.responses = self
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class Patched:
+    """Registro de herramientas temporal y ejecución de tools simulada"""
+
+    def __enter__(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tools_path = os.path.join(self.tmp.name, "tools.json")
+        with open(tools_path, "w", encoding="utf-8") as f:
+            json.dump(TOOLS, f)
+        self.executed = []
+        self.originals = (handler.tool_registry, handler.execute_function_tool,
+                          handler.MAX_TOOL_ROUNDS)
+        handler.tool_registry = ToolRegistry({1: "tools.json", 5: "tools.json"},
+                                             base_dir=self.tmp.name)
+        handler.execute_function_tool = self.execute
+        return self
+
+    def execute(self, name, args, assistant_number, subscriber_id=None, thread_id=None):
+        self.executed.append((name, args))
+        return {"estado": "en ruta", "pedido": args.get("pedido")}
+
+    def __exit__(self, *exc):
+        (handler.tool_registry, handler.execute_function_tool,
+         handler.MAX_TOOL_ROUNDS) = self.originals
+        self.tmp.cleanup()
+
+
+def run(client, deadline=None):
+    return handler.run_responses_rounds(client, FULL_INPUT, TOOLS, "gpt-5",
+                                        "thread_test", PARAMETERS, 1,
+                                        subscriber_id="sub_1", deadline=deadline)
+
+
+def test_several_rounds_before_text():
+    """Cada ronda envía los outputs con el previous_response_id anterior"""
+    print("🧪 TESTING VARIAS RONDAS")
+    client = FakeClient(
+        calls_response("resp_1", function_call("consultar_pedido", "call_1")),
+        calls_response("resp_2", function_call("consultar_pedido", "call_2",
+                                               '{"pedido": "B-2"}')),
+        text_response("resp_3"),
+    )
+    with Patched() as patched:
+        response, rounds = run(client)
+
+    assert response.id == "resp_3" and len(rounds) == 3
+    assert [r["function_calls"] for r in rounds] == [["consultar_pedido"],
+                                                     ["consultar_pedido"], []]
+    assert patched.executed == [("consultar_pedido", {"pedido": "A-17"}),
+                                ("consultar_pedido", {"pedido": "B-2"})]
+    assert client.calls[0]["input"] == FULL_INPUT
+    assert "previous_response_id" not in client.calls[0]
+    assert client.calls[1]["previous_response_id"] == "resp_1"
+    assert client.calls[2]["previous_response_id"] == "resp_2"
+    output = client.calls[2]["input"][0]
+    assert output["type"] == "function_call_output" and output["call_id"] == "call_2"
+    assert json.loads(output["output"])["pedido"] == "B-2"
+    assert all("tool_choice" not in call for call in client.calls)
+    print(f"✅ {len(rounds)} rondas")
+
+
+def test_last_round_forces_text():
+    """La ronda MAX_TOOL_ROUNDS+1 usa tool_choice='none' y termina el bucle"""
+    print("🧪 TESTING LÍMITE DE RONDAS")
+    client = FakeClient(*[calls_response(f"resp_{i}",
+                                         function_call("consultar_pedido", f"call_{i}"))
+                          for i in range(1, 4)])
+    with Patched() as patched:
+        handler.MAX_TOOL_ROUNDS = 2
+        response, rounds = run(client)
+
+    assert len(client.calls) == 3 and len(rounds) == 3 and response.id == "resp_3"
+    assert client.calls[2]["tool_choice"] == "none"
+    assert "tool_choice" not in client.calls[1]
+    assert len(patched.executed) == 2  # las calls de la última ronda no se ejecutan
+    print("✅ tool_choice='none' en la última ronda")
+
+
+def test_error_after_first_round_is_wrapped():
+    """Un error tras ejecutar herramientas no repite el turno con historial completo"""
+    print("🧪 TESTING ERROR EN RONDA 2")
+    client = FakeClient(calls_response("resp_1",
+                                       function_call("consultar_pedido", "call_1")),
+                        ValueError("respuesta inválida"))
+    with Patched() as patched:
+        try:
+            run(client)
+            raise AssertionError("debe fallar")
+        except RuntimeError as e:
+            assert "ronda 2" in str(e) and isinstance(e.__cause__, ValueError)
+    assert len(client.calls) == 2 and len(patched.executed) == 1
+    assert client.calls[1]["input"] != FULL_INPUT
+    assert client.calls[1]["previous_response_id"] == "resp_1"
+
+    # En la ronda 1 el error original se propaga (el turno aún no ejecutó nada)
+    with Patched():
+        try:
+            run(FakeClient(ValueError("formato")))
+            raise AssertionError("debe fallar")
+        except ValueError:
+            pass
+    print("✅ RuntimeError sin reenvío del historial")
+
+
+def test_unknown_tool_returns_error_output():
+    """Una function call desconocida recibe un error como output"""
+    print("🧪 TESTING HERRAMIENTA DESCONOCIDA")
+    with Patched() as patched:
+        outputs = handler.execute_function_calls(
+            [function_call("borrar_todo", "call_x"),
+             function_call("consultar_pedido", "call_y")], 1, "sub_1", "thread_test")
+    assert [item["call_id"] for item in outputs] == ["call_x", "call_y"]
+    assert json.loads(outputs[0]["output"]) == {"error": "Herramienta no "
+                                                         "disponible: borrar_todo"}
+    assert patched.executed == [("consultar_pedido", {"pedido": "A-17"})]
+    print("✅ Error como function_call_output")
+
+
+def test_expired_deadline():
+    """Sin tiempo restante no se llama al modelo"""
+    print("🧪 TESTING PLAZO AGOTADO")
+    client = FakeClient(text_response("resp_1"))
+    with Patched():
+        try:
+            run(client, deadline=time.time() - 1)
+            raise AssertionError("debe fallar por plazo")
+        except TimeoutError as e:
+            assert "ronda 1" in str(e)
+    assert client.calls == []
+    print("✅ TimeoutError antes de la ronda")
+
+
+def main():
+    """Función principal"""
+    print("🚀 RESPONSES ROUNDS TEST SUITE")
+    print("=" * 50)
+    test_several_rounds_before_text()
+    test_last_round_forces_text()
+    test_error_after_first_round_is_wrapped()
+    test_unknown_tool_returns_error_output()
+    test_expired_deadline()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
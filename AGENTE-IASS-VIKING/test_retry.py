@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Pruebas del motor de reintentos compartido
+"""
+
+import os
+import sys
+import time
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.retry import (RetryEngine, RetryBudget, ProviderHTTPError, classify_error,
+                       parse_retry_after)
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class APIStatusError(Exception):
+    """Imita los errores de estado de los SDK (status_code + response)"""
+
+    def __init__(self, status_code, headers=None, message="error"):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = FakeResponse(status_code, headers)
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+def flaky(errors, result="ok"):
+    """Llamada que lanza los errores indicados y luego responde"""
+    calls = []
+
+    def func():
+        calls.append(time.time())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return func, calls
+
+
+def test_classification():
+    """Transitorios vs terminales y Retry-After"""
+    print("🧪 TESTING CLASIFICACIÓN")
+    assert classify_error(APIStatusError(429))[0]
+    assert classify_error(APIStatusError(529))[0]
+    assert classify_error(ProviderHTTPError(503, "unavailable"))[0]
+    assert classify_error(APIConnectionError("reset"))[0]
+    assert classify_error(TimeoutError())[0]
+    assert not classify_error(APIStatusError(400))[0]
+    assert not classify_error(APIStatusError(401))[0]
+    assert not classify_error(APIStatusError(429, message="insufficient_quota"))[0]
+    assert not classify_error(ValueError("formato"))[0]
+
+    assert classify_error(APIStatusError(429, {"Retry-After": "7"}))[2] == 7
+    assert parse_retry_after({"retry-after-ms": "1500"}) == 1.5
+    assert parse_retry_after({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}) == 0
+    assert parse_retry_after({}) is None
+    print("✅ Clasificación correcta")
+
+
+def test_retries_and_backoff():
+    """Reintenta transitorios con jitter y no reintenta terminales"""
+    print("🧪 TESTING REINTENTOS")
+    sleeps = []
+    engine = RetryEngine(max_attempts=3, base_delay=1, budget=RetryBudget(),
+                         sleep=sleeps.append)
+
+    func, calls = flaky([APIStatusError(503), APIConnectionError()])
+    assert engine.call(func, "test") == "ok" and len(calls) == 3
+    assert 0 <= sleeps[0] <= 2 and 0 <= sleeps[1] <= 4, sleeps
+
+    func, calls = flaky([APIStatusError(400)])
+    try:
+        engine.call(func, "test")
+        raise AssertionError("un 400 no debe reintentarse")
+    except APIStatusError:
+        assert len(calls) == 1
+
+    func, calls = flaky([APIStatusError(500)] * 5)
+    try:
+        engine.call(func, "test")
+        raise AssertionError("debe rendirse tras max_attempts")
+    except APIStatusError:
+        assert len(calls) == 3
+
+    sleeps.clear()
+    func, calls = flaky([APIStatusError(429, {"retry-after": "2"})])
+    assert engine.call(func, "test") == "ok" and sleeps == [2.0]
+
+    stats = engine.get_stats()["operations"]["test"]
+    assert stats["terminal"] == 1 and stats["exhausted"] == 1, stats
+    assert stats["succeeded_after_retry"] == 2, stats
+    print(f"✅ Reintentos correctos: {stats}")
+
+
+def test_deadline_and_budget():
+    """No espera más allá del plazo y el presupuesto corta los reintentos"""
+    print("🧪 TESTING PLAZO Y PRESUPUESTO")
+    sleeps = []
+    engine = RetryEngine(max_attempts=5, budget=RetryBudget(), sleep=sleeps.append)
+    func, calls = flaky([APIStatusError(429, {"retry-after": "10"})])
+    try:
+        engine.call(func, "test", deadline=time.time() + 1)
+        raise AssertionError("no debe esperar más allá del plazo")
+    except APIStatusError:
+        assert len(calls) == 1 and not sleeps
+
+    budget = RetryBudget(ratio=0.5, min_retries=1, window_seconds=60)
+    engine = RetryEngine(max_attempts=3, base_delay=0, budget=budget,
+                         sleep=lambda seconds: None)
+    failures = 0
+    for _ in range(4):
+        func, _calls = flaky([APIStatusError(503)] * 10)
+        try:
+            engine.call(func, "test")
+        except APIStatusError:
+            failures += 1
+    stats = engine.get_stats()
+    # 4 llamadas => 1 + 0.5 * 4 = 3 reintentos en la ventana
+    assert failures == 4 and stats["operations"]["test"]["retries"] == 3, stats
+    assert stats["operations"]["test"]["budget_exhausted"] >= 1
+    print(f"✅ Presupuesto respetado: {stats['budget']}")
+
+
+def main():
+    """Función principal"""
+    print("🚀 RETRY TEST SUITE")
+    print("=" * 50)
+    test_classification()
+    test_retries_and_backoff()
+    test_deadline_and_budget()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
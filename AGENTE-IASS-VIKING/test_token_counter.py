@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Pruebas del conteo local de tokens y el recorte pre-flight
+"""
+
+import os
+import sys
+import importlib
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.utils.token_counter import TokenCounter, trim_messages, provider_for
+from app.utils.cost_calculator import cost_calculator
+
+# app.utils reexporta el singleton token_counter con el mismo nombre que el módulo
+token_counter_module = importlib.import_module("app.utils.token_counter")
+
+
+def test_counts_and_cache():
+    """Conteo por proveedor, caché de textos repetidos y ventanas de contexto"""
+    print("🧪 TESTING CONTEO Y CACHÉ")
+    # Sin tiktoken: el resultado no depende de la red ni de la versión instalada
+    counter = TokenCounter(cache_size=10, use_tiktoken=False)
+    text = "Eres el asistente de Energitel. " * 50
+
+    openai_tokens = counter.count_text(text, "gpt-5")
+    claude_tokens = counter.count_text(text, "claude-3-haiku")
+    assert openai_tokens == len(text) // 4 and counter.backend == "aproximado"
+    assert claude_tokens == -(-len(text) // 3.5)  # aproximación de Anthropic
+    assert counter.count_text(text, "gpt-5") == openai_tokens
+    assert counter.get_stats()["hits"] == 1
+
+    tools = [{"type": "function", "name": "cambiar_nombre",
+              "parameters": {"type": "object"}}]
+    assert counter.count_tools(tools, "gpt-5") > 0
+    assert counter.count_tools([], "gpt-5") == 0
+
+    assert provider_for("gemini-2.0-flash") == "gemini"
+    assert counter.context_window("gpt-5-mini") == 400000
+    assert counter.context_window("gemini-1.5-pro-002") == 2097152
+    assert counter.input_budget("gpt-4", 1000) < 8192 - 1000
+    print(f"✅ {openai_tokens} tokens OpenAI ({counter.backend}), "
+          f"{claude_tokens} Anthropic")
+
+
+def test_trim_keeps_valid_turns():
+    """El recorte descarta lo más antiguo sin dejar tool_result huérfanos"""
+    print("🧪 TESTING RECORTE")
+    counter = TokenCounter(use_tiktoken=False)
+    filler = "x" * 350  # ~100 tokens aproximados por mensaje
+    messages = [
+        {"role": "user", "content": "hola " + filler},
+        {"role": "assistant",
+         "content": [{"type": "tool_use", "id": "t1", "name": "n", "input": {}}]},
+        {"role": "user",
+         "content": [{"type": "tool_result", "tool_use_id": "t1", "content": filler}]},
+        {"role": "assistant", "content": "listo " + filler},
+        {"role": "user", "content": "gracias " + filler},
+        {"role": "assistant", "content": "a la orden " + filler},
+        {"role": "user", "content": "mensaje actual"},
+    ]
+
+    def turn_start(message):
+        content = message["content"]
+        return message["role"] == "user" and (isinstance(content, str)
+                                              or content[0]["type"] != "tool_result")
+
+    kept, dropped, tokens = trim_messages(messages, 250, "claude-3-haiku", turn_start,
+                                          counter)
+    assert kept[0]["content"].startswith("gracias") and dropped == 4, (dropped, kept[0])
+    assert tokens <= 250
+
+    kept, dropped, _ = trim_messages(messages, 10**6, "claude-3-haiku", turn_start,
+                                     counter)
+    assert dropped == 0 and kept == messages
+
+    # Aunque nada quepa, el mensaje actual se conserva
+    kept, _, _ = trim_messages(messages, 1, "claude-3-haiku", turn_start, counter)
+    assert kept == messages[-1:]
+
+    # Una ronda de herramientas que sola excede el presupuesto: se
+    # conserva el turno completo
+    tool_round = messages[:3]
+    kept, dropped, tokens = trim_messages(tool_round, 150, "claude-3-haiku", turn_start,
+                                          counter)
+    assert kept == tool_round and dropped == 0 and tokens > 150
+    kept, dropped, _ = trim_messages(messages[3:] + tool_round, 150, "claude-3-haiku",
+                                     turn_start, counter)
+    assert kept == tool_round and dropped == 4, (dropped, kept)
+    print("✅ Recorte correcto")
+
+
+class BrokenTiktoken:
+    """tiktoken sin red: cargar un encoding intenta descargar el BPE y falla"""
+
+    def encoding_for_model(self, model):
+        raise ConnectionError("sin acceso a openaipublic.blob.core.windows.net")
+
+    def get_encoding(self, name):
+        raise ConnectionError("sin acceso a openaipublic.blob.core.windows.net")
+
+
+def test_tiktoken_failure_falls_back():
+    """Si el encoding no se puede cargar se usa la aproximación y se informa"""
+    print("🧪 TESTING RESPALDO SIN TIKTOKEN")
+    original = token_counter_module.tiktoken
+    token_counter_module.tiktoken = BrokenTiktoken()
+    try:
+        counter = TokenCounter()
+        assert counter.warm_up(["gpt-5"]) == "aproximado"
+        assert counter.count_text("hola mundo", "gpt-5") == 3
+        assert "ConnectionError" in counter.get_stats()["tiktoken_error"]
+    finally:
+        token_counter_module.tiktoken = original
+    print("✅ Conteo aproximado tras el error")
+
+
+def test_cost_estimate_uses_tokenizer():
+    """La estimación de costo acepta texto o tokens ya contados"""
+    print("🧪 TESTING ESTIMACIÓN DE COSTO")
+    token_counter_module.token_counter.use_tiktoken = False
+    legacy = cost_calculator.estimate_conversation_cost("gpt-4o", 400)
+    assert legacy["estimated_input_tokens"] == 100
+    counted = cost_calculator.estimate_conversation_cost("gpt-4o", 0, input_tokens=1234)
+    assert counted["estimated_input_tokens"] == 1234
+    assert "tokenizador" in counted["estimation_note"]
+    texted = cost_calculator.estimate_conversation_cost("gpt-4o", 0,
+                                                        message_text="hola mundo")
+    assert texted["estimated_input_tokens"] == 3
+    token_counter_module.token_counter.use_tiktoken = True
+    print(f"✅ {counted['estimation_note']}")
+
+
+def main():
+    """Función principal"""
+    print("🚀 TOKEN COUNTER TEST SUITE")
+    print("=" * 50)
+    test_counts_and_cache()
+    test_trim_keeps_valid_turns()
+    test_tiktoken_failure_falls_back()
+    test_cost_estimate_uses_tokenizer()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
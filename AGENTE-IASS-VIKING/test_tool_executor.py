@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Pruebas del ejecutor concurrente de herramientas
+"""
+
+import os
+import sys
+import time
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.tool_executor import ToolCall, ToolExecutor
+
+
+def slow(value, seconds):
+    def fn():
+        time.sleep(seconds)
+        return value
+    return fn
+
+
+def failing():
+    raise ValueError("n8n caído")
+
+
+def test_parallel_and_ordered():
+    """Tres llamadas independientes tardan lo que la más lenta, en orden"""
+    print("🧪 TESTING EJECUCIÓN PARALELA")
+    executor = ToolExecutor(max_workers=4, default_timeout=5, timeouts={})
+    start = time.time()
+    results = executor.run([
+        ToolCall("a", slow("A", 0.3)),
+        ToolCall("b", slow("B", 0.1)),
+        ToolCall("c", slow("C", 0.2)),
+    ])
+    elapsed = time.time() - start
+    assert results == ["A", "B", "C"], results
+    assert elapsed < 0.5, elapsed
+    executor.shutdown()
+    print(f"✅ 3 herramientas en {elapsed:.2f}s")
+
+
+def test_timeouts_and_errors():
+    """Un plazo vencido o una excepción dan un resultado de error en su posición"""
+    print("🧪 TESTING PLAZOS Y ERRORES")
+    executor = ToolExecutor(max_workers=4, default_timeout=5, timeouts={"lenta": 0.1})
+    results = executor.run([
+        ToolCall("lenta", slow("tarde", 0.5)),
+        ToolCall("falla", failing),
+        ToolCall("rapida", slow("ok", 0)),
+        ToolCall("propia", slow("tarde", 0.5), timeout=0.1),
+    ])
+    assert results[0] == {"error": "timeout ejecutando lenta", "tool_name": "lenta"}
+    assert results[1] == {"error": "n8n caído", "tool_name": "falla"}
+    assert results[2] == "ok"
+    assert results[3]["tool_name"] == "propia"
+
+    # El plazo del turno acota el de cada herramienta
+    start = time.time()
+    results = executor.run([ToolCall("x", slow("tarde", 0.5))],
+                           deadline=time.time() + 0.1)
+    assert "error" in results[0] and time.time() - start < 0.4
+
+    stats = executor.get_stats()
+    assert stats["timeouts"] == 3 and stats["errors"] == 1 and stats["executed"] == 5
+    executor.shutdown()
+    print(f"✅ Estadísticas: {stats}")
+
+
+def main():
+    """Función principal"""
+    print("🚀 TOOL EXECUTOR TEST SUITE")
+    print("=" * 50)
+    test_parallel_and_ordered()
+    test_timeouts_and_errors()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
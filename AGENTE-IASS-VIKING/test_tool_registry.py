@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Pruebas del registro de herramientas con recarga por mtime
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.tool_registry import ToolRegistry, ASSISTANT_TOOLS
+
+
+def write_tools(path, names, mtime=None):
+    tools = [
+        {"type": "function", "name": name, "description": f"Herramienta {name}",
+         "parameters": {"type": "object", "properties": {"campo": {"type": "string"}},
+                        "required": ["campo"]}}
+        for name in names
+    ]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(tools, f)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_repo_tools():
+    """Los archivos reales de tools/ cargan y se indexan por nombre"""
+    print("🧪 TESTING HERRAMIENTAS DEL REPOSITORIO")
+    registry = ToolRegistry()
+    registry.load_all()
+    for assistant_number in ASSISTANT_TOOLS:
+        toolset = registry.toolset(assistant_number)
+        for tool in toolset.openai:
+            assert tool["name"] in toolset
+            assert registry.get_tool(tool["name"]) is not None
+        print(f"✅ Assistant {assistant_number}: {len(toolset)} herramientas")
+    assert registry.toolset(99) is registry.toolset(5)
+
+
+def test_representations():
+    """Formatos OpenAI, Anthropic y Gemini precalculados; acepta formato anidado"""
+    print("🧪 TESTING REPRESENTACIONES")
+    with tempfile.TemporaryDirectory() as tmp:
+        nested = [{"type": "function", "function": {"name": "anidada",
+                                                    "description": "d",
+                                                     "parameters": {"type": "object",
+                                                                    "properties": {}}}}]
+        with open(os.path.join(tmp, "default.json"), 'w', encoding='utf-8') as f:
+            json.dump(nested, f)
+        toolset = ToolRegistry({5: "default.json"}, base_dir=tmp).toolset(5)
+
+    assert toolset.openai == [{"type": "function", "name": "anidada",
+                               "description": "d",
+                               "parameters": {"type": "object", "properties": {}}}]
+    assert toolset.anthropic[0]["input_schema"] == {"type": "object", "properties": {}}
+    assert toolset.gemini[0] == {"name": "anidada", "description": "d",
+                                 "parameters": {"type": "object", "properties": {},
+                                                "required": []}}
+    assert "anidada" in toolset and "otra" not in toolset
+    print("✅ Representaciones correctas")
+
+
+def test_mtime_reload():
+    """Un cambio de mtime recarga; un JSON inválido conserva la versión anterior"""
+    print("🧪 TESTING RECARGA POR MTIME")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "default.json")
+        write_tools(path, ["consultar"], mtime=time.time() - 100)
+        registry = ToolRegistry({5: "default.json"}, base_dir=tmp, check_interval=0)
+        registry.load_all()
+        first = registry.toolset(5)
+        assert first.names == {"consultar"}
+        assert registry.toolset(5) is first  # sin cambios no se relee
+
+        write_tools(path, ["consultar", "crear_pedido"], mtime=time.time() - 50)
+        second = registry.toolset(5)
+        assert second.names == {"consultar", "crear_pedido"}
+        assert registry.get_tool("crear_pedido") is not None
+        assert first.names == {"consultar"}  # el ToolSet anterior no cambia
+
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("{ no es json")
+        os.utime(path, (time.time(), time.time()))
+        assert registry.toolset(5) is second
+        assert registry.get_stats()["reloads"] == 2
+
+        # Con intervalo de comprobación no se consulta el disco en cada turno
+        throttled = ToolRegistry({5: "default.json"}, base_dir=tmp, check_interval=3600)
+        write_tools(path, ["consultar"])
+        cached = throttled.toolset(5)
+        write_tools(path, ["otra"], mtime=time.time() + 10)
+        assert throttled.toolset(5) is cached
+    print("✅ Recarga y fallback correctos")
+
+
+def main():
+    """Función principal"""
+    print("🚀 TOOL REGISTRY TEST SUITE")
+    print("=" * 50)
+    test_repo_tools()
+    test_representations()
+    test_mtime_reload()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la selección de herramientas por turno y la caché de listas MCP
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.tool_registry import ToolSet
+from app.tool_selection import MCPToolCache, build_mcp_tool, select_tools, signal_words
+
+TOOLS = [
+    {"type": "function", "name": "cambiar_nombre",
+     "description": "Cambia el nombre del cliente",
+     "parameters": {"type": "object", "properties": {}}, "keywords": ["llamo"]},
+    {"type": "function", "name": "crear_pedido",
+     "description": "Crea un pedido de productos",
+     "parameters": {"type": "object", "properties": {}}},
+    {"type": "function", "name": "consultar_factura",
+     "description": "Consulta facturas pendientes",
+     "parameters": {"type": "object", "properties": {}}},
+    {"type": "function", "name": "actualizar_direccion",
+     "description": "Actualiza la dirección de entrega",
+     "parameters": {"type": "object", "properties": {}}},
+    {"type": "function", "name": "escalar_asesor",
+     "description": "Transfiere a un asesor humano",
+     "parameters": {"type": "object", "properties": {}}, "always": True},
+]
+MCP_CONFIG = {"type": "mcp", "server_url": "https://mcp.local/sse",
+              "server_label": "mcp-sql"}
+
+
+def names(tools):
+    return [tool.get("name") or tool.get("server_label") for tool in tools]
+
+
+def test_function_tool_subset():
+    """Solo las herramientas que coinciden con el mensaje o la última respuesta"""
+    print("🧪 TESTING SUBCONJUNTO DE FUNCTION TOOLS")
+    toolset = ToolSet("tools.json", TOOLS)
+    assert "keywords" not in toolset.openai[0] and toolset.always == {"escalar_asesor"}
+
+    tools, summary = select_tools(toolset.openai, [], "Quiero hacer unos pedidos",
+                                  keywords=toolset.keywords, always=toolset.always)
+    assert names(tools) == ["crear_pedido", "escalar_asesor"], names(tools)
+    assert summary["function_tools"] == "2/5"
+
+    # La respuesta "Juan Pérez" no nombra la herramienta, pero la pregunta anterior sí
+    tools, _ = select_tools(toolset.openai, [], "Juan Pérez",
+                            previous_reply="¿Cuál es tu nombre completo?",
+                            keywords=toolset.keywords, always=toolset.always)
+    assert "cambiar_nombre" in names(tools)
+    tools, _ = select_tools(toolset.openai, [], "Me llamo Ana",
+                            keywords=toolset.keywords, always=toolset.always)
+    assert "cambiar_nombre" in names(tools)
+
+    # Sin coincidencias se envían todas (fallback conservador)
+    tools, summary = select_tools(toolset.openai, [], "ok", keywords=toolset.keywords,
+                                  always=toolset.always)
+    assert len(tools) == 5 and "sin coincidencias" in summary["function_reason"]
+    print("✅ Selección correcta")
+
+
+def test_mcp_tool_cache_and_allowed_tools():
+    """La lista mcp_list_tools se guarda y acota allowed_tools"""
+    print("🧪 TESTING CACHÉ MCP")
+    cache = MCPToolCache(ttl_seconds=60)
+    tool = build_mcp_tool(MCP_CONFIG, signal_words("pedido"), cache)
+    assert "allowed_tools" not in tool
+
+    listed = SimpleNamespace(type="mcp_list_tools", server_label="mcp-sql", tools=[
+        {"name": "buscar_pedido", "description": "Busca un pedido por número"},
+        {"name": "buscar_cliente", "description": "Busca un cliente por teléfono"},
+        {"name": "listar_productos", "description": "Lista productos disponibles"},
+        {"name": "consultar_inventario", "description": "Inventario por bodega"},
+        {"name": "consultar_precios", "description": "Precios vigentes"},
+    ])
+    output = [SimpleNamespace(type="message"), listed]
+    cache.update_from_response(SimpleNamespace(output=output))
+    assert len(cache.get("mcp-sql")) == 5
+
+    tool = build_mcp_tool(MCP_CONFIG, signal_words("¿Dónde está mi pedido?"), cache)
+    assert tool["allowed_tools"] == ["buscar_pedido"]
+
+    # allowed_tools de la configuración siempre se respeta
+    configured = dict(MCP_CONFIG, allowed_tools=["buscar_cliente"])
+    tool = build_mcp_tool(configured, signal_words("pedido"), cache)
+    assert tool["allowed_tools"] == []
+    tool = build_mcp_tool(configured, signal_words("hola"), cache)
+    assert tool["allowed_tools"] == ["buscar_cliente"]
+
+    expired = MCPToolCache(ttl_seconds=-1)
+    expired.update_from_response(SimpleNamespace(output=[listed]))
+    assert expired.get("mcp-sql") is None
+    print("✅ Caché y allowed_tools correctos")
+
+
+def main():
+    """Función principal"""
+    print("🚀 TOOL SELECTION TEST SUITE")
+    print("=" * 50)
+    test_function_tool_subset()
+    test_mcp_tool_cache_and_allowed_tools()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Pruebas del exportador de trazas en segundo plano
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import threading
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.tracing import TraceExporter, TraceRejectedError
+from app.tool_executor import ToolCall, ToolExecutor
+
+
+class FakeLangfuse:
+    """Sender controlable: lento, caído o disponible"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.down = False
+        self.batches = []
+
+    def __call__(self, events):
+        time.sleep(self.delay)
+        if self.down:
+            raise ConnectionError("Langfuse no disponible")
+        self.batches.append(events)
+
+    def events(self, event_type=None):
+        return [e for batch in self.batches for e in batch
+                if event_type in (None, e["type"])]
+
+
+def run_turn(exporter, thread_id="thread_1"):
+    exporter.start_trace("turno", thread_id, "sub_1", input="hola",
+                         metadata={"model": "gpt-5"})
+    exporter.generation("llm", model="gpt-5", input=[{"role": "user"}],
+                        output="respuesta",
+                        usage={"input_tokens": 10, "output_tokens": 5},
+                        start_time=time.time())
+    # Las herramientas corren en otro hilo con el contexto copiado
+    executor = ToolExecutor(max_workers=2, default_timeout=5, timeouts={})
+    executor.run([ToolCall("consulta", lambda: exporter.span("consulta", input={"q": 1},
+                                                             output="ok"))])
+    executor.shutdown()
+    exporter.update_trace(output="respuesta")
+    exporter.end_trace()
+
+
+def test_export_and_sampling():
+    """Traza con generation y span; sin muestreo no se crea nada"""
+    print("🧪 TESTING EXPORTACIÓN Y MUESTREO")
+    sender = FakeLangfuse()
+    exporter = TraceExporter(sender=sender, enabled=True, sample_rate=1.0,
+                             flush_interval=0.05, spool_path=None)
+    run_turn(exporter)
+    assert exporter.flush(5)
+
+    trace = sender.events("trace-create")[0]["body"]
+    assert trace["sessionId"] == "thread_1" and trace["userId"] == "sub_1"
+    assert trace["input"] == "hola" and trace["output"] == "respuesta"
+    generation = sender.events("generation-create")[0]["body"]
+    assert generation["traceId"] == trace["id"]
+    assert generation["usageDetails"] == {"input_tokens": 10, "output_tokens": 5}
+    assert sender.events("span-create")[0]["body"]["name"] == "consulta"
+
+    unsampled = TraceExporter(sender=sender, enabled=True, sample_rate=0.0,
+                              spool_path=None)
+    assert unsampled.start_trace("turno", "thread_2", "sub_1") is None
+    unsampled.generation("llm", model="gpt-5")
+    unsampled.end_trace()
+    stats = unsampled.get_stats()
+    assert stats["sampled"] == 0 and stats["queued"] == 0
+    print(f"✅ {len(sender.events())} eventos exportados")
+
+
+def test_slow_backend_does_not_block_turns():
+    """Con Langfuse lento el turno no espera y la cola llena descarta"""
+    print("🧪 TESTING BACKEND LENTO")
+    sender = FakeLangfuse(delay=0.5)
+    exporter = TraceExporter(sender=sender, enabled=True, sample_rate=1.0, queue_size=3,
+                             batch_size=1, flush_interval=0.01, spool_path=None)
+    durations = []
+
+    def turns():
+        for i in range(10):
+            start = time.perf_counter()
+            run_turn(exporter, f"thread_{i}")
+            durations.append(time.perf_counter() - start)
+
+    worker = threading.Thread(target=turns)
+    worker.start()
+    worker.join()
+
+    assert max(durations) < 0.3, durations
+    assert exporter.get_stats()["dropped"] >= 5
+    print(f"✅ Turno más lento: {max(durations) * 1000:.0f} ms, descartadas: "
+          f"{exporter.get_stats()['dropped']}")
+
+
+def test_spool_and_replay():
+    """Si Langfuse cae los lotes van al spool y se reenvían cuando vuelve"""
+    print("🧪 TESTING SPOOL LOCAL")
+    with tempfile.TemporaryDirectory() as tmp:
+        spool_path = os.path.join(tmp, "spool", "traces.jsonl")
+        sender = FakeLangfuse()
+        sender.down = True
+        exporter = TraceExporter(sender=sender, enabled=True, sample_rate=1.0,
+                                 flush_interval=0.05,
+                                 spool_path=spool_path)
+        run_turn(exporter, "thread_caido")
+        assert exporter.flush(5)
+        assert os.path.exists(spool_path)
+        assert exporter.get_stats()["spooled_events"] == 3
+
+        sender.down = False
+        deadline = time.time() + 5
+        # El spool se mueve a .replay antes de reenviarse:
+        # esperar a los eventos reenviados
+        while exporter.get_stats()["replayed_events"] < 3 and time.time() < deadline:
+            time.sleep(0.05)
+        assert not os.path.exists(spool_path)
+        assert sender.events("trace-create")[0]["body"]["sessionId"] == "thread_caido"
+        assert exporter.get_stats()["replayed_events"] == 3
+    print("✅ Spool reenviado")
+
+
+class FakeSession:
+    """Sesión HTTP que responde siempre con el mismo código"""
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def post(self, *_args, **_kwargs):
+        return self
+
+    def json(self):
+        return {"errors": []}
+
+
+class Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_rejected_batches_are_dropped():
+    """Un 4xx distinto de 429 descarta el lote (sin spool) y se registra una sola vez"""
+    print("🧪 TESTING LOTES RECHAZADOS")
+    exporter = TraceExporter(enabled=True, spool_path=None)
+    for status, expected in ((401, TraceRejectedError), (400, TraceRejectedError),
+                             (429, RuntimeError), (503, RuntimeError), (200, None),
+                             (207, None)):
+        exporter._session = FakeSession(status)
+        try:
+            exporter._post_ingestion([{"type": "trace-create"}])
+            raised = None
+        except Exception as e:
+            raised = type(e)
+        assert raised is expected, (status, raised)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spool_path = os.path.join(tmp, "traces.jsonl")
+        exporter = TraceExporter(enabled=True, spool_path=spool_path)
+        exporter.sender = lambda events: exporter._post_ingestion(events)
+        exporter._session = FakeSession(401)
+        records = Records()
+        logging.getLogger("app.tracing").addHandler(records)
+        try:
+            for _ in range(3):
+                assert not exporter._export([{"type": "trace-create"},
+                                             {"type": "span-create"}])
+        finally:
+            logging.getLogger("app.tracing").removeHandler(records)
+        stats = exporter.get_stats()
+        assert stats["rejected_events"] == 6 and stats["spooled_events"] == 0
+        assert stats["export_errors"] == 0
+        assert not os.path.exists(spool_path)
+        rejected = [message for message in records.messages if "rechazó" in message]
+        assert len(rejected) == 1, records.messages
+    print("✅ Lotes rechazados descartados")
+
+
+def test_replay_keeps_previous_replay_file():
+    """Un .replay que quedó de un intento anterior se reenvía junto al spool nuevo"""
+    print("🧪 TESTING REENVÍO CON .replay PREVIO")
+    with tempfile.TemporaryDirectory() as tmp:
+        spool_path = os.path.join(tmp, "traces.jsonl")
+        with open(spool_path + ".replay", 'w', encoding='utf-8') as f:
+            f.write(json.dumps([{"id": "viejo"}]) + "\n")
+            f.write('[{"id": "trunc')  # Escritura cortada, sin salto de línea
+        with open(spool_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps([{"id": "nuevo"}]) + "\n")
+
+        sender = FakeLangfuse()
+        exporter = TraceExporter(sender=sender, enabled=True, spool_path=spool_path)
+        exporter._replay_spool()
+        assert [batch[0]["id"] for batch in sender.batches] == ["viejo", "nuevo"]
+        assert exporter.get_stats()["replayed_events"] == 2
+        assert not os.path.exists(spool_path)
+        assert not os.path.exists(spool_path + ".replay")
+
+        # Un rechazo durante el reenvío descarta ese lote y sigue con los demás
+        with open(spool_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps([{"id": "malo"}]) + "\n")
+            f.write(json.dumps([{"id": "bueno"}]) + "\n")
+
+        def picky(events):
+            if events[0]["id"] == "malo":
+                raise TraceRejectedError(400)
+            sender(events)
+        exporter.sender = picky
+        exporter._replay_spool()
+        assert sender.batches[-1][0]["id"] == "bueno"
+        assert exporter.get_stats()["rejected_events"] == 1
+        assert not os.path.exists(spool_path)
+    print("✅ Ningún lote pendiente se pierde")
+
+
+def main():
+    """Función principal"""
+    print("🚀 TRACING TEST SUITE")
+    print("=" * 50)
+    test_export_and_sampling()
+    test_slow_backend_does_not_block_turns()
+    test_spool_and_replay()
+    test_rejected_batches_are_dropped()
+    test_replay_keeps_previous_replay_file()
+    print()
+    print("🎉 Test suite completed!")
+
+
+if __name__ == "__main__":
+    main()